@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Compares the size and load time of diff chunks stored in the packed cache
+# format against pickled chunks (the format used by cache_memoize's large
+# data support).
+#
+# The chunks are built from syntax-highlighted copies of a source file,
+# with a few changed regions and moved lines per chunk.
+#
+# Usage: ./contrib/profiling/benchmark_chunk_cache.py [filename [copies]]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import random
+import sys
+import timeit
+import zlib
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return root_dir
+
+
+def build_chunks(content, filename, copies, lines_per_chunk=200):
+    from django.utils.safestring import mark_safe
+    from pygments import highlight
+    from pygments.lexers import get_lexer_for_filename
+
+    from reviewboard.diffviewer.highlighting import NoWrapperHtmlFormatter
+
+    markup = highlight(content, get_lexer_for_filename(filename),
+                       NoWrapperHtmlFormatter()).splitlines() * copies
+    rng = random.Random(0)
+    lines = []
+
+    for i, line in enumerate(markup):
+        line = mark_safe(line)
+        changed = rng.random() < 0.1
+
+        if changed:
+            regions = [(0, 4), (8, 12)]
+        else:
+            regions = []
+
+        diff_line = [i + 1, i + 1, line, regions, i + 1, line, regions,
+                     False]
+
+        if rng.random() < 0.01:
+            diff_line.append({'to': rng.randint(1, len(markup))})
+
+        lines.append(diff_line)
+
+    return [
+        {
+            'index': i,
+            'lines': lines[start:start + lines_per_chunk],
+            'numlines': len(lines[start:start + lines_per_chunk]),
+            'change': 'replace',
+            'collapsable': False,
+            'meta': {
+                'left_headers': [],
+                'right_headers': [],
+                'whitespace_chunk': False,
+                'whitespace_lines': [],
+            },
+        }
+        for i, start in enumerate(range(0, len(lines), lines_per_chunk))
+    ]
+
+
+def main():
+    root_dir = setup_environment()
+
+    from djblets.util.compat.six.moves import cPickle as pickle
+
+    from reviewboard.diffviewer.chunk_cache import pack_chunk, unpack_chunk
+
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = os.path.join(root_dir, 'reviewboard', 'diffviewer',
+                                'chunk_generator.py')
+
+    if len(sys.argv) > 2:
+        copies = int(sys.argv[2])
+    else:
+        copies = 20
+
+    with open(filename, 'rb') as f:
+        content = f.read().decode('utf-8')
+
+    chunks = build_chunks(content, filename, copies)
+    num_lines = sum(chunk['numlines'] for chunk in chunks)
+
+    pickled = zlib.compress(pickle.dumps(chunks, pickle.HIGHEST_PROTOCOL))
+    packed = [pack_chunk(chunk) for chunk in chunks]
+
+    for chunk, data in zip(chunks, packed):
+        if unpack_chunk(data) != chunk:
+            print('Packed chunk %d does not match!' % chunk['index'])
+            sys.exit(1)
+
+    def load_pickled():
+        return pickle.loads(zlib.decompress(pickled))
+
+    def load_packed():
+        return [unpack_chunk(data) for data in packed]
+
+    def render(loaded_chunks):
+        for chunk in loaded_chunks:
+            for line in chunk['lines']:
+                pass
+
+    iterations = 10
+    pickled_load = timeit.timeit(load_pickled, number=iterations) / iterations
+    packed_load = timeit.timeit(load_packed, number=iterations) / iterations
+    pickled_total = timeit.timeit(lambda: render(load_pickled()),
+                                  number=iterations) / iterations
+    packed_total = timeit.timeit(lambda: render(load_packed()),
+                                 number=iterations) / iterations
+    packed_size = sum(len(data) for data in packed)
+
+    print('%d lines in %d chunks' % (num_lines, len(chunks)))
+    print()
+    print('%-22s %12s %12s %8s' % ('', 'Pickled', 'Packed', 'Factor'))
+    print('%-22s %12d %12d %7.2fx'
+          % ('Bytes', len(pickled), packed_size,
+             float(len(pickled)) / packed_size))
+    print('%-22s %11.2fms %11.2fms %7.2fx'
+          % ('Load', pickled_load * 1000, packed_load * 1000,
+             pickled_load / packed_load))
+    print('%-22s %11.2fms %11.2fms %7.2fx'
+          % ('Load and iterate', pickled_total * 1000, packed_total * 1000,
+             pickled_total / packed_total))
+
+
+if __name__ == '__main__':
+    main()
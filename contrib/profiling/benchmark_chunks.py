@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Times cold-cache chunk generation for every file in a DiffSet, using
+# populate_diff_chunks with different numbers of workers.
+#
+# This must be run against a configured Review Board site, with a DiffSet
+# whose repository is reachable. The chunk and file caches are cleared
+# before each run.
+#
+# Usage: ./contrib/profiling/benchmark_chunks.py <diffset_id> [workers ...]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import time
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+
+def main():
+    setup_environment()
+
+    from django.core.cache import cache
+
+    from reviewboard.diffviewer.diffutils import (get_diff_files,
+                                                  populate_diff_chunks)
+    from reviewboard.diffviewer.models import DiffSet
+
+    if len(sys.argv) < 2:
+        sys.stderr.write('Usage: %s <diffset_id> [workers ...]\n'
+                         % sys.argv[0])
+        sys.exit(1)
+
+    diffset = DiffSet.objects.get(pk=int(sys.argv[1]))
+    worker_counts = [int(arg) for arg in sys.argv[2:]] or [1, 2, 4, 8]
+
+    print('Generating chunks for %d files in DiffSet %s'
+          % (diffset.files.count(), diffset.pk))
+    print()
+
+    results = {}
+
+    for max_workers in worker_counts:
+        cache.clear()
+        files = get_diff_files(diffset)
+
+        start = time.time()
+        populate_diff_chunks(files, max_workers=max_workers)
+        results[max_workers] = time.time() - start
+
+        print('%2d worker(s): %8.4f seconds'
+              % (max_workers, results[max_workers]))
+
+    if 1 in results:
+        print()
+
+        for max_workers in worker_counts:
+            if max_workers != 1:
+                print('Speedup with %2d worker(s): %5.2fx'
+                      % (max_workers, results[1] / results[max_workers]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Measures the throughput of the diff parsers, in MB/s.
+#
+# This parses the unified and context diffs in the diffviewer's testdata
+# (repeated until they reach the given size), along with a single large
+# generated file's diff, in both plain unified and Git formats.
+#
+# Usage: ./contrib/profiling/benchmark_diffparser.py [size_in_mb]
+
+from __future__ import print_function, unicode_literals
+
+import glob
+import os
+import sys
+import time
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return root_dir
+
+
+def load_testdata_diffs(root_dir, size):
+    """Returns the testdata diffs, repeated until reaching the given size."""
+    diffs = []
+
+    for filename in sorted(glob.glob(os.path.join(
+            root_dir, 'reviewboard', 'diffviewer', 'testdata', 'diffs',
+            '*', '*.diff'))):
+        with open(filename, 'rb') as f:
+            diffs.append(f.read())
+
+    data = b''.join(diffs)
+
+    return data * max(size // len(data), 1)
+
+
+def generate_file_diff(size, git=False):
+    """Returns a diff of a single large generated file."""
+    lines = []
+
+    if git:
+        lines += [
+            b'diff --git a/generated.c b/generated.c',
+            b'index 1234567..89abcde 100644',
+        ]
+
+    lines += [
+        b'--- a/generated.c\t(revision 1)',
+        b'+++ b/generated.c\t(working copy)',
+    ]
+
+    num_bytes = 0
+    i = 0
+
+    while num_bytes < size:
+        hunk = [
+            b'@@ -%d,4 +%d,4 @@' % (i * 4 + 1, i * 4 + 1),
+            b' static int table_%d[] = {' % i,
+            b'-    %d, %d, %d, %d,' % (i, i + 1, i + 2, i + 3),
+            b'+    %d, %d, %d, %d,' % (i + 3, i + 2, i + 1, i),
+            b' };',
+            b' ',
+        ]
+        num_bytes += sum(len(line) + 1 for line in hunk)
+        lines += hunk
+        i += 1
+
+    return b'\n'.join(lines) + b'\n'
+
+
+def time_parser(parser_cls, data):
+    start = time.time()
+    files = parser_cls(data).parse()
+    elapsed = time.time() - start
+
+    if not files:
+        print('%s found no files!' % parser_cls.__name__)
+        sys.exit(1)
+
+    return elapsed
+
+
+def main():
+    root_dir = setup_environment()
+
+    from reviewboard.diffviewer.parser import DiffParser
+    from reviewboard.scmtools.git import GitDiffParser
+
+    if len(sys.argv) > 1:
+        size = int(float(sys.argv[1]) * 1024 * 1024)
+    else:
+        size = 5 * 1024 * 1024
+
+    tests = [
+        ('Testdata diffs', DiffParser, load_testdata_diffs(root_dir, size)),
+        ('Generated file', DiffParser, generate_file_diff(size)),
+        ('Generated file (Git)', GitDiffParser,
+         generate_file_diff(size, git=True)),
+    ]
+
+    print('%-22s %10s %10s %10s' % ('', 'Size', 'Time', 'MB/s'))
+
+    for name, parser_cls, data in tests:
+        elapsed = time_parser(parser_cls, data)
+        mb = len(data) / (1024.0 * 1024.0)
+
+        print('%-22s %8.2fMB %9.3fs %10.2f'
+              % (name, mb, elapsed, mb / max(elapsed, 0.0001)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+#
+# Measures the time spent rendering lines of a diff.
+#
+# This builds large chunks out of syntax-highlighted source files from the
+# tree, with every line replaced by a slightly modified copy, and times the
+# filters applied to each line (highlightregion and showextrawhitespace)
+# along with rendering the whole chunks through diff_lines.
+#
+# Usage: ./contrib/profiling/benchmark_difftags.py [num_lines] [iterations]
+
+from __future__ import print_function, unicode_literals
+
+import glob
+import os
+import re
+import sys
+import time
+
+
+LINE_FMT = (
+    '<tr line="%(linenum_row)s"%(row_class_attr)s>'
+    '<th>%(anchor_html)s%(linenum1)s</th>'
+    '<td%(cell_1_class_attr)s>%(moved_to_html)s%(begin_collapse_html)s'
+    '<pre>%(line1)s</pre>%(end_collapse_html)s</td>'
+    '<th>%(linenum2)s</th>'
+    '<td%(cell_2_class_attr)s>%(moved_from_html)s<pre>%(line2)s</pre></td>'
+    '</tr>'
+)
+ANCHOR_FMT = '<a name="%(anchor)s" class="chunk-anchor"></a>'
+BEGIN_COLLAPSE_FMT = '<div class="collapse-floater">'
+END_COLLAPSE_FMT = '</div>'
+MOVED_FMT = '<a href="#" class="%(class)s">%(text)s</a>'
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return root_dir
+
+
+def build_chunks(root_dir, num_lines):
+    """Builds a replace chunk and an equal chunk of the given size.
+
+    The lines come from the Python source files in the tree. The replaced
+    lines have an identifier renamed, and some have trailing whitespace
+    added, so that there are regions of changes and extra whitespace to
+    highlight.
+    """
+    from reviewboard.diffviewer.chunk_generator import (
+        DiffChunkGenerator, compute_chunk_line_regions)
+    from reviewboard.diffviewer.highlighting import (get_lexer_for_file,
+                                                     highlight_file)
+
+    old_lines = []
+    new_lines = []
+    old_markup = []
+    new_markup = []
+    lexer = get_lexer_for_file('file.py')
+
+    for filename in sorted(glob.glob(os.path.join(root_dir, 'reviewboard',
+                                                  '*', '*.py'))):
+        with open(filename, 'rb') as f:
+            old = f.read().decode('utf-8')
+
+        new = re.sub(r'^(.*?\b[A-Za-z_]{4,})\b', r'\1_renamed', old,
+                     flags=re.M)
+        new = re.sub(r'(return .*)$', r'\1  ', new, flags=re.M)
+
+        old_lines += DiffChunkGenerator.NEWLINES_RE.split(old)
+        new_lines += DiffChunkGenerator.NEWLINES_RE.split(new)
+        old_markup += highlight_file(old, lexer)
+        new_markup += highlight_file(new, lexer)
+
+        if len(old_lines) >= num_lines:
+            break
+
+    lines = [
+        [i + 1, i + 1, old_markup[i], None, i + 1, new_markup[i], None, False]
+        for i in range(min(num_lines, len(old_lines)))
+        if old_lines[i] != new_lines[i]
+    ]
+    lines = compute_chunk_line_regions(lines)
+
+    replace_chunk = {
+        'index': 0,
+        'change': 'replace',
+        'lines': lines,
+        'numlines': len(lines),
+        'meta': {},
+    }
+
+    equal_chunk = {
+        'index': 1,
+        'change': 'equal',
+        'lines': [
+            [i + 1, i + 1, markup, [], i + 1, markup, [], False]
+            for i, markup in enumerate(old_markup[:num_lines])
+        ],
+        'numlines': min(num_lines, len(old_markup)),
+        'meta': {},
+    }
+
+    return replace_chunk, equal_chunk
+
+
+def time_func(func, iterations):
+    start = time.time()
+
+    for i in range(iterations):
+        func()
+
+    return (time.time() - start) / iterations
+
+
+def main():
+    root_dir = setup_environment()
+
+    from reviewboard.diffviewer.templatetags.difftags import (
+        diff_lines, highlightregion, showextrawhitespace)
+
+    num_lines = 5000
+    iterations = 5
+
+    if len(sys.argv) > 1:
+        num_lines = int(sys.argv[1])
+
+    if len(sys.argv) > 2:
+        iterations = int(sys.argv[2])
+
+    replace_chunk, equal_chunk = build_chunks(root_dir, num_lines)
+    replace_lines = replace_chunk['lines']
+    equal_lines = equal_chunk['lines']
+    diff_file = {
+        'index': 0,
+    }
+
+    def run_highlightregion():
+        for line in replace_lines:
+            highlightregion(line[2], line[3])
+            highlightregion(line[5], line[6])
+
+    def run_showextrawhitespace():
+        for line in equal_lines:
+            showextrawhitespace(line[2])
+
+    def run_diff_lines(chunk):
+        return lambda: diff_lines(diff_file, chunk, False, LINE_FMT,
+                                  ANCHOR_FMT, BEGIN_COLLAPSE_FMT,
+                                  END_COLLAPSE_FMT, MOVED_FMT)
+
+    tests = [
+        ('highlightregion', len(replace_lines) * 2, run_highlightregion),
+        ('showextrawhitespace', len(equal_lines), run_showextrawhitespace),
+        ('diff_lines (replace)', len(replace_lines),
+         run_diff_lines(replace_chunk)),
+        ('diff_lines (equal)', len(equal_lines),
+         run_diff_lines(equal_chunk)),
+    ]
+
+    print('%-22s %10s %10s %12s' % ('', 'Lines', 'Time', 'usecs/line'))
+
+    for name, count, func in tests:
+        elapsed = time_func(func, iterations)
+
+        print('%-22s %10d %9.3fs %12.2f'
+              % (name, count, elapsed, elapsed * 1000000 / max(count, 1)))
+
+
+if __name__ == '__main__':
+    main()
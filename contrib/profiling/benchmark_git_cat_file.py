@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+#
+# Compares fetching files and checking for their existence through a
+# long-lived git cat-file process against running git cat-file for each
+# lookup, using the bare repository in reviewboard/scmtools/testdata.
+#
+# Usage: ./contrib/profiling/benchmark_git_cat_file.py [iterations]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import subprocess
+import sys
+import timeit
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return os.path.join(root_dir, 'reviewboard', 'scmtools', 'testdata',
+                        'git_repo')
+
+
+def get_blob_shas(git_dir):
+    p = subprocess.Popen(['git', '--git-dir=%s' % git_dir, 'rev-list',
+                          '--objects', '--all'],
+                         stdout=subprocess.PIPE)
+    object_names = [
+        line.split(b' ')[0].decode('utf-8')
+        for line in p.communicate()[0].splitlines()
+    ]
+
+    p = subprocess.Popen(['git', '--git-dir=%s' % git_dir, 'cat-file',
+                          '--batch-check'],
+                         stdin=subprocess.PIPE,
+                         stdout=subprocess.PIPE)
+    output = p.communicate(
+        b''.join(name.encode('utf-8') + b'\n' for name in object_names))[0]
+
+    return [
+        line.split(b' ')[0].decode('utf-8')
+        for line in output.splitlines()
+        if line.split(b' ')[1] == b'blob'
+    ]
+
+
+def main():
+    git_dir = setup_environment()
+
+    from reviewboard.scmtools.core import SCMTool
+    from reviewboard.scmtools.git import GitClient
+
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 20
+
+    shas = get_blob_shas(git_dir)
+    client = GitClient(git_dir)
+
+    def cat_file_subprocess(option, sha):
+        p = SCMTool.popen(['git', '--git-dir=%s' % git_dir, 'cat-file',
+                           option, sha])
+        contents = p.stdout.read()
+        p.stderr.read()
+        p.wait()
+
+        return contents
+
+    for sha in shas:
+        if client.get_file('', sha) != cat_file_subprocess('blob', sha):
+            print('Results differ for %s!' % sha)
+            sys.exit(1)
+
+    print('Looking up %d blobs, %d iterations' % (len(shas), iterations))
+    print()
+
+    for name, option, func in (
+            ('get_file', 'blob', client.get_file),
+            ('get_file_exists', '-t', client.get_file_exists)):
+        pool_time = timeit.timeit(
+            lambda: [func('', sha) for sha in shas],
+            number=iterations)
+        subprocess_time = timeit.timeit(
+            lambda: [cat_file_subprocess(option, sha) for sha in shas],
+            number=iterations)
+
+        print('%s:' % name)
+        print('  Persistent process: %8.4f seconds' % pool_time)
+        print('  Process per lookup: %8.4f seconds' % subprocess_time)
+        print('  Speedup:            %8.1fx' % (subprocess_time / pool_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Compares fetching files through a long-lived Mercurial command server
+# against running hg cat for each file, using the repository in
+# reviewboard/scmtools/testdata.
+#
+# Usage: ./contrib/profiling/benchmark_hg_cmdserver.py [iterations]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return os.path.join(root_dir, 'reviewboard', 'scmtools', 'testdata',
+                        'hg_repo')
+
+
+def main():
+    repo_path = setup_environment()
+
+    from reviewboard.scmtools.hg import HgClient
+
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 20
+
+    files = [
+        ('doc/readme', '661e5dd3c493'),
+        ('doc/readme', 'tip'),
+        ('doc/readme2', 'tip'),
+    ]
+
+    command_server_client = HgClient(repo_path, None)
+    subprocess_client = HgClient(repo_path, None)
+    subprocess_client.use_command_server = False
+
+    def cat_files(client):
+        for path, rev in files:
+            try:
+                client.cat_file(path, rev)
+            except Exception:
+                pass
+
+    print('Fetching %d files, %d iterations' % (len(files), iterations))
+    print()
+
+    command_server_time = timeit.timeit(
+        lambda: cat_files(command_server_client),
+        number=iterations)
+    subprocess_time = timeit.timeit(
+        lambda: cat_files(subprocess_client),
+        number=iterations)
+
+    print('cat_file:')
+    print('  Command server:     %8.4f seconds' % command_server_time)
+    print('  Process per file:   %8.4f seconds' % subprocess_time)
+    print('  Speedup:            %8.1fx'
+          % (subprocess_time / command_server_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+#
+# Compares syntax highlighting of the original and modified versions of a
+# file the old way (looking up lexers by filename and highlighting both
+# files in full) against highlight_files, both with an empty cache and with
+# the original file already cached.
+#
+# Usage: ./contrib/profiling/benchmark_highlighting.py [filename [copies]]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import random
+import sys
+import timeit
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return root_dir
+
+
+def modify_file(content, seed, num_changes=5):
+    """Returns a copy of the file with a few lines inserted or changed."""
+    rng = random.Random(seed)
+    lines = content.splitlines(True)
+
+    for i in range(num_changes):
+        pos = rng.randint(0, len(lines) - 1)
+
+        if rng.random() < 0.5:
+            lines.insert(pos, '    # Added line %d\n' % i)
+        else:
+            lines[pos] = lines[pos].replace('self', 'this')
+
+    return ''.join(lines)
+
+
+def main():
+    root_dir = setup_environment()
+
+    from django.core.cache import cache
+    from pygments import highlight
+    from pygments.lexers import get_lexer_for_filename
+
+    from reviewboard.diffviewer.highlighting import (NoWrapperHtmlFormatter,
+                                                     highlight_files)
+
+    if len(sys.argv) > 1:
+        filename = sys.argv[1]
+    else:
+        filename = os.path.join(root_dir, 'reviewboard', 'diffviewer',
+                                'chunk_generator.py')
+
+    if len(sys.argv) > 2:
+        copies = int(sys.argv[2])
+    else:
+        copies = 10
+
+    with open(filename, 'rb') as f:
+        old = f.read().decode('utf-8') * copies
+
+    new = modify_file(old, seed=0)
+
+    def old_highlight():
+        results = []
+
+        for data in (old, new):
+            lexer = get_lexer_for_filename(filename, stripnl=False,
+                                           encoding='utf-8')
+            lexer.add_filter('codetagify')
+            results.append(highlight(data, lexer,
+                                     NoWrapperHtmlFormatter()).splitlines())
+
+        return tuple(results)
+
+    def new_highlight_cold():
+        cache.clear()
+        return highlight_files(old, new, filename, filename)
+
+    def new_highlight_warm():
+        # Only the modified file is removed from the cache, as when the
+        # original file is shared with other diffs.
+        cache.clear()
+        highlight_files(old, old, filename, filename)
+        start = timeit.default_timer()
+        highlight_files(old, new, filename, filename)
+
+        return timeit.default_timer() - start
+
+    if new_highlight_cold() != old_highlight():
+        print('Highlighted output does not match!')
+        sys.exit(1)
+
+    iterations = 5
+    old_time = timeit.timeit(old_highlight, number=iterations) / iterations
+    cold_time = timeit.timeit(new_highlight_cold,
+                              number=iterations) / iterations
+    warm_time = sum(new_highlight_warm()
+                    for i in range(iterations)) / iterations
+
+    print('%d lines' % len(new.splitlines()))
+    print()
+    print('%-30s %10.2fms' % ('Full highlighting', old_time * 1000))
+    print('%-30s %10.2fms %7.2fx' % ('highlight_files (empty cache)',
+                                     cold_time * 1000, old_time / cold_time))
+    print('%-30s %10.2fms %7.2fx' % ('highlight_files (old cached)',
+                                     warm_time * 1000, old_time / warm_time))
+
+
+if __name__ == '__main__':
+    main()
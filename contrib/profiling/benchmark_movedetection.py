@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+#
+# Measures move detection on large synthetic refactors.
+#
+# This generates files made up of many small functions, which share common
+# lines (braces, blank lines, returns, and so on), then shuffles the
+# functions around, as a large refactor would. The time spent generating
+# opcodes (including move detection) is reported along with the number of
+# moved lines found, both with and without the limit on how common a line
+# can be to begin a move range.
+#
+# Usage: ./contrib/profiling/benchmark_movedetection.py [num_functions ...]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import random
+import sys
+import time
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+
+def generate_files(num_functions, seed):
+    """Generates an original file and a refactored version of it.
+
+    The refactored file moves most functions to a new location, and
+    modifies a few lines in some of them.
+    """
+    rng = random.Random(seed)
+    functions = []
+
+    for i in range(num_functions):
+        functions.append([
+            'static int',
+            'function_%d(int value)' % i,
+            '{',
+            '    int result = 0;',
+            '',
+            '    result = compute_%d(value, %d);' % (i % 97, i),
+            '    result += lookup_table[%d];' % (i % 13),
+            '',
+            '    return result;',
+            '}',
+            '',
+        ])
+
+    old = [line for function in functions for line in function]
+
+    rng.shuffle(functions)
+
+    for function in rng.sample(functions, num_functions // 10):
+        function[6] = '    result -= lookup_table[%d];' % rng.randint(0, 12)
+
+    new = [line for function in functions for line in function]
+
+    return old, new
+
+
+def time_move_detection(old, new, max_line_candidates):
+    from reviewboard.diffviewer.myersdiff import MyersDiffer
+    from reviewboard.diffviewer.opcode_generator import DiffOpcodeGenerator
+
+    differ = MyersDiffer(old, new)
+    opcodes = list(differ.get_opcodes())
+    differ.get_opcodes = lambda: opcodes
+
+    generator = DiffOpcodeGenerator(differ)
+    generator.MOVE_MAX_LINE_CANDIDATES = max_line_candidates
+
+    start = time.time()
+    moved = sum(
+        len(meta.get('moved-from', {}))
+        for tag, i1, i2, j1, j2, meta in generator
+    )
+
+    return time.time() - start, moved
+
+
+def main():
+    setup_environment()
+
+    from reviewboard.diffviewer.opcode_generator import DiffOpcodeGenerator
+
+    if len(sys.argv) > 1:
+        sizes = [int(arg) for arg in sys.argv[1:]]
+    else:
+        sizes = [500, 1000, 2000]
+
+    print('%-10s %-10s %12s %12s' % ('Functions', 'Limit', 'Time', 'Moved'))
+
+    for num_functions in sizes:
+        old, new = generate_files(num_functions, seed=num_functions)
+
+        for name, limit in (
+                ('default', DiffOpcodeGenerator.MOVE_MAX_LINE_CANDIDATES),
+                ('none', sys.maxsize)):
+            elapsed, moved = time_move_detection(old, new, limit)
+
+            print('%-10d %-10s %11.3fs %12d'
+                  % (num_functions, name, elapsed, moved))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+#
+# Compares MyersDiffer against FastMyersDiffer on large synthetic files,
+# checking that both produce identical opcodes.
+#
+# Usage: ./contrib/profiling/benchmark_myersdiff.py [num_lines ...]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import random
+import sys
+import time
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+
+def generate_files(num_lines, change_rate, seed):
+    """Generates an original and a modified file.
+
+    The original file mixes unique lines with frequently repeated ones
+    (blank lines, braces, and so on). The modified file deletes, inserts,
+    replaces and duplicates lines at the given rate.
+    """
+    rng = random.Random(seed)
+    common_lines = ['\n', '    }\n', '    return 0;\n', '/*\n', ' */\n']
+
+    orig = []
+
+    for i in range(num_lines):
+        if rng.random() < 0.2:
+            orig.append(rng.choice(common_lines))
+        else:
+            orig.append('    value_%d = compute(%d);\n'
+                        % (rng.randint(0, num_lines), i))
+
+    modified = []
+
+    for line in orig:
+        r = rng.random()
+
+        if r < change_rate:
+            # Delete the line.
+            continue
+        elif r < change_rate * 2:
+            # Replace the line.
+            modified.append('    changed_%d();\n' % rng.randint(0, 1000))
+        elif r < change_rate * 3:
+            # Insert a line copied from elsewhere in the file.
+            modified.append(line)
+            modified.append(rng.choice(orig))
+        else:
+            modified.append(line)
+
+    return orig, modified
+
+
+def time_differ(cls, orig, modified):
+    start = time.time()
+    opcodes = list(cls(orig, modified).get_opcodes())
+
+    return time.time() - start, opcodes
+
+
+def main():
+    setup_environment()
+
+    from reviewboard.diffviewer.fastmyersdiff import FastMyersDiffer
+    from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+
+    print('%8s %6s %10s %10s %8s'
+          % ('Lines', 'Rate', 'Myers', 'FastMyers', 'Speedup'))
+
+    for num_lines in sizes:
+        for change_rate in (0.01, 0.05, 0.2):
+            orig, modified = generate_files(num_lines, change_rate,
+                                            seed=num_lines)
+
+            myers_time, myers_opcodes = \
+                time_differ(MyersDiffer, orig, modified)
+            fast_time, fast_opcodes = \
+                time_differ(FastMyersDiffer, orig, modified)
+
+            if myers_opcodes != fast_opcodes:
+                print('Opcodes differ for %d lines with a change rate of %s!'
+                      % (num_lines, change_rate))
+                sys.exit(1)
+
+            print('%8d %6.2f %9.3fs %9.3fs %7.2fx'
+                  % (num_lines, change_rate, myers_time, fast_time,
+                     myers_time / max(fast_time, 0.0001)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+# Compares the in-process patcher against the `patch` subprocess fallback,
+# using the diffs in reviewboard/diffviewer/testdata.
+#
+# Usage: ./contrib/profiling/benchmark_patch.py [iterations]
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+
+
+def setup_environment():
+    root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                            '..', '..'))
+    sys.path.insert(0, root_dir)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reviewboard.settings')
+
+    return os.path.join(root_dir, 'reviewboard', 'diffviewer', 'testdata')
+
+
+def load_corpus(testdata_dir):
+    corpus = []
+    diffs_dir = os.path.join(testdata_dir, 'diffs', 'unified')
+
+    for diff_name in sorted(os.listdir(diffs_dir)):
+        filename = diff_name[:-len('.diff')]
+        orig_path = os.path.join(testdata_dir, 'orig_src', filename)
+
+        if not os.path.exists(orig_path):
+            continue
+
+        with open(orig_path, 'rb') as f:
+            orig = f.read()
+
+        with open(os.path.join(diffs_dir, diff_name), 'rb') as f:
+            diff = f.read()
+
+        corpus.append((filename, orig, diff))
+
+    return corpus
+
+
+def main():
+    testdata_dir = setup_environment()
+
+    from reviewboard.diffviewer.diffutils import (_patch_with_subprocess,
+                                                  convert_line_endings)
+    from reviewboard.diffviewer.errors import PatchError
+    from reviewboard.diffviewer.patcher import apply_patch
+
+    if len(sys.argv) > 1:
+        iterations = int(sys.argv[1])
+    else:
+        iterations = 20
+
+    corpus = []
+
+    for filename, orig, diff in load_corpus(testdata_dir):
+        orig = convert_line_endings(orig)
+        diff = convert_line_endings(diff)
+
+        try:
+            in_process = apply_patch(diff, orig, filename)
+        except PatchError:
+            # The diff isn't for this file (or doesn't apply at all).
+            continue
+
+        if in_process != _patch_with_subprocess(diff, orig, filename):
+            print('Results differ for %s!' % filename)
+            sys.exit(1)
+
+        corpus.append((filename, orig, diff))
+
+    print('Patching %d files, %d iterations' % (len(corpus), iterations))
+    print()
+
+    def run(func):
+        for filename, orig, diff in corpus:
+            func(diff, orig, filename)
+
+    in_process_time = timeit.timeit(lambda: run(apply_patch),
+                                    number=iterations)
+    subprocess_time = timeit.timeit(lambda: run(_patch_with_subprocess),
+                                    number=iterations)
+
+    print('In-process: %8.4f seconds' % in_process_time)
+    print('Subprocess: %8.4f seconds' % subprocess_time)
+    print('Speedup:    %8.1fx' % (subprocess_time / in_process_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -534,6 +534,45 @@ class DiffSettingsForm(SiteSettingsForm):
                     'to disable size restrictions.'),
         widget=forms.TextInput(attrs={'size': '15'}))
 
+    diffviewer_max_chunk_workers = forms.IntegerField(
+        label=_('Max diff workers'),
+        help_text=_('The number of files on a diff viewer page that can be '
+                    'fetched, patched and diffed at the same time when '
+                    'building the page. Enter 1 to process them one at a '
+                    'time.'),
+        min_value=1,
+        initial=1,
+        widget=forms.TextInput(attrs={'size': '5'}))
+
+    diffviewer_prerender_enabled = forms.BooleanField(
+        label=_('Pre-render new diffs'),
+        help_text=_('Queues newly uploaded and published diffs to be '
+                    'rendered and cached before anyone views them. This '
+                    'requires running "rb-site manage /path/to/site '
+                    'prerender-diffs" to process the queue.'),
+        required=False)
+
+    diffviewer_render_time_budget = forms.IntegerField(
+        label=_('Render time budget (seconds)'),
+        help_text=_('The time allowed for processing each file in the diff '
+                    'viewer. Once this runs out, syntax highlighting, moved '
+                    'line detection and highlighting of changes within '
+                    'lines are skipped for the file. If pre-rendering is '
+                    'enabled, the file is then rendered in full in the '
+                    'background. Enter 0 for no limit.'),
+        min_value=0,
+        initial=10,
+        widget=forms.TextInput(attrs={'size': '5'}))
+
+    diffviewer_show_stage_timings = forms.BooleanField(
+        label=_('Show diff timings'),
+        help_text=_('Records the time spent in each stage of processing '
+                    'diffs for the Diff Timings administration widget. '
+                    'The timings are also sent in a Server-Timing header, '
+                    'and the recent timings for the repository are shown '
+                    'to administrators at the bottom of the diff viewer.'),
+        required=False)
+
     def load(self):
         # TODO: Move this check into a dependencies module so we can catch it
         #       when the user starts up Review Board.
@@ -578,7 +617,11 @@ class DiffSettingsForm(SiteSettingsForm):
                 'fields': ('diffviewer_max_diff_size',
                            'diffviewer_context_num_lines',
                            'diffviewer_paginate_by',
-                           'diffviewer_paginate_orphans')
+                           'diffviewer_paginate_orphans',
+                           'diffviewer_max_chunk_workers',
+                           'diffviewer_prerender_enabled',
+                           'diffviewer_render_time_budget',
+                           'diffviewer_show_stage_timings')
             }
         )
 
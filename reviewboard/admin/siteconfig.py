@@ -122,9 +122,13 @@ defaults.update({
     'auth_x509_autocreate_users':          False,
     'diffviewer_context_num_lines':        5,
     'diffviewer_include_space_patterns':   [],
+    'diffviewer_max_chunk_workers':        1,
     'diffviewer_max_diff_size':            0,
     'diffviewer_paginate_by':              20,
     'diffviewer_paginate_orphans':         10,
+    'diffviewer_prerender_enabled':        False,
+    'diffviewer_render_time_budget':       10,
+    'diffviewer_show_stage_timings':       False,
     'diffviewer_syntax_highlighting':      True,
     'diffviewer_syntax_highlighting_threshold': 0,
     'diffviewer_show_trailing_whitespace': True,
@@ -11,12 +11,17 @@ from django.template.context import RequestContext
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 from djblets.cache.backend import cache_memoize
+from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.compat import six
 
 from reviewboard.admin.cache_stats import get_cache_stats
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.changedescs.models import ChangeDescription
-from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.chunk_cache import get_chunk_cache_stats
+from reviewboard.diffviewer.file_cache import get_file_cache_stats
+from reviewboard.diffviewer.models import DiffPrerenderJob, DiffSet
+from reviewboard.diffviewer.timing import (get_stage_timing_repository_ids,
+                                           get_stage_timing_stats)
 from reviewboard.reviews.models import (ReviewRequest, Group,
                                         Comment, Review, Screenshot,
                                         ReviewRequestDraft)
@@ -253,7 +258,8 @@ class ReviewGroupsWidget(Widget):
 class ServerCacheWidget(Widget):
     """Cache statistics widget.
 
-    Displays a list of memcached statistics, if available.
+    Displays a list of memcached statistics, if available, along with
+    statistics on the diff chunks stored in the cache.
     """
     title = _('Server Cache')
     template = 'admin/widgets/w-server-cache.html'
@@ -277,10 +283,54 @@ class ServerCacheWidget(Widget):
 
         return {
             'cache_stats': cache_stats,
+            'diff_chunk_stats': get_chunk_cache_stats(),
+            'diff_file_stats': get_file_cache_stats(),
             'uptime': uptime
         }
 
 
+class DiffPrerenderQueueWidget(Widget):
+    """Diff pre-rendering queue widget.
+
+    Displays the number of diffs waiting to be pre-rendered, and how long
+    the oldest one has been waiting.
+    """
+    title = _('Diff Pre-rendering Queue')
+    template = 'admin/widgets/w-diff-prerender-queue.html'
+    cache_data = False
+
+    def generate_data(self, request):
+        siteconfig = SiteConfiguration.objects.get_current()
+        data = DiffPrerenderJob.objects.get_stats()
+        data['enabled'] = siteconfig.get('diffviewer_prerender_enabled')
+
+        return data
+
+
+class DiffStageTimingsWidget(Widget):
+    """Diff stage timings widget.
+
+    Displays percentiles for the recent time spent in each stage of
+    processing diffs (fetching, patching, diffing, highlighting, rendering,
+    etc.), across all repositories and for each repository.
+    """
+    title = _('Diff Timings')
+    template = 'admin/widgets/w-diff-stage-timings.html'
+    cache_data = False
+
+    def generate_data(self, request):
+        repositories = Repository.objects.filter(
+            pk__in=get_stage_timing_repository_ids()).order_by('name')
+
+        return {
+            'stats': get_stage_timing_stats(),
+            'repository_stats': [
+                (repository, get_stage_timing_stats(repository.pk))
+                for repository in repositories
+            ],
+        }
+
+
 class NewsWidget(Widget):
     """News widget.
 
@@ -497,5 +547,7 @@ register(ReviewRequestStatusesWidget)
 register(RecentActionsWidget)
 register(ReviewGroupsWidget)
 register(ServerCacheWidget)
+register(DiffPrerenderQueueWidget)
+register(DiffStageTimingsWidget)
 register(NewsWidget)
 register(DatabaseStatsWidget)
@@ -6,7 +6,8 @@ from pygments import highlight
 from pygments.formatters import HtmlFormatter
 from pygments.lexers import DiffLexer
 
-from reviewboard.diffviewer.models import FileDiff, DiffSet, DiffSetHistory
+from reviewboard.diffviewer.models import (DiffPrerenderJob, DiffSet,
+                                           DiffSetHistory, FileDiff)
 
 
 class FileDiffAdmin(admin.ModelAdmin):
@@ -67,6 +68,13 @@ class DiffSetHistoryAdmin(admin.ModelAdmin):
     ordering = ('-timestamp',)
 
 
+class DiffPrerenderJobAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'timestamp', 'started', 'attempts')
+    raw_id_fields = ('diffset', 'interdiffset')
+    ordering = ('timestamp',)
+
+
 admin.site.register(FileDiff, FileDiffAdmin)
 admin.site.register(DiffSet, DiffSetAdmin)
 admin.site.register(DiffSetHistory, DiffSetHistoryAdmin)
+admin.site.register(DiffPrerenderJob, DiffPrerenderJobAdmin)
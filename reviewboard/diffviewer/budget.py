@@ -0,0 +1,48 @@
+from __future__ import unicode_literals
+
+import time
+
+
+# The optional stages of generating diff chunks. When one of these is
+# skipped, its name is listed in the ``degraded`` list in the metadata of
+# the file's chunks.
+STAGE_SYNTAX_HIGHLIGHTING = 'syntax-highlighting'
+STAGE_MOVE_DETECTION = 'move-detection'
+STAGE_INTRALINE = 'intraline'
+
+
+class RenderBudget(object):
+    """Tracks the time budget for generating the chunks for a file.
+
+    Generating chunks happens in stages: fetching and patching the files,
+    syntax highlighting, diffing, move detection, and finding the changed
+    regions within lines. The required stages always run, but the optional
+    ones are skipped (or cut short) once the budget has run out, so that a
+    pathological file can't tie up a worker for the whole request.
+
+    A budget of 0 or None seconds is unlimited.
+    """
+    def __init__(self, secs=None):
+        if secs:
+            self.deadline = time.time() + secs
+        else:
+            self.deadline = None
+
+        self.degraded = set()
+
+    def is_exhausted(self):
+        """Returns whether the budget has run out."""
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def can_run_stage(self, stage):
+        """Returns whether an optional stage can (continue to) run.
+
+        If the budget has run out, the stage is recorded as degraded, and
+        this returns False.
+        """
+        if self.is_exhausted():
+            self.degraded.add(stage)
+
+            return False
+
+        return True
@@ -0,0 +1,52 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.core.cache import cache
+from djblets.cache.backend import DEFAULT_EXPIRATION_TIME, make_cache_key
+from djblets.util.compat import six
+
+
+CACHE_EXPIRATION_TIME = getattr(settings, 'CACHE_EXPIRATION_TIME',
+                                DEFAULT_EXPIRATION_TIME)
+
+
+def increment_stats(prefix, **values):
+    """Increments statistics kept in the cache.
+
+    Each keyword argument is the name of a statistic and the amount to add
+    to it. ``prefix`` identifies the set of statistics (such as
+    ``diff-chunk-cache-stats``).
+    """
+    for name, value in six.iteritems(values):
+        key = _make_stats_key(prefix, name)
+
+        try:
+            cache.incr(key, value)
+        except ValueError:
+            # The key isn't in the cache yet. There's a small chance of
+            # losing an update here if another process adds it first, which
+            # is fine for these statistics.
+            cache.add(key, value, CACHE_EXPIRATION_TIME)
+
+
+def get_stats(prefix, names):
+    """Returns statistics kept in the cache.
+
+    This returns a dictionary mapping each of the given statistic names to
+    its current value, which is 0 if it isn't in the cache.
+    """
+    keys = dict(
+        (name, _make_stats_key(prefix, name))
+        for name in names
+    )
+    values = cache.get_many(list(six.itervalues(keys)))
+
+    return dict(
+        (name, int(values.get(key, 0)))
+        for name, key in six.iteritems(keys)
+    )
+
+
+def _make_stats_key(prefix, name):
+    """Returns the cache key for a statistic."""
+    return make_cache_key('%s-%s' % (prefix, name))
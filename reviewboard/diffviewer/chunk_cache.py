@@ -0,0 +1,520 @@
+from __future__ import unicode_literals
+
+import struct
+import sys
+import time
+import zlib
+from array import array
+from collections import Sequence
+
+from django.core.cache import cache
+from django.utils.safestring import mark_safe
+from djblets.cache.backend import CACHE_CHUNK_SIZE, make_cache_key
+from djblets.util.compat.six.moves import cPickle as pickle, range
+
+from reviewboard.diffviewer.cache_utils import (CACHE_EXPIRATION_TIME,
+                                                get_stats, increment_stats)
+
+
+# The formats used for cached chunks. The format is stored in the first
+# byte of the cached data.
+CHUNK_FORMAT_PICKLED = b'\x00'
+CHUNK_FORMAT_PACKED = b'\x01'
+
+# The header for a packed chunk, containing the number of lines, strings,
+# region values and moved lines, and the byte lengths of the string data
+# and the pickled chunk attributes.
+_PACKED_HEADER = struct.Struct(str('<6I'))
+
+# Flags stored for each line in a packed chunk.
+_LINE_WHITESPACE = 1 << 0
+_LINE_MOVED = 1 << 1
+_LINE_NO_OLD_REGION = 1 << 2
+_LINE_NO_NEW_REGION = 1 << 3
+
+# Packed integers are always stored little-endian.
+_BYTESWAP_INTS = (sys.byteorder != 'little')
+
+# The keys for the statistics kept on the chunk cache.
+_STATS_PREFIX = 'diff-chunk-cache-stats'
+_STATS_KEYS = ('files', 'chunks', 'bytes', 'loads', 'load_usecs')
+
+
+class PackedChunkLines(Sequence):
+    """The lines of a chunk, decoded from the packed cache format.
+
+    This behaves like the list of lines normally found in a chunk, but each
+    line is only built when accessed. Iterating over the lines in a template
+    therefore only pays for the lines that are rendered, rather than for
+    every line in the chunk up-front.
+
+    Lines are built each time they're accessed, so changes made to a line
+    won't be kept.
+    """
+    def __init__(self, num_lines, numbers, string_refs, flags,
+                 region_offsets, region_values, moved, string_offsets,
+                 string_data):
+        self._num_lines = num_lines
+        self._numbers = numbers
+        self._string_refs = string_refs
+        self._flags = flags
+        self._region_offsets = region_offsets
+        self._region_values = region_values
+        self._moved = moved
+        self._string_offsets = string_offsets
+        self._string_data = string_data
+
+        # The decoded HTML strings, filled in as they're used.
+        self._strings = [None] * (len(string_offsets) - 1)
+
+    def __len__(self):
+        return self._num_lines
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [
+                self._build_line(j)
+                for j in range(*i.indices(self._num_lines))
+            ]
+
+        if i < 0:
+            i += self._num_lines
+
+        if not 0 <= i < self._num_lines:
+            raise IndexError('line index out of range')
+
+        return self._build_line(i)
+
+    def __iter__(self):
+        build_line = self._build_line
+
+        for i in range(self._num_lines):
+            yield build_line(i)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, PackedChunkLines)):
+            return list(self) == list(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+
+        if result is NotImplemented:
+            return result
+
+        return not result
+
+    def __reduce__(self):
+        # Anything pickling these lines will get a normal list.
+        return list, (list(self),)
+
+    def _build_line(self, i):
+        """Builds the line at the given index."""
+        numbers = self._numbers
+        string_refs = self._string_refs
+        region_offsets = self._region_offsets
+        flags = self._flags[i]
+        j = i * 3
+        k = i * 2
+
+        old_region_start = region_offsets[k - 1] if k else 0
+        old_region_end = region_offsets[k]
+        new_region_end = region_offsets[k + 1]
+
+        if flags & _LINE_NO_OLD_REGION:
+            old_region = None
+        elif old_region_start == old_region_end:
+            old_region = []
+        else:
+            old_region = self._get_region(old_region_start, old_region_end)
+
+        if flags & _LINE_NO_NEW_REGION:
+            new_region = None
+        elif old_region_end == new_region_end:
+            new_region = []
+        else:
+            new_region = self._get_region(old_region_end, new_region_end)
+
+        line = [
+            numbers[j],
+            numbers[j + 1] or '',
+            self._strings[string_refs[k]] or self._get_string(string_refs[k]),
+            old_region,
+            numbers[j + 2] or '',
+            (self._strings[string_refs[k + 1]] or
+             self._get_string(string_refs[k + 1])),
+            new_region,
+            bool(flags & _LINE_WHITESPACE),
+        ]
+
+        if flags & _LINE_MOVED:
+            line.append(dict(self._moved[i]))
+
+        return line
+
+    def _get_string(self, ref):
+        """Returns the HTML string with the given index."""
+        s = self._strings[ref]
+
+        if s is None:
+            s = mark_safe(
+                self._string_data[self._string_offsets[ref]:
+                                  self._string_offsets[ref + 1]]
+                .decode('utf-8'))
+            self._strings[ref] = s
+
+        return s
+
+    def _get_region(self, start, end):
+        """Returns the changed regions stored in the given range."""
+        values = self._region_values
+
+        return [
+            (values[i], values[i + 1])
+            for i in range(start, end, 2)
+        ]
+
+
+def build_chunk_index(chunks):
+    """Builds the index for a list of chunks.
+
+    The index is a dictionary containing the number of chunks and a list of
+    information on each chunk, in order. Each entry contains the chunk's
+    ``index``, ``change``, ``collapsable`` and ``numlines`` values, the
+    first and last virtual line numbers in the chunk (``first_line`` and
+    ``last_line``), the ``headers``, ``left_headers`` and ``right_headers``
+    from the chunk's metadata, and whether it's a ``whitespace_chunk``.
+
+    The index also contains the list of stages that were skipped when
+    generating the chunks (``degraded``), if any. See RenderBudget.
+    """
+    chunk_infos = []
+    degraded = set()
+
+    for i, chunk in enumerate(chunks):
+        lines = chunk['lines']
+        meta = chunk.get('meta', {})
+
+        chunk_infos.append({
+            'index': i,
+            'change': chunk['change'],
+            'collapsable': chunk.get('collapsable', False),
+            'numlines': len(lines),
+            'first_line': lines[0][0] if lines else None,
+            'last_line': lines[-1][0] if lines else None,
+            'headers': meta.get('headers'),
+            'left_headers': meta.get('left_headers', []),
+            'right_headers': meta.get('right_headers', []),
+            'whitespace_chunk': meta.get('whitespace_chunk', False),
+        })
+        degraded.update(meta.get('degraded', []))
+
+    return {
+        'num_chunks': len(chunk_infos),
+        'chunks': chunk_infos,
+        'degraded': sorted(degraded),
+    }
+
+
+def pack_chunk(chunk):
+    """Serializes a chunk for storage in the cache.
+
+    The lines are stored as columns of packed integers (line numbers,
+    flags and changed regions), along with a table of the unique HTML
+    strings used by the lines. The rest of the chunk is pickled. The result
+    is compressed.
+
+    This is much smaller than a pickled chunk, and much faster to load,
+    since only the columns need to be decoded up-front (see
+    PackedChunkLines).
+
+    Chunks with lines that can't be packed are pickled instead.
+    """
+    try:
+        payload = _pack_chunk_payload(chunk)
+        chunk_format = CHUNK_FORMAT_PACKED
+    except (AttributeError, IndexError, OverflowError, TypeError,
+            ValueError):
+        payload = pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+        chunk_format = CHUNK_FORMAT_PICKLED
+
+    return chunk_format + zlib.compress(payload)
+
+
+def unpack_chunk(data):
+    """Deserializes a chunk stored in the cache by pack_chunk.
+
+    If the data is in an unknown format, this will return None.
+    """
+    chunk_format = data[:1]
+
+    if chunk_format == CHUNK_FORMAT_PACKED:
+        return _unpack_chunk_payload(zlib.decompress(data[1:]))
+    elif chunk_format == CHUNK_FORMAT_PICKLED:
+        return pickle.loads(zlib.decompress(data[1:]))
+    else:
+        return None
+
+
+def cache_chunks(key, chunks, expiration=CACHE_EXPIRATION_TIME):
+    """Stores a list of chunks in the cache, along with their index.
+
+    Rather than storing the list as a whole, each chunk is stored separately,
+    so that callers needing only some of the chunks (such as a single
+    expanded chunk, or the lines around a comment) can fetch just those,
+    using the index to find them.
+
+    Each chunk is serialized with pack_chunk, and stored under its own key.
+    If a chunk is too large for a single cache entry, it's split up into
+    parts, the number of which is recorded in the index.
+
+    The index is stored last, so that it's never available before the
+    chunks it refers to.
+
+    Returns the index.
+    """
+    index = build_chunk_index(chunks)
+    entries = {}
+    num_bytes = 0
+
+    for chunk, chunk_info in zip(chunks, index['chunks']):
+        data = pack_chunk(chunk)
+        num_bytes += len(data)
+        num_parts = 0
+
+        for i in range(0, len(data), CACHE_CHUNK_SIZE):
+            # Like the large data support in cache_memoize, each part is
+            # stored as a single-element list, so the cache backend won't
+            # try to convert the binary data to UTF-8.
+            part_key = _make_chunk_part_key(key, chunk_info['index'],
+                                            num_parts)
+            entries[part_key] = [data[i:i + CACHE_CHUNK_SIZE]]
+            num_parts += 1
+
+        chunk_info['num_parts'] = num_parts
+
+    cache.set_many(entries, expiration)
+    cache.set(_make_index_key(key), index, expiration)
+
+    increment_stats(_STATS_PREFIX, files=1, chunks=len(chunks),
+                    bytes=num_bytes)
+
+    return index
+
+
+def get_cached_chunk_index(key):
+    """Returns the cached index for a list of chunks.
+
+    If the index isn't in the cache, this will return None.
+    """
+    return cache.get(_make_index_key(key))
+
+
+def get_cached_chunks(key, index, chunk_indexes):
+    """Returns chunks from the cache.
+
+    The chunks at each of the given indexes are fetched from the cache at
+    once, and returned in the same order as ``chunk_indexes``.
+
+    If any of the chunks are missing from the cache, this will return None.
+    """
+    chunk_part_keys = []
+
+    for chunk_index in chunk_indexes:
+        chunk_info = index['chunks'][chunk_index]
+        chunk_part_keys.append([
+            _make_chunk_part_key(key, chunk_index, i)
+            for i in range(chunk_info['num_parts'])
+        ])
+
+    entries = cache.get_many([
+        part_key
+        for part_keys in chunk_part_keys
+        for part_key in part_keys
+    ])
+    start_time = time.time()
+    chunks = []
+
+    for part_keys in chunk_part_keys:
+        try:
+            data = b''.join([
+                entries[part_key][0]
+                for part_key in part_keys
+            ])
+        except KeyError:
+            return None
+
+        chunk = unpack_chunk(data)
+
+        if chunk is None:
+            return None
+
+        chunks.append(chunk)
+
+    increment_stats(_STATS_PREFIX, loads=len(chunks),
+                    load_usecs=int((time.time() - start_time) * 1000000))
+
+    return chunks
+
+
+def get_chunk_cache_stats():
+    """Returns statistics on the chunks stored in the cache.
+
+    This returns a dictionary containing the number of ``files`` and
+    ``chunks`` stored, the total ``bytes`` stored, the number of chunks
+    loaded (``loads``) and the total time spent decoding them
+    (``load_usecs``), along with the average ``bytes_per_file`` and
+    ``usecs_per_load``.
+
+    These are kept in the cache, so they cover all processes sharing the
+    cache, and are reset along with it.
+    """
+    stats = get_stats(_STATS_PREFIX, _STATS_KEYS)
+
+    stats.update({
+        'bytes_per_file': stats['bytes'] // max(stats['files'], 1),
+        'usecs_per_load': stats['load_usecs'] // max(stats['loads'], 1),
+    })
+
+    return stats
+
+
+def _pack_chunk_payload(chunk):
+    """Packs a chunk into the packed chunk format."""
+    lines = chunk['lines']
+    numbers = array(str('i'))
+    string_refs = array(str('i'))
+    flags = bytearray()
+    region_offsets = array(str('i'))
+    region_values = array(str('i'))
+    moved = array(str('i'))
+    string_ids = {}
+    strings = []
+
+    for i, line in enumerate(lines):
+        numbers.extend((line[0], line[1] or 0, line[4] or 0))
+        line_flags = 0
+
+        for s in (line[2], line[5]):
+            s = s.encode('utf-8')
+
+            try:
+                string_refs.append(string_ids[s])
+            except KeyError:
+                string_ids[s] = len(strings)
+                string_refs.append(len(strings))
+                strings.append(s)
+
+        for region, no_region_flag in ((line[3], _LINE_NO_OLD_REGION),
+                                       (line[6], _LINE_NO_NEW_REGION)):
+            if region is None:
+                line_flags |= no_region_flag
+            else:
+                for start, end in region:
+                    region_values.extend((start, end))
+
+            region_offsets.append(len(region_values))
+
+        if line[7]:
+            line_flags |= _LINE_WHITESPACE
+
+        if len(line) > 8 and line[8]:
+            line_flags |= _LINE_MOVED
+            moved.extend((i, line[8].get('to', 0), line[8].get('from', 0)))
+
+        flags.append(line_flags)
+
+    string_offsets = array(str('i'), [0])
+
+    for s in strings:
+        string_offsets.append(string_offsets[-1] + len(s))
+
+    string_data = b''.join(strings)
+    attrs = pickle.dumps(
+        dict(
+            (attr_name, value)
+            for attr_name, value in chunk.items()
+            if attr_name != 'lines'
+        ),
+        pickle.HIGHEST_PROTOCOL)
+
+    header = _PACKED_HEADER.pack(len(lines), len(strings),
+                                 len(region_values), len(moved) // 3,
+                                 len(string_data), len(attrs))
+
+    if _BYTESWAP_INTS:
+        for values in (numbers, string_refs, region_offsets, region_values,
+                       moved, string_offsets):
+            values.byteswap()
+
+    return b''.join([
+        header,
+        numbers.tostring(),
+        string_refs.tostring(),
+        bytes(flags),
+        region_offsets.tostring(),
+        region_values.tostring(),
+        moved.tostring(),
+        string_offsets.tostring(),
+        string_data,
+        attrs,
+    ])
+
+
+def _unpack_chunk_payload(payload):
+    """Unpacks a chunk from the packed chunk format."""
+    (num_lines, num_strings, num_region_values, num_moved,
+     string_data_len, attrs_len) = _PACKED_HEADER.unpack_from(payload)
+    offset = _PACKED_HEADER.size
+
+    def read_ints(count):
+        values = array(str('i'))
+        end = offset + count * values.itemsize
+        values.fromstring(payload[offset:end])
+
+        if _BYTESWAP_INTS:
+            values.byteswap()
+
+        return values, end
+
+    numbers, offset = read_ints(num_lines * 3)
+    string_refs, offset = read_ints(num_lines * 2)
+    flags = bytearray(payload[offset:offset + num_lines])
+    offset += num_lines
+    region_offsets, offset = read_ints(num_lines * 2)
+    region_values, offset = read_ints(num_region_values)
+    moved_values, offset = read_ints(num_moved * 3)
+    string_offsets, offset = read_ints(num_strings + 1)
+    string_data = payload[offset:offset + string_data_len]
+    offset += string_data_len
+    chunk = pickle.loads(payload[offset:offset + attrs_len])
+
+    moved = {}
+
+    for i in range(0, len(moved_values), 3):
+        moved_info = []
+
+        if moved_values[i + 1]:
+            moved_info.append(('to', moved_values[i + 1]))
+
+        if moved_values[i + 2]:
+            moved_info.append(('from', moved_values[i + 2]))
+
+        moved[moved_values[i]] = moved_info
+
+    chunk['lines'] = PackedChunkLines(num_lines, numbers, string_refs, flags,
+                                      region_offsets, region_values, moved,
+                                      string_offsets, string_data)
+
+    return chunk
+
+
+def _make_index_key(key):
+    """Returns the cache key for the index of a list of chunks."""
+    return make_cache_key('%s-index' % key)
+
+
+def _make_chunk_part_key(key, chunk_index, part):
+    """Returns the cache key for part of a chunk."""
+    return make_cache_key('%s-chunk-%d-%d' % (key, chunk_index, part))
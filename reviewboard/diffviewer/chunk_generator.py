@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import fnmatch
+import logging
 import re
 from difflib import SequenceMatcher
 
@@ -8,36 +9,39 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _, get_language
 from djblets.log import log_timed
-from djblets.cache.backend import cache_memoize
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.compat import six
-from djblets.util.compat.six.moves import range
-from pygments import highlight
-from pygments.lexers import get_lexer_for_filename
-from pygments.formatters import HtmlFormatter
-
+from djblets.util.compat.six.moves import html_entities, range
+
+from reviewboard.diffviewer.budget import (RenderBudget,
+                                           STAGE_INTRALINE,
+                                           STAGE_MOVE_DETECTION,
+                                           STAGE_SYNTAX_HIGHLIGHTING)
+from reviewboard.diffviewer.chunk_cache import (build_chunk_index,
+                                                cache_chunks,
+                                                get_cached_chunk_index,
+                                                get_cached_chunks)
 from reviewboard.diffviewer.differ import get_differ
 from reviewboard.diffviewer.diffutils import (get_original_file,
                                               get_patched_file)
+from reviewboard.diffviewer.highlighting import highlight_files
+from reviewboard.diffviewer.models import DiffPrerenderJob, InterdiffResult
 from reviewboard.diffviewer.opcode_generator import get_diff_opcode_generator
+from reviewboard.diffviewer.timing import STAGE_HIGHLIGHTING, time_stage
 
 
-class NoWrapperHtmlFormatter(HtmlFormatter):
-    """An HTML Formatter for Pygments that doesn't wrap items in a div."""
-    def __init__(self, *args, **kwargs):
-        super(NoWrapperHtmlFormatter, self).__init__(*args, **kwargs)
+# The maximum number of lines to keep computed regions of changes for.
+LINE_REGIONS_CACHE_SIZE = 1000
 
-    def _wrap_div(self, inner):
-        """Removes the div wrapper from formatted code.
+# The number of seconds degraded chunks are cached for when no full render
+# can be queued to replace them. Once they expire, the chunks are generated
+# again, and may then fit within the budget.
+DEGRADED_CHUNKS_EXPIRATION_TIME = 10 * 60
 
-        This is called by the formatter to wrap the contents of inner.
-        Inner is a list of tuples containing formatted code. If the first item
-        in the tuple is zero, then it's the div wrapper, so we should ignore
-        it.
-        """
-        for tup in inner:
-            if tup[0]:
-                yield tup
+_MARKUP_TAG_RE = re.compile(r'<[^>]*>')
+_MARKUP_ENTITY_RE = re.compile(r'&(#?\w+);')
+
+_line_regions_cache = {}
 
 
 class DiffChunkGenerator(object):
@@ -77,6 +81,13 @@ class DiffChunkGenerator(object):
          in this case, so we have to indicate that we are indeed in
          interdiff mode so that we can special-case this and not
          grab a patched file for the interdiff version.
+
+    Generating the chunks for a file is limited by a render time budget
+    (see RenderBudget). If the optional stages (syntax highlighting, move
+    detection and changes within lines) have to be skipped, the chunks are
+    cached with the names of the skipped stages in the ``degraded`` list in
+    their metadata, and the diff is queued to be pre-rendered without a
+    budget, replacing the degraded chunks.
     """
     NEWLINES_RE = re.compile(r'\r?\n')
 
@@ -85,7 +96,8 @@ class DiffChunkGenerator(object):
     STYLED_MAX_LIMIT_BYTES = 200000  # 200KB
 
     def __init__(self, request, filediff, interfilediff=None,
-                 force_interdiff=False, enable_syntax_highlighting=True):
+                 force_interdiff=False, enable_syntax_highlighting=True,
+                 render_time_budget=None):
         assert filediff
 
         self.request = request
@@ -96,6 +108,11 @@ class DiffChunkGenerator(object):
         self.enable_syntax_highlighting = enable_syntax_highlighting
         self.differ = None
 
+        # The number of seconds allowed for generating the chunks. If None,
+        # the diffviewer_render_time_budget setting is used.
+        self.render_time_budget = render_time_budget
+        self.render_budget = RenderBudget()
+
         self.filename = filediff.source_file
 
         # Chunk processing state.
@@ -104,6 +121,9 @@ class DiffChunkGenerator(object):
         self._cur_meta = {}
         self._chunk_index = 0
 
+        # The cached index of the generated chunks.
+        self._cached_chunk_index = None
+
     def make_cache_key(self):
         """Creates a cache key for any generated chunks."""
         key = 'diff-sidebyside-'
@@ -123,51 +143,202 @@ class DiffChunkGenerator(object):
 
         return key
 
-    def get_chunks(self):
+    def get_chunks(self, chunk_indexes=None):
         """Returns the chunks for the given diff information.
 
         If the file is binary or deleted, or if the file has moved with no
         additional changes, then an empty list of chunks will be returned.
 
+        If ``chunk_indexes`` is provided, only the chunks at those indexes
+        will be returned, in the order given. Otherwise, all chunks are
+        returned.
+
         If there are chunks already computed in the cache, they will be
         returned. Otherwise, new chunks will be generated, stored in cache,
         and returned.
         """
-        if (self.filediff.binary or
-                self.filediff.deleted or
-                self.filediff.source_revision == ''):
+        if not self._has_chunks():
             return []
 
-        return cache_memoize(self.make_cache_key(),
-                             lambda: list(self._get_chunks_uncached()),
-                             large_data=True)
+        key = self.make_cache_key()
+        index = self._cached_chunk_index or get_cached_chunk_index(key)
 
-    def _get_chunks_uncached(self):
-        """Returns the list of chunks, bypassing the cache."""
-        old = get_original_file(self.filediff, self.request)
-        new = get_patched_file(old, self.filediff, self.request)
+        if index is not None and not self._can_use_cached_index(index):
+            index = None
+
+        if index is not None:
+            self._cached_chunk_index = index
+
+            if chunk_indexes is None:
+                chunk_indexes = range(index['num_chunks'])
+
+            chunks = get_cached_chunks(key, index, chunk_indexes)
+
+            if chunks is not None:
+                return chunks
+
+        chunks = self._generate_and_cache_chunks()
+
+        if chunk_indexes is None:
+            return chunks
+        else:
+            return [chunks[i] for i in chunk_indexes]
+
+    def get_chunk_index(self):
+        """Returns the index of the chunks for the given diff information.
+
+        The index describes the change type, line range and headers of each
+        chunk (see build_chunk_index), and is much smaller than the chunks
+        themselves. It can be used to determine which chunks to load with
+        get_chunks.
+
+        If the index isn't in the cache, the chunks will be generated and
+        stored in the cache, along with the index.
+        """
+        if self._cached_chunk_index is None:
+            if not self._has_chunks():
+                self._cached_chunk_index = build_chunk_index([])
+            else:
+                index = get_cached_chunk_index(self.make_cache_key())
+
+                if index is not None and self._can_use_cached_index(index):
+                    self._cached_chunk_index = index
+                else:
+                    self._generate_and_cache_chunks()
+
+        return self._cached_chunk_index
+
+    def needs_files(self):
+        """Returns whether generating the chunks requires fetching files.
+
+        This is the case unless the diff has no chunks, or usable chunks are
+        already in the cache.
+        """
+        if not self._has_chunks():
+            return False
+
+        if self._cached_chunk_index is None:
+            index = get_cached_chunk_index(self.make_cache_key())
+
+            if index is not None and self._can_use_cached_index(index):
+                self._cached_chunk_index = index
+
+        return self._cached_chunk_index is None
+
+    def _has_chunks(self):
+        """Returns whether there may be chunks for the diff.
+
+        Binary and deleted files, and files that have moved with no
+        additional changes, never have chunks.
+        """
+        return not (self.filediff.binary or
+                    self.filediff.deleted or
+                    self.filediff.source_revision == '')
+
+    def _get_render_time_budget(self):
+        """Returns the number of seconds allowed for generating chunks.
+
+        0 means there's no limit.
+        """
+        if self.render_time_budget is not None:
+            return self.render_time_budget
+
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        return siteconfig.get('diffviewer_render_time_budget')
+
+    def _can_use_cached_index(self, index):
+        """Returns whether the cached chunks with the given index can be used.
+
+        Chunks that were degraded to fit within a render time budget are
+        only used if this generator has a budget as well. Otherwise, they're
+        generated again at full fidelity.
+        """
+        return not index.get('degraded') or self._get_render_time_budget()
+
+    def _generate_and_cache_chunks(self):
+        """Generates all chunks for the diff and stores them in the cache.
+
+        If any stages had to be skipped to fit within the render time
+        budget, they're recorded in the metadata of each chunk, and the diff
+        is queued to be rendered in full. If it can't be queued (such as
+        when pre-rendering is disabled), the degraded chunks are only cached
+        briefly, rather than being served until they fall out of the cache.
 
+        Returns the list of generated chunks.
+        """
+        chunks = list(self._get_chunks_uncached())
+        degraded = sorted(self.render_budget.degraded)
+        cache_kwargs = {}
+
+        if degraded:
+            logging.warning('Ran out of time generating diff chunks for '
+                            'FileDiff %s (%s). Skipped: %s',
+                            self.filediff.pk, self.filediff.source_file,
+                            ', '.join(degraded),
+                            request=self.request)
+
+            for chunk in chunks:
+                chunk['meta']['degraded'] = degraded
+
+            if not self._queue_full_render():
+                cache_kwargs['expiration'] = DEGRADED_CHUNKS_EXPIRATION_TIME
+
+        self._cached_chunk_index = cache_chunks(self.make_cache_key(),
+                                                chunks, **cache_kwargs)
+
+        return chunks
+
+    def _queue_full_render(self):
+        """Queues the diff to be rendered without a render time budget.
+
+        This uses the diff pre-rendering queue, if enabled. Files that are
+        reverted in an interdiff have no FileDiff to find the interdiff
+        revision from, and aren't queued.
+
+        Returns whether a full render is queued.
+        """
         if self.interfilediff:
-            old = new
-            interdiff_orig = get_original_file(self.interfilediff,
-                                               self.request)
-            new = get_patched_file(interdiff_orig, self.interfilediff,
-                                   self.request)
+            interdiffset = self.interfilediff.diffset
         elif self.force_interdiff:
-            # Basically, revert the change.
-            old, new = new, old
+            return False
+        else:
+            interdiffset = None
 
-        encoding = self.diffset.repository.encoding or 'iso-8859-15'
-        old = self._convert_to_utf8(old, encoding)
-        new = self._convert_to_utf8(new, encoding)
+        pending = DiffPrerenderJob.objects.filter(diffset=self.diffset,
+                                                  interdiffset=interdiffset,
+                                                  started=None)
 
-        # Normalize the input so that if there isn't a trailing newline, we add
-        # it.
-        if old and old[-1] != '\n':
-            old += '\n'
+        return (pending.exists() or
+                DiffPrerenderJob.objects.queue(self.diffset,
+                                               interdiffset) is not None)
 
-        if new and new[-1] != '\n':
-            new += '\n'
+    def _get_chunks_uncached(self):
+        """Returns the list of chunks, bypassing the cache."""
+        self.render_budget = RenderBudget(self._get_render_time_budget())
+        siteconfig = SiteConfiguration.objects.get_current()
+        ignore_space = True
+
+        for pattern in siteconfig.get('diffviewer_include_space_patterns'):
+            if fnmatch.fnmatch(self.filename, pattern):
+                ignore_space = False
+                break
+
+        # The results of computing interdiffs are stored, so that they don't
+        # have to be computed again for FileDiffs with the same contents, or
+        # when the chunks fall out of the cache.
+        interdiff_key = None
+        interdiff_result = None
+
+        if self.interfilediff:
+            interdiff_key = InterdiffResult.objects.make_key(
+                self.filediff, self.interfilediff, ignore_space)
+
+            if interdiff_key:
+                interdiff_result = \
+                    InterdiffResult.objects.get_result(interdiff_key)
+
+        old, new = self._get_files()
 
         a = self.NEWLINES_RE.split(old or '')
         b = self.NEWLINES_RE.split(new or '')
@@ -182,7 +353,8 @@ class DiffChunkGenerator(object):
 
         markup_a = markup_b = None
 
-        if self._get_enable_syntax_highlighting(old, new, a, b):
+        if (self._get_enable_syntax_highlighting(old, new, a, b) and
+                self.render_budget.can_run_stage(STAGE_SYNTAX_HIGHLIGHTING)):
             repository = self.filediff.diffset.repository
             tool = repository.get_scmtool()
             source_file = \
@@ -190,13 +362,16 @@ class DiffChunkGenerator(object):
             dest_file = \
                 tool.normalize_path_for_display(self.filediff.dest_file)
 
-            try:
-                # TODO: Try to figure out the right lexer for these files
-                #       once instead of twice.
-                markup_a = self._apply_pygments(old or '', source_file)
-                markup_b = self._apply_pygments(new or '', dest_file)
-            except:
-                pass
+            with time_stage(STAGE_HIGHLIGHTING, self.filediff) as stage_info:
+                stage_info['num_bytes'] = len(old or '') + len(new or '')
+
+                try:
+                    markup_a, markup_b = highlight_files(old or '',
+                                                         new or '',
+                                                         source_file,
+                                                         dest_file)
+                except:
+                    pass
 
         if not markup_a:
             markup_a = self.NEWLINES_RE.split(escape(old))
@@ -204,18 +379,32 @@ class DiffChunkGenerator(object):
         if not markup_b:
             markup_b = self.NEWLINES_RE.split(escape(new))
 
-        siteconfig = SiteConfiguration.objects.get_current()
-        ignore_space = True
-
-        for pattern in siteconfig.get('diffviewer_include_space_patterns'):
-            if fnmatch.fnmatch(self.filename, pattern):
-                ignore_space = False
-                break
-
         self.differ = get_differ(a, b, ignore_space=ignore_space,
                                  compat_version=self.diffset.diffcompat)
         self.differ.add_interesting_lines_for_headers(self.filename)
 
+        if interdiff_result:
+            opcodes = interdiff_result['opcodes']
+            self.differ.interesting_lines = \
+                interdiff_result['interesting_lines']
+        else:
+            opcodes = get_diff_opcode_generator(
+                self.differ, self.filediff, self.interfilediff,
+                render_budget=self.render_budget)
+
+            if interdiff_key:
+                # The interesting lines are found while generating the
+                # opcodes, so they must all be generated before storing.
+                # Opcodes missing moved lines due to the render time budget
+                # aren't stored.
+                opcodes = list(opcodes)
+
+                if STAGE_MOVE_DETECTION not in self.render_budget.degraded:
+                    InterdiffResult.objects.store_result(interdiff_key, {
+                        'opcodes': opcodes,
+                        'interesting_lines': self.differ.interesting_lines,
+                    })
+
         context_num_lines = siteconfig.get("diffviewer_context_num_lines")
         collapse_threshold = 2 * context_num_lines + 3
 
@@ -232,11 +421,8 @@ class DiffChunkGenerator(object):
                 request=self.request)
 
         line_num = 1
-        opcodes_generator = get_diff_opcode_generator(self.differ,
-                                                      self.filediff,
-                                                      self.interfilediff)
 
-        for tag, i1, i2, j1, j2, meta in opcodes_generator:
+        for tag, i1, i2, j1, j2, meta in opcodes:
             old_lines = markup_a[i1:i2]
             new_lines = markup_b[j1:j2]
             num_lines = max(len(old_lines), len(new_lines))
@@ -272,6 +458,40 @@ class DiffChunkGenerator(object):
 
         log_timer.done()
 
+    def _get_files(self):
+        """Returns the original and modified versions of the file.
+
+        The files are fetched from the repository and patched, based on the
+        mode the generator is operating in. They're returned as UTF-8, with
+        trailing newlines.
+        """
+        old = get_original_file(self.filediff, self.request)
+        new = get_patched_file(old, self.filediff, self.request)
+
+        if self.interfilediff:
+            old = new
+            interdiff_orig = get_original_file(self.interfilediff,
+                                               self.request)
+            new = get_patched_file(interdiff_orig, self.interfilediff,
+                                   self.request)
+        elif self.force_interdiff:
+            # Basically, revert the change.
+            old, new = new, old
+
+        encoding = self.diffset.repository.encoding or 'iso-8859-15'
+        old = self._convert_to_utf8(old, encoding)
+        new = self._convert_to_utf8(new, encoding)
+
+        # Normalize the input so that if there isn't a trailing newline, we add
+        # it.
+        if old and old[-1] != '\n':
+            old += '\n'
+
+        if new and new[-1] != '\n':
+            new += '\n'
+
+        return old, new
+
     def _get_enable_syntax_highlighting(self, old, new, a, b):
         """Returns whether or not we'll be enabling syntax highlighting.
 
@@ -320,9 +540,11 @@ class DiffChunkGenerator(object):
         if (old_line and new_line and
                 len(old_line) <= self.STYLED_MAX_LINE_LEN and
                 len(new_line) <= self.STYLED_MAX_LINE_LEN and
-                old_line != new_line):
-            old_region, new_region = self._get_line_changed_regions(old_line,
-                                                                    new_line)
+                old_line != new_line and
+                self.render_budget.can_run_stage(STAGE_INTRALINE)):
+            # The regions of changes within these lines are computed when
+            # the line is rendered. See get_line_changed_regions.
+            old_region = new_region = None
         else:
             old_region = new_region = []
 
@@ -430,18 +652,6 @@ class DiffChunkGenerator(object):
         else:
             self._last_header_index[0] = last_index
 
-    def _apply_pygments(self, data, filename):
-        """Applies Pygments syntax-highlighting to a file's contents.
-
-        The resulting HTML will be returned as a list of lines.
-        """
-        lexer = get_lexer_for_filename(filename,
-                                       stripnl=False,
-                                       encoding='utf-8')
-        lexer.add_filter('codetagify')
-
-        return highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
-
     def _convert_to_utf8(self, s, enc):
         """Returns the passed string as a unicode string.
 
@@ -478,48 +688,7 @@ class DiffChunkGenerator(object):
 
     def _get_line_changed_regions(self, oldline, newline):
         """Returns regions of changes between two similar lines."""
-        if oldline is None or newline is None:
-            return (None, None)
-
-        # Use the SequenceMatcher directly. It seems to give us better results
-        # for this. We should investigate steps to move to the new differ.
-        differ = SequenceMatcher(None, oldline, newline)
-
-        # This thresholds our results -- we don't want to show inter-line diffs
-        # if most of the line has changed, unless those lines are very short.
-
-        # FIXME: just a plain, linear threshold is pretty crummy here.  Short
-        # changes in a short line get lost.  I haven't yet thought of a fancy
-        # nonlinear test.
-        if differ.ratio() < 0.6:
-            return (None, None)
-
-        oldchanges = []
-        newchanges = []
-        back = (0, 0)
-
-        for tag, i1, i2, j1, j2 in differ.get_opcodes():
-            if tag == 'equal':
-                if (i2 - i1 < 3) or (j2 - j1 < 3):
-                    back = (j2 - j1, i2 - i1)
-                continue
-
-            oldstart, oldend = i1 - back[0], i2
-            newstart, newend = j1 - back[1], j2
-
-            if oldchanges != [] and oldstart <= oldchanges[-1][1] < oldend:
-                oldchanges[-1] = (oldchanges[-1][0], oldend)
-            elif not oldline[oldstart:oldend].isspace():
-                oldchanges.append((oldstart, oldend))
-
-            if newchanges != [] and newstart <= newchanges[-1][1] < newend:
-                newchanges[-1] = (newchanges[-1][0], newend)
-            elif not newline[newstart:newend].isspace():
-                newchanges.append((newstart, newend))
-
-            back = (0, 0)
-
-        return oldchanges, newchanges
+        return _compute_line_changed_regions(oldline, newline)
 
 
 def compute_chunk_last_header(lines, numlines, meta, last_header=None):
@@ -551,6 +720,136 @@ def compute_chunk_last_header(lines, numlines, meta, last_header=None):
     return last_header
 
 
+def get_line_changed_regions(line):
+    """Returns the regions of changes for a line in a chunk.
+
+    Computing the regions of changes within a replaced line is expensive,
+    and most lines in a large diff are never looked at, so the regions
+    aren't computed when generating chunks. Instead, lines needing them
+    have None for their regions, and this computes them from the line's
+    markup when the line is rendered.
+
+    Results are kept in a small cache, since the same lines tend to be
+    rendered several times.
+
+    This returns a tuple of the regions for the old and new lines.
+    """
+    old_region = line[3]
+    new_region = line[6]
+
+    if old_region is None or new_region is None:
+        key = (line[2], line[5])
+
+        try:
+            old_region, new_region = _line_regions_cache[key]
+        except KeyError:
+            old_region, new_region = _compute_line_changed_regions(
+                _get_markup_text(line[2]),
+                _get_markup_text(line[5]))
+
+            if len(_line_regions_cache) >= LINE_REGIONS_CACHE_SIZE:
+                _line_regions_cache.clear()
+
+            _line_regions_cache[key] = (old_region, new_region)
+
+    return old_region, new_region
+
+
+def compute_chunk_line_regions(lines):
+    """Returns the lines of a chunk, with all regions of changes computed.
+
+    This is used when the lines are provided to something other than the
+    diff viewer's renderer, which expects the regions to be present. Lines
+    with regions that needed to be computed are copied.
+    """
+    result = []
+
+    for line in lines:
+        if line[3] is None or line[6] is None:
+            line = list(line)
+            line[3], line[6] = get_line_changed_regions(line)
+
+        result.append(line)
+
+    return result
+
+
+def _compute_line_changed_regions(oldline, newline):
+    """Returns regions of changes between two similar lines."""
+    if oldline is None or newline is None:
+        return (None, None)
+
+    # Use the SequenceMatcher directly. It seems to give us better results
+    # for this. We should investigate steps to move to the new differ.
+    differ = SequenceMatcher(None, oldline, newline)
+
+    # This thresholds our results -- we don't want to show inter-line diffs
+    # if most of the line has changed, unless those lines are very short.
+    #
+    # The quick ratios are upper bounds on the real ratio, and are much
+    # cheaper to compute, so they're checked first.
+
+    # FIXME: just a plain, linear threshold is pretty crummy here.  Short
+    # changes in a short line get lost.  I haven't yet thought of a fancy
+    # nonlinear test.
+    if (differ.real_quick_ratio() < 0.6 or
+            differ.quick_ratio() < 0.6 or
+            differ.ratio() < 0.6):
+        return (None, None)
+
+    oldchanges = []
+    newchanges = []
+    back = (0, 0)
+
+    for tag, i1, i2, j1, j2 in differ.get_opcodes():
+        if tag == 'equal':
+            if (i2 - i1 < 3) or (j2 - j1 < 3):
+                back = (j2 - j1, i2 - i1)
+            continue
+
+        oldstart, oldend = i1 - back[0], i2
+        newstart, newend = j1 - back[1], j2
+
+        if oldchanges != [] and oldstart <= oldchanges[-1][1] < oldend:
+            oldchanges[-1] = (oldchanges[-1][0], oldend)
+        elif not oldline[oldstart:oldend].isspace():
+            oldchanges.append((oldstart, oldend))
+
+        if newchanges != [] and newstart <= newchanges[-1][1] < newend:
+            newchanges[-1] = (newchanges[-1][0], newend)
+        elif not newline[newstart:newend].isspace():
+            newchanges.append((newstart, newend))
+
+        back = (0, 0)
+
+    return oldchanges, newchanges
+
+
+def _get_markup_text(markup):
+    """Returns the text of a line of markup.
+
+    This strips the tags from the markup and unescapes any entities, in
+    the same way that highlightregion counts characters in the markup.
+    """
+    return _MARKUP_ENTITY_RE.sub(_unescape_entity,
+                                 _MARKUP_TAG_RE.sub('', markup))
+
+
+def _unescape_entity(m):
+    """Returns the character for an entity matched in markup."""
+    name = m.group(1)
+
+    try:
+        if name.startswith('#x'):
+            return six.unichr(int(name[2:], 16))
+        elif name.startswith('#'):
+            return six.unichr(int(name[1:]))
+        else:
+            return six.unichr(html_entities.name2codepoint[name])
+    except (KeyError, ValueError):
+        return m.group(0)
+
+
 _generator = DiffChunkGenerator
 
 
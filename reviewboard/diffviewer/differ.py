@@ -7,7 +7,7 @@ from reviewboard.diffviewer.filetypes import (HEADER_REGEXES,
                                               HEADER_REGEX_ALIASES)
 
 
-DEFAULT_DIFF_COMPAT_VERSION = 1
+DEFAULT_DIFF_COMPAT_VERSION = 2
 
 
 class Differ(object):
@@ -72,13 +72,16 @@ def get_differ(a, b, ignore_space=False,
                compat_version=DEFAULT_DIFF_COMPAT_VERSION):
     """Returns a differ for with the given settings.
 
-    By default, this will return the MyersDiffer. Older differs can be used
-    by specifying a compat_version, but this is only for *really* ancient
-    diffs, currently.
+    By default, this will return the FastMyersDiffer, which produces the
+    same results as the MyersDiffer. Older differs can be used by specifying
+    a compat_version, but this is only for *really* ancient diffs, currently.
     """
     cls = None
 
-    if compat_version == 1:
+    if compat_version == 2:
+        from reviewboard.diffviewer.fastmyersdiff import FastMyersDiffer
+        cls = FastMyersDiffer
+    elif compat_version == 1:
         from reviewboard.diffviewer.myersdiff import MyersDiffer
         cls = MyersDiffer
     elif compat_version == 0:
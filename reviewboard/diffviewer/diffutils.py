@@ -1,11 +1,16 @@
 from __future__ import unicode_literals
 
+import logging
 import os
 import re
 import subprocess
 import tempfile
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
 
-from django.utils import six
+from django.db import connection
+from django.utils import six, translation
+from django.utils.http import urlquote
 from django.utils.translation import ugettext as _
 from djblets.log import log_timed
 from djblets.siteconfig.models import SiteConfiguration
@@ -13,6 +18,13 @@ from djblets.util.contextmanagers import controlled_subprocess
 
 from reviewboard.accounts.models import Profile
 from reviewboard.admin.checks import get_can_enable_syntax_highlighting
+from reviewboard.diffviewer.errors import PatchError
+from reviewboard.diffviewer.file_cache import (cache_file, get_cached_file,
+                                               get_cached_file_keys)
+from reviewboard.diffviewer.patcher import apply_patch
+from reviewboard.diffviewer.timing import (STAGE_FETCH, STAGE_PATCH,
+                                           get_stage_timings,
+                                           set_stage_timings, time_stage)
 from reviewboard.scmtools.core import PRE_CREATION, HEAD
 
 
@@ -45,9 +57,13 @@ def convert_line_endings(data):
 
 
 def patch(diff, file, filename, request=None):
-    """Apply a diff to a file.  Delegates out to `patch` because noone
-       except Larry Wall knows how to patch."""
+    """Apply a diff to a file.
 
+    This first tries to apply the diff in-process, which avoids the cost
+    of writing temporary files and spawning a process. If the diff can't
+    be parsed or applied that way, this delegates out to `patch`, because
+    noone except Larry Wall knows how to patch.
+    """
     log_timer = log_timed("Patching file %s" % filename,
                           request=request)
 
@@ -55,16 +71,41 @@ def patch(diff, file, filename, request=None):
         # Someone uploaded an unchanged file. Return the one we're patching.
         return file
 
+    file = convert_line_endings(file)
+    diff = convert_line_endings(diff)
+
+    try:
+        data = apply_patch(diff, file, filename)
+        log_timer.done()
+
+        return data
+    except PatchError as e:
+        logging.warning('Unable to apply the patch to %s in-process (%s). '
+                        'Falling back to patch.',
+                        filename, e, request=request)
+        rejects = e.rejects
+
+    try:
+        return _patch_with_subprocess(diff, file, filename, rejects)
+    finally:
+        log_timer.done()
+
+
+def _patch_with_subprocess(diff, file, filename, rejects=None):
+    """Apply a diff to a file using the `patch` utility.
+
+    Both the diff and file must already have had their line endings
+    converted. If the patch fails to apply, a PatchError will be raised,
+    containing any rejects found when applying the patch in-process.
+    """
     # Prepare the temporary directory if none is available
     tempdir = tempfile.mkdtemp(prefix='reviewboard.')
 
     (fd, oldfile) = tempfile.mkstemp(dir=tempdir)
     f = os.fdopen(fd, "w+b")
-    f.write(convert_line_endings(file))
+    f.write(file)
     f.close()
 
-    diff = convert_line_endings(diff)
-
     newfile = '%s-new' % oldfile
 
     process = subprocess.Popen(['patch', '-o', newfile, oldfile],
@@ -82,12 +123,8 @@ def patch(diff, file, filename, request=None):
         with open("%s.diff" % absolute_path, 'w') as f:
             f.write(diff)
 
-        log_timer.done()
-
-        # FIXME: This doesn't provide any useful error report on why the patch
-        # failed to apply, which makes it hard to debug.  We might also want to
-        # have it clean up if DEBUG=False
-        raise Exception(
+        # FIXME: We might also want to have it clean up if DEBUG=False
+        raise PatchError(
             _("The patch to '%(filename)s' didn't apply cleanly. The "
               "temporary files have been left in '%(tempdir)s' for debugging "
               "purposes.\n"
@@ -96,7 +133,10 @@ def patch(diff, file, filename, request=None):
                 'filename': filename,
                 'tempdir': tempdir,
                 'output': patch_output,
-            })
+            },
+            filename,
+            rejects=rejects,
+            error_output=patch_output)
 
     with open(newfile, "r") as f:
         data = f.read()
@@ -105,8 +145,6 @@ def patch(diff, file, filename, request=None):
     os.unlink(newfile)
     os.rmdir(tempdir)
 
-    log_timer.done()
-
     return data
 
 
@@ -115,43 +153,143 @@ def get_original_file(filediff, request=None):
     Get a file either from the cache or the SCM, applying the parent diff if
     it exists.
 
+    The file's line endings are normalized, and the result (after applying
+    any parent diff) is cached by the hash of its contents, so that files
+    with the same contents are only stored once. See file_cache for
+    details.
+
     SCM exceptions are passed back to the caller.
     """
-    data = b""
-
-    if filediff.source_revision != PRE_CREATION:
-        repository = filediff.diffset.repository
-        data = repository.get_file(
-            filediff.source_file,
-            filediff.source_revision,
-            base_commit_id=filediff.diffset.base_commit_id,
-            request=request)
-
-        # Repository.get_file doesn't know or care about how we need line
-        # endings to work. So, we'll just transform every time.
-        #
-        # This is mostly only a problem if the diff chunks aren't in the
-        # cache, though if several people are working off the same file,
-        # we'll be doing extra work to convert those line endings for each
-        # of those instead of once.
-        #
-        # Only other option is to cache the resulting file, but then we're
-        # duplicating the cached contents.
-        data = convert_line_endings(data)
+    with time_stage(STAGE_FETCH, filediff) as stage_info:
+        cache_key = _make_original_file_cache_key(filediff)
 
-    # If there's a parent diff set, apply it to the buffer.
-    if filediff.parent_diff:
-        data = patch(filediff.parent_diff, data, filediff.source_file,
-                     request)
+        if cache_key:
+            data = get_cached_file(cache_key)
 
-    return data
+            if data is not None:
+                stage_info.update(num_bytes=len(data), cache_hit=True)
+
+                return data
+
+        data = b""
+
+        if filediff.source_revision != PRE_CREATION:
+            repository = filediff.diffset.repository
+            data = repository.get_file(
+                filediff.source_file,
+                filediff.source_revision,
+                base_commit_id=filediff.diffset.base_commit_id,
+                request=request)
+
+            # Repository.get_file doesn't know or care about how we need line
+            # endings to work. So, we'll transform them here, and cache the
+            # result below.
+            data = convert_line_endings(data)
+
+        # If there's a parent diff set, apply it to the buffer.
+        if filediff.parent_diff:
+            data = patch(filediff.parent_diff, data, filediff.source_file,
+                         request)
+
+        if cache_key:
+            cache_file(cache_key, data)
+            stage_info['cache_hit'] = False
+
+        stage_info['num_bytes'] = len(data)
+
+        return data
+
+
+def prefetch_original_files(filediffs, request=None):
+    """Fetches the original versions of a list of files ahead of time.
+
+    Files that aren't already cached are fetched with a single call to
+    Repository.get_files for each repository and base commit, which caches
+    each of them. get_original_file will then find them in the cache,
+    rather than fetching them from the repository one at a time.
+
+    Errors are logged and otherwise ignored, since they'll be reported when
+    get_original_file tries to fetch the files.
+    """
+    filediffs = [
+        filediff
+        for filediff in filediffs
+        if filediff.source_revision != PRE_CREATION
+    ]
+    cache_keys = [
+        _make_original_file_cache_key(filediff)
+        for filediff in filediffs
+    ]
+    cached_keys = get_cached_file_keys([
+        cache_key
+        for cache_key in cache_keys
+        if cache_key
+    ])
+
+    to_fetch = OrderedDict()
+
+    for filediff, cache_key in zip(filediffs, cache_keys):
+        if cache_key not in cached_keys:
+            diffset = filediff.diffset
+            files = to_fetch.setdefault(
+                (diffset.repository_id, diffset.base_commit_id),
+                (diffset.repository, []))[1]
+            path_and_revision = (filediff.source_file,
+                                 filediff.source_revision)
+
+            if path_and_revision not in files:
+                files.append(path_and_revision)
+
+    for (repository_id, base_commit_id), (repository, files) in \
+            six.iteritems(to_fetch):
+        with time_stage(STAGE_FETCH) as stage_info:
+            num_bytes = 0
+
+            try:
+                for path, revision, data in repository.get_files(
+                        files, base_commit_id=base_commit_id,
+                        request=request):
+                    num_bytes += len(data or b'')
+            except Exception as e:
+                logging.warning('Unable to prefetch %d files from '
+                                'repository %s: %s',
+                                len(files), repository_id, e,
+                                request=request)
+
+            stage_info['num_bytes'] = num_bytes
+
+
+def _make_original_file_cache_key(filediff):
+    """Returns the cache key for the original version of a file.
+
+    This is based on the file's repository, path and revision, and the
+    parent diff applied to it. If the file doesn't need to be cached (it's
+    new and has no parent diff), or its parent diff hasn't been migrated to
+    have a hash, this returns None.
+    """
+    parent_diff_hash = filediff.parent_diff_hash_id or ''
+
+    if ((filediff.source_revision == PRE_CREATION and not parent_diff_hash) or
+        (filediff.parent_diff64 and not parent_diff_hash)):
+        return None
+
+    return 'diff-original-file:%s:%s:%s:%s:%s' % (
+        filediff.diffset.repository_id,
+        urlquote(filediff.source_file),
+        urlquote(filediff.source_revision),
+        urlquote(filediff.diffset.base_commit_id or ''),
+        parent_diff_hash)
 
 
 def get_patched_file(buffer, filediff, request=None):
-    tool = filediff.diffset.repository.get_scmtool()
-    diff = tool.normalize_patch(filediff.diff, filediff.source_file,
-                                filediff.source_revision)
-    return patch(diff, buffer, filediff.dest_file, request)
+    with time_stage(STAGE_PATCH, filediff) as stage_info:
+        tool = filediff.diffset.repository.get_scmtool()
+        diff = tool.normalize_patch(filediff.diff, filediff.source_file,
+                                    filediff.source_revision)
+        data = patch(diff, buffer, filediff.dest_file, request)
+        stage_info['num_bytes'] = len(data)
+
+        return data
 
 
 def get_revision_str(revision):
@@ -206,10 +344,15 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
     interdiff_map = {}
 
     if interdiffset:
-        for interfilediff in interdiffset.files.all():
-            if (not filediff or
-                    filediff.source_file == interfilediff.source_file):
-                interdiff_map[interfilediff.source_file] = interfilediff
+        interfilediffs = interdiffset.files.select_related(
+            'diffset', 'diffset__repository')
+
+        if filediff:
+            interfilediffs = interfilediffs.filter(
+                source_file=filediff.source_file)
+
+        for interfilediff in interfilediffs:
+            interdiff_map[interfilediff.source_file] = interfilediff
 
     # In order to support interdiffs properly, we need to display diffs
     # on every file in the union of both diffsets. Iterating over one diffset
@@ -255,7 +398,7 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
             # We only process if there's a difference in files.
 
             if (filediff and interfilediff and
-                    filediff.diff == interfilediff.diff):
+                    _has_same_diff(filediff, interfilediff)):
                 continue
 
             source_revision = _("Diff Revision %s") % diffset.revision
@@ -303,7 +446,7 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
             'index': len(files),
             'chunks_loaded': False,
             'is_new_file': (newfile and not interfilediff and
-                            not filediff.parent_diff),
+                            not _has_parent_diff(filediff)),
         })
 
     def cmp_file(x, y):
@@ -327,34 +470,95 @@ def get_diff_files(diffset, filediff=None, interdiffset=None, request=None):
     return files
 
 
+def _has_same_diff(filediff, interfilediff):
+    """Returns whether two FileDiffs contain the same diff.
+
+    The diffs are compared by their hashes where possible, so that their
+    contents don't have to be loaded. FileDiffs that haven't been migrated
+    to store their diffs by hash fall back on comparing the contents.
+    """
+    if filediff.diff_hash_id and interfilediff.diff_hash_id:
+        return filediff.diff_hash_id == interfilediff.diff_hash_id
+
+    return filediff.diff == interfilediff.diff
+
+
+def _has_parent_diff(filediff):
+    """Returns whether a FileDiff has a parent diff.
+
+    This avoids loading the parent diff's contents when it's stored by hash.
+    """
+    return bool(filediff.parent_diff_hash_id or filediff.parent_diff)
+
+
 def populate_diff_chunks(files, enable_syntax_highlighting=True,
-                         request=None):
+                         request=None, max_workers=None,
+                         render_time_budget=None):
     """Populates a list of diff files with chunk data.
 
     This accepts a list of files (generated by get_diff_files) and generates
     diff chunk data for each file in the list. The chunk data is stored in
     the file state.
+
+    If ``max_workers`` is greater than 1, the chunks for up to that many
+    files will be generated at once, using a pool of threads. If not
+    provided, this defaults to the ``diffviewer_max_chunk_workers`` setting.
+    Either way, the files are populated in their original order.
+
+    ``render_time_budget`` is the number of seconds allowed for generating
+    the chunks for each file (0 for no limit). If not provided, this
+    defaults to the ``diffviewer_render_time_budget`` setting. Files that
+    had to be degraded to fit in the budget are marked as ``degraded``.
     """
     from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
 
-    for diff_file in files:
-        generator = get_diff_chunk_generator(request,
-                                             diff_file['filediff'],
-                                             diff_file['interfilediff'],
-                                             diff_file['force_interdiff'],
-                                             enable_syntax_highlighting)
-        chunks = generator.get_chunks()
+    if max_workers is None:
+        siteconfig = SiteConfiguration.objects.get_current()
+        max_workers = siteconfig.get('diffviewer_max_chunk_workers')
+
+    generators = [
+        get_diff_chunk_generator(request,
+                                 diff_file['filediff'],
+                                 diff_file['interfilediff'],
+                                 diff_file['force_interdiff'],
+                                 enable_syntax_highlighting,
+                                 render_time_budget=render_time_budget)
+        for diff_file in files
+    ]
 
+    # Fetch the original versions of all the files that need chunks to be
+    # generated up-front, with as few requests to the repository as
+    # possible.
+    prefetch_original_files(
+        [
+            filediff
+            for generator in generators
+            if generator.needs_files()
+            for filediff in (generator.filediff, generator.interfilediff)
+            if filediff
+        ],
+        request)
+
+    if max_workers > 1 and len(generators) > 1:
+        all_chunks = _get_chunks_parallel(generators, max_workers)
+    else:
+        all_chunks = [generator.get_chunks() for generator in generators]
+
+    for diff_file, chunks in zip(files, all_chunks):
         diff_file.update({
             'chunks': chunks,
             'num_chunks': len(chunks),
             'changed_chunk_indexes': [],
             'whitespace_only': True,
+            'degraded': False,
         })
 
         for j, chunk in enumerate(chunks):
             chunk['index'] = j
 
+            if chunk.get('meta', {}).get('degraded'):
+                diff_file['degraded'] = True
+
             if chunk['change'] != 'equal':
                 diff_file['changed_chunk_indexes'].append(j)
                 meta = chunk.get('meta', {})
@@ -368,6 +572,99 @@ def populate_diff_chunks(files, enable_syntax_highlighting=True,
         })
 
 
+def populate_diff_chunk(diff_file, chunk_index,
+                        enable_syntax_highlighting=True, request=None):
+    """Populates a diff file with the data for a single chunk.
+
+    This works like populate_diff_chunks, but rather than loading every chunk
+    in the file, this loads only the file's chunk index and the requested
+    chunk. The rest of the file state (such as ``num_chunks`` and
+    ``changed_chunk_indexes``) is computed from the chunk index.
+
+    The ``chunks`` in the file state will contain only the requested chunk,
+    or will be empty if the chunk index is out of range.
+    """
+    from reviewboard.diffviewer.chunk_generator import get_diff_chunk_generator
+
+    generator = get_diff_chunk_generator(request,
+                                         diff_file['filediff'],
+                                         diff_file['interfilediff'],
+                                         diff_file['force_interdiff'],
+                                         enable_syntax_highlighting)
+    index = generator.get_chunk_index()
+
+    if 0 <= chunk_index < index['num_chunks']:
+        chunks = generator.get_chunks([chunk_index])
+    else:
+        chunks = []
+
+    changed_chunk_infos = [
+        chunk_info
+        for chunk_info in index['chunks']
+        if chunk_info['change'] != 'equal'
+    ]
+
+    diff_file.update({
+        'chunks': chunks,
+        'num_chunks': index['num_chunks'],
+        'changed_chunk_indexes': [
+            chunk_info['index']
+            for chunk_info in changed_chunk_infos
+        ],
+        'whitespace_only': all(
+            chunk_info['whitespace_chunk']
+            for chunk_info in changed_chunk_infos
+        ),
+        'degraded': bool(index.get('degraded')),
+        'num_changes': len(changed_chunk_infos),
+        'chunks_loaded': True,
+    })
+
+
+def _get_chunks_parallel(generators, max_workers):
+    """Returns the chunks for a list of chunk generators, in parallel.
+
+    Each generator is run in a pool of up to ``max_workers`` threads. The
+    list of chunks for each generator is returned in the same order as the
+    generators.
+    """
+    # The active language is part of the chunk cache key, and is local to
+    # each thread, so it needs to be carried over to the workers, along with
+    # any stage timings being collected for the request.
+    language = translation.get_language()
+    timings = get_stage_timings()
+
+    # Fetch anything the generators would otherwise lazily load from the
+    # database, so that the workers don't each need their own connection
+    # just to look up the diffs and repositories.
+    for generator in generators:
+        for filediff in (generator.filediff, generator.interfilediff):
+            if filediff:
+                repository = filediff.diffset.repository
+                repository.tool
+                repository.hosting_account
+                filediff.diff
+                filediff.parent_diff
+
+    def get_chunks(generator):
+        translation.activate(language)
+        set_stage_timings(timings)
+
+        try:
+            return generator.get_chunks()
+        finally:
+            translation.deactivate()
+            set_stage_timings(None)
+            connection.close()
+
+    pool = ThreadPool(min(max_workers, len(generators)))
+
+    try:
+        return pool.map(get_chunks, generators)
+    finally:
+        pool.terminate()
+
+
 def get_file_chunks_in_range(context, filediff, interfilediff,
                              first_line, num_lines):
     """
@@ -406,6 +703,9 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
       7        True if line consists of only whitespace changes
       ======== =============================================================
     """
+    from reviewboard.diffviewer.chunk_generator import (
+        compute_chunk_line_regions, get_diff_chunk_generator)
+
     def find_header(headers):
         for header in reversed(headers):
             if header[0] < first_line:
@@ -416,35 +716,64 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
 
     interdiffset = None
 
-    key = "_diff_files_%s_%s" % (filediff.diffset.id, filediff.id)
+    key = "_diff_chunk_generator_%s_%s" % (filediff.diffset.id, filediff.id)
 
     if interfilediff:
         key += "_%s" % (interfilediff.id)
         interdiffset = interfilediff.diffset
 
     if key in context:
-        files = context[key]
+        generator = context[key]
     else:
         assert 'user' in context
 
         request = context.get('request', None)
         files = get_diff_files(filediff.diffset, filediff, interdiffset,
                                request=request)
-        populate_diff_chunks(files, get_enable_highlighting(context['user']),
-                             request=request)
-        context[key] = files
 
-    if not files:
+        if files:
+            assert len(files) == 1
+
+            generator = get_diff_chunk_generator(
+                request,
+                files[0]['filediff'],
+                files[0]['interfilediff'],
+                files[0]['force_interdiff'],
+                get_enable_highlighting(context['user']))
+        else:
+            generator = None
+
+        # The generator keeps the chunk index around, so further lookups on
+        # this file only need to fetch the chunks they use.
+        context[key] = generator
+
+    if not generator:
         raise StopIteration
 
-    assert len(files) == 1
+    # Only load the chunks that overlap the range of lines. The rest of the
+    # information needed (the headers) is in the chunk index.
+    chunk_infos = generator.get_chunk_index()['chunks']
+    last_line = first_line + num_lines - 1
+    chunk_indexes = [
+        chunk_info['index']
+        for chunk_info in chunk_infos
+        if (chunk_info['numlines'] and
+            chunk_info['first_line'] <= last_line and
+            chunk_info['last_line'] >= first_line)
+    ]
+    chunks = dict(zip(chunk_indexes, generator.get_chunks(chunk_indexes)))
     last_header = [None, None]
 
-    for chunk in files[0]['chunks']:
-        if ('headers' in chunk['meta'] and
-                (chunk['meta']['headers'][0] or chunk['meta']['headers'][1])):
-            last_header = chunk['meta']['headers']
+    for chunk_info in chunk_infos:
+        headers = chunk_info['headers']
+
+        if headers and (headers[0] or headers[1]):
+            last_header = headers
+
+        if chunk_info['index'] not in chunks:
+            continue
 
+        chunk = chunks[chunk_info['index']]
         lines = chunk['lines']
 
         if lines[-1][0] >= first_line >= lines[0][0]:
@@ -456,7 +785,8 @@ def get_file_chunks_in_range(context, filediff, interfilediff,
                 last_index = len(lines)
 
             new_chunk = {
-                'lines': chunk['lines'][start_index:last_index],
+                'lines': compute_chunk_line_regions(
+                    chunk['lines'][start_index:last_index]),
                 'numlines': last_index - start_index,
                 'change': chunk['change'],
                 'meta': chunk.get('meta', {}),
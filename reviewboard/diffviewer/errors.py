@@ -25,3 +25,16 @@ class DiffParserError(Exception):
     def __init__(self, msg, linenum):
         Exception.__init__(self, msg)
         self.linenum = linenum
+
+
+class PatchError(Exception):
+    """An error that occurred when applying a patch to a file.
+
+    If specific hunks failed to apply, ``rejects`` will contain
+    information on each of them, which is shown on the error page.
+    """
+    def __init__(self, msg, filename, rejects=None, error_output=None):
+        Exception.__init__(self, msg)
+        self.filename = filename
+        self.rejects = rejects or []
+        self.error_output = error_output
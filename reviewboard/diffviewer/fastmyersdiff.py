@@ -0,0 +1,473 @@
+from __future__ import unicode_literals
+
+from array import array
+
+from djblets.util.compat.six.moves import range
+
+from reviewboard.diffviewer.myersdiff import MyersDiffer
+
+
+# The typecode used for the arrays of line codes and line indexes.
+#
+# array() on Python 2 requires a byte string here.
+CODE_TYPECODE = str('l')
+
+
+class FastMyersDiffer(MyersDiffer):
+    """An optimized version of MyersDiffer.
+
+    This produces exactly the same opcodes as MyersDiffer, but does less
+    work per line. Lines are interned into typed arrays of line codes.
+    Confusing lines are classified once per line code and discarded in bulk.
+    The diagonal search keeps all of its state in local variables and walks
+    the preallocated diagonal vectors by index. The divide-and-conquer LCS
+    search uses a stack instead of recursion, so very large files can't hit
+    the recursion limit.
+
+    This is used for DiffSets with a diff compatibility version of 2.
+    """
+    def _gen_diff_data(self):
+        """
+        Generate all the diff data needed to return opcodes or the diff ratio.
+        This is only called once during the liftime of a MyersDiffer instance.
+        """
+        if self.a_data and self.b_data:
+            return
+
+        self.a_data = self.DiffData(self._gen_diff_codes(self.a, False))
+        self.b_data = self.DiffData(self._gen_diff_codes(self.b, True))
+
+        self._discard_confusing_lines()
+
+        self.max_lines = (self.a_data.undiscarded_lines +
+                          self.b_data.undiscarded_lines + 3)
+
+        vector_size = (self.a_data.undiscarded_lines +
+                       self.b_data.undiscarded_lines + 3)
+        self.fdiag = [0] * vector_size
+        self.bdiag = [0] * vector_size
+        self.downoff = self.upoff = self.b_data.undiscarded_lines + 1
+
+        self._lcs(0, self.a_data.undiscarded_lines,
+                  0, self.b_data.undiscarded_lines,
+                  self.minimal_diff)
+        self._shift_chunks(self.a_data, self.b_data)
+        self._shift_chunks(self.b_data, self.a_data)
+
+    def _gen_diff_codes(self, lines, is_modified_file):
+        """
+        Converts all unique lines of text into unique numbers. Comparing
+        lists of numbers is faster than comparing lists of strings.
+        """
+        codes = array(CODE_TYPECODE)
+        append_code = codes.append
+
+        code_table = self.code_table
+        interesting_line_table = self.interesting_line_table
+        interesting_line_regexes = self.interesting_line_regexes
+        ignore_space = self.ignore_space
+        last_code = self.last_code
+
+        if is_modified_file:
+            interesting_lines = self.interesting_lines[1]
+        else:
+            interesting_lines = self.interesting_lines[0]
+
+        for linenum, raw_line in enumerate(lines):
+            line = raw_line
+
+            if ignore_space:
+                # We still want to show lines that contain only whitespace.
+                stripped_line = raw_line.lstrip()
+
+                if stripped_line:
+                    line = stripped_line
+
+            code = code_table.get(line)
+
+            if code is None:
+                # This is a new, unrecorded line, so mark it and store it.
+                last_code += 1
+                code = last_code
+                code_table[line] = code
+
+                # Check to see if this is an interesting line that the caller
+                # wants recorded.
+                if interesting_line_regexes and raw_line.lstrip():
+                    for name, regex in interesting_line_regexes:
+                        if regex.match(raw_line):
+                            interesting_line_table[code] = name
+                            interesting_lines[name].append((linenum,
+                                                            raw_line))
+                            break
+            elif code in interesting_line_table:
+                interesting_lines[interesting_line_table[code]].append(
+                    (linenum, raw_line))
+
+            append_code(code)
+
+        self.last_code = last_code
+
+        return codes
+
+    def _find_sms(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        """
+        Finds the Shortest Middle Snake.
+
+        This walks the diagonals by their index in the vectors, rather than
+        by k, to save on arithmetic in the inner loops. The forward and
+        reverse vectors share the same offset.
+        """
+        down_vector = self.fdiag  # The vector for the (0, 0) to (x, y) search
+        up_vector = self.bdiag    # The vector for the (u, v) to (N, M) search
+        diagoff = self.downoff
+        max_lines = self.max_lines
+        snake_limit = self.SNAKE_LIMIT
+        a_undiscarded = self.a_data.undiscarded
+        b_undiscarded = self.b_data.undiscarded
+
+        assert self.upoff == diagoff
+
+        down_k = a_lower - b_lower  # The k-line to start the forward search
+        up_k = a_upper - b_upper    # The k-line to start the reverse search
+        odd_delta = (down_k - up_k) % 2 != 0
+
+        down_vector[diagoff + down_k] = a_lower
+        up_vector[diagoff + up_k] = a_upper
+
+        # These are all indexes into the vectors, rather than k values.
+        dmin = diagoff + a_lower - b_upper
+        dmax = diagoff + a_upper - b_lower
+
+        down_min = down_max = diagoff + down_k
+        up_min = up_max = diagoff + up_k
+
+        # y = x - k, where k = i - diagoff.
+        y_offset = diagoff
+
+        cost = 0
+
+        while True:
+            cost += 1
+            big_snake = False
+
+            if down_min > dmin:
+                down_min -= 1
+                down_vector[down_min - 1] = -1
+            else:
+                down_min += 1
+
+            if down_max < dmax:
+                down_max += 1
+                down_vector[down_max + 1] = -1
+            else:
+                down_max -= 1
+
+            # Extend the forward path
+            for i in range(down_max, down_min - 1, -2):
+                tlo = down_vector[i - 1]
+                thi = down_vector[i + 1]
+
+                if tlo >= thi:
+                    x = tlo + 1
+                else:
+                    x = thi
+
+                y = x - i + y_offset
+                old_x = x
+
+                # Find the end of the furthest reaching forward D-path in
+                # diagonal k
+                while (x < a_upper and y < b_upper and
+                       a_undiscarded[x] == b_undiscarded[y]):
+                    x += 1
+                    y += 1
+
+                if (odd_delta and up_min <= i <= up_max and
+                        up_vector[i] <= x):
+                    return x, y, True, True
+
+                if x - old_x > snake_limit:
+                    big_snake = True
+
+                down_vector[i] = x
+
+            # Extend the reverse path
+            if up_min > dmin:
+                up_min -= 1
+                up_vector[up_min - 1] = max_lines
+            else:
+                up_min += 1
+
+            if up_max < dmax:
+                up_max += 1
+                up_vector[up_max + 1] = max_lines
+            else:
+                up_max -= 1
+
+            for i in range(up_max, up_min - 1, -2):
+                tlo = up_vector[i - 1]
+                thi = up_vector[i + 1]
+
+                if tlo < thi:
+                    x = tlo
+                else:
+                    x = thi - 1
+
+                y = x - i + y_offset
+                old_x = x
+
+                while (x > a_lower and y > b_lower and
+                       a_undiscarded[x - 1] == b_undiscarded[y - 1]):
+                    x -= 1
+                    y -= 1
+
+                if (not odd_delta and down_min <= i <= down_max and
+                        x <= down_vector[i]):
+                    return x, y, True, True
+
+                if old_x - x > snake_limit:
+                    big_snake = True
+
+                up_vector[i] = x
+
+            if find_minimal or cost <= 200 or not big_snake:
+                continue
+
+            # See MyersDiffer._find_sms for the reasoning behind these
+            # heuristics. They work in terms of k, rather than indexes.
+            ret_x, ret_y, best = self._find_diagonal(
+                down_min - diagoff, down_max - diagoff, down_k, 0,
+                diagoff, down_vector,
+                lambda x: x - a_lower,
+                lambda x: a_lower + snake_limit <= x < a_upper,
+                lambda y: b_lower + snake_limit <= y < b_upper,
+                lambda i, k: i - k,
+                1, cost)
+
+            if best > 0:
+                return ret_x, ret_y, True, False
+
+            ret_x, ret_y, best = self._find_diagonal(
+                up_min - diagoff, up_max - diagoff, up_k, best, diagoff,
+                up_vector,
+                lambda x: a_upper - x,
+                lambda x: a_lower < x <= a_upper - snake_limit,
+                lambda y: b_lower < y <= b_upper - snake_limit,
+                lambda i, k: i + k,
+                0, cost)
+
+            if best > 0:
+                return ret_x, ret_y, False, True
+
+    def _lcs(self, a_lower, a_upper, b_lower, b_upper, find_minimal):
+        """
+        The divide-and-conquer implementation of the Longest Common
+        Subsequence (LCS) algorithm.
+
+        The ranges still to be processed are kept on a stack, in the same
+        order that MyersDiffer's recursion would process them.
+        """
+        a_undiscarded = self.a_data.undiscarded
+        b_undiscarded = self.b_data.undiscarded
+        a_modified = self.a_data.modified
+        b_modified = self.b_data.modified
+        a_real_indexes = self.a_data.real_indexes
+        b_real_indexes = self.b_data.real_indexes
+
+        stack = [(a_lower, a_upper, b_lower, b_upper, find_minimal)]
+
+        while stack:
+            a_lower, a_upper, b_lower, b_upper, find_minimal = stack.pop()
+
+            # Fast walkthrough equal lines at the start
+            while (a_lower < a_upper and b_lower < b_upper and
+                   a_undiscarded[a_lower] == b_undiscarded[b_lower]):
+                a_lower += 1
+                b_lower += 1
+
+            while (a_upper > a_lower and b_upper > b_lower and
+                   a_undiscarded[a_upper - 1] == b_undiscarded[b_upper - 1]):
+                a_upper -= 1
+                b_upper -= 1
+
+            if a_lower == a_upper:
+                # Inserted lines.
+                for i in range(b_lower, b_upper):
+                    b_modified[b_real_indexes[i]] = True
+            elif b_lower == b_upper:
+                # Deleted lines
+                for i in range(a_lower, a_upper):
+                    a_modified[a_real_indexes[i]] = True
+            else:
+                # Find the middle snake and length of an optimal path for A
+                # and B
+                x, y, low_minimal, high_minimal = \
+                    self._find_sms(a_lower, a_upper, b_lower, b_upper,
+                                   find_minimal)
+
+                stack.append((x, a_upper, y, b_upper, high_minimal))
+                stack.append((a_lower, x, b_lower, y, low_minimal))
+
+    def _discard_confusing_lines(self):
+        a_data = self.a_data
+        b_data = self.b_data
+        num_codes = self.last_code + 1
+
+        a_code_counts = [0] * num_codes
+        b_code_counts = [0] * num_codes
+
+        for item in a_data.data:
+            a_code_counts[item] += 1
+
+        for item in b_data.data:
+            b_code_counts[item] += 1
+
+        a_discards = self._build_discard_list(a_data, b_code_counts)
+        b_discards = self._build_discard_list(b_data, a_code_counts)
+
+        self._check_discard_runs(a_data, a_discards)
+        self._check_discard_runs(b_data, b_discards)
+
+        self._discard_lines(a_data, a_discards)
+        self._discard_lines(b_data, b_discards)
+
+    def _build_discard_list(self, data, counts):
+        """Returns the provisional discard state for each line in data.
+
+        Every line with the same code gets the same provisional state, so
+        the state is computed once per code, and then mapped across all the
+        lines at once.
+        """
+        many = 5 * self._very_approx_sqrt(data.length // 64)
+        code_discards = bytearray(len(counts))
+
+        for code, num_matches in enumerate(counts):
+            if num_matches == 0:
+                code_discards[code] = self.DISCARD_FOUND
+            elif num_matches > many:
+                code_discards[code] = self.DISCARD_CANCEL
+
+        # Code 0 is never assigned to a line, but MyersDiffer never discards
+        # it either.
+        code_discards[0] = self.DISCARD_NONE
+
+        return bytearray(map(code_discards.__getitem__, data.data))
+
+    def _check_discard_runs(self, data, discards):
+        DISCARD_NONE = self.DISCARD_NONE
+        DISCARD_FOUND = self.DISCARD_FOUND
+        DISCARD_CANCEL = self.DISCARD_CANCEL
+        length = data.length
+
+        def scan_run(indexes):
+            consec = 0
+
+            for j, index in enumerate(indexes):
+                discard = discards[index]
+
+                if j >= 8 and discard == DISCARD_FOUND:
+                    break
+
+                if discard == DISCARD_FOUND:
+                    consec += 1
+                else:
+                    consec = 0
+
+                    if discard == DISCARD_CANCEL:
+                        discards[index] = DISCARD_NONE
+
+                if consec == 3:
+                    break
+
+        i = 0
+
+        while i < length:
+            discard = discards[i]
+
+            # Cancel the provisional discards that are not in the middle
+            # of a run of discards
+            if discard == DISCARD_CANCEL:
+                discards[i] = DISCARD_NONE
+            elif discard == DISCARD_FOUND:
+                # We found a provisional discard
+                provisional = 0
+
+                # Find the end of this run of discardable lines and count
+                # how many are provisionally discardable.
+                j = i
+
+                while j < length:
+                    if discards[j] == DISCARD_NONE:
+                        break
+                    elif discards[j] == DISCARD_CANCEL:
+                        provisional += 1
+
+                    j += 1
+
+                # Cancel the provisional discards at the end and shrink
+                # the run.
+                while j > i and discards[j - 1] == DISCARD_CANCEL:
+                    j -= 1
+                    discards[j] = DISCARD_NONE
+                    provisional -= 1
+
+                run_length = j - i
+
+                # If 1/4 of the lines are provisional, cancel discarding
+                # all the provisional lines in the run.
+                if provisional * 4 > run_length:
+                    while j > i:
+                        j -= 1
+
+                        if discards[j] == DISCARD_CANCEL:
+                            discards[j] = DISCARD_NONE
+                else:
+                    minimum = 1 + self._very_approx_sqrt(run_length // 4)
+                    j = 0
+                    consec = 0
+
+                    while j < run_length:
+                        if discards[i + j] != DISCARD_CANCEL:
+                            consec = 0
+                        else:
+                            consec += 1
+
+                            if minimum == consec:
+                                j -= consec
+                            elif minimum < consec:
+                                discards[i + j] = DISCARD_NONE
+
+                        j += 1
+
+                    scan_run(range(i, i + run_length))
+                    i += run_length - 1
+                    scan_run(range(i, i - run_length, -1))
+
+            i += 1
+
+    def _discard_lines(self, data, discards):
+        codes = data.data
+        length = data.length
+
+        if self.minimal_diff:
+            kept = list(range(length))
+        else:
+            kept = [i for i, discard in enumerate(discards)
+                    if discard == self.DISCARD_NONE]
+
+            modified = data.modified
+
+            for i, discard in enumerate(discards):
+                if discard != self.DISCARD_NONE:
+                    modified[i] = True
+
+        num_discarded = length - len(kept)
+
+        # These are lists, rather than arrays, as they're read constantly
+        # during the diagonal search, and lists are faster to index.
+        data.undiscarded = list(map(codes.__getitem__, kept))
+        data.undiscarded += [0] * num_discarded
+        data.real_indexes = array(CODE_TYPECODE, kept)
+        data.real_indexes += array(CODE_TYPECODE, [0]) * num_discarded
+        data.undiscarded_lines = len(kept)
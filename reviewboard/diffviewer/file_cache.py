@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+
+import hashlib
+import zlib
+
+from django.core.cache import cache
+from djblets.cache.backend import CACHE_CHUNK_SIZE, make_cache_key
+from djblets.util.compat import six
+from djblets.util.compat.six.moves import range
+
+from reviewboard.diffviewer.cache_utils import (CACHE_EXPIRATION_TIME,
+                                                get_stats, increment_stats)
+
+
+_STATS_PREFIX = 'diff-file-cache-stats'
+_STATS_KEYS = ('hits', 'misses', 'files', 'bytes', 'duplicates')
+
+
+def get_cached_file(key):
+    """Returns file contents cached under the given key.
+
+    The key (such as one made up of a repository, path and revision) points
+    to the hash of the file's contents, which are stored separately. If
+    either is missing from the cache, this returns None.
+    """
+    content_hash = cache.get(make_cache_key(key))
+    data = None
+
+    if content_hash:
+        data = _get_file_contents(content_hash)
+
+    if data is None:
+        increment_stats(_STATS_PREFIX, misses=1)
+    else:
+        increment_stats(_STATS_PREFIX, hits=1)
+
+    return data
+
+
+def cache_file(key, data, expiration=CACHE_EXPIRATION_TIME):
+    """Caches file contents under the given key.
+
+    The contents are stored by their SHA1 hash, and the key is set to point
+    to them. Files with the same contents, such as the same file reached
+    through different paths or branches, share a single copy of the
+    contents in the cache.
+
+    The contents are only skipped if all of their parts are still in the
+    cache. A part may have been evicted while the count of parts is still
+    there, in which case the contents are stored again.
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+
+    content_hash = hashlib.sha1(data).hexdigest()
+    contents_key = _make_contents_key(content_hash)
+
+    if _get_file_contents(content_hash) is not None:
+        increment_stats(_STATS_PREFIX, duplicates=1)
+    else:
+        compressed = zlib.compress(data)
+        parts = dict(
+            (_make_contents_part_key(content_hash, i),
+             [compressed[start:start + CACHE_CHUNK_SIZE]])
+            for i, start in enumerate(range(0, max(len(compressed), 1),
+                                            CACHE_CHUNK_SIZE))
+        )
+
+        # The parts are stored before the count of parts, so that the
+        # contents are never seen without all of their parts.
+        cache.set_many(parts, expiration)
+        cache.set(make_cache_key(contents_key), '%d' % len(parts),
+                  expiration)
+
+        increment_stats(_STATS_PREFIX, files=1, bytes=len(compressed))
+
+    cache.set(make_cache_key(key), content_hash, expiration)
+
+
+def get_cached_file_keys(keys):
+    """Returns which of the given keys have files cached under them.
+
+    This only checks that the keys are in the cache, without loading the
+    contents of the files.
+    """
+    cached = cache.get_many([make_cache_key(key) for key in keys])
+
+    return set(
+        key
+        for key in keys
+        if make_cache_key(key) in cached
+    )
+
+
+def get_file_cache_stats():
+    """Returns statistics on the file cache.
+
+    This returns a dictionary containing the number of ``hits`` and
+    ``misses`` when looking up files, the number of distinct ``files``
+    stored and the total (compressed) ``bytes`` stored for them, the number
+    of ``duplicates`` that shared an already-stored file's contents, and
+    the average ``bytes_per_file`` and ``hit_rate`` (as a percentage).
+
+    These are kept in the cache, so they cover all processes sharing the
+    cache, and are reset along with it.
+    """
+    stats = get_stats(_STATS_PREFIX, _STATS_KEYS)
+
+    stats.update({
+        'bytes_per_file': stats['bytes'] // max(stats['files'], 1),
+        'hit_rate': (100 * stats['hits'] //
+                     max(stats['hits'] + stats['misses'], 1)),
+    })
+
+    return stats
+
+
+def _get_file_contents(content_hash):
+    """Returns the cached file contents with the given hash.
+
+    If the contents, or any part of them, are missing from the cache, this
+    returns None.
+    """
+    num_parts = cache.get(make_cache_key(_make_contents_key(content_hash)))
+
+    if num_parts is None:
+        return None
+
+    part_keys = [
+        _make_contents_part_key(content_hash, i)
+        for i in range(int(num_parts))
+    ]
+    parts = cache.get_many(part_keys)
+
+    try:
+        return zlib.decompress(b''.join(
+            parts[part_key][0]
+            for part_key in part_keys
+        ))
+    except (KeyError, zlib.error):
+        return None
+
+
+def _make_contents_key(content_hash):
+    """Returns the cache key for file contents with the given hash."""
+    return 'diff-file-contents-%s' % content_hash
+
+
+def _make_contents_part_key(content_hash, part):
+    """Returns the cache key for part of the file contents."""
+    return make_cache_key('diff-file-contents-%s-%d' % (content_hash, part))
@@ -0,0 +1,334 @@
+from __future__ import unicode_literals
+
+import fnmatch
+import hashlib
+import os
+import re
+from difflib import SequenceMatcher
+
+import pygments
+from djblets.cache.backend import cache_memoize
+from djblets.util.compat import six
+from djblets.util.compat.six.moves import range
+from pygments import format, highlight
+from pygments.formatters import HtmlFormatter
+from pygments.lexers import get_all_lexers, get_lexer_for_filename
+from pygments.util import ClassNotFound
+
+
+# The maximum fraction of the lines in a new version of a file that can
+# be re-highlighted when highlighting it incrementally. Past this, the
+# whole file is highlighted.
+INCREMENTAL_MAX_RATIO = 0.5
+
+# The number of lines around each end of a changed region that are
+# re-highlighted along with it, giving the lexer a chance to get back in
+# sync with the rest of the file.
+INCREMENTAL_RESYNC_LINES = 20
+
+# The number of lines on each end of the re-highlighted region that must
+# match the fully-highlighted file for the result to be used.
+INCREMENTAL_CHECK_LINES = 5
+
+# Matches lexer filename patterns that only match by file extension.
+_EXTENSION_PATTERN_RE = re.compile(r'^\*\.[^*?\[\].]+$')
+
+_lexer_classes = {}
+_special_filename_patterns = None
+
+
+class NoWrapperHtmlFormatter(HtmlFormatter):
+    """An HTML Formatter for Pygments that doesn't wrap items in a div."""
+    def __init__(self, *args, **kwargs):
+        super(NoWrapperHtmlFormatter, self).__init__(*args, **kwargs)
+
+    def _wrap_div(self, inner):
+        """Removes the div wrapper from formatted code.
+
+        This is called by the formatter to wrap the contents of inner.
+        Inner is a list of tuples containing formatted code. If the first item
+        in the tuple is zero, then it's the div wrapper, so we should ignore
+        it.
+        """
+        for tup in inner:
+            if tup[0]:
+                yield tup
+
+
+def get_lexer_for_file(filename):
+    """Returns a Pygments lexer for highlighting the given file.
+
+    This works like Pygments' get_lexer_for_filename, but the lexer class
+    is only looked up once for each file extension (or, for files matched
+    by special filename patterns such as ``Makefile``, each filename), since
+    the lookup is expensive.
+
+    Raises pygments.util.ClassNotFound if there's no lexer for the file.
+    """
+    basename = os.path.basename(filename)
+    extension = os.path.splitext(basename)[1]
+
+    if extension and not _matches_special_pattern(basename):
+        key = extension
+    else:
+        key = '/' + basename
+
+    try:
+        lexer_cls = _lexer_classes[key]
+    except KeyError:
+        try:
+            lexer_cls = type(get_lexer_for_filename(basename))
+        except ClassNotFound:
+            lexer_cls = None
+
+        _lexer_classes[key] = lexer_cls
+
+    if lexer_cls is None:
+        raise ClassNotFound('no lexer for filename %r found' % filename)
+
+    lexer = lexer_cls(stripnl=False, encoding='utf-8')
+    lexer.add_filter('codetagify')
+
+    return lexer
+
+
+def highlight_file(data, lexer):
+    """Applies syntax highlighting to a file's contents.
+
+    The resulting HTML will be returned as a list of lines.
+
+    The result is cached based on the lexer and a hash of the contents, so
+    a file shared by many diffs (such as a commonly-used original file) is
+    only highlighted once.
+    """
+    return cache_memoize(_make_cache_key(data, lexer),
+                         lambda: _highlight_lines(data, lexer),
+                         large_data=True)
+
+
+def highlight_files(old, new, old_filename, new_filename):
+    """Applies syntax highlighting to the old and new versions of a file.
+
+    This returns a tuple of the resulting HTML for each file, as lists of
+    lines. If a file can't be highlighted, its entry will be None.
+
+    Both files are cached in the same way as highlight_file. If the new
+    version of the file isn't in the cache, and it shares most of its
+    contents with the old version, then only the parts that differ (along
+    with some surrounding lines) are highlighted, and the rest are taken
+    from the old version's highlighting. See _highlight_incremental for
+    details.
+    """
+    try:
+        old_lexer = get_lexer_for_file(old_filename)
+        old_markup = highlight_file(old, old_lexer)
+    except ClassNotFound:
+        old_lexer = None
+        old_markup = None
+
+    try:
+        new_lexer = get_lexer_for_file(new_filename)
+    except ClassNotFound:
+        return old_markup, None
+
+    if old_markup is not None and type(old_lexer) is type(new_lexer):
+        new_markup = cache_memoize(
+            _make_cache_key(new, new_lexer),
+            lambda: _highlight_incremental(old, old_markup, new, new_lexer),
+            large_data=True)
+    else:
+        new_markup = highlight_file(new, new_lexer)
+
+    return old_markup, new_markup
+
+
+def _highlight_lines(data, lexer):
+    """Highlights text with the given lexer, returning a list of lines."""
+    return highlight(data, lexer, NoWrapperHtmlFormatter()).splitlines()
+
+
+def _highlight_first_lines(data, lexer, num_lines):
+    """Highlights the first lines of text with the given lexer.
+
+    The lexer is given all of the text, so that tokens spanning past the
+    last line (such as multi-line strings) are handled the same as when
+    highlighting all of it. However, tokens are only generated up to the
+    end of the last line.
+
+    The resulting HTML will be returned as a list of lines.
+    """
+    def get_tokens():
+        remaining = num_lines
+
+        for token_type, value in lexer.get_tokens(data):
+            num_newlines = value.count('\n')
+
+            if num_newlines >= remaining:
+                # This token contains the end of the last line. Stop there.
+                end = -1
+
+                for i in range(remaining):
+                    end = value.index('\n', end + 1)
+
+                yield token_type, value[:end + 1]
+                break
+
+            remaining -= num_newlines
+            yield token_type, value
+
+    return format(get_tokens(), NoWrapperHtmlFormatter()).splitlines()
+
+
+def _highlight_incremental(old, old_markup, new, lexer):
+    """Highlights a new version of a file, based on the old version.
+
+    Lines that are unchanged from the old version are taken from the old
+    version's highlighting. Each changed region, along with
+    INCREMENTAL_RESYNC_LINES on either side of it, is highlighted on its own.
+
+    Since the lexer starts partway through the file, its state may not
+    match that of a lexer highlighting the whole file, and the changes may
+    affect the highlighting of the lines after them. The lines at each end
+    of a highlighted region must therefore match the highlighting of the
+    rest of the file, showing that the lexer was in sync at those points.
+    If they don't, the region is widened on that end and highlighted again.
+    If too much of the file ends up being highlighted, the whole new
+    version is highlighted instead.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    num_new_lines = len(new_lines)
+
+    if len(old_markup) != len(old_lines):
+        return _highlight_lines(new, lexer)
+
+    # Find the changed ranges of new lines, merging any that are close
+    # enough that their regions would overlap.
+    new_to_old = [None] * num_new_lines
+    changes = []
+
+    opcodes = SequenceMatcher(None, old_lines, new_lines).get_opcodes()
+
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == 'equal':
+            new_to_old[j1:j2] = range(i1, i2)
+        elif (changes and
+              j1 - changes[-1][1] <= 2 * INCREMENTAL_RESYNC_LINES):
+            changes[-1][1] = j2
+        else:
+            changes.append([j1, j2])
+
+    # Start off with the old version's highlighting for each unchanged
+    # line. The changed lines are filled in below.
+    markup = [
+        old_markup[i] if i is not None else None
+        for i in new_to_old
+    ]
+
+    max_highlighted = num_new_lines * INCREMENTAL_MAX_RATIO
+    num_highlighted = 0
+
+    for changed_start, changed_end in changes:
+        lines_before = INCREMENTAL_RESYNC_LINES
+        lines_after = INCREMENTAL_RESYNC_LINES
+
+        while True:
+            region_start = max(changed_start - lines_before, 0)
+            region_end = min(changed_end + lines_after, num_new_lines)
+            num_highlighted += region_end - region_start
+
+            if num_highlighted > max_highlighted:
+                return _highlight_lines(new, lexer)
+
+            region_markup = _highlight_first_lines(
+                ''.join(new_lines[region_start:]), lexer,
+                region_end - region_start)
+
+            if len(region_markup) != region_end - region_start:
+                return _highlight_lines(new, lexer)
+
+            # Make sure the lexer is in sync with the rest of the file's
+            # highlighting before and after the changed lines.
+            if region_start > 0:
+                sync_start = max(changed_start - INCREMENTAL_CHECK_LINES,
+                                 region_start)
+                start_in_sync = _markup_matches(
+                    markup, region_markup, region_start,
+                    range(sync_start, changed_start))
+            else:
+                sync_start = 0
+                start_in_sync = True
+
+            if region_end < num_new_lines:
+                end_in_sync = _markup_matches(
+                    markup, region_markup, region_start,
+                    range(max(region_end - INCREMENTAL_CHECK_LINES,
+                              changed_end),
+                          region_end))
+            else:
+                end_in_sync = True
+
+            if start_in_sync and end_in_sync:
+                break
+
+            if not start_in_sync:
+                lines_before *= 4
+
+            if not end_in_sync:
+                lines_after *= 4
+
+        # Everything between the points where the lexer was found to be in
+        # sync can be taken from the new highlighting. This may include
+        # unchanged lines that are highlighted differently due to the
+        # changes (such as lines inside a newly-added comment).
+        markup[sync_start:region_end] = \
+            region_markup[sync_start - region_start:]
+
+    return markup
+
+
+def _markup_matches(markup, region_markup, region_start, line_nums):
+    """Returns whether a region's highlighting matches on the given lines.
+
+    The line numbers are relative to the start of the file.
+    """
+    for i in line_nums:
+        if region_markup[i - region_start] != markup[i]:
+            return False
+
+    return True
+
+
+def _matches_special_pattern(basename):
+    """Returns whether a filename matches a special lexer filename pattern.
+
+    Special patterns are those that don't just match by file extension,
+    such as ``Makefile`` or ``*.php[345]``. Files matching these can't be
+    looked up by extension alone.
+    """
+    global _special_filename_patterns
+
+    if _special_filename_patterns is None:
+        _special_filename_patterns = set(
+            pattern
+            for name, aliases, filenames, mimetypes in get_all_lexers()
+            for pattern in filenames
+            if not _EXTENSION_PATTERN_RE.match(pattern)
+        )
+
+    for pattern in _special_filename_patterns:
+        if fnmatch.fnmatch(basename, pattern):
+            return True
+
+    return False
+
+
+def _make_cache_key(data, lexer):
+    """Returns the cache key for highlighted file contents."""
+    if isinstance(data, six.text_type):
+        data = data.encode('utf-8')
+
+    return 'diff-highlight-%s-%s.%s-%s' % (pygments.__version__,
+                                           type(lexer).__module__,
+                                           type(lexer).__name__,
+                                           hashlib.sha1(data).hexdigest())
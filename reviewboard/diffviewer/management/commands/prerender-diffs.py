@@ -0,0 +1,57 @@
+from __future__ import unicode_literals
+
+import optparse
+import time
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.diffviewer.models import InterdiffResult
+from reviewboard.diffviewer.prerender import process_next_job
+
+
+# The number of seconds between prunings of old stored interdiff results.
+PRUNE_INTERVAL_SECS = 60 * 60
+
+
+class Command(NoArgsCommand):
+    option_list = NoArgsCommand.option_list + (
+        optparse.make_option('--once', action='store_true', dest='once',
+                             default=False,
+                             help='Process the queued diffs and exit, '
+                                  'instead of waiting for new ones'),
+        optparse.make_option('--poll-interval', type='int',
+                             dest='poll_interval', default=5,
+                             help='The number of seconds to wait between '
+                                  'checks for newly queued diffs'),
+    )
+    help = ('Processes the queue of diffs to pre-render, caching them '
+            'before they are first viewed. Old stored interdiff results are '
+            'also pruned while waiting for new diffs')
+
+    def handle_noargs(self, **options):
+        once = options.get('once', False)
+        poll_interval = options.get('poll_interval', 5)
+        verbosity = int(options.get('verbosity', 1))
+        last_pruned = None
+
+        while True:
+            job = process_next_job()
+
+            if job:
+                if verbosity > 0:
+                    self.stdout.write('Processed %s' % job)
+                continue
+
+            if (last_pruned is None or
+                time.time() - last_pruned >= PRUNE_INTERVAL_SECS):
+                num_pruned = InterdiffResult.objects.prune()
+                last_pruned = time.time()
+
+                if verbosity > 0 and num_pruned:
+                    self.stdout.write('Pruned %d stored interdiff results'
+                                      % num_pruned)
+
+            if once:
+                break
+
+            time.sleep(poll_interval)
@@ -0,0 +1,17 @@
+from __future__ import unicode_literals
+
+from django.core.management.base import NoArgsCommand
+
+from reviewboard.diffviewer.models import InterdiffResult
+
+
+class Command(NoArgsCommand):
+    help = ('Deletes stored interdiff results that are too old to be used. '
+            'This can be run periodically if prerender-diffs is not running')
+
+    def handle_noargs(self, **options):
+        num_pruned = InterdiffResult.objects.prune()
+
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write('Pruned %d stored interdiff results'
+                              % num_pruned)
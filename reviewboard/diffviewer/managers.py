@@ -1,12 +1,20 @@
 from __future__ import unicode_literals
 
+import hashlib
+import logging
 import os
+import zlib
+from datetime import timedelta
 
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
 from django.utils.encoding import smart_unicode
 from django.utils.translation import ugettext as _
 from djblets.db.fields import Base64DecodedValue
 from djblets.siteconfig.models import SiteConfiguration
+from djblets.util.compat import six
+from djblets.util.compat.six.moves import cPickle as pickle, range
 
 from reviewboard.diffviewer.differ import DEFAULT_DIFF_COMPAT_VERSION
 from reviewboard.diffviewer.errors import DiffTooBigError, EmptyDiffError
@@ -30,6 +38,101 @@ class FileDiffDataManager(models.Manager):
 
         return super(FileDiffDataManager, self).get_or_create(*args, **kwargs)
 
+    # The maximum number of hashes to look up in a single query. This keeps
+    # the number of query parameters within the limits of databases such as
+    # SQLite.
+    LOOKUP_BATCH_SIZE = 500
+
+    def get_or_create_many(self, diffs):
+        """Returns FileDiffData for many diffs, creating any that are missing.
+
+        diffs is a list of (data, insert_count, delete_count) tuples. The
+        counts may be None if they aren't known.
+
+        The existing entries are looked up by hash using as few queries as
+        possible, and the missing ones are created, with their line counts,
+        in a single bulk insert. Existing entries have their line counts
+        updated if needed.
+
+        This returns a list of FileDiffData, one for each diff, in the same
+        order. It should be called within a transaction.
+        """
+        hashes = []
+        entries = {}
+
+        for data, insert_count, delete_count in diffs:
+            binary_hash = hashlib.sha1(data).hexdigest()
+            hashes.append(binary_hash)
+
+            if (binary_hash not in entries or
+                entries[binary_hash][1] is None):
+                entries[binary_hash] = (data, insert_count, delete_count)
+
+        unique_hashes = list(entries)
+        diff_data = {}
+
+        for i in range(0, len(unique_hashes), self.LOOKUP_BATCH_SIZE):
+            diff_data.update(self.in_bulk(
+                unique_hashes[i:i + self.LOOKUP_BATCH_SIZE]))
+
+        for binary_hash, filediff_data in six.iteritems(diff_data):
+            data, insert_count, delete_count = entries[binary_hash]
+
+            if (insert_count is not None and
+                (filediff_data.insert_count != insert_count or
+                 filediff_data.delete_count != delete_count)):
+                if filediff_data.insert_count is not None:
+                    logging.warning('Overriding line counts on FileDiffData '
+                                    '%s from %s/%s to %s/%s',
+                                    binary_hash,
+                                    filediff_data.insert_count,
+                                    filediff_data.delete_count,
+                                    insert_count, delete_count)
+
+                filediff_data.insert_count = insert_count
+                filediff_data.delete_count = delete_count
+                filediff_data.save(update_fields=['insert_count',
+                                                  'delete_count'])
+
+        new_diff_data = [
+            self.model(binary_hash=binary_hash,
+                       binary=Base64DecodedValue(new_data),
+                       insert_count=new_insert_count,
+                       delete_count=new_delete_count)
+            for binary_hash, (new_data, new_insert_count, new_delete_count)
+            in six.iteritems(entries)
+            if binary_hash not in diff_data
+        ]
+
+        if new_diff_data:
+            sid = transaction.savepoint()
+
+            try:
+                self.bulk_create(new_diff_data)
+                transaction.savepoint_commit(sid)
+            except IntegrityError:
+                # Some of these were created by another upload at the same
+                # time. Fall back on creating them one at a time.
+                transaction.savepoint_rollback(sid)
+
+                for filediff_data in new_diff_data:
+                    filediff_data, is_new = self.get_or_create(
+                        binary_hash=filediff_data.binary_hash,
+                        defaults={
+                            'binary': filediff_data.binary,
+                            'insert_count': filediff_data.insert_count,
+                            'delete_count': filediff_data.delete_count,
+                        })
+                    diff_data[filediff_data.binary_hash] = filediff_data
+            else:
+                for filediff_data in new_diff_data:
+                    diff_data[filediff_data.binary_hash] = filediff_data
+
+        return [
+            diff_data[binary_hash]
+            for binary_hash in hashes
+        ]
+
 
 class DiffSetManager(models.Manager):
     """A custom manager for DiffSet objects.
@@ -91,8 +194,13 @@ class DiffSetManager(models.Manager):
 
         The diff_file_contents and parent_diff_file_contents parameters are
         strings with the actual diff contents.
+
+        The DiffSet and all of its FileDiffs are created in a single
+        transaction, using bulk queries for the FileDiffs and their diff
+        data.
         """
-        from reviewboard.diffviewer.models import FileDiff
+        from reviewboard.diffviewer.models import (DiffPrerenderJob, FileDiff,
+                                                   FileDiffData)
 
         tool = repository.get_scmtool()
 
@@ -137,58 +245,83 @@ class DiffSetManager(models.Manager):
             # IDs.
             parent_commit_id = parent_parser.get_orig_commit_id()
 
-        diffset = super(DiffSetManager, self).create(
-            name=diff_file_name, revision=0,
-            basedir=basedir,
-            history=diffset_history,
-            repository=repository,
-            diffcompat=DEFAULT_DIFF_COMPAT_VERSION,
-            base_commit_id=base_commit_id)
-
-        if save:
-            diffset.save()
-
-        for f in files:
-            if f.origFile in parent_files:
-                parent_file = parent_files[f.origFile]
-                parent_content = parent_file.data
-                source_rev = parent_file.origInfo
-            else:
-                parent_content = b""
-
-                if parent_commit_id and f.origInfo != PRE_CREATION:
-                    source_rev = parent_commit_id
+        with transaction.commit_on_success():
+            diffset = super(DiffSetManager, self).create(
+                name=diff_file_name, revision=0,
+                basedir=basedir,
+                history=diffset_history,
+                repository=repository,
+                diffcompat=DEFAULT_DIFF_COMPAT_VERSION,
+                base_commit_id=base_commit_id)
+
+            filediffs = []
+            diffs = []
+            parent_diffs = []
+
+            for f in files:
+                if f.origFile in parent_files:
+                    parent_file = parent_files[f.origFile]
+                    parent_content = parent_file.data
+                    source_rev = parent_file.origInfo
                 else:
-                    source_rev = f.origInfo
+                    parent_content = b""
 
-            dest_file = os.path.join(basedir, f.newFile).replace("\\", "/")
+                    if parent_commit_id and f.origInfo != PRE_CREATION:
+                        source_rev = parent_commit_id
+                    else:
+                        source_rev = f.origInfo
 
-            if f.deleted:
-                status = FileDiff.DELETED
-            elif f.moved:
-                status = FileDiff.MOVED
-            else:
-                status = FileDiff.MODIFIED
-
-            filediff = FileDiff(diffset=diffset,
-                                source_file=f.origFile,
-                                dest_file=dest_file,
-                                source_revision=smart_unicode(source_rev),
-                                dest_detail=f.newInfo,
-                                diff=f.data,
-                                parent_diff=parent_content,
-                                binary=f.binary,
-                                status=status)
-            filediff.set_line_counts(f.insert_count, f.delete_count)
+                dest_file = os.path.join(basedir, f.newFile).replace("\\",
+                                                                     "/")
+
+                if f.deleted:
+                    status = FileDiff.DELETED
+                elif f.moved:
+                    status = FileDiff.MOVED
+                else:
+                    status = FileDiff.MODIFIED
+
+                filediffs.append(FileDiff(
+                    diffset=diffset,
+                    source_file=f.origFile,
+                    dest_file=dest_file,
+                    source_revision=smart_unicode(source_rev),
+                    dest_detail=f.newInfo,
+                    binary=f.binary,
+                    status=status))
+                diffs.append((f.data, f.insert_count, f.delete_count))
+
+                if parent_content:
+                    parent_diffs.append((len(filediffs) - 1,
+                                         (parent_content, None, None)))
 
             if save:
-                filediff.save()
+                diff_data = FileDiffData.objects.get_or_create_many(
+                    diffs + [diff for i, diff in parent_diffs])
+
+                for filediff, filediff_data in zip(filediffs, diff_data):
+                    filediff.diff_hash = filediff_data
+
+                for (i, diff), filediff_data in \
+                        zip(parent_diffs, diff_data[len(diffs):]):
+                    filediffs[i].parent_diff_hash = filediff_data
+
+                FileDiff.objects.bulk_create(filediffs)
+                DiffPrerenderJob.objects.queue(diffset)
 
         return diffset
 
     def _process_files(self, parser, basedir, repository, base_commit_id,
                        request, check_existence=False, limit_to=None):
+        """Returns the files parsed from a diff.
+
+        If check_existence is set, the existence of the original files is
+        checked all at once, raising a FileNotFoundError for the first one
+        that doesn't exist.
+        """
         tool = repository.get_scmtool()
+        files = []
+        files_to_check = []
 
         for f in parser.parse():
             f2, revision = tool.parse_diff_revision(f.origFile, f.origInfo,
@@ -205,21 +338,31 @@ class DiffSetManager(models.Manager):
                 continue
 
             # FIXME: this would be a good place to find permissions errors
-            if (revision != PRE_CREATION and
+            if (check_existence and
+                revision != PRE_CREATION and
                 revision != UNKNOWN and
                 not f.binary and
                 not f.deleted and
-                not f.moved and
-                (check_existence and
-                 not repository.get_file_exists(filename, revision,
-                                                base_commit_id=base_commit_id,
-                                                request=request))):
-                raise FileNotFoundError(filename, revision, base_commit_id)
+                not f.moved):
+                files_to_check.append(f)
 
             f.origFile = filename
             f.origInfo = revision
 
-            yield f
+            files.append(f)
+
+        if files_to_check:
+            files_exist = repository.get_files_exist(
+                [(f.origFile, f.origInfo) for f in files_to_check],
+                base_commit_id=base_commit_id,
+                request=request)
+
+            for f, exists in zip(files_to_check, files_exist):
+                if not exists:
+                    raise FileNotFoundError(f.origFile, f.origInfo,
+                                            base_commit_id)
+
+        return files
 
     def _compare_files(self, filename1, filename2):
         """
@@ -240,3 +383,180 @@ class DiffSetManager(models.Manager):
                     return 1
 
         return cmp(filename1, filename2)
+
+
+class InterdiffResultManager(models.Manager):
+    """A custom manager for InterdiffResult objects.
+
+    This stores and looks up the results of computing interdiffs, keyed
+    by the contents of the diffs and the files they apply to.
+    """
+
+    # The version of the stored results. This is part of each key, and
+    # must be bumped whenever the contents of the results change.
+    RESULT_VERSION = 2
+
+    # The number of days a result is kept after it's stored. Older results
+    # are ignored, and are deleted by prune().
+    MAX_RESULT_AGE_DAYS = 30
+
+    def make_key(self, filediff, interfilediff, ignore_space):
+        """Returns the key for the result of an interdiff.
+
+        The key is a hash of the diffs' contents (through their FileDiffData
+        hashes), the files and revisions they apply to, and the settings
+        used to compute the interdiff. FileDiffs with identical contents,
+        such as those re-posted after a rebase, share the same key.
+
+        If either FileDiff hasn't been migrated to store its diffs by hash,
+        this returns None.
+        """
+        parts = [self.RESULT_VERSION, filediff.diffset.diffcompat,
+                 ignore_space]
+
+        for f in (filediff, interfilediff):
+            if (not f.diff_hash_id or
+                (f.parent_diff64 and not f.parent_diff_hash_id)):
+                return None
+
+            parts += [
+                f.diffset.repository_id,
+                f.source_file,
+                f.source_revision,
+                f.diffset.base_commit_id or '',
+                f.diff_hash_id,
+                f.parent_diff_hash_id or '',
+            ]
+
+        return hashlib.sha1(
+            '\0'.join(six.text_type(part) for part in parts)
+            .encode('utf-8')).hexdigest()
+
+    def get_result(self, key):
+        """Returns the stored result for an interdiff.
+
+        If there's no result stored for the key, or it can't be loaded,
+        this returns None.
+        """
+        try:
+            interdiff_result = self.get(pk=key,
+                                        timestamp__gte=self._get_cutoff())
+        except self.model.DoesNotExist:
+            return None
+
+        try:
+            return pickle.loads(zlib.decompress(interdiff_result.data))
+        except Exception as e:
+            logging.warning('Unable to load stored interdiff result %s: %s',
+                            key, e)
+            return None
+
+    def store_result(self, key, result):
+        """Stores the result of an interdiff.
+
+        If a result has already been stored for the key (for instance, by
+        another process computing the same interdiff), it's left alone,
+        unless it's older than MAX_RESULT_AGE_DAYS, in which case it's
+        replaced.
+        """
+        data = zlib.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL))
+
+        self.filter(pk=key, timestamp__lt=self._get_cutoff()).delete()
+        self.get_or_create(key=key, defaults={
+            'data': Base64DecodedValue(data),
+        })
+
+    def prune(self):
+        """Deletes any results older than MAX_RESULT_AGE_DAYS.
+
+        This is run by the ``prerender-diffs`` and ``prune-interdiff-results``
+        management commands, rather than when viewing diffs.
+
+        Returns the number of results deleted.
+        """
+        expired = self.filter(timestamp__lt=self._get_cutoff())
+        count = expired.count()
+        expired.delete()
+
+        return count
+
+    def _get_cutoff(self):
+        """Returns the oldest timestamp for results that are still used."""
+        return timezone.now() - timedelta(days=self.MAX_RESULT_AGE_DAYS)
+
+
+class DiffPrerenderJobManager(models.Manager):
+    """A custom manager for DiffPrerenderJob objects.
+
+    This provides the queue operations used when uploading diffs and by the
+    ``prerender-diffs`` management command.
+    """
+
+    # The number of seconds before a claimed job that hasn't finished is
+    # considered abandoned (for instance, if its worker was killed), and
+    # can be claimed again.
+    CLAIM_TIMEOUT_SECS = 15 * 60
+
+    def queue(self, diffset, interdiffset=None):
+        """Queues a diff or interdiff to be pre-rendered.
+
+        If pre-rendering is disabled, this does nothing and returns None.
+        Otherwise, the new job is returned.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if not siteconfig.get('diffviewer_prerender_enabled'):
+            return None
+
+        return self.create(diffset=diffset, interdiffset=interdiffset)
+
+    def claim_next(self):
+        """Claims the oldest job in the queue for processing.
+
+        The job is marked as started, so that other workers won't claim it
+        as well. If there are no jobs waiting, this returns None.
+        """
+        now = timezone.now()
+        expired = now - timedelta(seconds=self.CLAIM_TIMEOUT_SECS)
+
+        while True:
+            try:
+                job = self.filter(Q(started=None) | Q(started__lt=expired)) \
+                    .order_by('timestamp')[0]
+            except IndexError:
+                return None
+
+            # Another worker may have claimed this job since we looked it up,
+            # so only claim it if it's in the state we found it in.
+            claimed = self.filter(pk=job.pk, started=job.started).update(
+                started=now,
+                attempts=F('attempts') + 1)
+
+            if claimed:
+                job.started = now
+                job.attempts += 1
+
+                return job
+
+    def get_stats(self):
+        """Returns statistics on the queue.
+
+        This returns a dictionary containing the number of jobs waiting to
+        be processed (``pending``), the number being processed
+        (``in_progress``), and the timestamp of the oldest waiting job
+        (``oldest_timestamp``), or None if there aren't any.
+        """
+        pending = self.filter(started=None)
+
+        try:
+            oldest_timestamp = \
+                pending.order_by('timestamp').values_list('timestamp',
+                                                          flat=True)[0]
+        except IndexError:
+            oldest_timestamp = None
+
+        return {
+            'pending': pending.count(),
+            'in_progress': self.exclude(started=None).count(),
+            'oldest_timestamp': oldest_timestamp,
+        }
@@ -0,0 +1,38 @@
+from __future__ import unicode_literals
+
+from djblets.siteconfig.models import SiteConfiguration
+
+from reviewboard.diffviewer.timing import (record_stage_samples,
+                                           set_stage_timings,
+                                           start_stage_timings)
+
+
+class DiffStageTimingMiddleware(object):
+    """Middleware that times the stages of processing diffs in each request.
+
+    This only happens if the ``diffviewer_show_stage_timings`` setting is
+    enabled. The timings are sent in a Server-Timing header, and recorded
+    for the percentiles shown in the administration dashboard and the diff
+    viewer.
+    """
+    def process_request(self, request):
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if siteconfig.get('diffviewer_show_stage_timings'):
+            request._diff_stage_timings = start_stage_timings()
+
+        return None
+
+    def process_response(self, request, response):
+        timings = getattr(request, '_diff_stage_timings', None)
+
+        if timings is None:
+            return response
+
+        set_stage_timings(None)
+
+        if timings.entries:
+            record_stage_samples(timings)
+            response['Server-Timing'] = timings.get_server_timing()
+
+        return response
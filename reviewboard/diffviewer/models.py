@@ -9,7 +9,10 @@ from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
 from djblets.db.fields import Base64Field
 
-from reviewboard.diffviewer.managers import FileDiffDataManager, DiffSetManager
+from reviewboard.diffviewer.managers import (DiffPrerenderJobManager,
+                                             DiffSetManager,
+                                             FileDiffDataManager,
+                                             InterdiffResultManager)
 from reviewboard.scmtools.core import PRE_CREATION
 from reviewboard.scmtools.models import Repository
 
@@ -317,3 +320,62 @@ class DiffSetHistory(models.Model):
 
     class Meta:
         verbose_name_plural = "Diff set histories"
+
+
+@python_2_unicode_compatible
+class InterdiffResult(models.Model):
+    """The stored result of computing an interdiff for a file.
+
+    This contains the opcodes and interesting lines generated when diffing
+    the two versions of the file. The file contents aren't stored, since
+    they're cached by content (see file_cache) and patched again when
+    needed. It's keyed by the contents of the diffs involved (see
+    InterdiffResultManager.make_key), so identical interdiffs are only
+    computed once, and don't need to be computed again if the generated
+    chunks fall out of the cache. Results older than
+    InterdiffResultManager.MAX_RESULT_AGE_DAYS are ignored, and are deleted
+    by the ``prerender-diffs`` and ``prune-interdiff-results`` management
+    commands.
+    """
+    key = models.CharField(_('key'), max_length=40, primary_key=True)
+    data = Base64Field(_('data'))
+    timestamp = models.DateTimeField(_('timestamp'), default=timezone.now,
+                                     db_index=True)
+
+    objects = InterdiffResultManager()
+
+    def __str__(self):
+        return 'Interdiff result %s' % self.key
+
+
+@python_2_unicode_compatible
+class DiffPrerenderJob(models.Model):
+    """A queued request to pre-render a diff.
+
+    Jobs are queued when a diff is uploaded, and when a new revision of a
+    diff is published (for the interdiff against the previous revision).
+    They're processed by the ``prerender-diffs`` management command, which
+    generates and caches the diff chunks and rendered diff fragments before
+    anyone views the diff.
+    """
+    diffset = models.ForeignKey(DiffSet,
+                                related_name='prerender_jobs',
+                                verbose_name=_('diff set'))
+    interdiffset = models.ForeignKey(DiffSet,
+                                     null=True,
+                                     blank=True,
+                                     related_name='interdiff_prerender_jobs',
+                                     verbose_name=_('interdiff set'))
+    timestamp = models.DateTimeField(_('timestamp'), default=timezone.now,
+                                     db_index=True)
+    started = models.DateTimeField(_('started'), null=True, blank=True)
+    attempts = models.IntegerField(_('attempts'), default=0)
+
+    objects = DiffPrerenderJobManager()
+
+    def __str__(self):
+        if self.interdiffset_id:
+            return 'Pre-render interdiff %s-%s' % (self.diffset_id,
+                                                   self.interdiffset_id)
+        else:
+            return 'Pre-render diff %s' % self.diffset_id
@@ -5,8 +5,10 @@ import re
 from djblets.util.compat import six
 from djblets.util.compat.six.moves import range
 
+from reviewboard.diffviewer.budget import STAGE_MOVE_DETECTION
 from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
                                                merge_adjacent_chunks)
+from reviewboard.diffviewer.timing import STAGE_DIFF, time_stage
 
 
 class DiffOpcodeGenerator(object):
@@ -16,10 +18,19 @@ class DiffOpcodeGenerator(object):
     MOVE_PREFERRED_MIN_LINES = 2
     MOVE_MIN_LINE_LENGTH = 20
 
-    def __init__(self, differ, filediff=None, interfilediff=None):
+    # The maximum number of remove groups a line can appear in and still
+    # begin a new move range. Lines that are removed in more places than
+    # this (closing braces, common statements, etc.) can still extend a
+    # move range, but are too common to tell us where a move came from, and
+    # checking all of them makes large refactors slow to diff.
+    MOVE_MAX_LINE_CANDIDATES = 50
+
+    def __init__(self, differ, filediff=None, interfilediff=None,
+                 render_budget=None):
         self.differ = differ
         self.filediff = filediff
         self.interfilediff = interfilediff
+        self.render_budget = render_budget
 
     def __iter__(self):
         """Returns opcodes from the differ with extra metadata.
@@ -34,9 +45,14 @@ class DiffOpcodeGenerator(object):
         self.groups = []
         self.removes = {}
         self.inserts = []
+        self.line_codes = {}
+        self.removed_codes = {}
+
+        with time_stage(STAGE_DIFF, self.filediff):
+            self._precompute_opcodes()
 
-        self._precompute_opcodes()
-        self._compute_moves()
+        with time_stage(STAGE_MOVE_DETECTION, self.filediff):
+            self._compute_moves()
 
         for opcodes in self.groups:
             yield opcodes
@@ -87,19 +103,29 @@ class DiffOpcodeGenerator(object):
             group = (tag, i1, i2, j1, j2, meta)
             self.groups.append(group)
 
-            # Store delete/insert ranges for later lookup. We will be building
-            # keys that in most cases will be unique for the particular block
-            # of text being inserted/deleted. There is a chance of collision,
-            # so we store a list of matching groups under that key.
+            # Store delete/insert ranges for later lookup.
             #
-            # Later, we will loop through the keys and attempt to find insert
-            # keys/groups that match remove keys/groups.
+            # Each non-blank removed line is interned as a code, so that
+            # lines can be compared as integers. For each code, we store the
+            # remove groups containing the line, along with a key for the
+            # group and the first position of the line within it.
+            #
+            # Later, we will loop through the inserted lines and look up
+            # the remove groups that match, in order to assemble move ranges.
+            # The codes of the removed lines at each position are used to
+            # quickly extend those ranges.
             if tag in ('delete', 'replace'):
+                key = '%s-%s-%s-%s' % (i1, i2, j1, j2)
+
                 for i in range(i1, i2):
-                    line = self.differ.a[i].strip()
+                    code = self._get_line_code(self.differ.a[i], True)
 
-                    if line:
-                        self.removes.setdefault(line, []).append((i, group))
+                    if code is not None:
+                        self.removed_codes[i] = code
+                        candidates = self.removes.setdefault(code, [])
+
+                        if not candidates or candidates[-1][1] is not group:
+                            candidates.append((key, group, i))
 
             if tag in ('insert', 'replace'):
                 self.inserts.append(group)
@@ -115,7 +141,16 @@ class DiffOpcodeGenerator(object):
         # The algorithm will be documented as we go in the code.
         #
         # We start by looping through all the inserted groups.
+        #
+        # If there's a render budget and it runs out, we stop here. The
+        # moves found so far are still valid, since each one is recorded
+        # in both the insert and remove groups at once.
         for insert in self.inserts:
+            if (self.render_budget and
+                    not self.render_budget.can_run_stage(
+                        STAGE_MOVE_DETECTION)):
+                break
+
             self._compute_move_for_insert(*insert)
 
     def _compute_move_for_insert(self, itag, ii1, ii2, ij1, ij2, imeta):
@@ -150,43 +185,61 @@ class DiffOpcodeGenerator(object):
 
             updated_range = False
 
-            if iline and iline in self.removes:
-                # The inserted line at this location has a corresponding
-                # removed line.
+            if iline:
+                code = self._get_line_code(iline)
+            else:
+                code = None
+
+            if code in self.removes:
+                # The inserted line at this location has corresponding
+                # removed lines.
                 #
                 # If there's already some information on removed line ranges
                 # for this particular move block we're processing then we'll
-                # update the range.
+                # update the ranges.
                 #
-                # The way we do that is to find each removed line that matches
-                # this inserted line, and for each of those find out if there's
-                # an existing move range that the found removed line
-                # immediately follows. If there is, we update the existing
-                # range.
+                # The way we do that is to find each existing move range that
+                # is immediately followed by a removed copy of this line. If
+                # there is one, we update the existing range.
                 #
-                # If there isn't any move information for this line, we'll
-                # simply add it to the move ranges.
-                for ri, rgroup in self.removes.get(iline, []):
-                    key = '%s-%s-%s-%s' % rgroup[1:5]
-                    prev_key = key
-
-                    r_move_range = r_move_ranges.get(key)
+                # Then, for each remove group containing the line that we
+                # don't have a move range for yet, we'll simply add the line
+                # to the move ranges, provided the line isn't too common to
+                # be useful.
+                candidates = self.removes[code]
+                prev_key = candidates[-1][0]
+
+                if len(candidates) < len(r_move_ranges):
+                    keys = [
+                        key
+                        for key, rgroup, ri in candidates
+                        if key in r_move_ranges
+                    ]
+                else:
+                    keys = list(six.iterkeys(r_move_ranges))
+
+                for key in keys:
+                    r_start, r_end, rgroup = r_move_ranges[key]
+                    new_end = self._extend_move_range(r_end, code, rgroup)
+
+                    if new_end != r_end:
+                        # The removed lines following this calculated move
+                        # range match, so update the end of the range to
+                        # include them.
+                        r_move_ranges[key] = (r_start, new_end, rgroup)
+                        updated_range = True
 
-                    if r_move_range:
-                        # If the remove information for the line is next in
-                        # the sequence for this calculated move range...
-                        if ri == r_move_range[1] + 1:
-                            # This is part of the current range, so update
-                            # the end of the range to include it.
-                            r_move_ranges[key] = (r_move_range[0], ri, rgroup)
+                if len(candidates) <= self.MOVE_MAX_LINE_CANDIDATES:
+                    for key, rgroup, ri in candidates:
+                        if key not in r_move_ranges:
+                            # We don't have a move range for this group yet,
+                            # so it's time to build one based on the removed
+                            # lines we find that match the inserted line.
+                            r_move_ranges[key] = (
+                                ri,
+                                self._extend_move_range(ri, code, rgroup),
+                                rgroup)
                             updated_range = True
-                    else:
-                        # We don't have any move ranges yet, or we're done
-                        # with the existing range, so it's time to build one
-                        # based on any removed lines we find that match the
-                        # inserted line.
-                        r_move_ranges[key] = (ri, ri, rgroup)
-                        updated_range = True
 
                 if not updated_range and r_move_ranges:
                     # We didn't find a move range that this line is a part
@@ -274,6 +327,43 @@ class DiffOpcodeGenerator(object):
                 i_move_range = (i_move_cur, i_move_cur)
                 r_move_ranges = {}
 
+    def _get_line_code(self, line, add=False):
+        """Returns the code for a line, ignoring surrounding whitespace.
+
+        Codes are only assigned to lines that aren't blank. If ``add`` is
+        set, a new code will be assigned to a line that doesn't have one
+        yet. Otherwise, None is returned for such a line.
+        """
+        line = line.strip()
+
+        if not line:
+            return None
+
+        try:
+            return self.line_codes[line]
+        except KeyError:
+            if not add:
+                return None
+
+            code = len(self.line_codes) + 1
+            self.line_codes[line] = code
+
+            return code
+
+    def _extend_move_range(self, r_end, code, rgroup):
+        """Returns the new end of a move range ending at r_end.
+
+        The range is extended over any consecutive removed lines in the
+        remove group that match the given line code.
+        """
+        r_group_end = rgroup[2]
+
+        while (r_end + 1 < r_group_end and
+               self.removed_codes.get(r_end + 1) == code):
+            r_end += 1
+
+        return r_end
+
     def _find_longest_move_range(self, r_move_ranges):
         # Go through every range of lines we've found and find the longest.
         #
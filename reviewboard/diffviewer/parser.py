@@ -3,8 +3,6 @@ from __future__ import unicode_literals
 import logging
 import re
 
-from djblets.util.compat.six.moves import range
-
 from reviewboard.diffviewer.errors import DiffParserError
 
 
@@ -22,6 +20,10 @@ class File(object):
         self.insert_count = 0
         self.delete_count = 0
 
+        # The ranges of lines in the diff making up this file's data. These
+        # are joined into the data once the diff is parsed.
+        self.data_line_ranges = []
+
 
 class DiffParser(object):
     """
@@ -31,6 +33,10 @@ class DiffParser(object):
 
     INDEX_SEP = "=" * 67
 
+    # The number of FileDiffs loaded at a time when iterating through a
+    # raw diff.
+    RAW_DIFF_BATCH_SIZE = 20
+
     def __init__(self, data):
         self.data = data
         self.lines = data.splitlines()
@@ -43,7 +49,7 @@ class DiffParser(object):
         logging.debug("DiffParser.parse: Beginning parse of diff, size = %s",
                       len(self.data))
 
-        preamble = ''
+        preamble_start = None
         self.files = []
         file = None
         i = 0
@@ -55,17 +61,28 @@ class DiffParser(object):
             if new_file:
                 # This line is the start of a new file diff.
                 file = new_file
-                file.data = preamble + file.data
-                preamble = ''
+
+                if preamble_start is not None:
+                    self.add_file_data(file, preamble_start,
+                                       i - preamble_start)
+                    preamble_start = None
+
+                # The header is part of the diff, so make sure it gets in
+                # the diff content.
+                self.add_file_data(file, i, next_linenum - i)
                 self.files.append(file)
                 i = next_linenum
             else:
                 if file:
                     i = self.parse_diff_line(i, file)
                 else:
-                    preamble += self.lines[i] + '\n'
+                    if preamble_start is None:
+                        preamble_start = i
+
                     i += 1
 
+        self.finalize_files()
+
         logging.debug("DiffParser.parse: Finished parsing diff.")
 
         return self.files
@@ -79,10 +96,39 @@ class DiffParser(object):
             elif line.startswith('+'):
                 info.insert_count += 1
 
-        info.data += line + '\n'
+        self.add_file_data(info, linenum)
 
         return linenum + 1
 
+    def add_file_data(self, info, linenum, num_lines=1):
+        """Adds lines of the diff to a file's data.
+
+        Only the range of lines is recorded here. The data is built from
+        all of a file's lines at once by finalize_files, since appending
+        each line to the data in turn is very slow for large files.
+        """
+        if num_lines <= 0:
+            return
+
+        ranges = info.data_line_ranges
+        end = linenum + num_lines
+
+        if ranges and ranges[-1][1] == linenum:
+            ranges[-1][1] = end
+        else:
+            ranges.append([linenum, end])
+
+    def finalize_files(self):
+        """Builds the data for each parsed file from its ranges of lines.
+
+        This is called once all files in the diff have been parsed.
+        """
+        for file in self.files:
+            file.data = ''.join([
+                '\n'.join(self.lines[start:end]) + '\n'
+                for start, end in file.data_line_ranges
+            ])
+
     def parse_change_header(self, linenum):
         """
         Parses part of the diff beginning at the specified line number, trying
@@ -90,7 +136,6 @@ class DiffParser(object):
         """
         info = {}
         file = None
-        start = linenum
         linenum = self.parse_special_header(linenum, info)
         linenum = self.parse_diff_header(linenum, info)
 
@@ -117,12 +162,6 @@ class DiffParser(object):
             file.newInfo         = info.get('newInfo')
             file.origChangesetId = info.get('origChangesetId')
 
-            # The header is part of the diff, so make sure it gets in the
-            # diff content.
-            file.data = ''.join([
-                self.lines[i] + '\n' for i in range(start, linenum)
-            ])
-
         return linenum, file
 
     def parse_special_header(self, linenum, info):
@@ -210,7 +249,22 @@ class DiffParser(object):
 
         The returned diff as composed of all FileDiffs in the provided diffset.
         """
-        return ''.join([filediff.diff for filediff in diffset.files.all()])
+        return b''.join(self.iter_raw_diff(diffset))
+
+    def iter_raw_diff(self, diffset):
+        """Iterates through the raw diff of each FileDiff in a diffset.
+
+        The FileDiffs are loaded RAW_DIFF_BATCH_SIZE at a time, so that only
+        a batch of them (rather than the whole diff) is in memory at once.
+        """
+        filediffs = diffset.files.select_related('diff_hash').order_by('pk')
+        filediff_ids = list(filediffs.values_list('pk', flat=True))
+
+        for i in range(0, len(filediff_ids), self.RAW_DIFF_BATCH_SIZE):
+            batch_ids = filediff_ids[i:i + self.RAW_DIFF_BATCH_SIZE]
+
+            for filediff in filediffs.filter(pk__in=batch_ids).iterator():
+                yield filediff.diff
 
     def get_orig_commit_id(self):
         """Returns the commit ID of the original revision for the diff.
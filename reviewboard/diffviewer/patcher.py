@@ -0,0 +1,439 @@
+"""An in-process applier for unified diffs.
+
+This applies unified diffs to in-memory file contents, without writing
+anything to disk or spawning the external ``patch`` utility. It's used by
+:py:func:`reviewboard.diffviewer.diffutils.patch` for the common case, with
+``patch`` kept around as a fallback for diffs we don't understand.
+
+The hunk location logic mirrors GNU patch's: each hunk is first tried at
+its stated position (adjusted by the offset of the previous hunk), and then
+at increasing offsets above and below that position. If no exact match is
+found, up to ``MAX_FUZZ`` lines of leading and trailing context are
+ignored. Hunks with less leading (or trailing) context than the other side
+are anchored to the start (or end) of the file, like in GNU patch.
+"""
+
+from __future__ import unicode_literals
+
+import re
+
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.translation import ugettext as _
+
+from reviewboard.diffviewer.errors import PatchError
+
+
+HUNK_HEADER_RE = re.compile(br'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# The maximum number of context lines that can be ignored when locating
+# a hunk. This matches the default for GNU patch.
+MAX_FUZZ = 2
+
+
+class Hunk(object):
+    """A single hunk from a unified diff."""
+    def __init__(self, header, orig_start, orig_len, new_start, new_len):
+        self.header = header
+        self.orig_start = orig_start
+        self.orig_len = orig_len
+        self.new_start = new_start
+        self.new_len = new_len
+
+        # A list of (op, line) tuples, where op is one of ' ', '-' or '+'.
+        # Each line contains its trailing newline, if any.
+        self.ops = []
+
+        self.orig_lines = []
+        self.prefix_context = 0
+        self.suffix_context = 0
+
+    @property
+    def orig_first(self):
+        """The 0-based index of the first line in the original file.
+
+        For hunks that only insert lines, this is the index the new lines
+        are inserted before.
+        """
+        if self.orig_len == 0:
+            return self.orig_start
+        else:
+            return self.orig_start - 1
+
+    def reverse(self):
+        """Returns a copy of this hunk with the two sides swapped."""
+        hunk = Hunk(self.header, self.new_start, self.new_len,
+                    self.orig_start, self.orig_len)
+        swapped_ops = {
+            b' ': b' ',
+            b'-': b'+',
+            b'+': b'-',
+        }
+        hunk.ops = [
+            (swapped_ops[op], line)
+            for op, line in self.ops
+        ]
+        hunk.finalize()
+
+        return hunk
+
+    def finalize(self):
+        """Computes the state needed for locating the hunk in a file."""
+        self.orig_lines = [
+            line
+            for op, line in self.ops
+            if op != b'+'
+        ]
+
+        for op, line in self.ops:
+            if op != b' ':
+                break
+
+            self.prefix_context += 1
+
+        for op, line in reversed(self.ops):
+            if op != b' ':
+                break
+
+            self.suffix_context += 1
+
+
+@python_2_unicode_compatible
+class PatchReject(object):
+    """Information on a hunk that could not be applied."""
+    def __init__(self, hunk_num, hunk, reason):
+        self.hunk_num = hunk_num
+        self.header = hunk.header.rstrip()
+        self.orig_start = hunk.orig_start
+        self.reason = reason
+
+    def __str__(self):
+        return _('Hunk #%(hunk_num)s (%(header)s) at line %(line)s: '
+                 '%(reason)s') % {
+            'hunk_num': self.hunk_num,
+            'header': self.header.decode('utf-8', 'replace'),
+            'line': self.orig_start,
+            'reason': self.reason,
+        }
+
+
+def split_lines(data):
+    """Splits data into a list of lines, keeping the trailing newlines.
+
+    Unlike str.splitlines, this only splits on ``\\n``, which is all
+    the data will contain once line endings have been converted.
+    """
+    lines = data.split(b'\n')
+    result = [line + b'\n' for line in lines[:-1]]
+
+    if lines[-1]:
+        # The last line has no trailing newline.
+        result.append(lines[-1])
+
+    return result
+
+
+def parse_hunks(diff, filename=None):
+    """Parses the hunks out of a unified diff for a single file.
+
+    Any file headers (``---``/``+++``, ``diff --git``, ``Index:``, etc.)
+    are skipped. A PatchError is raised if the diff contains no unified
+    hunks, or if a hunk is malformed.
+    """
+    hunks = []
+    lines = split_lines(diff)
+    num_lines = len(lines)
+    i = 0
+
+    while i < num_lines:
+        m = HUNK_HEADER_RE.match(lines[i])
+
+        if not m:
+            i += 1
+            continue
+
+        orig_len = m.group(2)
+        new_len = m.group(4)
+
+        hunk = Hunk(header=lines[i],
+                    orig_start=int(m.group(1)),
+                    orig_len=(1 if orig_len is None else int(orig_len)),
+                    new_start=int(m.group(3)),
+                    new_len=(1 if new_len is None else int(new_len)))
+        orig_remaining = hunk.orig_len
+        new_remaining = hunk.new_len
+        i += 1
+
+        while orig_remaining > 0 or new_remaining > 0:
+            if i >= num_lines:
+                raise PatchError(
+                    _('Unexpected end of diff in hunk %s')
+                    % hunk.header.rstrip().decode('utf-8', 'replace'),
+                    filename)
+
+            line = lines[i]
+            op = line[:1]
+
+            if op == b'\n':
+                # Some tools strip the leading space from blank context
+                # lines. GNU patch accepts these, so we do as well.
+                op = b' '
+                line = b' \n'
+
+            if op == b' ':
+                orig_remaining -= 1
+                new_remaining -= 1
+            elif op == b'-':
+                orig_remaining -= 1
+            elif op == b'+':
+                new_remaining -= 1
+            elif op == b'\\' and hunk.ops:
+                _strip_last_newline(hunk)
+                i += 1
+                continue
+            else:
+                raise PatchError(
+                    _('Malformed line %(linenum)d in hunk %(header)s')
+                    % {
+                        'linenum': i + 1,
+                        'header': hunk.header.rstrip().decode('utf-8',
+                                                              'replace'),
+                    },
+                    filename)
+
+            if orig_remaining < 0 or new_remaining < 0:
+                raise PatchError(
+                    _('Line counts in hunk %s do not match its contents')
+                    % hunk.header.rstrip().decode('utf-8', 'replace'),
+                    filename)
+
+            hunk.ops.append((op, line[1:]))
+            i += 1
+
+        # A "\ No newline at end of file" marker may follow the last line.
+        if i < num_lines and lines[i].startswith(b'\\') and hunk.ops:
+            _strip_last_newline(hunk)
+            i += 1
+
+        hunk.finalize()
+        hunks.append(hunk)
+
+    if not hunks:
+        raise PatchError(_('No unified diff hunks were found'), filename)
+
+    return hunks
+
+
+def _strip_last_newline(hunk):
+    """Handles a "\\ No newline at end of file" marker for a hunk."""
+    op, line = hunk.ops[-1]
+
+    if line.endswith(b'\n'):
+        hunk.ops[-1] = (op, line[:-1])
+
+
+class _ReversedPatch(Exception):
+    """Raised internally when a hunk appears to be reversed."""
+    pass
+
+
+class Patcher(object):
+    """Applies the hunks of a unified diff to a file's contents."""
+    def __init__(self, data, hunks, filename=None):
+        self.lines = split_lines(data)
+        self.hunks = hunks
+        self.filename = filename
+        self.rejects = []
+
+        # The offset of the last applied hunk from its stated position.
+        self._offset = 0
+
+        # The index of the first line that hasn't been written yet.
+        self._frozen = 0
+
+    def apply(self):
+        """Applies all hunks, returning the patched file's contents.
+
+        Every hunk is attempted, even if an earlier one fails. If any
+        hunks could not be applied, a PatchError listing the rejects is
+        raised.
+        """
+        result = []
+
+        for hunk_num, hunk in enumerate(self.hunks, start=1):
+            try:
+                base = self._locate(hunk, check_reversed=(hunk_num == 1))
+            except _ReversedPatch:
+                # GNU patch refuses to apply these when run
+                # non-interactively, so we do the same.
+                raise PatchError(
+                    _('Reversed (or previously applied) patch detected'),
+                    self.filename,
+                    rejects=[PatchReject(
+                        hunk_num, hunk,
+                        _('the hunk appears to already be applied'))])
+
+            if base is None:
+                self.rejects.append(PatchReject(
+                    hunk_num, hunk,
+                    _('the hunk did not match the file contents')))
+                continue
+
+            result.extend(self.lines[self._frozen:base])
+            i = base
+
+            # Like GNU patch, trailing context isn't consumed by the hunk,
+            # so that the next hunk may overlap it.
+            for op, line in hunk.ops[:len(hunk.ops) - hunk.suffix_context]:
+                if op == b' ':
+                    # Context lines come from the file, in case fuzz
+                    # was needed to apply this hunk.
+                    result.append(self.lines[i])
+                    i += 1
+                elif op == b'-':
+                    i += 1
+                else:
+                    result.append(line)
+
+            self._offset = base - hunk.orig_first
+            self._frozen = i
+
+        if self.rejects:
+            raise PatchError(
+                _('%(num_rejects)d out of %(num_hunks)d hunks failed to '
+                  'apply')
+                % {
+                    'num_rejects': len(self.rejects),
+                    'num_hunks': len(self.hunks),
+                },
+                self.filename,
+                rejects=self.rejects)
+
+        result.extend(self.lines[self._frozen:])
+
+        # A line marked as having no newline only keeps that status if it
+        # ends up at the end of the file.
+        for i in range(len(result) - 1):
+            if not result[i].endswith(b'\n'):
+                result[i] += b'\n'
+
+        return b''.join(result)
+
+    def _locate(self, hunk, check_reversed=False):
+        """Returns the index where a hunk applies, or None.
+
+        Exact matches are tried first, followed by matches ignoring an
+        increasing amount of leading and trailing context.
+
+        If check_reversed is True and the hunk would apply in reverse
+        where it otherwise doesn't apply, _ReversedPatch is raised.
+        """
+        context = max(hunk.prefix_context, hunk.suffix_context)
+        reversed_hunk = None
+
+        for fuzz in range(min(MAX_FUZZ, context) + 1):
+            base = self._locate_with_fuzz(hunk, fuzz, context)
+
+            if base is not None:
+                return base
+
+            if check_reversed and hunk.orig_lines:
+                if reversed_hunk is None:
+                    reversed_hunk = hunk.reverse()
+
+                if (self._locate_with_fuzz(reversed_hunk, fuzz,
+                                           context) is not None):
+                    raise _ReversedPatch()
+
+        return None
+
+    def _locate_with_fuzz(self, hunk, fuzz, context):
+        """Returns the index where a hunk applies with the given fuzz.
+
+        The first and last ``fuzz`` lines of context will not be compared.
+        The trailing lines that aren't compared may extend beyond the end
+        of the file.
+        """
+        pattern = hunk.orig_lines
+        pattern_len = len(pattern)
+        num_lines = len(self.lines)
+        first_guess = hunk.orig_first + self._offset
+
+        if pattern_len == 0:
+            # There's nothing to match against, so trust the position,
+            # appending to the end of the file if it's out of range.
+            if first_guess >= self._frozen:
+                return min(first_guess, num_lines)
+            else:
+                return None
+
+        prefix_fuzz = fuzz + hunk.prefix_context - context
+        suffix_fuzz = fuzz + hunk.suffix_context - context
+
+        if prefix_fuzz < 0 and hunk.orig_start <= 1:
+            # This hunk can only match the start of the file.
+            if suffix_fuzz < 0 and pattern_len != num_lines:
+                # ... and can only match the entire file.
+                return None
+
+            if (self._frozen == 0 and
+                    self._matches(0, pattern, 0, max(suffix_fuzz, 0))):
+                return 0
+
+            return None
+        elif prefix_fuzz < 0:
+            prefix_fuzz = 0
+
+        min_base = self._frozen
+
+        if suffix_fuzz < 0:
+            # This hunk can only match the end of the file.
+            base = num_lines - pattern_len
+
+            if (base >= min_base and
+                    self._matches(base, pattern, prefix_fuzz, 0)):
+                return base
+
+            return None
+
+        max_base = num_lines - (pattern_len - suffix_fuzz)
+        max_offset = max(max_base - first_guess, first_guess - min_base)
+
+        for offset in range(max_offset + 1):
+            base = first_guess + offset
+
+            if (min_base <= base <= max_base and
+                    self._matches(base, pattern, prefix_fuzz, suffix_fuzz)):
+                return base
+
+            base = first_guess - offset
+
+            if (offset > 0 and min_base <= base <= max_base and
+                    self._matches(base, pattern, prefix_fuzz, suffix_fuzz)):
+                return base
+
+        return None
+
+    def _matches(self, base, pattern, prefix_fuzz, suffix_fuzz):
+        start = prefix_fuzz
+        end = len(pattern) - suffix_fuzz
+
+        if start >= end:
+            return True
+
+        lines = self.lines
+
+        return (lines[base + start] == pattern[start] and
+                lines[base + start:base + end] == pattern[start:end])
+
+
+def apply_patch(diff, data, filename=None):
+    """Applies a unified diff for a single file to the file's contents.
+
+    Both the diff and the data are expected to have had their line endings
+    converted already. The patched contents are returned.
+
+    A PatchError is raised if the diff can't be parsed, or if any hunks
+    fail to apply. In the latter case, the error's ``rejects`` will
+    contain a PatchReject for each failed hunk.
+    """
+    return Patcher(data, parse_hunks(diff, filename), filename).apply()
@@ -0,0 +1,95 @@
+from __future__ import unicode_literals
+
+import logging
+
+from django.contrib.auth.models import AnonymousUser
+
+from reviewboard.diffviewer.diffutils import (get_diff_files,
+                                              get_enable_highlighting,
+                                              populate_diff_chunks)
+from reviewboard.diffviewer.models import DiffPrerenderJob
+from reviewboard.diffviewer.renderers import get_diff_renderer
+
+
+# The number of times a job can fail before it's removed from the queue.
+MAX_JOB_ATTEMPTS = 3
+
+
+def prerender_diff(diffset, interdiffset=None):
+    """Generates and caches the rendered contents of a diff.
+
+    This generates the diff chunks for every file in the diff (or interdiff),
+    along with the rendered fragments the diff viewer loads for each file,
+    storing them all in the cache.
+
+    Files that fail to render are logged and skipped, since the diff viewer
+    will report the error when they're viewed. There's no render time budget
+    here, so any chunks that were degraded to fit within the budget when
+    viewed are replaced with full ones.
+
+    Returns the number of files that were rendered.
+    """
+    highlighting = get_enable_highlighting(AnonymousUser())
+    files = get_diff_files(diffset, None, interdiffset)
+
+    try:
+        populate_diff_chunks(files, highlighting, render_time_budget=0)
+    except Exception:
+        # Populate the files one at a time instead, so that one bad file
+        # doesn't prevent the others from being cached.
+        for diff_file in files:
+            try:
+                populate_diff_chunks([diff_file], highlighting,
+                                     render_time_budget=0)
+            except Exception as e:
+                logging.warning('Unable to pre-render diff chunks for '
+                                'FileDiff %s: %s',
+                                diff_file['filediff'].pk, e)
+
+    num_rendered = 0
+
+    for diff_file in files:
+        if not diff_file['chunks_loaded'] or diff_file['binary']:
+            continue
+
+        renderer = get_diff_renderer(diff_file, highlighting=highlighting,
+                                     collapse_all=True)
+
+        try:
+            renderer.render_to_string()
+            num_rendered += 1
+        except Exception as e:
+            logging.warning('Unable to pre-render diff fragment for '
+                            'FileDiff %s: %s',
+                            diff_file['filediff'].pk, e)
+
+    return num_rendered
+
+
+def process_next_job():
+    """Claims and processes the next job in the pre-rendering queue.
+
+    The job is removed from the queue once processed. If it fails, it's
+    released for another attempt, up to MAX_JOB_ATTEMPTS times.
+
+    Returns the job that was processed, or None if the queue was empty.
+    """
+    job = DiffPrerenderJob.objects.claim_next()
+
+    if not job:
+        return None
+
+    try:
+        prerender_diff(job.diffset, job.interdiffset)
+    except Exception as e:
+        logging.exception('Error pre-rendering %s: %s', job, e)
+
+        if job.attempts < MAX_JOB_ATTEMPTS:
+            job.started = None
+            job.save()
+
+            return job
+
+    job.delete()
+
+    return job
@@ -0,0 +1,275 @@
+from __future__ import unicode_literals
+
+import hashlib
+import re
+
+from django.core.cache import cache
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.http.response import HttpResponseBase
+from django.utils.http import parse_etags
+from djblets.cache.backend import make_cache_key
+from djblets.util.dates import http_date
+from djblets.util.http import set_etag, set_last_modified
+
+from reviewboard.diffviewer.cache_utils import CACHE_EXPIRATION_TIME
+
+
+RAW_DIFF_MIMETYPE = 'text/x-patch'
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RawDiffResponse(StreamingHttpResponse, HttpResponse):
+    """A response streaming a raw diff to the client.
+
+    This is also an HttpResponse, so that it can be returned from web API
+    resources, which only pass through responses of that type.
+    """
+    # djblets.webapi.resources.WebAPIResource.__call__ returns a handler's
+    # result as-is only if isinstance(result, HttpResponse), and raises an
+    # AssertionError otherwise. To pass that check while still streaming,
+    # HttpResponse.__init__ (which would set content) is skipped, and
+    # iteration uses the stream rather than HttpResponse's container.
+    _base_content_is_iter = False
+
+    def __init__(self, streaming_content=(), *args, **kwargs):
+        HttpResponseBase.__init__(self, *args, **kwargs)
+        self.streaming_content = streaming_content
+
+    __iter__ = HttpResponseBase.__iter__
+
+    @property
+    def content(self):
+        # Code expecting an HttpResponse may read the content. The rest of
+        # the stream is buffered, so that the response can still be sent.
+        content = b''.join(self.streaming_content)
+        self.streaming_content = [content]
+
+        return content
+
+    def __len__(self):
+        return len(self.content)
+
+    def __nonzero__(self):
+        # Don't read the whole stream just to test the response's truth.
+        return True
+
+
+class RequestedRangeNotSatisfiable(HttpResponse):
+    status_code = 416
+
+
+def get_raw_diff_response(request, diffset, parser, filename):
+    """Returns a response streaming the raw diff of a diffset.
+
+    The FileDiffs are loaded and sent in batches, rather than building the
+    whole diff in memory. The response supports conditional and byte range
+    requests, so interrupted downloads can be resumed.
+    """
+    return _get_response(
+        request,
+        iter_data=lambda: parser.iter_raw_diff(diffset),
+        get_size=lambda: get_raw_diff_size(diffset, parser),
+        etag=_get_etag(diffset),
+        timestamp=diffset.timestamp,
+        filename=filename)
+
+
+def get_raw_filediff_response(request, filediff, filename):
+    """Returns a response streaming the raw diff of a single FileDiff.
+
+    Like get_raw_diff_response, this supports conditional and byte range
+    requests.
+    """
+    return _get_response(
+        request,
+        iter_data=lambda: iter([filediff.diff]),
+        get_size=lambda: len(filediff.diff),
+        etag=_get_etag(filediff.diffset, filediff),
+        timestamp=filediff.diffset.timestamp,
+        filename=filename)
+
+
+def get_raw_diff_size(diffset, parser):
+    """Returns the size of the raw diff of a diffset, in bytes.
+
+    Diffsets don't change once they've been created, so this is cached
+    after it's first computed.
+    """
+    key = make_cache_key('raw-diff-size-%s' % diffset.pk)
+    size = cache.get(key)
+
+    if size is None:
+        size = sum(len(data) for data in parser.iter_raw_diff(diffset))
+        cache.set(key, size, CACHE_EXPIRATION_TIME)
+
+    return size
+
+
+def _get_response(request, iter_data, get_size, etag, timestamp, filename):
+    """Returns a response for a raw diff.
+
+    If the client has an up-to-date copy, this returns a 304. If a single
+    byte range was requested (and any If-Range header matches), only that
+    range is sent, with a 206. Otherwise, the whole diff is sent.
+    """
+    if _etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        return HttpResponseNotModified()
+
+    byte_range = None
+
+    if _if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, timestamp):
+        byte_range = _parse_range(request.META.get('HTTP_RANGE'))
+
+    if byte_range is None:
+        response = RawDiffResponse(iter_data(), mimetype=RAW_DIFF_MIMETYPE)
+    else:
+        size = get_size()
+        start, end = _get_range_bounds(byte_range, size)
+
+        if start is None:
+            response = RequestedRangeNotSatisfiable()
+            response['Content-Range'] = 'bytes */%d' % size
+
+            return response
+
+        response = RawDiffResponse(_iter_range(iter_data(), start, end),
+                                   mimetype=RAW_DIFF_MIMETYPE,
+                                   status=206)
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['Content-Length'] = str(end - start + 1)
+
+        # The range applies to the diff itself, so it must not be compressed
+        # by GZipMiddleware.
+        response['Content-Encoding'] = 'identity'
+
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = 'inline; filename=%s' % filename
+    set_etag(response, etag)
+    set_last_modified(response, timestamp)
+
+    return response
+
+
+def _get_etag(diffset, filediff=None):
+    """Returns the ETag for the raw diff of a diffset or a FileDiff."""
+    key = 'raw-diff:%s:%s' % (diffset.pk, diffset.timestamp)
+
+    if filediff:
+        key += ':%s' % filediff.pk
+
+    return '"%s"' % hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _etag_matches(value, etag):
+    """Returns whether an If-None-Match header value matches the ETag.
+
+    The header may list several ETags, any of which can be weak, or be "*"
+    to match any ETag. GZipMiddleware adds ";gzip" to the ETags of the
+    responses it compresses, so the ETags are allowed to have that suffix.
+    """
+    if value is None:
+        return False
+
+    if value.strip() == '*':
+        return True
+
+    etag = etag.strip('"')
+
+    return any(
+        _strip_gzip_suffix(tag) == etag
+        for tag in parse_etags(value)
+    )
+
+
+def _strip_gzip_suffix(tag):
+    """Returns an ETag without the suffix added by GZipMiddleware."""
+    if tag.endswith(';gzip'):
+        tag = tag[:-len(';gzip')]
+
+    return tag
+
+
+def _if_range_matches(value, etag, timestamp):
+    """Returns whether a Range header should be honored.
+
+    This is the case if there's no If-Range header, or if it matches the
+    ETag or the Last-Modified timestamp of the diff. Unlike If-None-Match,
+    If-Range only holds a single ETag, which must be a strong match (though
+    it may have GZipMiddleware's ";gzip" suffix).
+    """
+    return (value is None or
+            value.replace(';gzip"', '"') == etag or
+            value == http_date(timestamp))
+
+
+def _parse_range(value):
+    """Parses a Range header.
+
+    This returns a tuple of the first and last byte positions (either of
+    which may be None), or None if there's no header or it isn't a single,
+    valid byte range, in which case the header is ignored.
+    """
+    if not value:
+        return None
+
+    m = _RANGE_RE.match(value.strip())
+
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+
+    first, last = [
+        int(pos) if pos else None
+        for pos in m.groups()
+    ]
+
+    if first is not None and last is not None and last < first:
+        return None
+
+    return first, last
+
+
+def _get_range_bounds(byte_range, size):
+    """Returns the first and last byte positions to send for a range.
+
+    If the range can't be satisfied, this returns (None, None).
+    """
+    first, last = byte_range
+
+    if first is None:
+        # This is a suffix range, requesting the last bytes of the diff.
+        start = max(size - last, 0)
+        end = size - 1
+    else:
+        start = first
+
+        if last is None:
+            end = size - 1
+        else:
+            end = min(last, size - 1)
+
+    if start >= size or end < start:
+        return None, None
+
+    return start, end
+
+
+def _iter_range(chunks, start, end):
+    """Iterates through a byte range of the data from an iterator.
+
+    Once the end of the range has been reached, no more data is read from
+    the iterator.
+    """
+    offset = 0
+
+    for data in chunks:
+        data_end = offset + len(data)
+
+        if data_end > start:
+            yield data[max(start - offset, 0):end + 1 - offset]
+
+        offset = data_end
+
+        if offset > end:
+            break
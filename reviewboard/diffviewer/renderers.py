@@ -10,6 +10,7 @@ from djblets.cache.backend import cache_memoize
 
 from reviewboard.diffviewer.chunk_generator import compute_chunk_last_header
 from reviewboard.diffviewer.errors import UserVisibleError
+from reviewboard.diffviewer.timing import STAGE_RENDER, time_stage
 
 
 class DiffRenderer(object):
@@ -51,7 +52,11 @@ class DiffRenderer(object):
         if self.chunk_index is not None:
             assert not self.lines_of_context or self.collapse_all
 
-            self.num_chunks = len(self.diff_file['chunks'])
+            # The file may only contain some of its chunks (see
+            # populate_diff_chunk), in which case the total number is
+            # provided separately.
+            self.num_chunks = self.diff_file.get('num_chunks',
+                                                 len(self.diff_file['chunks']))
 
             if self.chunk_index < 0 or self.chunk_index >= self.num_chunks:
                 raise UserVisibleError(
@@ -69,15 +74,31 @@ class DiffRenderer(object):
         quick.
 
         If operating with a cache, and the diff doesn't exist in the cache,
-        it will be stored after render.
+        it will be stored after render. Diffs with chunks that were degraded
+        to fit within the render time budget aren't cached, so that they'll
+        be rendered in full once the full chunks are available.
         """
-        cache = self.allow_caching and not self.lines_of_context
+        cache = (self.allow_caching and
+                 not self.lines_of_context and
+                 not self.diff_file.get('degraded'))
 
-        if cache:
-            return cache_memoize(self.make_cache_key(),
-                                 self.render_to_string_uncached)
-        else:
-            return self.render_to_string_uncached()
+        with time_stage(STAGE_RENDER,
+                        self.diff_file.get('filediff')) as stage_info:
+            if cache:
+                def _render_uncached():
+                    stage_info['cache_hit'] = False
+
+                    return self.render_to_string_uncached()
+
+                stage_info['cache_hit'] = True
+                result = cache_memoize(self.make_cache_key(),
+                                       _render_uncached)
+            else:
+                result = self.render_to_string_uncached()
+
+            stage_info['num_bytes'] = len(result)
+
+        return result
 
     def render_to_string_uncached(self):
         """Renders a diff to a string without caching.
@@ -128,8 +149,18 @@ class DiffRenderer(object):
         if self.chunk_index is not None:
             # We're rendering a specific chunk within a file's diff, rather
             # than the whole diff.
-            self.diff_file['chunks'] = \
-                [self.diff_file['chunks'][self.chunk_index]]
+            chunks = self.diff_file['chunks']
+
+            if len(chunks) == self.num_chunks:
+                chunks = [chunks[self.chunk_index]]
+            else:
+                chunks = [
+                    chunk
+                    for chunk in chunks
+                    if chunk['index'] == self.chunk_index
+                ]
+
+            self.diff_file['chunks'] = chunks
 
             if self.lines_of_context:
                 # We're rendering a specific range of lines within this chunk,
@@ -1,6 +1,7 @@
 from __future__ import unicode_literals
 
 import re
+import time
 
 from django import template
 from django.template.loader import render_to_string
@@ -10,12 +11,19 @@ from django.utils.translation import ugettext as _
 from djblets.util.compat.six.moves import range
 from djblets.util.decorators import basictag
 
-from reviewboard.diffviewer.chunk_generator import DiffChunkGenerator
+from reviewboard.diffviewer.budget import STAGE_INTRALINE
+from reviewboard.diffviewer.chunk_generator import (DiffChunkGenerator,
+                                                    get_line_changed_regions)
+from reviewboard.diffviewer.timing import get_stage_timings
 
 
 register = template.Library()
 
 
+_MARKUP_TAG_RE = re.compile(r'(<[^>]*>)')
+_MARKUP_ENTITY_RE = re.compile(r'&[^;]*;')
+
+
 @register.filter
 def highlightregion(value, regions):
     """
@@ -27,66 +35,91 @@ def highlightregion(value, regions):
     if not regions:
         return value
 
-    s = ""
-
     # We need to insert span tags into a string already consisting
     # of span tags. We have a list of ranges that our span tags should
     # go into, but those ranges are in the markup-less string.
     #
-    # We go through the string and keep track of the location in the
-    # markup and in the markup-less string. We make sure to insert our
-    # span tag any time that we're within the current region, so long
-    # as we haven't already created one. We close the span tag whenever
-    # we're done with the region or when we're about to enter a tag in
-    # the markup string.
+    # We split the markup into the tags and the text between them, and keep
+    # track of the location in the markup-less string as we go. For each
+    # piece of text, we map locations in the markup-less string to offsets
+    # in the text (entities count as a single character), and splice in
+    # span tags around the parts of the text within the regions. Span tags
+    # are never left open across a tag in the markup, so a region covering
+    # several pieces of text is highlighted in each of them.
     #
     # This code makes the assumption that the list of regions is sorted.
     # This is safe to assume in practice, but if we ever at some point
     # had reason to doubt it, we could always sort the regions up-front.
-    in_tag = in_entity = in_hl = False
-    i = j = r = 0
-    region = regions[r]
-
-    for i in range(len(value)):
-        if value[i] == "<":
-            in_tag = True
-
-            if in_hl:
-                s += "</span>"
-                in_hl = False
-        elif value[i] == ">":
-            in_tag = False
-        elif value[i] == ';' and in_entity:
-            in_entity = False
-            j += 1
-        elif not in_tag and not in_entity:
-            if not in_hl and region[0] <= j < region[1]:
-                s += '<span class="hl">'
-                in_hl = True
-
-            if value[i] == '&':
-                in_entity = True
-            else:
-                j += 1
+    parts = _MARKUP_TAG_RE.split(value)
+    num_parts = len(parts)
+    num_regions = len(regions)
+    result = []
+    j = r = 0
+    region_start, region_end = regions[r]
 
-        s += value[i]
+    for i in range(0, num_parts, 2):
+        text = parts[i]
 
-        if j == region[1]:
-            r += 1
+        if '&' in text:
+            # Build a map of each character's offset in the text. The
+            # final entry is the end of the text.
+            offsets = []
+            text_i = 0
 
-            if in_hl:
-                s += '</span>'
-                in_hl = False
+            for m in _MARKUP_ENTITY_RE.finditer(text):
+                offsets.extend(range(text_i, m.start() + 1))
+                text_i = m.end()
 
-            if r == len(regions):
+            offsets.extend(range(text_i, len(text) + 1))
+            text_len = len(offsets) - 1
+        else:
+            offsets = None
+            text_len = len(text)
+
+        text_start = j
+        text_end = j + text_len
+        text_i = 0
+
+        while region_start < text_end:
+            hl_start = max(region_start, text_start) - text_start
+            hl_end = min(region_end, text_end) - text_start
+
+            if hl_start < hl_end:
+                if offsets is not None:
+                    hl_start = offsets[hl_start]
+                    hl_end = offsets[hl_end]
+
+                result += [
+                    text[text_i:hl_start],
+                    '<span class="hl">',
+                    text[hl_start:hl_end],
+                    '</span>',
+                ]
+                text_i = hl_end
+
+            if region_end > text_end:
+                # The region continues on past this text.
                 break
 
-            region = regions[r]
+            r += 1
+
+            if r == num_regions:
+                break
 
-    if i + 1 < len(value):
-        s += value[i + 1:]
+            region_start, region_end = regions[r]
 
-    return s
+        result.append(text[text_i:])
+        j = text_end
+
+        if r == num_regions:
+            # There's nothing left to highlight. Keep the rest as-is.
+            result += parts[i + 1:]
+            break
+
+        if i + 1 < num_parts:
+            result.append(parts[i + 1])
+
+    return ''.join(result)
 highlightregion.is_safe = True
 
 
@@ -101,8 +134,16 @@ def showextrawhitespace(value):
     Any trailing whitespace or tabs following one or more spaces are
     marked up by inserted ``<span class="ew">...</span>`` tags.
     """
-    value = extraWhitespace.sub(r'<span class="ew">\1</span>', value)
-    return value.replace("\t", '<span class="tb">\t</span>')
+    if '\t' in value:
+        value = extraWhitespace.sub(r'<span class="ew">\1</span>', value)
+        return value.replace("\t", '<span class="tb">\t</span>')
+    elif (value[-1:].isspace() or
+          (value.endswith('</span>') and value[-8:-7].isspace())):
+        # Only trailing whitespace can be marked up, so the (much slower)
+        # regex is only run when there is some.
+        return extraWhitespace.sub(r'<span class="ew">\1</span>', value)
+    else:
+        return value
 
 showextrawhitespace.is_safe = True
 
@@ -204,6 +245,11 @@ def diff_lines(file, chunk, standalone, line_fmt, anchor_fmt,
     moved_from_prev_linenum = None
     moved_to_prev_linenum = None
 
+    # The time spent finding the changes within lines is recorded for the
+    # whole chunk, if timings are being collected for the diff pipeline.
+    timings = is_replace and get_stage_timings()
+    regions_secs = 0
+
     result = []
 
     for i, line in enumerate(lines):
@@ -232,11 +278,18 @@ def diff_lines(file, chunk, standalone, line_fmt, anchor_fmt,
                 row_classes.append('whitespace-line')
 
             if is_replace:
+                if timings:
+                    start_time = time.time()
+                    region1, region2 = get_line_changed_regions(line)
+                    regions_secs += time.time() - start_time
+                else:
+                    region1, region2 = get_line_changed_regions(line)
+
                 if len(line1) < DiffChunkGenerator.STYLED_MAX_LINE_LEN:
-                    line1 = highlightregion(line1, line[3])
+                    line1 = highlightregion(line1, region1)
 
                 if len(line2) < DiffChunkGenerator.STYLED_MAX_LINE_LEN:
-                    line2 = highlightregion(line2, line[6])
+                    line2 = highlightregion(line2, region2)
         else:
             show_collapse = (i == 0 and standalone)
 
@@ -352,4 +405,7 @@ def diff_lines(file, chunk, standalone, line_fmt, anchor_fmt,
 
         result.append(line_fmt % context)
 
+    if timings:
+        timings.add(STAGE_INTRALINE, file['filediff'], regions_secs)
+
     return ''.join(result)
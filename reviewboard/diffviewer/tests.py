@@ -1,28 +1,62 @@
 from __future__ import unicode_literals
 
+import hashlib
 import os
+import random
+import re
+import time
 import unittest
+from datetime import timedelta
 
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.http import HttpResponse
-from djblets.cache.backend import cache_memoize
+from django.utils import timezone, translation
+from django.utils.safestring import SafeText, mark_safe
+from djblets.cache.backend import cache_memoize, make_cache_key
 from djblets.siteconfig.models import SiteConfiguration
 from djblets.util.compat.six.moves import zip_longest
 from kgb import SpyAgency
 import nose
 
+from reviewboard import initialize
+import reviewboard.diffviewer.chunk_cache as chunk_cache
+import reviewboard.diffviewer.chunk_generator as chunk_generator
 import reviewboard.diffviewer.diffutils as diffutils
+import reviewboard.diffviewer.file_cache as file_cache
+import reviewboard.diffviewer.highlighting as highlighting
 import reviewboard.diffviewer.parser as diffparser
-from reviewboard.diffviewer.chunk_generator import DiffChunkGenerator
-from reviewboard.diffviewer.errors import UserVisibleError
+import reviewboard.diffviewer.prerender as prerender
+import reviewboard.diffviewer.timing as timing
+from reviewboard.diffviewer.budget import (RenderBudget,
+                                           STAGE_INTRALINE,
+                                           STAGE_MOVE_DETECTION,
+                                           STAGE_SYNTAX_HIGHLIGHTING)
+from reviewboard.diffviewer.cache_utils import CACHE_EXPIRATION_TIME
+from reviewboard.diffviewer.chunk_generator import (
+    DiffChunkGenerator, compute_chunk_line_regions,
+    get_diff_chunk_generator_class, get_line_changed_regions,
+    set_diff_chunk_generator_class)
+from reviewboard.diffviewer.differ import (DEFAULT_DIFF_COMPAT_VERSION,
+                                          get_differ)
+from reviewboard.diffviewer.errors import PatchError, UserVisibleError
+from reviewboard.diffviewer.fastmyersdiff import FastMyersDiffer
 from reviewboard.diffviewer.forms import UploadDiffForm
-from reviewboard.diffviewer.models import DiffSet, FileDiff
+from reviewboard.diffviewer.models import (DiffPrerenderJob, DiffSet,
+                                           FileDiff, FileDiffData,
+                                           InterdiffResult)
 from reviewboard.diffviewer.myersdiff import MyersDiffer
 from reviewboard.diffviewer.opcode_generator import get_diff_opcode_generator
+from reviewboard.diffviewer.patcher import apply_patch
 from reviewboard.diffviewer.renderers import DiffRenderer
 from reviewboard.diffviewer.processors import (filter_interdiff_opcodes,
                                                merge_adjacent_chunks)
-from reviewboard.diffviewer.templatetags.difftags import highlightregion
+from reviewboard.diffviewer.templatetags.difftags import (highlightregion,
+                                                          showextrawhitespace)
+from reviewboard.scmtools.core import PRE_CREATION
+from reviewboard.scmtools.errors import FileNotFoundError
 from reviewboard.scmtools.models import Repository, Tool
 from reviewboard.testing import TestCase
 
@@ -55,6 +89,82 @@ class MyersDifferTest(TestCase):
         self.assertEquals(opcodes, expected)
 
 
+class FastMyersDifferTest(TestCase):
+    """Unit tests for FastMyersDiffer."""
+    def test_get_differ(self):
+        """Testing get_differ with compat version 2"""
+        differ = get_differ([], [], compat_version=2)
+        self.assertTrue(isinstance(differ, FastMyersDiffer))
+
+    def test_matches_myers_differ(self):
+        """Testing FastMyersDiffer produces the same results as MyersDiffer"""
+        for seed in range(40):
+            rng = random.Random(seed)
+            vocab = rng.choice([3, 20, 500, 100000])
+            orig = []
+
+            for i in range(rng.choice([1, 5, 50, 300])):
+                if rng.random() < 0.1:
+                    orig.append('\n')
+                else:
+                    template = rng.choice(['    line %d\n', 'def func%d():\n'])
+                    orig.append(template % rng.randint(0, vocab))
+
+            modified = self._mutate(rng, orig, rng.choice([0.01, 0.1, 0.4]))
+
+            self._check_differs(orig, modified,
+                                ignore_space=rng.random() < 0.3)
+
+    def test_matches_myers_differ_with_heuristics(self):
+        """Testing FastMyersDiffer produces the same results as MyersDiffer
+        when falling back on the diagonal heuristics
+        """
+        rng = random.Random(0)
+        common = ['common %d\n' % i for i in range(60)]
+        orig = ['a %d\n' % i for i in range(300)]
+        modified = orig[:]
+        rng.shuffle(modified)
+
+        self._check_differs(orig + common, modified + common)
+
+    def test_matches_myers_differ_with_chars(self):
+        """Testing FastMyersDiffer produces the same results as MyersDiffer
+        with strings
+        """
+        self._check_differs('1\n2\n3\n7\n', '1\n2\n4\n5\n6\n7\n')
+
+    def _mutate(self, rng, lines, rate):
+        result = []
+
+        for line in lines:
+            r = rng.random()
+
+            if r < rate:
+                continue
+            elif r < rate * 2:
+                result.append('new %d\n' % rng.randint(0, 1000))
+            elif r < rate * 3:
+                result.append(line)
+                result.append(rng.choice(lines))
+            else:
+                result.append(line)
+
+        return result
+
+    def _check_differs(self, a, b, ignore_space=False):
+        results = []
+
+        for cls in (MyersDiffer, FastMyersDiffer):
+            differ = cls(a, b, ignore_space=ignore_space)
+            differ.add_interesting_line_regex('header',
+                                              re.compile(r'def \w+'))
+            results.append((list(differ.get_opcodes()),
+                            differ.interesting_lines,
+                            differ.ratio()))
+
+        self.assertEqual(results[0], results[1])
+
+
 class InterestingLinesTest(TestCase):
     PREFIX = os.path.join(os.path.dirname(__file__), 'testdata')
 
@@ -430,6 +540,46 @@ class DiffParserTest(TestCase):
             ]
         )
 
+    def test_move_detection_with_common_lines(self):
+        """Testing diff viewer move detection with lines common to many
+        removed regions
+        """
+        old = []
+
+        for i in range(60):
+            old += ['unchanged line %d' % i, '}']
+
+        old += [
+            '}',
+            'this is line 1, and it is sufficiently long',
+            'this is line 2, and it is sufficiently long',
+        ]
+
+        new = [
+            '}',
+            'this is line 1, and it is sufficiently long',
+            'this is line 2, and it is sufficiently long',
+        ] + [
+            'unchanged line %d' % i
+            for i in range(60)
+        ]
+
+        self._test_move_detection(
+            old,
+            new,
+            [
+                {
+                    2: 122,
+                    3: 123,
+                },
+            ],
+            [
+                {
+                    122: 2,
+                    123: 3,
+                },
+            ])
+
     def test_line_counts(self):
         """Testing DiffParser with insert/delete line counts"""
         diff = (
@@ -453,6 +603,37 @@ class DiffParserTest(TestCase):
         self.assertEqual(files[0].insert_count, 3)
         self.assertEqual(files[0].delete_count, 4)
 
+    def test_file_data(self):
+        """Testing DiffParser builds file data from the diff's lines"""
+        diff = (
+            b'Preamble line\r\n'
+            b'--- README  123\n'
+            b'+++ README  (new)\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-blah\n'
+            b'+blah!\n'
+            b'--- foo.c  123\n'
+            b'+++ foo.c  (new)\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-int x;\n'
+            b'+int y;')
+        files = diffparser.DiffParser(diff).parse()
+
+        self.assertEqual(len(files), 2)
+        self.assertEqual(files[0].data,
+                         b'Preamble line\n'
+                         b'--- README  123\n'
+                         b'+++ README  (new)\n'
+                         b'@ -1,1 +1,1 @@\n'
+                         b'-blah\n'
+                         b'+blah!\n')
+        self.assertEqual(files[1].data,
+                         b'--- foo.c  123\n'
+                         b'+++ foo.c  (new)\n'
+                         b'@ -1,1 +1,1 @@\n'
+                         b'-int x;\n'
+                         b'+int y;\n')
+
     def _get_file(self, *relative):
         path = os.path.join(*tuple([self.PREFIX] + list(relative)))
         with open(path, 'rb') as f:
@@ -479,6 +660,110 @@ class DiffParserTest(TestCase):
         self.assertEqual(r_moves, expected_r_moves)
 
 
+class PatcherTests(SpyAgency, TestCase):
+    """Unit tests for the in-process patcher."""
+    def test_apply_with_offset(self):
+        """Testing apply_patch with hunks at an offset"""
+        old = b'x\ny\na\nb\nc\nd\ne\n'
+        diff = (b'--- a\n'
+                b'+++ b\n'
+                b'@@ -1,5 +1,5 @@\n'
+                b' a\n'
+                b' b\n'
+                b'-c\n'
+                b'+C\n'
+                b' d\n'
+                b' e\n')
+
+        self.assertEqual(apply_patch(diff, old),
+                         b'x\ny\na\nb\nC\nd\ne\n')
+
+    def test_apply_with_fuzz(self):
+        """Testing apply_patch with hunks requiring fuzz"""
+        old = b'1\n2\nX\n4\n5\n6\n7\n'
+        diff = (b'@@ -2,5 +2,5 @@\n'
+                b' 2\n'
+                b' 3\n'
+                b' 4\n'
+                b'-5\n'
+                b'+five\n'
+                b' 6\n'
+                b' 7\n')
+
+        self.assertEqual(apply_patch(diff, old),
+                         b'1\n2\nX\n4\nfive\n6\n7\n')
+
+    def test_apply_with_no_newline(self):
+        """Testing apply_patch with "No newline at end of file" markers"""
+        old = b'a\nb'
+        diff = (b'@@ -1,2 +1,2 @@\n'
+                b' a\n'
+                b'-b\n'
+                b'\\ No newline at end of file\n'
+                b'+c\n')
+
+        self.assertEqual(apply_patch(diff, old), b'a\nc\n')
+
+    def test_apply_with_rejects(self):
+        """Testing apply_patch with hunks that don't apply"""
+        old = b'a\nb\nc\n'
+        diff = (b'@@ -1,3 +1,3 @@\n'
+                b' a\n'
+                b'-x\n'
+                b'+y\n'
+                b' c\n')
+
+        try:
+            apply_patch(diff, old, 'test.c')
+            self.fail('PatchError was not raised')
+        except PatchError as e:
+            self.assertEqual(e.filename, 'test.c')
+            self.assertEqual(len(e.rejects), 1)
+            self.assertEqual(e.rejects[0].hunk_num, 1)
+
+    def test_patch_matches_subprocess(self):
+        """Testing diffutils.patch in-process results match patch"""
+        prefix = os.path.join(os.path.dirname(__file__), 'testdata')
+        spy = self.spy_on(diffutils._patch_with_subprocess)
+
+        for filename in ('foo.c', 'helloworld.py', 'movetest1.c',
+                         'README.nonewline'):
+            with open(os.path.join(prefix, 'orig_src', filename)) as f:
+                old = f.read()
+
+            with open(os.path.join(prefix, 'diffs', 'unified',
+                                   '%s.diff' % filename)) as f:
+                diff = f.read()
+
+            self.assertEqual(
+                diffutils.patch(diff, old, filename),
+                diffutils._patch_with_subprocess(
+                    diffutils.convert_line_endings(diff),
+                    diffutils.convert_line_endings(old),
+                    filename))
+
+        # Only our explicit calls should have gone through patch.
+        self.assertEqual(len(spy.calls), 4)
+
+    def test_patch_falls_back_for_context_diffs(self):
+        """Testing diffutils.patch falling back to patch for context diffs"""
+        prefix = os.path.join(os.path.dirname(__file__), 'testdata')
+        spy = self.spy_on(diffutils._patch_with_subprocess)
+
+        with open(os.path.join(prefix, 'orig_src', 'foo.c')) as f:
+            old = f.read()
+
+        with open(os.path.join(prefix, 'new_src', 'foo.c')) as f:
+            new = f.read()
+
+        with open(os.path.join(prefix, 'diffs', 'context',
+                               'foo.c.diff')) as f:
+            diff = f.read()
+
+        self.assertEqual(diffutils.patch(diff, old, 'foo.c'), new)
+        self.assertTrue(spy.called)
+
+
 class FileDiffMigrationTests(TestCase):
     fixtures = ['test_scmtools']
 
@@ -652,6 +937,31 @@ class HighlightRegionTest(TestCase):
             'foo=<span class="ab"><span class="hl">&quot;foo&quot;' +
             '</span></span>)')
 
+        self.assertEquals(highlightregion(
+            'foo<span class="ab">bar</span>',
+            [(0, 0), (1, 1), (3, 4)]),
+            'foo<span class="ab"><span class="hl">b</span>ar</span>')
+
+        self.assertEquals(highlightregion(
+            'foo<span class="ab">bar</span>',
+            [(4, 10)]),
+            'foo<span class="ab">b<span class="hl">ar</span></span>')
+
+    def test_showextrawhitespace(self):
+        """Testing showextrawhitespace"""
+        self.assertEquals(showextrawhitespace('abc'), 'abc')
+
+        self.assertEquals(showextrawhitespace('abc  '),
+                          'abc<span class="ew">  </span>')
+
+        self.assertEquals(
+            showextrawhitespace('<span class="c">abc  </span>'),
+            '<span class="c">abc<span class="ew">  </span></span>')
+
+        self.assertEquals(
+            showextrawhitespace('a  \tb'),
+            'a<span class="ew">  <span class="tb">\t</span></span>b')
+
 
 class DbTests(TestCase):
     """Unit tests for database operations."""
@@ -697,6 +1007,10 @@ class DbTests(TestCase):
         self.assertEquals(filediff1.diff_hash, filediff2.diff_hash)
 
 
+def _all_files_exist(repository, paths_and_revisions, *args, **kwargs):
+    return [True] * len(paths_and_revisions)
+
+
 class DiffSetManagerTests(SpyAgency, TestCase):
     """Unit tests for DiffSetManager."""
     fixtures = ['test_scmtools']
@@ -715,14 +1029,350 @@ class DiffSetManagerTests(SpyAgency, TestCase):
 
         repository = self.create_repository(tool_name='Test')
 
-        self.spy_on(repository.get_file_exists,
-                    call_fake=lambda *args, **kwargs: True)
+        self.spy_on(repository.get_files_exist,
+                    call_fake=_all_files_exist)
 
         diffset = DiffSet.objects.create_from_data(
             repository, 'diff', diff, None, None, None, '/', None)
 
         self.assertEqual(diffset.files.count(), 1)
 
+    def test_creating_with_many_files(self):
+        """Testing DiffSetManager.create_from_data with many files and
+        existing diff data
+        """
+        diff = b''.join(
+            b'diff --git a/file%d b/file%d\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- file%d\n'
+            b'+++ file%d\n'
+            b'@ -1,1 +1,2 @@\n'
+            b'-blah..\n'
+            b'+blah blah\n'
+            b'+blah %d\n'
+            % (i, i, i, i, i)
+            for i in range(20)
+        )
+        parent_diff = (
+            b'diff --git a/file3 b/file3\n'
+            b'index d6613f4..d6613f5 100644\n'
+            b'--- file3\n'
+            b'+++ file3\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-blah\n'
+            b'+blah..\n'
+        )
+
+        repository = self.create_repository(tool_name='Test')
+
+        self.spy_on(repository.get_files_exist,
+                    call_fake=_all_files_exist)
+
+        diffset1 = DiffSet.objects.create_from_data(
+            repository, 'diff', diff, None, None, None, '/', None)
+        num_diff_data = FileDiffData.objects.count()
+        self.assertEqual(num_diff_data, 20)
+
+        # Uploading the same files again should reuse the existing data.
+        with self.assertNumQueries(4):
+            diffset2 = DiffSet.objects.create_from_data(
+                repository, 'diff', diff, 'parent', parent_diff, None, '/',
+                None)
+
+        self.assertEqual(FileDiffData.objects.count(), num_diff_data + 1)
+
+        filediffs1 = list(diffset1.files.order_by('source_file'))
+        filediffs2 = list(diffset2.files.order_by('source_file'))
+        self.assertEqual(len(filediffs2), 20)
+
+        for filediff1, filediff2 in zip(filediffs1, filediffs2):
+            self.assertEqual(filediff1.diff_hash_id, filediff2.diff_hash_id)
+            self.assertEqual(filediff2.insert_count, 2)
+            self.assertEqual(filediff2.delete_count, 1)
+
+            if filediff2.source_file == '/file3':
+                self.assertEqual(filediff2.parent_diff, parent_diff)
+            else:
+                self.assertEqual(filediff2.parent_diff, None)
+
+    def test_creating_with_missing_file(self):
+        """Testing DiffSetManager.create_from_data checks that files exist
+        all at once
+        """
+        diff = b''.join(
+            b'diff --git a/file%d b/file%d\n'
+            b'index d6613f%d..5b50866 100644\n'
+            b'--- file%d\n'
+            b'+++ file%d\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-blah..\n'
+            b'+blah blah\n'
+            % (i, i, i, i, i)
+            for i in range(3)
+        )
+
+        def _get_files_exist(repository, paths_and_revisions, *args,
+                             **kwargs):
+            return [
+                path != '/file1'
+                for path, revision in paths_and_revisions
+            ]
+
+        repository = self.create_repository(tool_name='Test')
+        self.spy_on(repository.get_files_exist, call_fake=_get_files_exist)
+
+        try:
+            DiffSet.objects.create_from_data(
+                repository, 'diff', diff, None, None, None, '/', None)
+            self.fail('FileNotFoundError was not raised')
+        except FileNotFoundError as e:
+            self.assertEqual(e.path, '/file1')
+            self.assertEqual(e.revision, 'd6613f1')
+
+        self.assertEqual(len(repository.get_files_exist.calls), 1)
+        self.assertEqual(
+            repository.get_files_exist.calls[0].args[0],
+            [
+                ('/file0', 'd6613f0'),
+                ('/file1', 'd6613f1'),
+                ('/file2', 'd6613f2'),
+            ])
+        self.assertEqual(DiffSet.objects.count(), 0)
+
+    def test_get_or_create_many(self):
+        """Testing FileDiffDataManager.get_or_create_many"""
+        FileDiffData.objects.get_or_create(
+            binary_hash=hashlib.sha1(b'diff 1').hexdigest(),
+            defaults={'binary': b'diff 1'})
+
+        diff_data = FileDiffData.objects.get_or_create_many([
+            (b'diff 1', 1, 2),
+            (b'diff 2', 3, 4),
+            (b'diff 1', 1, 2),
+            (b'diff 3', None, None),
+        ])
+
+        self.assertEqual(len(diff_data), 4)
+        self.assertEqual(FileDiffData.objects.count(), 3)
+        self.assertEqual(diff_data[0].pk, diff_data[2].pk)
+
+        for filediff_data, data, insert_count, delete_count in (
+                (diff_data[0], b'diff 1', 1, 2),
+                (diff_data[1], b'diff 2', 3, 4),
+                (diff_data[3], b'diff 3', None, None)):
+            filediff_data = FileDiffData.objects.get(pk=filediff_data.pk)
+            self.assertEqual(filediff_data.binary, data)
+            self.assertEqual(filediff_data.insert_count, insert_count)
+            self.assertEqual(filediff_data.delete_count, delete_count)
+
+
+class GetDiffFilesTests(TestCase):
+    """Unit tests for get_diff_files."""
+    fixtures = ['test_scmtools']
+
+    def test_interdiff_matches_by_hash(self):
+        """Testing get_diff_files with interdiffs compares diffs by hash"""
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        interdiffset = self.create_diffset(repository=repository,
+                                           revision=2)
+
+        self.create_filediff(diffset, source_file='/same',
+                             dest_file='/same', diff=b'same diff')
+        self.create_filediff(diffset, source_file='/changed',
+                             dest_file='/changed', diff=b'old diff')
+        self.create_filediff(interdiffset, source_file='/same',
+                             dest_file='/same', diff=b'same diff')
+        self.create_filediff(interdiffset, source_file='/changed',
+                             dest_file='/changed', diff=b'new diff')
+        self.create_filediff(interdiffset, source_file='/new',
+                             dest_file='/new', diff=b'new file diff')
+
+        # Only the FileDiffs should be fetched, not their diff data.
+        with self.assertNumQueries(2):
+            files = diffutils.get_diff_files(diffset,
+                                             interdiffset=interdiffset)
+
+        self.assertEqual([f['depot_filename'] for f in files],
+                         ['/changed', '/new'])
+        self.assertEqual(files[0]['interfilediff'].source_file, '/changed')
+        self.assertEqual(files[1]['interfilediff'], None)
+
+    def test_interdiff_with_filediff(self):
+        """Testing get_diff_files with interdiffs and a single filediff"""
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        interdiffset = self.create_diffset(repository=repository,
+                                           revision=2)
+
+        filediff = self.create_filediff(diffset, source_file='/changed',
+                                        dest_file='/changed',
+                                        diff=b'old diff')
+        self.create_filediff(interdiffset, source_file='/changed',
+                             dest_file='/changed', diff=b'new diff')
+        self.create_filediff(interdiffset, source_file='/other',
+                             dest_file='/other', diff=b'other diff')
+
+        files = diffutils.get_diff_files(diffset, filediff=filediff,
+                                         interdiffset=interdiffset)
+
+        self.assertEqual(len(files), 1)
+        self.assertEqual(files[0]['filediff'], filediff)
+        self.assertEqual(files[0]['interfilediff'].source_file, '/changed')
+
+
+class DiffPrerenderTests(SpyAgency, TestCase):
+    """Unit tests for the diff pre-rendering queue."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(DiffPrerenderTests, self).setUp()
+
+        initialize()
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('diffviewer_prerender_enabled', True)
+
+        self.repository = self.create_repository(tool_name='Test')
+
+    def tearDown(self):
+        super(DiffPrerenderTests, self).tearDown()
+
+        self.siteconfig.set('diffviewer_prerender_enabled', False)
+
+    def test_queue_on_create(self):
+        """Testing DiffSetManager.create_from_data queues pre-rendering"""
+        diffset = self._create_diffset()
+
+        jobs = list(DiffPrerenderJob.objects.all())
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].diffset, diffset)
+        self.assertEqual(jobs[0].interdiffset, None)
+
+    def test_queue_with_disabled(self):
+        """Testing DiffSetManager.create_from_data with pre-rendering
+        disabled
+        """
+        self.siteconfig.set('diffviewer_prerender_enabled', False)
+        self._create_diffset()
+
+        self.assertEqual(DiffPrerenderJob.objects.count(), 0)
+
+    def test_claim_next(self):
+        """Testing DiffPrerenderJobManager.claim_next"""
+        diffset = self.create_diffset(repository=self.repository)
+        job1 = DiffPrerenderJob.objects.queue(diffset)
+        job2 = DiffPrerenderJob.objects.queue(diffset)
+
+        job = DiffPrerenderJob.objects.claim_next()
+        self.assertEqual(job, job1)
+        self.assertNotEqual(job.started, None)
+        self.assertEqual(job.attempts, 1)
+
+        self.assertEqual(DiffPrerenderJob.objects.claim_next(), job2)
+        self.assertEqual(DiffPrerenderJob.objects.claim_next(), None)
+
+        # Abandoned jobs should be claimable again.
+        DiffPrerenderJob.objects.filter(pk=job1.pk).update(
+            started=job.started - timedelta(
+                seconds=DiffPrerenderJob.objects.CLAIM_TIMEOUT_SECS + 1))
+
+        job = DiffPrerenderJob.objects.claim_next()
+        self.assertEqual(job, job1)
+        self.assertEqual(job.attempts, 2)
+
+    def test_get_stats(self):
+        """Testing DiffPrerenderJobManager.get_stats"""
+        diffset = self.create_diffset(repository=self.repository)
+        job = DiffPrerenderJob.objects.queue(diffset)
+        DiffPrerenderJob.objects.queue(diffset)
+        DiffPrerenderJob.objects.claim_next()
+
+        stats = DiffPrerenderJob.objects.get_stats()
+        self.assertEqual(stats['pending'], 1)
+        self.assertEqual(stats['in_progress'], 1)
+        self.assertNotEqual(stats['oldest_timestamp'], None)
+        self.assertTrue(stats['oldest_timestamp'] >= job.timestamp)
+
+    def test_process_next_job(self):
+        """Testing process_next_job"""
+        diffset = self.create_diffset(repository=self.repository)
+        DiffPrerenderJob.objects.queue(diffset)
+
+        spy = self.spy_on(prerender.prerender_diff,
+                          call_fake=lambda *args: 0)
+
+        job = prerender.process_next_job()
+        self.assertEqual(job.diffset, diffset)
+        self.assertTrue(spy.called)
+        self.assertEqual(spy.last_call.args, (diffset, None))
+        self.assertEqual(DiffPrerenderJob.objects.count(), 0)
+        self.assertEqual(prerender.process_next_job(), None)
+
+    def test_process_next_job_with_error(self):
+        """Testing process_next_job with errors pre-rendering"""
+        def _prerender_diff(*args):
+            raise Exception('Oh no')
+
+        diffset = self.create_diffset(repository=self.repository)
+        DiffPrerenderJob.objects.queue(diffset)
+
+        self.spy_on(prerender.prerender_diff, call_fake=_prerender_diff)
+
+        for i in range(prerender.MAX_JOB_ATTEMPTS - 1):
+            prerender.process_next_job()
+
+            job = DiffPrerenderJob.objects.get()
+            self.assertEqual(job.started, None)
+            self.assertEqual(job.attempts, i + 1)
+
+        prerender.process_next_job()
+        self.assertEqual(DiffPrerenderJob.objects.count(), 0)
+
+    def test_prerender_diff(self):
+        """Testing prerender_diff caches the rendered diff"""
+        diffset = self.create_diffset(repository=self.repository)
+        diffset.diffcompat = DEFAULT_DIFF_COMPAT_VERSION
+        diffset.save()
+        self.create_filediff(
+            diffset,
+            source_file='/README',
+            dest_file='/README',
+            source_revision=PRE_CREATION,
+            diff=(b'--- README\n'
+                  b'+++ README\n'
+                  b'@@ -0,0 +1,1 @@\n'
+                  b'+Hello, world!\n'))
+
+        self.assertEqual(prerender.prerender_diff(diffset), 1)
+
+        diff_file = diffutils.get_diff_files(diffset)[0]
+        diffutils.populate_diff_chunks([diff_file])
+        renderer = DiffRenderer(diff_file, collapse_all=True,
+                                highlighting=diffutils.get_enable_highlighting(
+                                    AnonymousUser()))
+
+        self.assertNotEqual(cache.get(make_cache_key(
+                                renderer.make_cache_key())),
+                            None)
+
+    def _create_diffset(self):
+        diff = (
+            b'diff --git a/README b/README\n'
+            b'index d6613f5..5b50866 100644\n'
+            b'--- README\n'
+            b'+++ README\n'
+            b'@ -1,1 +1,1 @@\n'
+            b'-blah..\n'
+            b'+blah blah\n'
+        )
+
+        self.spy_on(self.repository.get_files_exist,
+                    call_fake=_all_files_exist)
+
+        return DiffSet.objects.create_from_data(
+            self.repository, 'diff', diff, None, None, None, '/', None)
+
 
 class UploadDiffFormTests(SpyAgency, TestCase):
     """Unit tests for UploadDiffForm."""
@@ -745,8 +1395,8 @@ class UploadDiffFormTests(SpyAgency, TestCase):
 
         repository = self.create_repository(tool_name='Test')
 
-        self.spy_on(repository.get_file_exists,
-                    call_fake=lambda *args, **kwargs: True)
+        self.spy_on(repository.get_files_exist,
+                    call_fake=_all_files_exist)
 
         form = UploadDiffForm(
             repository=repository,
@@ -768,9 +1418,12 @@ class UploadDiffFormTests(SpyAgency, TestCase):
         """Testing UploadDiffForm and filtering parent diff files"""
         saw_file_exists = {}
 
-        def get_file_exists(repository, filename, revision, *args, **kwargs):
-            saw_file_exists[(filename, revision)] = True
-            return True
+        def get_files_exist(repository, paths_and_revisions, *args,
+                            **kwargs):
+            for filename, revision in paths_and_revisions:
+                saw_file_exists[(filename, revision)] = True
+
+            return [True] * len(paths_and_revisions)
 
         diff = (
             b'diff --git a/README b/README\n'
@@ -807,7 +1460,7 @@ class UploadDiffFormTests(SpyAgency, TestCase):
                                               content_type='text/x-patch')
 
         repository = self.create_repository(tool_name='Test')
-        self.spy_on(repository.get_file_exists, call_fake=get_file_exists)
+        self.spy_on(repository.get_files_exist, call_fake=get_files_exist)
 
         form = UploadDiffForm(
             repository=repository,
@@ -1059,6 +1712,985 @@ class DiffChunkGeneratorTests(TestCase):
         regions = generator._get_line_changed_regions(old, new)
         deep_equal(regions, (None, None))
 
+    def test_get_line_changed_regions_from_markup(self):
+        """Testing get_line_changed_regions with lines of markup"""
+        old = ('<span class="n">submitter</span> = '
+               'models.ForeignKey(Person, verbose_name=&quot;Submitter&quot;)')
+        new = ('<span class="n">submitter</span> = '
+               'models.ForeignKey(User, verbose_name=&quot;Submitter&quot;)')
+
+        self.assertEqual(
+            get_line_changed_regions([1, 1, old, None, 1, new, None, False]),
+            ([(30, 36)], [(30, 34)]))
+
+        # Regions that have already been computed are used as-is.
+        self.assertEqual(
+            get_line_changed_regions([1, 1, old, [], 1, new, [], False]),
+            ([], []))
+
+    def test_compute_chunk_line_regions(self):
+        """Testing compute_chunk_line_regions"""
+        lines = [
+            [1, 1, 'abc = 1', [], 1, 'abc = 1', [], False],
+            [2, 2, 'value = foo(1)', None, 2, 'value = foo(2)', None, False],
+        ]
+
+        self.assertEqual(
+            compute_chunk_line_regions(lines),
+            [
+                [1, 1, 'abc = 1', [], 1, 'abc = 1', [], False],
+                [2, 2, 'value = foo(1)', [(12, 13)], 2, 'value = foo(2)',
+                 [(12, 13)], False],
+            ])
+
+        # The original lines are left alone.
+        self.assertEqual(lines[1][3], None)
+
+
+class PopulateDiffChunksTests(SpyAgency, TestCase):
+    """Unit tests for populate_diff_chunks."""
+    fixtures = ['test_scmtools']
+
+    class DummyChunkGenerator(DiffChunkGenerator):
+        languages = []
+
+        def get_chunks(self):
+            i = int(self.filediff.source_file[len('/file'):])
+            self.languages.append(translation.get_language())
+
+            # Make the earlier files finish last, to make sure the results
+            # are put back in order.
+            time.sleep(0.01 * (5 - i))
+
+            return [
+                {
+                    'change': 'equal',
+                    'meta': {},
+                },
+                {
+                    'change': 'replace',
+                    'meta': {
+                        'filename': self.filediff.source_file,
+                        'whitespace_chunk': i % 2 == 0,
+                    },
+                },
+            ]
+
+    def setUp(self):
+        super(PopulateDiffChunksTests, self).setUp()
+
+        self.old_generator_class = get_diff_chunk_generator_class()
+        set_diff_chunk_generator_class(self.DummyChunkGenerator)
+        self.DummyChunkGenerator.languages = []
+
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+
+        self.files = [
+            {
+                'filediff': self.create_filediff(
+                    diffset,
+                    source_file='/file%d' % i,
+                    dest_file='/file%d' % i),
+                'interfilediff': None,
+                'force_interdiff': False,
+            }
+            for i in range(5)
+        ]
+
+    def tearDown(self):
+        super(PopulateDiffChunksTests, self).tearDown()
+
+        set_diff_chunk_generator_class(self.old_generator_class)
+
+    def test_serial(self):
+        """Testing populate_diff_chunks with max_workers=1"""
+        spy = self.spy_on(diffutils._get_chunks_parallel)
+
+        diffutils.populate_diff_chunks(self.files, max_workers=1)
+
+        self.assertFalse(spy.called)
+        self._check_files()
+
+    def test_parallel(self):
+        """Testing populate_diff_chunks with max_workers > 1"""
+        spy = self.spy_on(diffutils._get_chunks_parallel)
+
+        diffutils.populate_diff_chunks(self.files, max_workers=3)
+
+        self.assertTrue(spy.called)
+        self._check_files()
+
+    def test_parallel_with_language(self):
+        """Testing populate_diff_chunks with max_workers > 1 uses the
+        active language in the workers
+        """
+        translation.activate('fr')
+
+        try:
+            diffutils.populate_diff_chunks(self.files, max_workers=3)
+        finally:
+            translation.deactivate()
+
+        self.assertEqual(self.DummyChunkGenerator.languages,
+                         ['fr'] * len(self.files))
+
+    def _check_files(self):
+        for i, diff_file in enumerate(self.files):
+            self.assertTrue(diff_file['chunks_loaded'])
+            self.assertEqual(diff_file['num_chunks'], 2)
+            self.assertEqual(diff_file['num_changes'], 1)
+            self.assertEqual(diff_file['changed_chunk_indexes'], [1])
+            self.assertEqual(diff_file['whitespace_only'], i % 2 == 0)
+            self.assertEqual(diff_file['chunks'][1]['meta']['filename'],
+                             diff_file['filediff'].source_file)
+
+
+class ChunkCacheTests(SpyAgency, TestCase):
+    """Unit tests for caching chunks individually."""
+    fixtures = ['test_scmtools']
+
+    class DummyChunkGenerator(DiffChunkGenerator):
+        num_generated = 0
+
+        def _get_chunks_uncached(self):
+            self.__class__.num_generated += 1
+
+            for i, change in enumerate(('equal', 'replace', 'equal')):
+                lines = [
+                    [j, j, 'line %d' % j, [], j, 'line %d' % j, [], False]
+                    for j in range(i * 10 + 1, i * 10 + 11)
+                ]
+
+                yield {
+                    'index': i,
+                    'lines': lines,
+                    'numlines': len(lines),
+                    'change': change,
+                    'collapsable': False,
+                    'meta': {
+                        'left_headers': [],
+                        'right_headers': [],
+                    },
+                }
+
+    def setUp(self):
+        super(ChunkCacheTests, self).setUp()
+
+        cache.clear()
+
+        self.old_generator_class = get_diff_chunk_generator_class()
+        set_diff_chunk_generator_class(self.DummyChunkGenerator)
+        self.DummyChunkGenerator.num_generated = 0
+
+        repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=repository)
+        self.filediff = self.create_filediff(self.diffset)
+
+    def tearDown(self):
+        super(ChunkCacheTests, self).tearDown()
+
+        set_diff_chunk_generator_class(self.old_generator_class)
+
+    def test_get_chunks(self):
+        """Testing DiffChunkGenerator.get_chunks loads individual chunks
+        from the cache
+        """
+        chunks = self.DummyChunkGenerator(None, self.filediff).get_chunks()
+        self.assertEqual(len(chunks), 3)
+
+        generator = self.DummyChunkGenerator(None, self.filediff)
+        self.assertEqual(generator.get_chunks([2, 1]),
+                         [chunks[2], chunks[1]])
+        self.assertEqual(generator.get_chunks(), chunks)
+        self.assertEqual(self.DummyChunkGenerator.num_generated, 1)
+
+    def test_get_chunks_with_missing_chunk(self):
+        """Testing DiffChunkGenerator.get_chunks with a chunk missing from
+        the cache
+        """
+        generator = self.DummyChunkGenerator(None, self.filediff)
+        chunks = generator.get_chunks()
+        cache.delete(make_cache_key('%s-chunk-1-0'
+                                    % generator.make_cache_key()))
+
+        generator = self.DummyChunkGenerator(None, self.filediff)
+        self.assertEqual(generator.get_chunks([1]), [chunks[1]])
+        self.assertEqual(self.DummyChunkGenerator.num_generated, 2)
+
+    def test_get_chunk_index(self):
+        """Testing DiffChunkGenerator.get_chunk_index"""
+        index = self.DummyChunkGenerator(None, self.filediff).get_chunk_index()
+
+        self.assertEqual(index['num_chunks'], 3)
+        self.assertEqual(
+            [
+                (chunk_info['change'], chunk_info['first_line'],
+                 chunk_info['last_line'])
+                for chunk_info in index['chunks']
+            ],
+            [('equal', 1, 10), ('replace', 11, 20), ('equal', 21, 30)])
+
+        # The index alone should come from the cache.
+        generator = self.DummyChunkGenerator(None, self.filediff)
+        self.assertEqual(generator.get_chunk_index(), index)
+        self.assertEqual(self.DummyChunkGenerator.num_generated, 1)
+
+    def test_pack_chunk(self):
+        """Testing pack_chunk and unpack_chunk"""
+        chunk = {
+            'index': 3,
+            'change': 'replace',
+            'collapsable': False,
+            'numlines': 3,
+            'meta': {
+                'whitespace_lines': [(1, 1)],
+            },
+            'lines': [
+                [1, 10, mark_safe('<span>a</span>'), [(0, 1), (3, 4)],
+                 12, mark_safe('<span>b</span>'), [(2, 5)], True],
+                [2, '', mark_safe(''), None, 13, mark_safe('\u00e9t\u00e9'),
+                 None, False, {'from': 40}],
+                [3, 11, mark_safe('<span>a</span>'), [], '', mark_safe(''),
+                 [], False, {'to': 20}],
+            ],
+        }
+
+        data = chunk_cache.pack_chunk(chunk)
+        self.assertEqual(data[:1], chunk_cache.CHUNK_FORMAT_PACKED)
+
+        new_chunk = chunk_cache.unpack_chunk(data)
+        self.assertTrue(isinstance(new_chunk['lines'],
+                                   chunk_cache.PackedChunkLines))
+        self.assertEqual(new_chunk, chunk)
+        self.assertEqual(list(new_chunk['lines']), chunk['lines'])
+        self.assertEqual(new_chunk['lines'][1:], chunk['lines'][1:])
+        self.assertEqual(new_chunk['lines'][-1], chunk['lines'][-1])
+        self.assertTrue(isinstance(new_chunk['lines'][0][2], SafeText))
+
+    def test_pack_chunk_with_unpackable_lines(self):
+        """Testing pack_chunk with lines that can't be packed"""
+        chunk = {
+            'change': 'equal',
+            'lines': [['1', '1', b'abc', [], '1', b'abc', [], False]],
+        }
+
+        data = chunk_cache.pack_chunk(chunk)
+        self.assertEqual(data[:1], chunk_cache.CHUNK_FORMAT_PICKLED)
+        self.assertEqual(chunk_cache.unpack_chunk(data), chunk)
+
+    def test_unpack_chunk_with_unknown_format(self):
+        """Testing unpack_chunk with data in an unknown format"""
+        self.assertEqual(chunk_cache.unpack_chunk(b'x\x9cabc'), None)
+
+    def test_get_chunk_cache_stats(self):
+        """Testing get_chunk_cache_stats"""
+        self.DummyChunkGenerator(None, self.filediff).get_chunks()
+        self.DummyChunkGenerator(None, self.filediff).get_chunks([0, 1])
+
+        stats = chunk_cache.get_chunk_cache_stats()
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(stats['chunks'], 3)
+        self.assertEqual(stats['loads'], 2)
+        self.assertTrue(stats['bytes'] > 0)
+        self.assertEqual(stats['bytes_per_file'], stats['bytes'])
+
+    def test_populate_diff_chunk(self):
+        """Testing populate_diff_chunk"""
+        diff_file = diffutils.get_diff_files(self.diffset)[0]
+        diffutils.populate_diff_chunk(diff_file, 1)
+
+        self.assertTrue(diff_file['chunks_loaded'])
+        self.assertEqual(len(diff_file['chunks']), 1)
+        self.assertEqual(diff_file['chunks'][0]['index'], 1)
+        self.assertEqual(diff_file['num_chunks'], 3)
+        self.assertEqual(diff_file['changed_chunk_indexes'], [1])
+        self.assertEqual(diff_file['num_changes'], 1)
+        self.assertFalse(diff_file['whitespace_only'])
+
+        renderer = DiffRenderer(diff_file, chunk_index=1)
+        context = renderer.make_context()
+        self.assertEqual(len(context['file']['chunks']), 1)
+        self.assertEqual(context['file']['chunks'][0]['change'], 'replace')
+
+    def test_get_file_chunks_in_range(self):
+        """Testing get_file_chunks_in_range loads only the chunks in range"""
+        self.DummyChunkGenerator(None, self.filediff).get_chunks()
+
+        spy = self.spy_on(chunk_cache.get_cached_chunks)
+
+        chunks = list(diffutils.get_file_chunks_in_range(
+            {'user': AnonymousUser()}, self.filediff, None, 18, 5))
+
+        self.assertEqual(spy.last_call.args[2], [1, 2])
+        self.assertEqual(len(chunks), 2)
+        self.assertEqual([line[0] for line in chunks[0]['lines']],
+                         [18, 19, 20])
+        self.assertEqual([line[0] for line in chunks[1]['lines']],
+                         [21, 22])
+        self.assertEqual(self.DummyChunkGenerator.num_generated, 1)
+
+
+class FileCacheTests(SpyAgency, TestCase):
+    """Unit tests for caching original files by their contents."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(FileCacheTests, self).setUp()
+
+        cache.clear()
+
+        self.repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=self.repository)
+
+    def test_get_original_file_cached(self):
+        """Testing get_original_file caches normalized files"""
+        filediff = self.create_filediff(self.diffset)
+        self._set_repository_file(filediff, b'line 1\r\nline 2\r\n')
+
+        self.spy_on(diffutils.convert_line_endings)
+
+        self.assertEqual(diffutils.get_original_file(filediff),
+                         b'line 1\nline 2\n')
+        self.assertEqual(diffutils.get_original_file(filediff),
+                         b'line 1\nline 2\n')
+        self.assertEqual(len(diffutils.convert_line_endings.spy.calls), 1)
+
+        stats = file_cache.get_file_cache_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(stats['hit_rate'], 50)
+
+    def test_get_original_file_shares_contents(self):
+        """Testing get_original_file stores files with the same contents
+        once
+        """
+        filediff1 = self.create_filediff(self.diffset, source_file='/foo')
+        filediff2 = self.create_filediff(self.diffset, source_file='/bar')
+        self._set_repository_file(filediff1, b'line 1\r\n')
+        self._set_repository_file(filediff2, b'line 1\n')
+
+        self.assertEqual(diffutils.get_original_file(filediff1),
+                         b'line 1\n')
+        self.assertEqual(diffutils.get_original_file(filediff2),
+                         b'line 1\n')
+
+        stats = file_cache.get_file_cache_stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['files'], 1)
+        self.assertEqual(stats['duplicates'], 1)
+
+    def test_get_original_file_pre_creation(self):
+        """Testing get_original_file doesn't cache new files"""
+        filediff = self.create_filediff(self.diffset,
+                                        source_revision=PRE_CREATION)
+
+        self.assertEqual(diffutils.get_original_file(filediff), b'')
+        self.assertEqual(file_cache.get_file_cache_stats()['misses'], 0)
+
+    def test_get_cached_file_with_missing_contents(self):
+        """Testing get_cached_file with contents missing from the cache"""
+        file_cache.cache_file('my-file', b'x' * 100)
+        self.assertEqual(file_cache.get_cached_file('my-file'), b'x' * 100)
+
+        cache.delete(file_cache._make_contents_part_key(
+            hashlib.sha1(b'x' * 100).hexdigest(), 0))
+        self.assertEqual(file_cache.get_cached_file('my-file'), None)
+
+    def test_cache_file_with_evicted_part(self):
+        """Testing cache_file stores contents again when a part was evicted"""
+        content_hash = hashlib.sha1(b'x' * 100).hexdigest()
+
+        file_cache.cache_file('my-file', b'x' * 100)
+        cache.delete(file_cache._make_contents_part_key(content_hash, 0))
+
+        file_cache.cache_file('my-file', b'x' * 100)
+        self.assertEqual(file_cache.get_cached_file('my-file'), b'x' * 100)
+
+        stats = file_cache.get_file_cache_stats()
+        self.assertEqual(stats['files'], 2)
+        self.assertEqual(stats['duplicates'], 0)
+
+    def _set_repository_file(self, filediff, data):
+        cache_memoize(
+            self.repository._make_file_cache_key(filediff.source_file,
+                                                 filediff.source_revision,
+                                                 None),
+            lambda: [data],
+            large_data=True)
+
+
+class PrefetchOriginalFilesTests(SpyAgency, TestCase):
+    """Unit tests for prefetch_original_files."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(PrefetchOriginalFilesTests, self).setUp()
+
+        cache.clear()
+
+        self.repository = self.create_repository(tool_name='Git')
+        self.diffset = self.create_diffset(repository=self.repository)
+
+    def test_prefetch_original_files(self):
+        """Testing prefetch_original_files fetches uncached files at once"""
+        filediffs = [
+            self.create_filediff(self.diffset, source_file='readme',
+                                 source_revision=revision)
+            for revision in ('e965047', 'd6613f5', PRE_CREATION, 'fffffff',
+                             'e965047')
+        ]
+        cached_filediff = self.create_filediff(self.diffset,
+                                               source_file='cached',
+                                               source_revision='123')
+        file_cache.cache_file(
+            diffutils._make_original_file_cache_key(cached_filediff),
+            b'cached\n')
+
+        self.spy_on(self.repository.get_files)
+        diffutils.prefetch_original_files(filediffs + [cached_filediff])
+
+        self.assertEqual(len(self.repository.get_files.spy.calls), 1)
+        self.assertEqual(self.repository.get_files.spy.calls[0].args[0],
+                         [('readme', 'e965047'), ('readme', 'd6613f5'),
+                          ('readme', 'fffffff')])
+
+        # The files that were found are now in the cache.
+        self.spy_on(self.repository._get_file_uncached)
+
+        self.assertEqual(diffutils.get_original_file(filediffs[0]),
+                         b'Hello\n')
+        self.assertEqual(diffutils.get_original_file(filediffs[1]),
+                         b'Hello there\n')
+        self.assertEqual(diffutils.get_original_file(cached_filediff),
+                         b'cached\n')
+        self.assertFalse(self.repository._get_file_uncached.spy.called)
+
+
+class InterdiffResultTests(SpyAgency, TestCase):
+    """Unit tests for storing the results of interdiffs."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(InterdiffResultTests, self).setUp()
+
+        cache.clear()
+
+        self.repository = self.create_repository(tool_name='Test')
+
+        def get_original_file(filediff, request=None):
+            return b'line 1\nline 2\nline 3\n'
+
+        def get_patched_file(buffer, filediff, request=None):
+            return buffer.replace(b'line 2', b'line 2 (%s)'
+                                  % filediff.dest_detail)
+
+        self.spy_on(diffutils.get_original_file,
+                    call_fake=get_original_file)
+        self.spy_on(diffutils.get_patched_file,
+                    call_fake=get_patched_file)
+
+    def test_stores_result(self):
+        """Testing DiffChunkGenerator stores and reuses interdiff results
+        for FileDiffs with the same contents
+        """
+        self.spy_on(chunk_generator.get_diff_opcode_generator)
+
+        filediff1, interfilediff1 = self._create_filediffs()
+        chunks1 = DiffChunkGenerator(None, filediff1, interfilediff1,
+                                     True).get_chunks()
+
+        self.assertEqual(InterdiffResult.objects.count(), 1)
+        self.assertEqual(
+            len(chunk_generator.get_diff_opcode_generator.spy.calls), 1)
+
+        # Only the opcodes and interesting lines are stored. The files are
+        # fetched through the file cache.
+        key = InterdiffResult.objects.make_key(filediff1, interfilediff1,
+                                               True)
+        self.assertEqual(
+            sorted(InterdiffResult.objects.get_result(key)),
+            ['interesting_lines', 'opcodes'])
+
+        # New FileDiffs with the same contents, with nothing in the cache,
+        # should use the stored result.
+        cache.clear()
+        filediff2, interfilediff2 = self._create_filediffs()
+        chunks2 = DiffChunkGenerator(None, filediff2, interfilediff2,
+                                     True).get_chunks()
+
+        self.assertEqual(InterdiffResult.objects.count(), 1)
+        self.assertEqual(
+            len(chunk_generator.get_diff_opcode_generator.spy.calls), 1)
+        self.assertEqual(chunks1, chunks2)
+
+    def test_make_key(self):
+        """Testing InterdiffResultManager.make_key"""
+        filediff1, interfilediff1 = self._create_filediffs()
+        filediff2, interfilediff2 = self._create_filediffs()
+        filediff3, interfilediff3 = self._create_filediffs(
+            interdiff=b'other diff')
+
+        key = InterdiffResult.objects.make_key(filediff1, interfilediff1,
+                                               True)
+
+        self.assertEqual(
+            InterdiffResult.objects.make_key(filediff2, interfilediff2, True),
+            key)
+        self.assertNotEqual(
+            InterdiffResult.objects.make_key(filediff1, interfilediff1,
+                                             False),
+            key)
+        self.assertNotEqual(
+            InterdiffResult.objects.make_key(filediff3, interfilediff3, True),
+            key)
+
+    def test_get_result_with_bad_data(self):
+        """Testing InterdiffResultManager.get_result with bad data"""
+        InterdiffResult.objects.store_result('abc123', {'old': 'foo'})
+        self.assertEqual(InterdiffResult.objects.get_result('abc123'),
+                         {'old': 'foo'})
+
+        InterdiffResult.objects.filter(pk='abc123').update(data='')
+        self.assertEqual(InterdiffResult.objects.get_result('abc123'), None)
+        self.assertEqual(InterdiffResult.objects.get_result('def456'), None)
+
+    def test_prune_expired_results(self):
+        """Testing InterdiffResultManager prunes expired results"""
+        expired = timezone.now() - timedelta(
+            days=InterdiffResult.objects.MAX_RESULT_AGE_DAYS + 1)
+
+        InterdiffResult.objects.store_result('abc123', {'old': 'foo'})
+        InterdiffResult.objects.store_result('def456', {'old': 'bar'})
+        InterdiffResult.objects.store_result('ghi789', {'old': 'baz'})
+        InterdiffResult.objects.filter(pk__in=['abc123', 'def456']).update(
+            timestamp=expired)
+
+        self.assertEqual(InterdiffResult.objects.get_result('abc123'), None)
+
+        # Storing a result only replaces an expired result for its own key.
+        InterdiffResult.objects.store_result('abc123', {'old': 'new foo'})
+        self.assertEqual(InterdiffResult.objects.get_result('abc123'),
+                         {'old': 'new foo'})
+        self.assertEqual(InterdiffResult.objects.count(), 3)
+
+        call_command('prune-interdiff-results', verbosity=0)
+
+        self.assertEqual(
+            sorted(InterdiffResult.objects.values_list('pk', flat=True)),
+            ['abc123', 'ghi789'])
+
+    def _create_filediffs(self, interdiff=b'new diff'):
+        diffset = self.create_diffset(repository=self.repository)
+        interdiffset = self.create_diffset(repository=self.repository,
+                                           revision=2)
+        diffset.diffcompat = DEFAULT_DIFF_COMPAT_VERSION
+        interdiffset.diffcompat = DEFAULT_DIFF_COMPAT_VERSION
+
+        filediff = self.create_filediff(diffset, dest_detail='old',
+                                        diff=b'old diff')
+        interfilediff = self.create_filediff(interdiffset, dest_detail='new',
+                                             diff=interdiff)
+
+        return filediff, interfilediff
+
+
+class RenderBudgetTests(SpyAgency, TestCase):
+    """Unit tests for limiting chunk generation to a render time budget."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(RenderBudgetTests, self).setUp()
+
+        cache.clear()
+
+        self.siteconfig = SiteConfiguration.objects.get_current()
+        self.siteconfig.set('diffviewer_prerender_enabled', True)
+
+        repository = self.create_repository(tool_name='Test')
+        self.diffset = self.create_diffset(repository=repository)
+        self.diffset.diffcompat = DEFAULT_DIFF_COMPAT_VERSION
+        self.filediff = self.create_filediff(self.diffset,
+                                             source_file='/foo.py',
+                                             dest_file='/foo.py')
+
+        def get_original_file(filediff, request=None):
+            return (b'def foo():\n'
+                    b'    return 1\n'
+                    b'\n'
+                    b'def bar():\n'
+                    b'    return 2\n')
+
+        def get_patched_file(buffer, filediff, request=None):
+            return buffer.replace(b'return 1', b'return 100')
+
+        self.spy_on(diffutils.get_original_file,
+                    call_fake=get_original_file)
+        self.spy_on(diffutils.get_patched_file,
+                    call_fake=get_patched_file)
+
+    def tearDown(self):
+        super(RenderBudgetTests, self).tearDown()
+
+        self.siteconfig.set('diffviewer_prerender_enabled', False)
+
+    def test_render_budget(self):
+        """Testing RenderBudget"""
+        budget = RenderBudget()
+        self.assertFalse(budget.is_exhausted())
+        self.assertTrue(budget.can_run_stage(STAGE_INTRALINE))
+        self.assertEqual(budget.degraded, set())
+
+        budget = RenderBudget(-1)
+        self.assertTrue(budget.is_exhausted())
+        self.assertFalse(budget.can_run_stage(STAGE_INTRALINE))
+        self.assertEqual(budget.degraded, set([STAGE_INTRALINE]))
+
+    def test_get_chunks(self):
+        """Testing DiffChunkGenerator.get_chunks within the render time
+        budget
+        """
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    render_time_budget=60).get_chunks()
+
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[1]['change'], 'replace')
+        self.assertNotIn('degraded', chunks[1]['meta'])
+        self.assertEqual(chunks[1]['lines'][0][3], None)
+        self.assertIn('<span', chunks[1]['lines'][0][2])
+        self.assertEqual(DiffPrerenderJob.objects.count(), 0)
+
+    def test_get_chunks_with_budget_exhausted(self):
+        """Testing DiffChunkGenerator.get_chunks with the render time
+        budget exhausted
+        """
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    render_time_budget=-1).get_chunks()
+
+        self.assertEqual(len(chunks), 3)
+
+        for chunk in chunks:
+            self.assertEqual(chunk['meta']['degraded'],
+                             [STAGE_INTRALINE, STAGE_MOVE_DETECTION,
+                              STAGE_SYNTAX_HIGHLIGHTING])
+
+        # The diff is still shown, without highlighting.
+        line = chunks[1]['lines'][0]
+        self.assertEqual(line[2], '    return 1')
+        self.assertEqual(line[3], [])
+        self.assertEqual(line[5], '    return 100')
+        self.assertEqual(line[6], [])
+
+        # The full render is queued, only once.
+        DiffChunkGenerator(None, self.filediff,
+                           render_time_budget=-1)._generate_and_cache_chunks()
+
+        jobs = list(DiffPrerenderJob.objects.all())
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].diffset, self.diffset)
+        self.assertEqual(jobs[0].interdiffset, None)
+
+    def test_get_chunks_with_budget_exhausted_no_prerender(self):
+        """Testing DiffChunkGenerator.get_chunks with the render time
+        budget exhausted and pre-rendering disabled caches degraded chunks
+        briefly
+        """
+        self.siteconfig.set('diffviewer_prerender_enabled', False)
+        self.spy_on(chunk_generator.cache_chunks)
+
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    render_time_budget=-1).get_chunks()
+        self.assertIn('degraded', chunks[0]['meta'])
+        self.assertEqual(DiffPrerenderJob.objects.count(), 0)
+
+        calls = chunk_generator.cache_chunks.spy.calls
+        self.assertEqual(calls[0].kwargs['expiration'],
+                         chunk_generator.DEGRADED_CHUNKS_EXPIRATION_TIME)
+
+        # Chunks that aren't degraded are cached as usual.
+        DiffChunkGenerator(None, self.filediff,
+                           render_time_budget=0).get_chunks()
+        self.assertEqual(calls[1].kwargs['expiration'],
+                         CACHE_EXPIRATION_TIME)
+
+    def test_get_chunks_replaces_degraded(self):
+        """Testing DiffChunkGenerator.get_chunks without a render time
+        budget replaces degraded chunks in the cache
+        """
+        generator = DiffChunkGenerator(None, self.filediff,
+                                       render_time_budget=-1)
+        generator.get_chunks()
+        self.assertEqual(generator.get_chunk_index()['degraded'],
+                         [STAGE_INTRALINE, STAGE_MOVE_DETECTION,
+                              STAGE_SYNTAX_HIGHLIGHTING])
+
+        # Degraded chunks are used when there's a budget.
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    render_time_budget=60).get_chunks()
+        self.assertIn('degraded', chunks[0]['meta'])
+        self.assertEqual(len(diffutils.get_original_file.spy.calls), 1)
+
+        # They're replaced when rendering in full.
+        chunks = DiffChunkGenerator(None, self.filediff,
+                                    render_time_budget=0).get_chunks()
+        self.assertNotIn('degraded', chunks[0]['meta'])
+        self.assertEqual(len(diffutils.get_original_file.spy.calls), 2)
+
+        index = DiffChunkGenerator(None, self.filediff,
+                                   render_time_budget=60).get_chunk_index()
+        self.assertEqual(index['degraded'], [])
+
+    def test_move_detection_with_budget_exhausted(self):
+        """Testing DiffOpcodeGenerator skips move detection with the render
+        time budget exhausted
+        """
+        old = ['this is line 1, and it is sufficiently long',
+               '-------------------------------------------',
+               '-------------------------------------------',
+               'this is line 2, and it is sufficiently long']
+        new = ['this is line 2, and it is sufficiently long',
+               '-------------------------------------------',
+               '-------------------------------------------',
+               'this is line 1, and it is sufficiently long']
+
+        differ = MyersDiffer(old, new)
+        budget = RenderBudget(-1)
+        opcodes = list(get_diff_opcode_generator(differ,
+                                                 render_budget=budget))
+
+        for opcode in opcodes:
+            self.assertNotIn('moved-from', opcode[5])
+            self.assertNotIn('moved-to', opcode[5])
+
+        self.assertEqual(budget.degraded, set([STAGE_MOVE_DETECTION]))
+
+        opcodes = list(get_diff_opcode_generator(MyersDiffer(old, new)))
+        self.assertTrue(any('moved-from' in opcode[5] for opcode in opcodes))
+
+
+class DiffStageTimingTests(SpyAgency, TestCase):
+    """Unit tests for timing the stages of the diff pipeline."""
+    fixtures = ['test_scmtools']
+
+    def setUp(self):
+        super(DiffStageTimingTests, self).setUp()
+
+        initialize()
+        cache.clear()
+
+        repository = self.create_repository(tool_name='Test')
+        diffset = self.create_diffset(repository=repository)
+        self.filediff = self.create_filediff(diffset)
+
+    def tearDown(self):
+        super(DiffStageTimingTests, self).tearDown()
+
+        timing.set_stage_timings(None)
+
+    def test_time_stage(self):
+        """Testing time_stage"""
+        # Nothing is recorded unless timings are being collected.
+        with timing.time_stage(timing.STAGE_FETCH, self.filediff):
+            pass
+
+        timings = timing.start_stage_timings()
+
+        with timing.time_stage(timing.STAGE_FETCH,
+                               self.filediff) as stage_info:
+            stage_info.update(num_bytes=100, cache_hit=True)
+
+        with timing.time_stage(timing.STAGE_FETCH,
+                               self.filediff) as stage_info:
+            stage_info.update(num_bytes=50, cache_hit=False)
+
+        with timing.time_stage(timing.STAGE_PATCH, self.filediff):
+            pass
+
+        entries = sorted(timings.get_entries(),
+                         key=lambda entry: entry['stage'])
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]['stage'], timing.STAGE_FETCH)
+        self.assertEqual(entries[0]['filediff_id'], self.filediff.pk)
+        self.assertEqual(entries[0]['repository_id'],
+                         self.filediff.diffset.repository_id)
+        self.assertEqual(entries[0]['count'], 2)
+        self.assertEqual(entries[0]['bytes'], 150)
+        self.assertEqual(entries[0]['hits'], 1)
+        self.assertEqual(entries[0]['misses'], 1)
+        self.assertEqual(entries[1]['stage'], timing.STAGE_PATCH)
+        self.assertEqual(entries[1]['count'], 1)
+
+        self.assertEqual(
+            [total['stage'] for total in timings.get_summary()],
+            [timing.STAGE_FETCH, timing.STAGE_PATCH])
+
+        self.assertTrue(re.match(
+            r'^fetch;dur=\d+\.\d;desc="files=1 bytes=150 hits=1 misses=1", '
+            r'patch;dur=\d+\.\d;desc="files=1 bytes=0"$',
+            timings.get_server_timing()))
+
+    def test_get_stage_timing_stats(self):
+        """Testing record_stage_samples and get_stage_timing_stats"""
+        for i in range(1, 101):
+            timings = timing.DiffStageTimings()
+            timings.add(timing.STAGE_DIFF, self.filediff, i / 1000.0)
+            timing.record_stage_samples(timings)
+
+        repository_id = self.filediff.diffset.repository_id
+
+        for stats in (timing.get_stage_timing_stats(),
+                      timing.get_stage_timing_stats(repository_id)):
+            self.assertEqual(len(stats), 1)
+            self.assertEqual(stats[0]['stage'], timing.STAGE_DIFF)
+            self.assertEqual(stats[0]['samples'], 100)
+            self.assertEqual(stats[0]['p50'], 50)
+            self.assertEqual(stats[0]['p90'], 90)
+            self.assertEqual(stats[0]['p99'], 99)
+            self.assertEqual(stats[0]['max'], 100)
+
+        self.assertEqual(timing.get_stage_timing_stats(repository_id + 1),
+                         [])
+        self.assertEqual(timing.get_stage_timing_repository_ids(),
+                         [repository_id])
+
+    def test_pipeline(self):
+        """Testing timing the stages of generating and rendering a diff"""
+        diffset = self.filediff.diffset
+        diffset.diffcompat = DEFAULT_DIFF_COMPAT_VERSION
+        diffset.save()
+        filediff = self.create_filediff(
+            diffset,
+            source_file='/README',
+            dest_file='/README',
+            source_revision=PRE_CREATION,
+            diff=(b'--- README\n'
+                  b'+++ README\n'
+                  b'@@ -0,0 +1,1 @@\n'
+                  b'+Hello, world!\n'))
+
+        timings = timing.start_stage_timings()
+
+        diff_file = diffutils.get_diff_files(diffset, filediff)[0]
+        diffutils.populate_diff_chunks([diff_file])
+        DiffRenderer(diff_file).render_to_string()
+
+        stages = set(
+            entry['stage']
+            for entry in timings.get_entries()
+            if entry['filediff_id'] == filediff.pk
+        )
+
+        self.assertTrue(stages.issuperset([
+            timing.STAGE_FETCH, timing.STAGE_PATCH, timing.STAGE_DIFF,
+            timing.STAGE_MOVE_DETECTION, timing.STAGE_RENDER,
+        ]))
+
+
+class HighlightingTests(SpyAgency, TestCase):
+    """Unit tests for syntax highlighting of diffed files."""
+    def setUp(self):
+        super(HighlightingTests, self).setUp()
+
+        highlighting._lexer_classes.clear()
+        cache.clear()
+
+        self.old = ''.join(
+            'def func_%d(value):\n'
+            '    """Returns value %d."""\n'
+            '    return value + %d\n'
+            '\n'
+            % (i, i, i)
+            for i in range(100)
+        )
+
+    def test_get_lexer_for_file_caches_class(self):
+        """Testing get_lexer_for_file looks up lexers once per extension"""
+        self.spy_on(highlighting.get_lexer_for_filename)
+
+        lexer1 = highlighting.get_lexer_for_file('foo/bar.py')
+        lexer2 = highlighting.get_lexer_for_file('baz.py')
+
+        self.assertEqual(type(lexer1), type(lexer2))
+        self.assertEqual(lexer1.__class__.__name__, 'PythonLexer')
+        self.assertEqual(
+            len(highlighting.get_lexer_for_filename.spy.calls), 1)
+
+    def test_get_lexer_for_file_special_filenames(self):
+        """Testing get_lexer_for_file with special filename patterns"""
+        self.assertEqual(
+            highlighting.get_lexer_for_file('CMakeLists.txt')
+            .__class__.__name__,
+            'CMakeLexer')
+        self.assertEqual(
+            highlighting.get_lexer_for_file('foo.txt').__class__.__name__,
+            'TextLexer')
+
+    def test_get_lexer_for_file_not_found(self):
+        """Testing get_lexer_for_file with unknown file types"""
+        self.assertRaises(highlighting.ClassNotFound,
+                          highlighting.get_lexer_for_file, 'foo.unknown-ext')
+        self.assertRaises(highlighting.ClassNotFound,
+                          highlighting.get_lexer_for_file, 'foo.unknown-ext')
+
+    def test_highlight_file_cached(self):
+        """Testing highlight_file caches by file contents"""
+        self.spy_on(highlighting._highlight_lines)
+        lexer = highlighting.get_lexer_for_file('foo.py')
+
+        markup1 = highlighting.highlight_file(self.old, lexer)
+        markup2 = highlighting.highlight_file(self.old, lexer)
+
+        self.assertEqual(markup1, markup2)
+        self.assertEqual(len(markup1), len(self.old.splitlines()))
+        self.assertEqual(len(highlighting._highlight_lines.spy.calls), 1)
+
+    def test_highlight_files_incremental(self):
+        """Testing highlight_files highlights new files incrementally"""
+        lines = self.old.splitlines(True)
+        lines[50:52] = ['    # Changed\n', '    return value * 2\n',
+                        '    """Added string."""\n']
+        lines.insert(200, '# Added comment\n')
+        new = ''.join(lines)
+
+        self.spy_on(highlighting._highlight_lines)
+
+        old_markup, new_markup = highlighting.highlight_files(
+            self.old, new, 'foo.py', 'foo.py')
+
+        # Only the old file should have been fully highlighted.
+        self.assertEqual(len(highlighting._highlight_lines.spy.calls), 1)
+
+        lexer = highlighting.get_lexer_for_file('foo.py')
+        self.assertEqual(old_markup,
+                         highlighting._highlight_lines(self.old, lexer))
+        self.assertEqual(new_markup,
+                         highlighting._highlight_lines(new, lexer))
+
+    def test_highlight_files_incremental_falls_back(self):
+        """Testing highlight_files falls back to full highlighting when
+        the lexer is out of sync
+        """
+        # Opening a docstring that isn't closed changes the highlighting
+        # of the rest of the file.
+        lines = self.old.splitlines(True)
+        lines.insert(20, '"""\n')
+        new = ''.join(lines)
+
+        old_markup, new_markup = highlighting.highlight_files(
+            self.old, new, 'foo.py', 'foo.py')
+
+        lexer = highlighting.get_lexer_for_file('foo.py')
+        self.assertEqual(new_markup,
+                         highlighting._highlight_lines(new, lexer))
+
+    def test_highlight_files_unknown_type(self):
+        """Testing highlight_files with unknown file types"""
+        self.assertEqual(
+            highlighting.highlight_files('a\n', 'b\n', 'foo.unknown-ext',
+                                         'foo.unknown-ext'),
+            (None, None))
+
 
 class DiffRendererTests(SpyAgency, TestCase):
     """Unit tests for DiffRenderer."""
@@ -0,0 +1,313 @@
+from __future__ import unicode_literals
+
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+from djblets.cache.backend import make_cache_key
+from djblets.util.compat import six
+
+from reviewboard.diffviewer.budget import STAGE_INTRALINE, STAGE_MOVE_DETECTION
+from reviewboard.diffviewer.cache_utils import CACHE_EXPIRATION_TIME
+
+
+# The stages of the diff pipeline that are timed, in order. Move detection
+# and computing changes within lines share their names with the stages
+# that can be skipped to fit within a render time budget.
+STAGE_FETCH = 'fetch'
+STAGE_PATCH = 'patch'
+STAGE_DIFF = 'diff'
+STAGE_HIGHLIGHTING = 'highlighting'
+STAGE_RENDER = 'render'
+
+STAGES = (STAGE_FETCH, STAGE_PATCH, STAGE_DIFF, STAGE_MOVE_DETECTION,
+          STAGE_HIGHLIGHTING, STAGE_INTRALINE, STAGE_RENDER)
+
+# The number of most recent samples kept for each stage, for computing
+# percentiles.
+MAX_STAGE_SAMPLES = 500
+
+_local = threading.local()
+
+
+class DiffStageTimings(object):
+    """Timings for the stages of the diff pipeline in a request.
+
+    Each stage is timed separately for each FileDiff, along with the number
+    of bytes processed and whether the results came from the cache, where
+    those apply. Stages may be timed more than once for a FileDiff (for
+    instance, when fetching both the file and the interdiff's file), in
+    which case the values are added together.
+
+    Stages can overlap. Rendering a diff includes computing the changes
+    within lines, for example.
+    """
+    def __init__(self):
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, filediff, secs, num_bytes=None, cache_hit=None):
+        """Adds a timing for a stage of the pipeline for a FileDiff."""
+        if filediff:
+            key = (stage, filediff.pk)
+        else:
+            key = (stage, None)
+
+        with self._lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                entry = {
+                    'stage': stage,
+                    'filediff_id': key[1],
+                    'repository_id': None,
+                    'count': 0,
+                    'secs': 0,
+                    'bytes': 0,
+                    'hits': 0,
+                    'misses': 0,
+                }
+
+                if filediff:
+                    entry['repository_id'] = filediff.diffset.repository_id
+
+                self.entries[key] = entry
+
+            entry['count'] += 1
+            entry['secs'] += secs
+
+            if num_bytes:
+                entry['bytes'] += num_bytes
+
+            if cache_hit is True:
+                entry['hits'] += 1
+            elif cache_hit is False:
+                entry['misses'] += 1
+
+    def get_entries(self):
+        """Returns the timings for each stage for each FileDiff.
+
+        Each entry is a dictionary containing the ``stage``, the
+        ``filediff_id`` and ``repository_id``, the ``count`` of times the
+        stage ran, the total ``secs`` and ``bytes``, and the number of
+        cache ``hits`` and ``misses``.
+        """
+        with self._lock:
+            return [
+                dict(entry)
+                for entry in six.itervalues(self.entries)
+            ]
+
+    def get_summary(self):
+        """Returns the timings for each stage, across all FileDiffs.
+
+        This returns a list of dictionaries, in the order of STAGES,
+        containing the ``stage``, the number of ``files`` and the ``count``
+        of times it ran, the total ``secs`` and ``bytes``, and the number of
+        cache ``hits`` and ``misses``. Stages that didn't run are left out.
+        """
+        totals = {}
+
+        for entry in self.get_entries():
+            total = totals.setdefault(entry['stage'], {
+                'stage': entry['stage'],
+                'files': 0,
+                'count': 0,
+                'secs': 0,
+                'bytes': 0,
+                'hits': 0,
+                'misses': 0,
+            })
+
+            total['files'] += 1
+
+            for name in ('count', 'secs', 'bytes', 'hits', 'misses'):
+                total[name] += entry[name]
+
+        return [
+            totals[stage]
+            for stage in STAGES
+            if stage in totals
+        ]
+
+    def get_server_timing(self):
+        """Returns the timings as a Server-Timing header value.
+
+        Each stage is listed with its total duration in milliseconds, and a
+        description containing the number of files, bytes and cache hits
+        and misses.
+        """
+        metrics = []
+
+        for total in self.get_summary():
+            desc = 'files=%d bytes=%d' % (total['files'], total['bytes'])
+
+            if total['hits'] or total['misses']:
+                desc += ' hits=%d misses=%d' % (total['hits'],
+                                                total['misses'])
+
+            metrics.append('%s;dur=%.1f;desc="%s"'
+                           % (total['stage'], total['secs'] * 1000, desc))
+
+        return ', '.join(metrics)
+
+
+def start_stage_timings():
+    """Starts collecting timings for the current thread.
+
+    Returns the new DiffStageTimings.
+    """
+    timings = DiffStageTimings()
+    set_stage_timings(timings)
+
+    return timings
+
+
+def get_stage_timings():
+    """Returns the timings being collected for the current thread, if any."""
+    return getattr(_local, 'timings', None)
+
+
+def set_stage_timings(timings):
+    """Sets the timings to collect into for the current thread.
+
+    This can be used to collect timings from worker threads into those of
+    the request being processed. Passing None stops collecting.
+    """
+    _local.timings = timings
+
+
+@contextmanager
+def time_stage(stage, filediff=None):
+    """Times a stage of the diff pipeline.
+
+    This yields a dictionary, in which the ``num_bytes`` processed and
+    whether there was a ``cache_hit`` can be set. If timings aren't being
+    collected for the current thread, this does nothing.
+    """
+    timings = get_stage_timings()
+    info = {}
+
+    if timings is None:
+        yield info
+    else:
+        start_time = time.time()
+
+        try:
+            yield info
+        finally:
+            timings.add(stage, filediff, time.time() - start_time, **info)
+
+
+def record_stage_samples(timings):
+    """Records the timings from a request for computing percentiles.
+
+    The time spent in each stage for each FileDiff is added to a list of
+    the most recent samples for the stage, both across all repositories
+    and for the FileDiff's repository.
+
+    Like the other statistics kept in the cache, there's a small chance of
+    losing samples if another process records them at the same time.
+    """
+    samples = {}
+    entries = timings.get_entries()
+
+    for entry in entries:
+        usecs = int(entry['secs'] * 1000000)
+        keys = [_make_samples_key(entry['stage'], None)]
+
+        if entry['repository_id'] is not None:
+            keys.append(_make_samples_key(entry['stage'],
+                                          entry['repository_id']))
+
+        for key in keys:
+            samples.setdefault(key, []).append(usecs)
+
+    if not samples:
+        return
+
+    repository_ids = set(
+        entry['repository_id']
+        for entry in entries
+        if entry['repository_id'] is not None
+    )
+    repositories_key = _make_repositories_key()
+    keys = list(samples) + [repositories_key]
+    values = cache.get_many(keys)
+
+    new_values = {}
+
+    for key, new_samples in six.iteritems(samples):
+        stage_samples = values.get(key, []) + new_samples
+        new_values[key] = stage_samples[-MAX_STAGE_SAMPLES:]
+
+    known_repository_ids = set(values.get(repositories_key, []))
+
+    if not repository_ids.issubset(known_repository_ids):
+        new_values[repositories_key] = \
+            sorted(known_repository_ids | repository_ids)
+
+    cache.set_many(new_values, CACHE_EXPIRATION_TIME)
+
+
+def get_stage_timing_stats(repository_id=None):
+    """Returns percentiles for the recent timings of each stage.
+
+    If ``repository_id`` is provided, only timings for that repository are
+    included.
+
+    This returns a list of dictionaries, in the order of STAGES, containing
+    the ``stage``, the number of ``samples``, and the 50th, 90th and 99th
+    percentile (``p50``, ``p90`` and ``p99``) and ``max`` durations, in
+    milliseconds. Stages without any samples are left out.
+    """
+    keys = dict(
+        (stage, _make_samples_key(stage, repository_id))
+        for stage in STAGES
+    )
+    values = cache.get_many(list(six.itervalues(keys)))
+    stats = []
+
+    for stage in STAGES:
+        samples = sorted(values.get(keys[stage], []))
+
+        if samples:
+            stats.append({
+                'stage': stage,
+                'samples': len(samples),
+                'p50': _get_percentile(samples, 50) / 1000.0,
+                'p90': _get_percentile(samples, 90) / 1000.0,
+                'p99': _get_percentile(samples, 99) / 1000.0,
+                'max': samples[-1] / 1000.0,
+            })
+
+    return stats
+
+
+def get_stage_timing_repository_ids():
+    """Returns the IDs of repositories with recorded timings."""
+    return cache.get(_make_repositories_key()) or []
+
+
+def _get_percentile(samples, percentile):
+    """Returns a percentile of a sorted list of samples.
+
+    This uses the nearest-rank method.
+    """
+    rank = (percentile * len(samples) + 99) // 100
+
+    return samples[max(rank, 1) - 1]
+
+
+def _make_samples_key(stage, repository_id):
+    """Returns the cache key for the samples for a stage."""
+    if repository_id is None:
+        repository_id = 'all'
+
+    return make_cache_key('diff-stage-timings-%s-%s' % (repository_id, stage))
+
+
+def _make_repositories_key():
+    """Returns the cache key for the IDs of repositories with samples."""
+    return make_cache_key('diff-stage-timings-repositories')
@@ -1,23 +1,30 @@
 from __future__ import unicode_literals
 
+import hashlib
 import logging
 import traceback
 
+from django.conf import settings
 from django.core.paginator import Paginator
-from django.http import HttpResponseServerError, Http404
+from django.http import (HttpResponseNotModified, HttpResponseServerError,
+                         Http404)
 from django.shortcuts import get_object_or_404
 from django.template import RequestContext
 from django.template.loader import render_to_string
-from django.utils.translation import ugettext as _
+from django.utils import six
+from django.utils.translation import ugettext as _, get_language
 from django.views.generic.base import TemplateView, View
 from djblets.siteconfig.models import SiteConfiguration
+from djblets.util.http import etag_if_none_match, set_etag
 
 from reviewboard.diffviewer.diffutils import (get_diff_files,
+                                              populate_diff_chunk,
                                               populate_diff_chunks,
                                               get_enable_highlighting)
 from reviewboard.diffviewer.errors import UserVisibleError
 from reviewboard.diffviewer.models import DiffSet, FileDiff
 from reviewboard.diffviewer.renderers import get_diff_renderer
+from reviewboard.diffviewer.timing import get_stage_timing_stats
 
 
 def get_collapse_diff(request):
@@ -63,6 +70,10 @@ class DiffViewerView(TemplateView):
         * ?page=<pagenum>
           - Renders diffs found on the given page number, if the diff viewer
             is paginated.
+
+    An ETag is generated for the page, based on get_etag_data, so that
+    repeat visits to a page that hasn't changed don't have to render it
+    again.
     """
     template_name = 'diffviewer/view_diff.html'
     fragment_error_template_name = 'diffviewer/diff_fragment_error.html'
@@ -79,6 +90,11 @@ class DiffViewerView(TemplateView):
         with a traceback will be returned instead.
         """
         self.collapse_diffs = get_collapse_diff(request)
+        self.stage_timing_stats = self.get_stage_timing_stats(diffset)
+        self.etag = self.get_etag(diffset, interdiffset)
+
+        if etag_if_none_match(request, self.etag):
+            return HttpResponseNotModified()
 
         if interdiffset:
             logging.debug('Generating diff viewer page for interdiffset '
@@ -116,9 +132,73 @@ class DiffViewerView(TemplateView):
         response = super(DiffViewerView, self).render_to_response(*args,
                                                                   **kwargs)
         response.set_cookie('collapsediffs', self.collapse_diffs)
+        set_etag(response, self.etag)
 
         return response
 
+    def get_etag(self, diffset, interdiffset):
+        """Returns the ETag for the page.
+
+        This is a hash of the data returned by get_etag_data.
+        """
+        etag_data = ':'.join(
+            six.text_type(value)
+            for value in self.get_etag_data(diffset, interdiffset)
+        )
+
+        return hashlib.sha1(etag_data.encode('utf-8')).hexdigest()
+
+    def get_etag_data(self, diffset, interdiffset):
+        """Returns the data representing the state of the page.
+
+        If any of this changes, the page will be rendered again, rather than
+        letting the browser use its cached copy. Subclasses that render
+        additional data should add to this.
+
+        DiffSets never change once they're created, so the diff itself is
+        represented by the IDs and timestamps of the DiffSets. The diff
+        viewer settings (such as pagination and the number of lines of
+        context) are also included, so that changing them in the
+        administration UI takes effect right away.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        diffviewer_settings = sorted(
+            (key, siteconfig.get(key))
+            for key in (set(siteconfig.settings) |
+                        set(siteconfig.get_defaults()))
+            if key.startswith('diffviewer_')
+        )
+
+        return [
+            diffset.pk,
+            diffset.timestamp,
+            interdiffset and interdiffset.pk,
+            interdiffset and interdiffset.timestamp,
+            self.request.GET.get('page', ''),
+            self.request.GET.get('file', ''),
+            self.collapse_diffs,
+            get_enable_highlighting(self.request.user),
+            get_language(),
+            settings.AJAX_SERIAL,
+            diffviewer_settings,
+            self.stage_timing_stats,
+        ]
+
+    def get_stage_timing_stats(self, diffset):
+        """Returns the recent timings of the diff pipeline for the page.
+
+        These are shown in a debug panel to administrators, when the
+        ``diffviewer_show_stage_timings`` setting is enabled. They cover the
+        diff's repository. If the panel isn't shown, this returns None.
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+
+        if (siteconfig.get('diffviewer_show_stage_timings') and
+                self.request.user.is_staff):
+            return get_stage_timing_stats(diffset.repository_id)
+
+        return None
+
     def get_context_data(self, diffset, interdiffset, extra_context={},
                          **kwargs):
         """Calculates and returns data used for rendering the diff viewer.
@@ -153,6 +233,9 @@ class DiffViewerView(TemplateView):
 
         page = paginator.page(page_num)
 
+        if siteconfig.get('diffviewer_max_chunk_workers') > 1:
+            self._prefetch_chunks(page.object_list)
+
         diff_context = {
             'revision': {
                 'revision': diffset.revision,
@@ -184,10 +267,31 @@ class DiffViewerView(TemplateView):
             'diffset_pair': (diffset, interdiffset),
             'files': page.object_list,
             'collapseall': self.collapse_diffs,
+            'show_stage_timings': self.stage_timing_stats is not None,
+            'stage_timing_stats': self.stage_timing_stats,
         }, **extra_context)
 
         return context
 
+    def _prefetch_chunks(self, files):
+        """Generates and caches the chunks for the files on a page.
+
+        The files are processed in parallel, so that the diff fragments that
+        are later loaded for the page are served from the cache, instead of
+        each waiting on their own SCM fetch, patch and diff.
+
+        Any errors are left for the diff fragments to report.
+        """
+        try:
+            populate_diff_chunks(
+                [dict(f) for f in files],
+                enable_syntax_highlighting=get_enable_highlighting(
+                    self.request.user),
+                request=self.request)
+        except Exception as e:
+            logging.debug('Unable to pre-generate diff chunks: %s', e,
+                          request=self.request)
+
 
 class DiffFragmentView(View):
     """Renders a fragment from a file in the diff viewer.
@@ -323,7 +427,7 @@ class DiffFragmentView(View):
         else:
             collapseall = get_collapse_diff(self.request)
 
-        self.diff_file = self._get_requested_diff_file()
+        self.diff_file = self._get_requested_diff_file(chunk_index=chunkindex)
 
         if not self.diff_file:
             raise UserVisibleError(
@@ -348,7 +452,7 @@ class DiffFragmentView(View):
         """
         return {}
 
-    def _get_requested_diff_file(self, get_chunks=True):
+    def _get_requested_diff_file(self, get_chunks=True, chunk_index=None):
         """Fetches information on the requested diff.
 
         This will look up information on the diff that's to be rendered
@@ -357,14 +461,21 @@ class DiffFragmentView(View):
 
         If get_chunks is True, the diff file information will include chunks
         for rendering. Otherwise, it will just contain generic information
-        from the database.
+        from the database. If chunk_index is also provided, only that chunk
+        will be loaded.
         """
         files = get_diff_files(self.diffset, self.filediff, self.interdiffset,
                                request=self.request)
 
         if get_chunks:
-            populate_diff_chunks(files, self.highlighting,
-                                 request=self.request)
+            if chunk_index is None:
+                populate_diff_chunks(files, self.highlighting,
+                                     request=self.request)
+            else:
+                for diff_file in files:
+                    populate_diff_chunk(diff_file, chunk_index,
+                                        self.highlighting,
+                                        request=self.request)
 
         if files:
             assert len(files) == 1
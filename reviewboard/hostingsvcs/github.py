@@ -322,6 +322,37 @@ class GitHub(HostingService):
         except (URLError, HTTPError):
             return False
 
+    def get_files_exist(self, repository, paths_and_revisions,
+                        base_commit_id=None, *args, **kwargs):
+        """Returns whether each of a list of files exists.
+
+        If a base commit ID is provided, the blobs in that commit's tree are
+        fetched with a single API request, and files whose revisions are
+        among them exist. The rest are checked one at a time.
+        """
+        blob_shas = set()
+
+        if base_commit_id:
+            url = '%s&recursive=1' % self._build_api_url(
+                self._get_repo_api_url(repository),
+                'git/trees/%s' % base_commit_id)
+
+            try:
+                rsp = self._api_get(url)
+                blob_shas = set(
+                    entry['sha']
+                    for entry in rsp['tree']
+                    if entry['type'] == 'blob'
+                )
+            except Exception as e:
+                logging.warning('Failed to fetch tree from %s: %s', url, e)
+
+        return [
+            (revision in blob_shas or
+             self.get_file_exists(repository, path, revision))
+            for path, revision in paths_and_revisions
+        ]
+
     def get_branches(self, repository):
         results = []
 
@@ -14,6 +14,8 @@ from djblets.util.compat.six.moves.urllib.request import (
     urlopen)
 from pkg_resources import iter_entry_points
 
+from reviewboard.scmtools.errors import FileNotFoundError
+
 
 class HostingService(object):
     """An interface to a hosting service for repositories and bug trackers.
@@ -115,6 +117,63 @@ class HostingService(object):
 
         return repository.get_scmtool().file_exists(path, revision)
 
+    def get_files_exist(self, repository, paths_and_revisions,
+                        base_commit_id=None, *args, **kwargs):
+        """Returns whether each of a list of files exists in the repository.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        returns a list of booleans, in the same order.
+
+        By default, this checks each file with get_file_exists. Services
+        with APIs for checking many files at once should override this.
+        """
+        if not self.supports_repositories:
+            raise NotImplementedError
+
+        if (self.get_file_exists.__func__ is
+            HostingService.get_file_exists.__func__):
+            # Files are checked through the SCMTool, which may be able to
+            # check them all at once.
+            return repository.get_scmtool().get_files_exist(
+                paths_and_revisions)
+
+        return [
+            self.get_file_exists(repository, path, revision,
+                                 base_commit_id=base_commit_id)
+            for path, revision in paths_and_revisions
+        ]
+
+    def get_files(self, repository, paths_and_revisions, base_commit_id=None,
+                  *args, **kwargs):
+        """Fetches the contents of a list of files from the repository.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        yields a (path, revision, data) tuple for each file, in the same
+        order, as the files are fetched. Files that don't exist are yielded
+        with None for their data.
+
+        By default, this fetches each file with get_file. Services with APIs
+        for fetching many files at once should override this.
+        """
+        if not self.supports_repositories:
+            raise NotImplementedError
+
+        if self.get_file.__func__ is HostingService.get_file.__func__:
+            # Files are fetched through the SCMTool, which may be able to
+            # fetch them all at once.
+            for result in repository.get_scmtool().get_files(
+                    paths_and_revisions):
+                yield result
+        else:
+            for path, revision in paths_and_revisions:
+                try:
+                    data = self.get_file(repository, path, revision,
+                                         base_commit_id=base_commit_id)
+                except FileNotFoundError:
+                    data = None
+
+                yield path, revision, data
+
     def get_branches(self, repository):
         """Get a list of all branches in the repositories.
 
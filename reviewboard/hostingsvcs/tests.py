@@ -1262,6 +1262,73 @@ class GitHubTests(ServiceTests):
             SCMError, 'Not Found',
             lambda: service.get_change(repository, commit_sha))
 
+    def test_get_files_exist(self):
+        """Testing GitHub get_files_exist implementation"""
+        tree_api_response = json.dumps({
+            'sha': 'abc123',
+            'tree': [
+                {
+                    'path': 'README',
+                    'type': 'blob',
+                    'sha': 'a' * 40,
+                },
+                {
+                    'path': 'src',
+                    'type': 'tree',
+                    'sha': 'b' * 40,
+                },
+                {
+                    'path': 'src/main.c',
+                    'type': 'blob',
+                    'sha': 'c' * 40,
+                },
+            ],
+        })
+        urls = []
+
+        def _http_get(service, url, *args, **kwargs):
+            urls.append(url)
+
+            if '/git/trees/' in url:
+                return tree_api_response, {}
+            elif url.startswith(
+                    'https://api.github.com/repos/myuser/myrepo/git/blobs/%s'
+                    % ('d' * 40)):
+                return b'', {}
+            else:
+                raise HTTPError(url, 404, '', {}, StringIO())
+
+        account = self._get_hosting_account()
+        account.data['authorization'] = {'token': 'abc123'}
+
+        repository = Repository(hosting_account=account)
+        repository.extra_data = {
+            'repository_plan': 'public',
+            'github_public_repo_name': 'myrepo',
+        }
+
+        service = account.service
+        self.spy_on(service._http_get, call_fake=_http_get)
+
+        self.assertEqual(
+            service.get_files_exist(
+                repository,
+                [
+                    ('/README', 'a' * 40),
+                    ('/src/main.c', 'c' * 40),
+                    ('/src', 'b' * 40),
+                    ('/other', 'd' * 40),
+                    ('/missing', 'e' * 40),
+                ],
+                base_commit_id='f' * 40),
+            [True, True, False, True, False])
+
+        self.assertEqual(
+            urls[0],
+            'https://api.github.com/repos/myuser/myrepo/git/trees/%s'
+            '?access_token=abc123&recursive=1' % ('f' * 40))
+        self.assertEqual(len(urls), 4)
+
     def _test_check_repository(self, expected_user='myuser', **kwargs):
         def _http_get(service, url, *args, **kwargs):
             self.assertEqual(
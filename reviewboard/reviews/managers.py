@@ -1,12 +1,16 @@
 from __future__ import unicode_literals
 
 import logging
+import re
+import uuid
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import connections, router, transaction
 from django.db.models import Manager, Q
 from django.db.models.query import QuerySet
+from djblets.cache.backend import make_cache_key
 from djblets.db.managers import ConcurrencyManager
 from djblets.util.compat import six
 
@@ -14,6 +18,74 @@ from reviewboard.diffviewer.models import DiffSetHistory
 from reviewboard.scmtools.errors import ChangeNumberInUseError
 
 
+# The characters with special meaning in a regular expression.
+_REGEX_SPECIAL_CHARS = set('.^$*+?{}[]\\|()')
+
+# Inline flags, which change the meaning of the whole regular expression.
+_REGEX_INLINE_FLAGS_RE = re.compile(r'\(\?[iLmsux]+\)')
+
+_DEFAULT_REVIEWERS_GENERATION_KEY = 'default-reviewers-generation'
+
+# Compiled matchers, keyed by repository and LocalSite IDs.
+_default_reviewer_matchers = {}
+
+
+class DefaultReviewerMatcher(object):
+    """Matches file paths against the file regexes of DefaultReviewers.
+
+    The file regexes are compiled once, and indexed by the literal text
+    (if any) that a matching path must start with. Only the regexes that
+    could possibly match a path are tried against it.
+    """
+    def __init__(self, default_reviewers):
+        """Initializes the matcher.
+
+        ``default_reviewers`` is a list of tuples of DefaultReviewer IDs
+        and file regexes. Any file regexes that fail to compile are
+        skipped.
+        """
+        self._regexes_by_prefix = {}
+        self._num_regexes = 0
+
+        for pk, file_regex in default_reviewers:
+            try:
+                regex = re.compile(file_regex)
+            except Exception:
+                continue
+
+            prefix = _get_regex_literal_prefix(file_regex)
+            self._regexes_by_prefix.setdefault(prefix, []).append(
+                (pk, regex))
+            self._num_regexes += 1
+
+        self._prefix_lengths = sorted(set(
+            len(prefix)
+            for prefix in six.iterkeys(self._regexes_by_prefix)
+        ))
+
+    def __len__(self):
+        return self._num_regexes
+
+    def get_matching_ids(self, paths):
+        """Returns the IDs of DefaultReviewers matching any of the paths."""
+        regexes_by_prefix = self._regexes_by_prefix
+        prefix_lengths = self._prefix_lengths
+        matching_ids = set()
+
+        for path in paths:
+            path_len = len(path)
+
+            for prefix_len in prefix_lengths:
+                if prefix_len > path_len:
+                    break
+
+                for pk, regex in regexes_by_prefix.get(path[:prefix_len], []):
+                    if pk not in matching_ids and regex.match(path):
+                        matching_ids.add(pk)
+
+        return matching_ids
+
+
 class DefaultReviewerManager(Manager):
     """A manager for DefaultReviewer models."""
 
@@ -27,12 +99,111 @@ class DefaultReviewerManager(Manager):
         return self.filter(local_site=local_site).filter(
             Q(repository__isnull=True) | Q(repository=repository))
 
+    def get_matcher(self, repository, local_site):
+        """Returns a DefaultReviewerMatcher for a repository.
+
+        This matches against the DefaultReviewers returned by
+        for_repository. Matchers are kept around for each repository until
+        any DefaultReviewer changes, so that the file regexes don't have to
+        be fetched and compiled every time they're needed.
+        """
+        key = (repository and repository.pk, local_site and local_site.pk)
+
+        # The generation must be fetched before the DefaultReviewers, so that
+        # any changes made in-between will cause the matcher to be rebuilt
+        # the next time it's needed.
+        generation = _get_default_reviewers_generation()
+
+        try:
+            matcher_generation, matcher = _default_reviewer_matchers[key]
+
+            if matcher_generation == generation:
+                return matcher
+        except KeyError:
+            pass
+
+        matcher = DefaultReviewerMatcher(
+            self.for_repository(repository, local_site)
+                .values_list('pk', 'file_regex'))
+        _default_reviewer_matchers[key] = (generation, matcher)
+
+        return matcher
+
+    def invalidate_matchers(self):
+        """Invalidates the DefaultReviewerMatchers for all repositories.
+
+        This is called automatically when any DefaultReviewer changes. The
+        generation of the matchers is kept in the cache, so that all
+        processes will rebuild their matchers.
+        """
+        cache.set(make_cache_key(_DEFAULT_REVIEWERS_GENERATION_KEY),
+                  uuid.uuid4().hex)
+
     def can_create(self, user, local_site=None):
         """Returns whether the user can create default reviewers."""
         return (user.is_superuser or
                 (local_site and local_site.is_mutable_by(user)))
 
 
+def _get_default_reviewers_generation():
+    """Returns the current generation of the DefaultReviewers.
+
+    The generation is a random value, replaced whenever DefaultReviewers
+    change. A random value is used (rather than a counter), so that a
+    generation isn't reused if it falls out of the cache.
+    """
+    key = make_cache_key(_DEFAULT_REVIEWERS_GENERATION_KEY)
+    generation = cache.get(key)
+
+    if generation is None:
+        generation = uuid.uuid4().hex
+        cache.add(key, generation)
+        generation = cache.get(key, generation)
+
+    return generation
+
+
+def _get_regex_literal_prefix(regex):
+    """Returns the literal text any match of a regular expression starts with.
+
+    This is conservative, returning an empty string for anything that
+    isn't simple to reason about, such as alternations and inline flags.
+    """
+    if '|' in regex or _REGEX_INLINE_FLAGS_RE.search(regex):
+        return ''
+
+    prefix = []
+    i = 0
+    regex_len = len(regex)
+
+    if regex.startswith('^'):
+        i = 1
+
+    while i < regex_len:
+        c = regex[i]
+
+        if c == '\\':
+            c = regex[i + 1:i + 2]
+
+            if not c or c.isalnum():
+                # This is a special sequence, like \d or \1.
+                break
+
+            i += 2
+        elif c in _REGEX_SPECIAL_CHARS:
+            break
+        else:
+            i += 1
+
+        if regex[i:i + 1] in ('*', '?', '{'):
+            # The character may not appear in the match at all.
+            break
+
+        prefix.append(c)
+
+    return ''.join(prefix)
+
+
 class ReviewGroupManager(Manager):
     """A manager for Group models."""
     def accessible(self, user, visible_only=True, local_site=None):
@@ -6,6 +6,7 @@ import re
 from django.contrib.auth.models import User
 from django.db import models
 from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.utils import six, timezone
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.html import escape
@@ -18,7 +19,8 @@ from djblets.db.query import get_object_or_none
 from djblets.util.templatetags.djblets_images import crop_image, thumbnail
 
 from reviewboard.changedescs.models import ChangeDescription
-from reviewboard.diffviewer.models import DiffSet, DiffSetHistory, FileDiff
+from reviewboard.diffviewer.models import (DiffPrerenderJob, DiffSet,
+                                           DiffSetHistory, FileDiff)
 from reviewboard.attachments.models import FileAttachment
 from reviewboard.reviews.errors import PermissionError
 from reviewboard.reviews.managers import (DefaultReviewerManager,
@@ -162,6 +164,22 @@ class DefaultReviewer(models.Model):
         return self.name
 
 
+def _invalidate_default_reviewer_matchers(**kwargs):
+    """Invalidates the matchers for DefaultReviewers after any changes."""
+    DefaultReviewer.objects.invalidate_matchers()
+
+
+post_save.connect(_invalidate_default_reviewer_matchers,
+                  sender=DefaultReviewer)
+post_delete.connect(_invalidate_default_reviewer_matchers,
+                    sender=DefaultReviewer)
+
+for through in (DefaultReviewer.repository.through,
+                DefaultReviewer.groups.through,
+                DefaultReviewer.people.through):
+    m2m_changed.connect(_invalidate_default_reviewer_matchers, sender=through)
+
+
 @python_2_unicode_compatible
 class Screenshot(models.Model):
     """
@@ -357,43 +375,33 @@ class BaseReviewRequestDetails(models.Model):
         if not diffset:
             return
 
-        people = set()
-        groups = set()
-
-        # TODO: This is kind of inefficient, and could maybe be optimized in
-        # some fancy way.  Certainly the most superficial optimization that
-        # could be made would be to cache the compiled regexes somewhere.
-        files = diffset.files.all()
-        reviewers = DefaultReviewer.objects.for_repository(self.repository,
-                                                           self.local_site)
-
-        for default in reviewers:
-            try:
-                regex = re.compile(default.file_regex)
-            except:
-                continue
+        matcher = DefaultReviewer.objects.get_matcher(self.repository,
+                                                      self.local_site)
 
-            for filediff in files:
-                if regex.match(filediff.source_file or filediff.dest_file):
-                    for person in default.people.all():
-                        people.add(person)
+        if not matcher:
+            return
 
-                    for group in default.groups.all():
-                        groups.add(group)
+        default_reviewer_ids = matcher.get_matching_ids(
+            source_file or dest_file
+            for source_file, dest_file in diffset.files.values_list(
+                'source_file', 'dest_file')
+        )
 
-                    break
+        if not default_reviewer_ids:
+            return
 
-        existing_people = self.target_people.all()
+        # Any people and groups already on the review request will be skipped
+        # when adding them.
+        people = list(User.objects.filter(
+            default_review_paths__in=default_reviewer_ids).distinct())
+        groups = list(Group.objects.filter(
+            defaultreviewer__in=default_reviewer_ids).distinct())
 
-        for person in people:
-            if person not in existing_people:
-                self.target_people.add(person)
+        if people:
+            self.target_people.add(*people)
 
-        existing_groups = self.target_groups.all()
-
-        for group in groups:
-            if group not in existing_groups:
-                self.target_groups.add(group)
+        if groups:
+            self.target_groups.add(*groups)
 
     def update_from_commit_id(self, commit_id):
         """Updates the data from a server-side changeset.
@@ -1472,9 +1480,14 @@ class ReviewRequestDraft(BaseReviewRequestDetails):
                                self.diffset.id)],
                 }
 
+            previous_diffset = review_request.get_latest_diffset()
+
             self.diffset.history = review_request.diffset_history
             self.diffset.save()
 
+            if previous_diffset:
+                DiffPrerenderJob.objects.queue(previous_diffset, self.diffset)
+
         if self.changedesc:
             self.changedesc.timestamp = timezone.now()
             self.changedesc.rich_text = self.rich_text
@@ -6,8 +6,10 @@ import os
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.urlresolvers import reverse
+from django.http import HttpResponse
 from django.template import Context, Template
 from django.utils import six
 from djblets.siteconfig.models import SiteConfiguration
@@ -16,7 +18,12 @@ from kgb import SpyAgency
 
 from reviewboard.accounts.models import Profile, LocalSiteProfile
 from reviewboard.attachments.models import FileAttachment
+from reviewboard.diffviewer.models import DiffPrerenderJob
+from reviewboard.diffviewer.parser import DiffParser
+from reviewboard.diffviewer.rawdiff import RawDiffResponse
+from reviewboard.diffviewer.timing import get_stage_timing_stats
 from reviewboard.reviews.forms import DefaultReviewerForm, GroupForm
+from reviewboard.reviews.managers import DefaultReviewerMatcher
 from reviewboard.reviews.markdown_utils import (markdown_escape,
                                                 markdown_unescape)
 from reviewboard.reviews.models import (Comment,
@@ -819,6 +826,241 @@ class ViewTests(TestCase):
         self.assertEqual(comments[0].text, comment_text_1)
         self.assertEqual(comments[1].text, comment_text_2)
 
+    def test_diff_viewer_etag(self):
+        """Testing view_diff with ETags"""
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        url = '/r/%d/diff/' % review_request.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.assertTrue(etag)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # A new review on the review request must cause a new render.
+        review = self.create_review(review_request)
+        review.publish()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_diff_viewer_etag_with_user(self):
+        """Testing view_diff with ETags and different users"""
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        url = '/r/%d/diff/' % review_request.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+
+        self.client.login(username='doc', password='doc')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_diff_viewer_etag_with_siteconfig(self):
+        """Testing view_diff with ETags and changed diff viewer settings"""
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        url = '/r/%d/diff/' % review_request.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        paginate_by = self.siteconfig.get('diffviewer_paginate_by')
+
+        self.siteconfig.set('diffviewer_paginate_by', paginate_by + 1)
+        self.siteconfig.save()
+
+        try:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        finally:
+            self.siteconfig.set('diffviewer_paginate_by', paginate_by)
+            self.siteconfig.save()
+
+    def test_diff_viewer_etag_with_blocks(self):
+        """Testing view_diff with ETags and a new blocked review request"""
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset)
+
+        url = '/r/%d/diff/' % review_request.pk
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+
+        blocked = self.create_review_request(publish=True)
+        blocked.depends_on.add(review_request)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_diff_viewer_stage_timings(self):
+        """Testing view_diff with diff timings shown"""
+        self.siteconfig.set('diffviewer_show_stage_timings', True)
+        self.siteconfig.save()
+
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        filediff = self.create_filediff(diffset)
+
+        response = self.client.get('/r/%d/diff/1/fragment/%d/'
+                                   % (review_request.pk, filediff.pk))
+        self.assertTrue(response['Server-Timing'].startswith('fetch;dur='))
+
+        response = self.client.get('/r/%d/diff/' % review_request.pk)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.getContextVar(response, 'stage_timing_stats'),
+                         None)
+
+        self.client.login(username='admin', password='admin')
+        response = self.client.get('/r/%d/diff/' % review_request.pk)
+        self.assertEqual(response.status_code, 200)
+
+        stats = self.getContextVar(response, 'stage_timing_stats')
+        self.assertEqual(stats[0]['stage'], 'fetch')
+        self.assertContains(response, 'Diff Timings')
+
+    def test_diff_viewer_stage_timings_disabled(self):
+        """Testing view_diff with diff timings disabled doesn't record them"""
+        self.siteconfig.set('diffviewer_show_stage_timings', False)
+        self.siteconfig.save()
+        cache.clear()
+
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request)
+        filediff = self.create_filediff(diffset)
+
+        response = self.client.get('/r/%d/diff/1/fragment/%d/'
+                                   % (review_request.pk, filediff.pk))
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(get_stage_timing_stats(), [])
+
+    def test_raw_diff(self):
+        """Testing raw_diff streams the diff of each file"""
+        review_request, diffs = self._create_raw_diff_review_request()
+
+        old_batch_size = DiffParser.RAW_DIFF_BATCH_SIZE
+        DiffParser.RAW_DIFF_BATCH_SIZE = 2
+
+        try:
+            response = self.client.get('/r/%d/diff/raw/' % review_request.pk)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            self.assertEqual(b''.join(response.streaming_content),
+                             b''.join(diffs))
+        finally:
+            DiffParser.RAW_DIFF_BATCH_SIZE = old_batch_size
+
+        self.assertEqual(response['Content-Type'], 'text/x-patch')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Disposition'],
+                         'inline; filename=rb%d.patch' % review_request.pk)
+
+        response = self.client.get('/r/%d/diff/raw/' % review_request.pk,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_raw_diff_with_range(self):
+        """Testing raw_diff with byte ranges"""
+        review_request, diffs = self._create_raw_diff_review_request()
+        data = b''.join(diffs)
+        url = '/r/%d/diff/raw/' % review_request.pk
+
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-%d' % len(data))
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), data[10:])
+        self.assertEqual(response['Content-Range'],
+                         'bytes 10-%d/%d' % (len(data) - 1, len(data)))
+        self.assertEqual(response['Content-Length'],
+                         six.text_type(len(data) - 10))
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-5',
+                                   HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), data[-5:])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=%d-' % len(data))
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%d' % len(data))
+
+        # A Range header is ignored if If-Range doesn't match.
+        response = self.client.get(url, HTTP_RANGE='bytes=10-',
+                                   HTTP_IF_RANGE='"old-etag"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), data)
+
+    def test_raw_diff_with_if_none_match(self):
+        """Testing raw_diff with If-None-Match lists, weak and "*" ETags"""
+        review_request, diffs = self._create_raw_diff_review_request()
+        url = '/r/%d/diff/raw/' % review_request.pk
+
+        response = self.client.get(url)
+        etag = response['ETag']
+
+        for value in ('"other", %s' % etag,
+                      'W/%s' % etag,
+                      '"other",W/"%s;gzip"' % etag.strip('"'),
+                      '*'):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=value)
+            self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"a", W/"b"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_raw_diff_response_content(self):
+        """Testing RawDiffResponse.content and len() buffer the stream"""
+        response = RawDiffResponse(iter([b'abc', b'def']))
+
+        self.assertTrue(isinstance(response, HttpResponse))
+        self.assertTrue(response)
+        self.assertEqual(response.content, b'abcdef')
+        self.assertEqual(len(response), 6)
+        self.assertEqual(b''.join(response), b'abcdef')
+
+    def _create_raw_diff_review_request(self):
+        """Creates a review request with a diff of several files.
+
+        This returns the review request and the diffs of its files.
+        """
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request, name='diff')
+        diffs = []
+
+        for i in range(5):
+            diff = (b'--- /file%d\n+++ /file%d\n@@ -1 +1 @@\n-foo\n+bar%d\n'
+                    % (i, i, i))
+            self.create_filediff(diffset, source_file='/file%d' % i,
+                                 dest_file='/file%d' % i, diff=diff)
+            diffs.append(diff)
+
+        return review_request, diffs
+
     def testReviewDetailSitewideLogin(self):
         """Testing review_detail view with site-wide login enabled"""
         self.siteconfig.set("auth_require_sitewide_login", True)
@@ -1499,6 +1741,29 @@ class DraftTests(TestCase):
         self.assertEqual(set(fields["bugs_closed"]["removed"]), old_bugs_norm)
         self.assertEqual(set(fields["bugs_closed"]["added"]), new_bugs_norm)
 
+    def test_publish_with_diff_queues_interdiff(self):
+        """Testing ReviewRequestDraft.publish with a new diff revision
+        queues the interdiff for pre-rendering
+        """
+        siteconfig = SiteConfiguration.objects.get_current()
+        siteconfig.set('diffviewer_prerender_enabled', True)
+
+        try:
+            review_request = self.create_review_request(
+                create_repository=True, publish=True)
+            diffset1 = self.create_diffset(review_request)
+            diffset2 = self.create_diffset(review_request, revision=2,
+                                           draft=True)
+
+            review_request.get_draft().publish()
+        finally:
+            siteconfig.set('diffviewer_prerender_enabled', False)
+
+        jobs = list(DiffPrerenderJob.objects.all())
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(jobs[0].diffset, diffset1)
+        self.assertEqual(jobs[0].interdiffset, diffset2)
+
     def getDraft(self):
         """Convenience function for getting a new draft to work with."""
         review_request = self.create_review_request(publish=True)
@@ -1734,6 +1999,102 @@ class DefaultReviewerTests(TestCase):
         self.assertEqual(len(default_reviewers), 1)
         self.assertTrue(default_reviewer2 in default_reviewers)
 
+    @add_fixtures(['test_users'])
+    def test_add_default_reviewers(self):
+        """Testing ReviewRequest.add_default_reviewers"""
+        review_request = self.create_review_request(create_repository=True)
+        repository = review_request.repository
+        other_repository = self.create_repository(name='Other Repo')
+
+        diffset = self.create_diffset(review_request)
+        self.create_filediff(diffset, source_file='src/foo.py',
+                             dest_file='src/foo.py')
+        self.create_filediff(diffset, source_file='docs/README',
+                             dest_file='docs/README')
+
+        user1 = User.objects.get(username='doc')
+        user2 = User.objects.get(username='grumpy')
+        user3 = User.objects.get(username='dopey')
+        group1 = self.create_review_group(name='group1')
+        group2 = self.create_review_group(name='group2')
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Source', file_regex=r'^src/.*\.py$')
+        default_reviewer.people.add(user1)
+        default_reviewer.groups.add(group1)
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Docs', file_regex='docs/|README')
+        default_reviewer.people.add(user1, user2)
+        default_reviewer.groups.add(group2)
+        default_reviewer.repository.add(repository)
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Libraries', file_regex='lib/.*')
+        default_reviewer.people.add(user3)
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Other', file_regex='.*')
+        default_reviewer.people.add(user3)
+        default_reviewer.repository.add(other_repository)
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Invalid', file_regex='(src')
+        default_reviewer.people.add(user3)
+
+        review_request.add_default_reviewers()
+
+        self.assertEqual(set(review_request.target_people.all()),
+                         set([user1, user2]))
+        self.assertEqual(set(review_request.target_groups.all()),
+                         set([group1, group2]))
+
+    def test_get_matcher(self):
+        """Testing DefaultReviewer.objects.get_matcher caches matchers"""
+        repository = self.create_repository()
+
+        default_reviewer = DefaultReviewer.objects.create(
+            name='Source', file_regex='src/.*')
+
+        matcher = DefaultReviewer.objects.get_matcher(repository, None)
+        self.assertEqual(len(matcher), 1)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                DefaultReviewer.objects.get_matcher(repository, None)
+                is matcher)
+
+        # Changing any DefaultReviewer should rebuild the matcher.
+        default_reviewer.repository.add(self.create_repository(name='Other'))
+
+        new_matcher = DefaultReviewer.objects.get_matcher(repository, None)
+        self.assertFalse(new_matcher is matcher)
+        self.assertEqual(len(new_matcher), 0)
+
+        DefaultReviewer.objects.create(name='Docs', file_regex='docs/.*')
+
+        matcher = DefaultReviewer.objects.get_matcher(repository, None)
+        self.assertFalse(new_matcher is matcher)
+        self.assertEqual(len(matcher), 1)
+
+    def test_matcher(self):
+        """Testing DefaultReviewerMatcher.get_matching_ids"""
+        matcher = DefaultReviewerMatcher([
+            (1, r'^src/.*\.py$'),
+            (2, 'src/foo'),
+            (3, 'docs|README'),
+            (4, 'lib/(?i)test'),
+            (5, r'lib\/a?b'),
+            (6, 'src/bar'),
+        ])
+
+        self.assertEqual(
+            matcher.get_matching_ids(['src/foo.py', 'README', 'LIB/TEST']),
+            set([1, 2, 3, 4]))
+        self.assertEqual(matcher.get_matching_ids(['lib/b', 'src/ba']),
+                         set([5]))
+        self.assertEqual(matcher.get_matching_ids([]), set())
+
     def test_form_with_localsite(self):
         """Testing DefaultReviewerForm with a LocalSite."""
         test_site = LocalSite.objects.create(name='test')
@@ -38,6 +38,7 @@ from reviewboard.attachments.models import FileAttachment
 from reviewboard.changedescs.models import ChangeDescription
 from reviewboard.diffviewer.diffutils import get_file_chunks_in_range
 from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.rawdiff import get_raw_diff_response
 from reviewboard.diffviewer.views import (DiffFragmentView, DiffViewerView,
                                           exception_traceback_string)
 from reviewboard.extensions.hooks import (DashboardHook,
@@ -987,6 +988,10 @@ class ReviewsDiffViewerView(DiffViewerView):
                                        revision, self.draft)
         self.interdiffset = None
 
+        # Try to find an existing pending review of this diff from the
+        # current user.
+        self.pending_review = review_request.get_pending_review(request.user)
+
         if interdiff_revision and interdiff_revision != revision:
             # An interdiff revision was specified. Try to find a matching
             # diffset.
@@ -996,6 +1001,51 @@ class ReviewsDiffViewerView(DiffViewerView):
         return super(ReviewsDiffViewerView, self).get(
             request, self.diffset, self.interdiffset)
 
+    def get_etag_data(self, diffset, interdiffset):
+        """Returns the data representing the state of the page.
+
+        Along with the diff, the page shows the review request, its draft,
+        the reviews and comments made on it, the review requests it blocks,
+        and the user's own pending review and starred state, so changes to
+        any of these will cause the page to be rendered again.
+        """
+        user = self.request.user
+        etag_data = super(ReviewsDiffViewerView, self).get_etag_data(
+            diffset, interdiffset)
+        etag_data += [
+            user,
+            self.review_request.last_updated,
+            self.review_request.last_review_activity_timestamp,
+            self.draft and self.draft.last_updated,
+            ','.join([
+                six.text_type(r.pk)
+                for r in self.review_request.blocks.all()
+            ]),
+        ]
+
+        if self.pending_review:
+            # Deleting a comment from a pending review doesn't update the
+            # review's timestamp, so the number of comments is included.
+            etag_data += [
+                self.pending_review.pk,
+                self.pending_review.timestamp,
+                self.pending_review.comments.count(),
+            ]
+
+        starred = False
+
+        if user.is_authenticated():
+            try:
+                profile = user.get_profile()
+                starred = profile.starred_review_requests.filter(
+                    pk=self.review_request.pk).exists()
+            except Profile.DoesNotExist:
+                pass
+
+        etag_data.append(starred)
+
+        return etag_data
+
     def get_context_data(self, *args, **kwargs):
         """Calculates additional context data for rendering.
 
@@ -1004,10 +1054,7 @@ class ReviewsDiffViewerView(DiffViewerView):
         as opposed to the data calculated by DiffViewerView.get_context_data,
         which is more focused on the actual diff.
         """
-        # Try to find an existing pending review of this diff from the
-        # current user.
-        pending_review = \
-            self.review_request.get_pending_review(self.request.user)
+        pending_review = self.pending_review
 
         has_draft_diff = self.draft and self.draft.diffset
         is_draft_diff = has_draft_diff and self.draft.diffset == self.diffset
@@ -1171,19 +1218,14 @@ def raw_diff(request,
     diffset = _query_for_diff(review_request, request.user, revision, draft)
 
     tool = review_request.repository.get_scmtool()
-    data = tool.get_parser('').raw_diff(diffset)
-
-    resp = HttpResponse(data, mimetype='text/x-patch')
 
     if diffset.name == 'diff':
         filename = "rb%d.patch" % review_request.display_id
     else:
         filename = six.text_type(diffset.name).encode('ascii', 'ignore')
 
-    resp['Content-Disposition'] = 'inline; filename=%s' % filename
-    set_last_modified(resp, diffset.timestamp)
-
-    return resp
+    return get_raw_diff_response(request, diffset, tool.get_parser(''),
+                                 filename)
 
 
 @check_login_required
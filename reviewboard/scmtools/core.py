@@ -5,6 +5,8 @@ import logging
 import os
 import subprocess
 import sys
+import threading
+import time
 
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.translation import ugettext_lazy as _
@@ -146,6 +148,41 @@ class SCMTool(object):
         except FileNotFoundError:
             return False
 
+    def get_files_exist(self, paths_and_revisions):
+        """Returns whether each of a list of files exists in the repository.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        returns a list of booleans, in the same order.
+
+        By default, this checks each file with file_exists. SCMTools that
+        can check many files at once, saving round trips to the repository,
+        should override this.
+        """
+        return [
+            self.file_exists(path, revision)
+            for path, revision in paths_and_revisions
+        ]
+
+    def get_files(self, paths_and_revisions):
+        """Fetches the contents of a list of files from the repository.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        yields a (path, revision, data) tuple for each file, in the same
+        order, as the files are fetched. Files that don't exist are yielded
+        with None for their data.
+
+        By default, this fetches each file with get_file. SCMTools that can
+        fetch many files at once, saving round trips to the repository,
+        should override this.
+        """
+        for path, revision in paths_and_revisions:
+            try:
+                data = self.get_file(path, revision)
+            except FileNotFoundError:
+                data = None
+
+            yield path, revision, data
+
     def parse_diff_revision(self, file_str, revision_str, moved=False):
         raise NotImplementedError
 
@@ -214,12 +251,18 @@ class SCMTool(object):
         return patch
 
     @classmethod
-    def popen(cls, command, local_site_name=None):
+    def popen(cls, command, local_site_name=None, stdin=None,
+              stderr=subprocess.PIPE):
         """Launches an application, capturing output.
 
         This wraps subprocess.Popen to provide some common parameters and
         to pass environment variables that may be needed by rbssh, if
         indirectly invoked.
+
+        Passing ``stdin=subprocess.PIPE`` allows writing to the
+        application's input. Long-lived applications whose errors aren't
+        read should pass a different ``stderr``, so that they can't block
+        on a full pipe.
         """
         env = os.environ.copy()
 
@@ -230,7 +273,8 @@ class SCMTool(object):
 
         return subprocess.Popen(command,
                                 env=env,
-                                stderr=subprocess.PIPE,
+                                stdin=stdin,
+                                stderr=stderr,
                                 stdout=subprocess.PIPE,
                                 close_fds=(os.name != 'nt'))
 
@@ -334,3 +378,170 @@ class SCMClient(object):
             msg = "Unexpected error fetching file from %s: %s" % (url, e)
             logging.error(msg)
             raise SCMError(msg)
+
+
+class Coprocess(object):
+    """A long-lived process that commands are sent to over pipes.
+
+    Starting some tools (such as git or hg) costs more than the commands
+    run with them. Rather than running the tool for every command, a
+    subclass keeps a process running for a repository, and implements the
+    tool's protocol for sending it commands and reading their results.
+
+    Commands are run one at a time. If the process dies or gets out of
+    sync, it's restarted and the command is tried again. Processes that
+    have been idle for IDLE_TIMEOUT seconds are stopped (and will be
+    started again when next used).
+    """
+    # The number of seconds a process can be idle before it's stopped.
+    IDLE_TIMEOUT = 5 * 60
+
+    # The errors raised when the process has died or can't be understood.
+    process_errors = (IOError, OSError, ValueError)
+
+    # The message for the SCMError raised when a command can't be run, even
+    # after restarting the process. This is given the error.
+    error_message = None
+
+    def __init__(self, local_site_name=None):
+        self.local_site_name = local_site_name
+        self.process = None
+        self.last_used = None
+        self._lock = threading.Lock()
+
+        # Whether results are still to be read for a command. If a command
+        # is interrupted, this stays set, and the process is restarted
+        # rather than reading the wrong results.
+        self._out_of_sync = False
+
+    def is_idle(self):
+        """Returns whether the process has been idle for too long."""
+        return (self.process is not None and
+                time.time() - self.last_used >= self.IDLE_TIMEOUT)
+
+    def stop(self):
+        """Stops the process, if it's running."""
+        with self._lock:
+            self._stop()
+
+    def stop_if_idle(self):
+        """Stops the process if it's been idle for too long.
+
+        A process that's running a command isn't idle, so this doesn't
+        wait for the command to finish.
+        """
+        if self._lock.acquire(False):
+            try:
+                if self.is_idle():
+                    self._stop()
+            finally:
+                self._lock.release()
+
+    def _run(self, func, *args):
+        """Runs a command on the process.
+
+        ``func`` is called with ``args`` to send the command and read its
+        results, once the process has been started. It's retried once on a
+        new process if it fails with one of ``process_errors``.
+        """
+        with self._lock:
+            # The process is in use from the time the command starts, so
+            # that it isn't stopped while running a slow command.
+            self.last_used = time.time()
+
+            try:
+                try:
+                    return self._run_once(func, args)
+                except self.process_errors as e:
+                    logging.warning('Restarting %s: %s', self, e)
+                    self._stop()
+
+                try:
+                    return self._run_once(func, args)
+                except self.process_errors as e:
+                    self._stop()
+
+                    raise SCMError(self.error_message % e)
+            finally:
+                self.last_used = time.time()
+
+    def _run_once(self, func, args):
+        """Runs a command, without locking or handling errors."""
+        if (self.process is None or
+            self.process.poll() is not None or
+            self._out_of_sync):
+            self._stop()
+            self._start()
+
+        self._out_of_sync = True
+        result = func(*args)
+        self._out_of_sync = False
+
+        return result
+
+    def _start(self):
+        """Starts the process.
+
+        Subclasses must implement this, setting ``self.process``.
+        """
+        raise NotImplementedError
+
+    def _stop(self):
+        """Stops the process, without locking."""
+        self._out_of_sync = False
+
+        if self.process is not None:
+            process = self.process
+            self.process = None
+
+            try:
+                process.stdin.close()
+            except (IOError, OSError):
+                pass
+
+            if process.poll() is None:
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+            process.wait()
+            process.stdout.close()
+
+
+class CoprocessRegistry(object):
+    """The Coprocesses for a tool, kept for reuse within a worker.
+
+    There's one Coprocess for each set of arguments (such as a repository's
+    path) passed to get(). Any that have been idle for too long are stopped
+    whenever one is looked up.
+    """
+    def __init__(self, coprocess_cls):
+        self.coprocess_cls = coprocess_cls
+        self._coprocesses = {}
+        self._lock = threading.Lock()
+
+    def get(self, *args):
+        """Returns the Coprocess for the given arguments.
+
+        The Coprocess is created with the arguments if it doesn't exist.
+        """
+        with self._lock:
+            idle = [
+                coprocess
+                for coprocess in six.itervalues(self._coprocesses)
+                if coprocess.is_idle()
+            ]
+
+            try:
+                coprocess = self._coprocesses[args]
+            except KeyError:
+                coprocess = self.coprocess_cls(*args)
+                self._coprocesses[args] = coprocess
+
+        # Stopping a process may have to wait for it to exit, so it's done
+        # without holding the lock.
+        for idle_coprocess in idle:
+            idle_coprocess.stop_if_idle()
+
+        return coprocess
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 import logging
 import os
 import re
+import subprocess
 
 from django.utils.translation import ugettext_lazy as _
 from djblets.util.compat import six
@@ -10,7 +11,9 @@ from djblets.util.compat.six.moves.urllib.parse import quote as urlquote
 from djblets.util.filesystem import is_exe_in_path
 
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError, File
-from reviewboard.scmtools.core import SCMClient, SCMTool, HEAD, PRE_CREATION
+from reviewboard.scmtools.core import (Coprocess, CoprocessRegistry,
+                                       SCMClient, SCMTool, HEAD,
+                                       PRE_CREATION)
 from reviewboard.scmtools.errors import (FileNotFoundError,
                                          InvalidRevisionFormatError,
                                          RepositoryNotFoundError,
@@ -96,6 +99,36 @@ class GitTool(SCMTool):
         except (FileNotFoundError, InvalidRevisionFormatError):
             return False
 
+    def get_files_exist(self, paths_and_revisions):
+        results = [False] * len(paths_and_revisions)
+        indexes = [
+            i
+            for i, (path, revision) in enumerate(paths_and_revisions)
+            if revision != PRE_CREATION
+        ]
+        files_exist = self.client.get_files_exist([
+            paths_and_revisions[i]
+            for i in indexes
+        ])
+
+        for i, exists in zip(indexes, files_exist):
+            results[i] = exists
+
+        return results
+
+    def get_files(self, paths_and_revisions):
+        fetched = self.client.get_files([
+            (path, revision)
+            for path, revision in paths_and_revisions
+            if revision != PRE_CREATION
+        ])
+
+        for path, revision in paths_and_revisions:
+            if revision == PRE_CREATION:
+                yield path, revision, ""
+            else:
+                yield next(fetched)
+
     def parse_diff_revision(self, file_str, revision_str, moved=False,
                             *args, **kwargs):
         revision = revision_str
@@ -156,7 +189,7 @@ class GitDiffParser(DiffParser):
         """
         self.files = []
         i = 0
-        preamble = ''
+        preamble_start = None
 
         while i < len(self.lines):
             next_i, file_info, new_diff = self._parse_diff(i)
@@ -164,24 +197,27 @@ class GitDiffParser(DiffParser):
             if file_info:
                 self._ensure_file_has_required_fields(file_info)
 
-                if preamble:
-                    file_info.data = preamble + file_info.data
-                    preamble = ''
+                if preamble_start is not None:
+                    file_info.data_line_ranges.insert(0, [preamble_start, i])
+                    preamble_start = None
 
                 self.files.append(file_info)
             elif new_diff:
                 # We found a diff, but it was empty and has no file entry.
                 # Reset the preamble.
-                preamble = ''
-            else:
-                preamble += self.lines[i] + '\n'
+                preamble_start = None
+            elif preamble_start is None:
+                preamble_start = i
 
             i = next_i
 
-        if not self.files and preamble.strip() != '':
+        if (not self.files and preamble_start is not None and
+            any(line.strip() for line in self.lines[preamble_start:i])):
             # This is probably not an actual git diff file.
             raise DiffParserError('This does not appear to be a git diff', 0)
 
+        self.finalize_files()
+
         return self.files
 
     def _parse_diff(self, linenum):
@@ -206,7 +242,7 @@ class GitDiffParser(DiffParser):
 
         # Now we have a diff we are going to use so get the filenames + commits
         file_info = File()
-        file_info.data = self.lines[linenum] + "\n"
+        self.add_file_data(file_info, linenum)
         file_info.binary = False
         diff_line = self.lines[linenum].split()
 
@@ -223,20 +259,17 @@ class GitDiffParser(DiffParser):
         # Parse the extended header to save the new file, deleted file,
         # mode change, file move, and index.
         if self._is_new_file(linenum):
-            file_info.data += self.lines[linenum] + "\n"
+            self.add_file_data(file_info, linenum)
             linenum += 1
         elif self._is_deleted_file(linenum):
-            file_info.data += self.lines[linenum] + "\n"
+            self.add_file_data(file_info, linenum)
             linenum += 1
             file_info.deleted = True
         elif self._is_mode_change(linenum):
-            file_info.data += self.lines[linenum] + "\n"
-            file_info.data += self.lines[linenum + 1] + "\n"
+            self.add_file_data(file_info, linenum, 2)
             linenum += 2
         elif self._is_moved_file(linenum):
-            file_info.data += self.lines[linenum] + "\n"
-            file_info.data += self.lines[linenum + 1] + "\n"
-            file_info.data += self.lines[linenum + 2] + "\n"
+            self.add_file_data(file_info, linenum, 3)
             linenum += 3
             file_info.moved = True
 
@@ -257,7 +290,7 @@ class GitDiffParser(DiffParser):
             if self.pre_creation_regexp.match(file_info.origInfo):
                 file_info.origInfo = PRE_CREATION
 
-            file_info.data += self.lines[linenum] + "\n"
+            self.add_file_data(file_info, linenum)
             linenum += 1
 
         # Get the changes
@@ -266,7 +299,7 @@ class GitDiffParser(DiffParser):
                 break
             elif self._is_binary_patch(linenum):
                 file_info.binary = True
-                file_info.data += self.lines[linenum] + "\n"
+                self.add_file_data(file_info, linenum)
                 empty_change = False
                 linenum += 1
                 break
@@ -274,8 +307,7 @@ class GitDiffParser(DiffParser):
                 if self.lines[linenum].split()[1] == "/dev/null":
                     file_info.origInfo = PRE_CREATION
 
-                file_info.data += self.lines[linenum] + '\n'
-                file_info.data += self.lines[linenum + 1] + '\n'
+                self.add_file_data(file_info, linenum, 2)
                 linenum += 2
             else:
                 empty_change = False
@@ -336,9 +368,133 @@ class GitDiffParser(DiffParser):
                 setattr(file_info, attr, '')
 
 
+class GitCatFileProcess(Coprocess):
+    """A long-lived git cat-file process for looking up objects.
+
+    Rather than running git cat-file for every object, this keeps a
+    ``git cat-file --batch`` (for fetching contents) or ``--batch-check``
+    (for fetching types) process running, and writes object names to it,
+    so that each lookup only costs a round trip through a pipe.
+
+    Several object names can be looked up at once, in which case they're
+    pipelined to the process.
+    """
+    error_message = _('Unable to look up objects in the local Git '
+                      'repository: %s')
+
+    # The maximum number of bytes of object names written to the process
+    # before reading the results. This is kept well below the size of a
+    # pipe's buffer, so that writing can never block while the process is
+    # blocked writing results we haven't read yet.
+    MAX_PIPELINE_BYTES = 4096
+
+    def __init__(self, git_dir, batch_option, local_site_name=None):
+        super(GitCatFileProcess, self).__init__(local_site_name)
+
+        self.git_dir = git_dir
+        self.batch_option = batch_option
+
+    def __str__(self):
+        return 'git cat-file %s for %s' % (self.batch_option, self.git_dir)
+
+    def lookup(self, object_names):
+        """Looks up a list of objects.
+
+        This returns a list of (type, contents) tuples, in the same order
+        as ``object_names``. The contents are None when using
+        ``--batch-check``, and both are None for objects that don't exist
+        (or for ambiguous names).
+        """
+        return self._run(self._lookup, object_names)
+
+    def _lookup(self, object_names):
+        """Looks up a list of objects, without handling errors."""
+        results = []
+        batch = []
+        batch_size = 0
+
+        for object_name in object_names:
+            object_name = object_name.encode('utf-8') + b'\n'
+
+            if (batch and
+                batch_size + len(object_name) > self.MAX_PIPELINE_BYTES):
+                results += self._lookup_batch(batch)
+                batch = []
+                batch_size = 0
+
+            batch.append(object_name)
+            batch_size += len(object_name)
+
+        if batch:
+            results += self._lookup_batch(batch)
+
+        return results
+
+    def _lookup_batch(self, batch):
+        """Writes a batch of object names and reads their results."""
+        self.process.stdin.write(b''.join(batch))
+        self.process.stdin.flush()
+
+        return [
+            self._read_result()
+            for i in range(len(batch))
+        ]
+
+    def _read_result(self):
+        """Reads the result of looking up an object."""
+        header = self.process.stdout.readline()
+
+        if not header.endswith(b'\n'):
+            raise IOError('git cat-file exited unexpectedly')
+
+        header = header[:-1]
+
+        if header.endswith(b' missing') or header.endswith(b' ambiguous'):
+            return None, None
+
+        obj_type, size = header.split(b' ')[1:]
+        contents = None
+
+        if self.batch_option == '--batch':
+            size = int(size)
+            contents = self.process.stdout.read(size + 1)
+
+            if len(contents) != size + 1:
+                raise IOError('git cat-file exited unexpectedly')
+
+            contents = contents[:-1]
+
+        return obj_type.decode('utf-8'), contents
+
+    def _start(self):
+        """Starts the process."""
+        with open(os.devnull, 'w') as devnull:
+            self.process = SCMTool.popen(
+                ['git', '--git-dir=%s' % self.git_dir, 'cat-file',
+                 self.batch_option],
+                local_site_name=self.local_site_name,
+                stdin=subprocess.PIPE,
+                stderr=devnull)
+
+
+_cat_file_processes = CoprocessRegistry(GitCatFileProcess)
+
+
+def get_cat_file_process(git_dir, batch_option, local_site_name=None):
+    """Returns the git cat-file process for a repository.
+
+    There's one process for each repository and batch option in each
+    worker. Any processes that have been idle for too long are stopped.
+    """
+    return _cat_file_processes.get(git_dir, batch_option, local_site_name)
+
+
 class GitClient(SCMClient):
     FULL_SHA1_LENGTH = 40
 
+    # The number of files fetched at a time by get_files.
+    GET_FILES_BATCH_SIZE = 20
+
     schemeless_url_re = re.compile(
         r'^(?P<username>[A-Za-z0-9_\.-]+@)?(?P<hostname>[A-Za-z0-9_\.-]+):'
         r'(?P<path>.*)')
@@ -415,6 +571,87 @@ class GitClient(SCMClient):
             contents = self._cat_file(path, revision, "-t")
             return contents and contents.strip() == "blob"
 
+    def get_files_exist(self, paths_and_revisions):
+        """Returns whether each of a list of files exists.
+
+        For local repositories, the files are all looked up at once through
+        git cat-file.
+        """
+        if self.raw_file_url:
+            return [
+                self.get_file_exists(path, revision)
+                for path, revision in paths_and_revisions
+            ]
+
+        object_names = [
+            self._resolve_head(revision, path)
+            for path, revision in paths_and_revisions
+        ]
+
+        # Object names are written to git cat-file one per line, so there
+        # can't be objects with newlines in their names.
+        lookup_names = [
+            object_name
+            for object_name in object_names
+            if '\n' not in object_name
+        ]
+
+        cat_file = get_cat_file_process(self.git_dir, '--batch-check',
+                                        self.local_site_name)
+        obj_types = dict(
+            (object_name, obj_type)
+            for object_name, (obj_type, contents) in zip(
+                lookup_names, cat_file.lookup(lookup_names))
+        )
+
+        return [
+            obj_types.get(object_name) == 'blob'
+            for object_name in object_names
+        ]
+
+    def get_files(self, paths_and_revisions):
+        """Fetches the contents of a list of files.
+
+        This yields a (path, revision, data) tuple for each file, with None
+        for the data of files that don't exist. For local repositories, the
+        files are fetched in batches through git cat-file.
+        """
+        if self.raw_file_url:
+            for path, revision in paths_and_revisions:
+                try:
+                    data = self.get_file(path, revision)
+                except FileNotFoundError:
+                    data = None
+
+                yield path, revision, data
+
+            return
+
+        cat_file = get_cat_file_process(self.git_dir, '--batch',
+                                        self.local_site_name)
+
+        for i in range(0, len(paths_and_revisions),
+                       self.GET_FILES_BATCH_SIZE):
+            batch = paths_and_revisions[i:i + self.GET_FILES_BATCH_SIZE]
+            object_names = [
+                self._resolve_head(revision, path)
+                for path, revision in batch
+            ]
+            lookup_names = [
+                object_name
+                for object_name in object_names
+                if '\n' not in object_name
+            ]
+            results = dict(zip(lookup_names, cat_file.lookup(lookup_names)))
+
+            for (path, revision), object_name in zip(batch, object_names):
+                obj_type, contents = results.get(object_name, (None, None))
+
+                if obj_type != 'blob':
+                    contents = None
+
+                yield path, revision, contents
+
     def validate_sha1_format(self, path, sha1):
         """Validates that a SHA1 is of the right length for this repository."""
         if self.raw_file_url and len(sha1) != self.FULL_SHA1_LENGTH:
@@ -433,30 +670,43 @@ class GitClient(SCMClient):
 
     def _cat_file(self, path, revision, option):
         """
-        Call git-cat-file(1) to get content or type information for a
-        repository object.
+        Look up a repository object through git-cat-file(1) to get its
+        content or type information.
 
-        If called with just "commit", gets the content of a blob (or
-        raises an exception if the commit is not a blob).
+        If called with "blob", gets the content of a blob (or raises an
+        exception if the object is not a blob).
 
-        Otherwise, "option" can be used to pass a switch to git-cat-file,
-        e.g. to test or existence or get the type of "commit".
+        If called with "-t", gets the type of the object.
+
+        The lookup goes through a long-lived git cat-file process, rather
+        than running a new one each time.
         """
         commit = self._resolve_head(revision, path)
 
-        p = self._run_git(['--git-dir=%s' % self.git_dir, 'cat-file',
-                           option, commit])
-        contents = p.stdout.read()
-        errmsg = six.text_type(p.stderr.read())
-        failure = p.wait()
+        if '\n' in commit:
+            # Object names are written to git cat-file one per line, so
+            # there can't be an object with this name.
+            raise FileNotFoundError(commit)
 
-        if failure:
-            if errmsg.startswith("fatal: Not a valid object name"):
-                raise FileNotFoundError(commit)
-            else:
-                raise SCMError(errmsg)
+        if option == 'blob':
+            batch_option = '--batch'
+        else:
+            batch_option = '--batch-check'
+
+        cat_file = get_cat_file_process(self.git_dir, batch_option,
+                                        self.local_site_name)
+        obj_type, contents = cat_file.lookup([commit])[0]
 
-        return contents
+        if obj_type is None:
+            raise FileNotFoundError(commit)
+
+        if option == 'blob':
+            if obj_type != 'blob':
+                raise SCMError('%s is a %s, not a blob' % (commit, obj_type))
+
+            return contents
+        else:
+            return obj_type
 
     def _resolve_head(self, revision, path):
         if revision == HEAD:
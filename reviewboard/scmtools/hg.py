@@ -1,8 +1,12 @@
 from __future__ import unicode_literals
 
 import logging
+import os
 import re
+import struct
+import subprocess
 
+from django.utils.translation import ugettext_lazy as _
 from djblets.util.compat import six
 from djblets.util.compat.six.moves.urllib.parse import quote as urllib_quote
 from pkg_resources import parse_version
@@ -10,7 +14,8 @@ from pkg_resources import parse_version
 from reviewboard.diffviewer.parser import DiffParser, DiffParserError
 from reviewboard.scmtools.git import GitDiffParser
 from reviewboard.scmtools.core import \
-    FileNotFoundError, SCMClient, SCMTool, HEAD, PRE_CREATION, UNKNOWN
+    Coprocess, CoprocessRegistry, FileNotFoundError, SCMClient, SCMTool, \
+    HEAD, PRE_CREATION, UNKNOWN
 from reviewboard.scmtools.errors import RepositoryNotFoundError
 
 
@@ -222,6 +227,117 @@ class HgWebClient(SCMClient):
         raise FileNotFoundError(path, rev)
 
 
+class HgCommandServer(Coprocess):
+    """A long-lived Mercurial command server for a local repository.
+
+    Every run of hg pays for starting Python and loading Mercurial and its
+    extensions. Rather than running hg for every command, this keeps an
+    ``hg serve --cmdserver pipe`` process running for the repository, and
+    sends it commands (such as cat, log or status) using Mercurial's
+    command server protocol, so that each command only costs a round trip
+    through a pipe.
+    """
+    process_errors = Coprocess.process_errors + (struct.error,)
+    error_message = _('Unable to run a command in the local Mercurial '
+                      'repository: %s')
+
+    def __init__(self, path, local_site_name=None):
+        super(HgCommandServer, self).__init__(local_site_name)
+
+        self.path = path
+
+    def __str__(self):
+        return 'the hg command server for %s' % self.path
+
+    def run_command(self, args):
+        """Runs an hg command.
+
+        This returns a tuple of the command's exit code and its output.
+        """
+        return self._run(self._run_command, args)
+
+    def _run_command(self, args):
+        """Runs an hg command, without handling errors."""
+        data = b'\0'.join(arg.encode('utf-8') for arg in args)
+
+        self.process.stdin.write(b'runcommand\n' +
+                                 struct.pack(str('>I'), len(data)) +
+                                 data)
+        self.process.stdin.flush()
+
+        output = []
+
+        while True:
+            channel, data = self._read_message()
+
+            if channel == b'o':
+                output.append(data)
+            elif channel == b'r':
+                result = struct.unpack(str('>i'), data)[0]
+                break
+            elif channel in (b'I', b'L'):
+                # The command wants input, which we never have.
+                self.process.stdin.write(struct.pack(str('>I'), 0))
+                self.process.stdin.flush()
+            elif channel.isupper():
+                raise IOError('Unexpected required channel %r from hg'
+                              % channel)
+
+        return result, b''.join(output)
+
+    def _read_message(self):
+        """Reads a message from one of the command server's channels.
+
+        This returns a tuple of the channel and the data. For the input
+        channels, the data is the amount of input requested.
+        """
+        header = self.process.stdout.read(5)
+
+        if len(header) != 5:
+            raise IOError('hg exited unexpectedly')
+
+        channel, length = struct.unpack(str('>cI'), header)
+
+        if channel in (b'I', b'L'):
+            return channel, length
+
+        data = self.process.stdout.read(length)
+
+        if len(data) != length:
+            raise IOError('hg exited unexpectedly')
+
+        return channel, data
+
+    def _start(self):
+        """Starts the process, and reads the command server's greeting."""
+        with open(os.devnull, 'w') as devnull:
+            self.process = SCMTool.popen(
+                ['hg', '--noninteractive',
+                 '--repository', self.path,
+                 '--cwd', self.path,
+                 'serve', '--cmdserver', 'pipe'],
+                local_site_name=self.local_site_name,
+                stdin=subprocess.PIPE,
+                stderr=devnull)
+
+        channel, hello = self._read_message()
+
+        if channel != b'o' or b'runcommand' not in hello:
+            raise IOError('Unexpected hello message from hg: %r' % hello)
+
+
+_command_servers = CoprocessRegistry(HgCommandServer)
+
+
+def get_command_server(path, local_site_name=None):
+    """Returns the hg command server for a local repository.
+
+    There's one command server for each repository in each worker. Any
+    command servers that have been idle for too long are stopped.
+    """
+    return _command_servers.get(path, local_site_name)
+
+
 class HgClient(SCMClient):
     def __init__(self, path, local_site):
         super(HgClient, self).__init__(path)
@@ -232,6 +348,10 @@ class HgClient(SCMClient):
         else:
             self.local_site_name = None
 
+        # Commands for local repositories go through a command server.
+        # Anything else (such as a remote repository) runs hg each time.
+        self.use_command_server = os.path.isdir(path)
+
     def cat_file(self, path, rev="tip"):
         if rev == HEAD:
             rev = "tip"
@@ -239,9 +359,16 @@ class HgClient(SCMClient):
             rev = ""
 
         if path:
-            p = self._run_hg(['cat', '--rev', rev, path])
-            contents = p.stdout.read()
-            failure = p.wait()
+            args = ['cat', '--rev', rev, path]
+
+            if self.use_command_server:
+                command_server = get_command_server(self.path,
+                                                    self.local_site_name)
+                failure, contents = command_server.run_command(args)
+            else:
+                p = self._run_hg(args)
+                contents = p.stdout.read()
+                failure = p.wait()
 
             if not failure:
                 return contents
@@ -1,5 +1,8 @@
 from __future__ import unicode_literals
 
+import logging
+import zlib
+
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
@@ -10,8 +13,10 @@ from django.utils.translation import ugettext_lazy as _
 from djblets.cache.backend import cache_memoize, make_cache_key
 from djblets.db.fields import JSONField
 from djblets.log import log_timed
+from djblets.util.compat.six.moves import cPickle as pickle
 
 from reviewboard.hostingsvcs.models import HostingServiceAccount
+from reviewboard.scmtools.errors import FileNotFoundError
 from reviewboard.scmtools.managers import RepositoryManager, ToolManager
 from reviewboard.scmtools.signals import (checked_file_exists,
                                           checking_file_exists,
@@ -219,6 +224,155 @@ class Repository(models.Model):
 
         return exists
 
+    def get_files_exist(self, paths_and_revisions, base_commit_id=None,
+                        request=None):
+        """Returns whether or not each of a list of files exists.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        returns a list of booleans, in the same order.
+
+        Like get_file_exists, the results are cached for each file. Files
+        that aren't already known to exist are checked all at once through
+        the hosting service or SCMTool, which can be much faster than
+        checking them one at a time.
+        """
+        exists_keys = [
+            make_cache_key(self._make_file_exists_cache_key(
+                path, revision, base_commit_id))
+            for path, revision in paths_and_revisions
+        ]
+        file_keys = [
+            make_cache_key(self._make_file_cache_key(
+                path, revision, base_commit_id))
+            for path, revision in paths_and_revisions
+        ]
+        cached = cache.get_many(exists_keys + file_keys)
+
+        results = [
+            cached.get(exists_key) == '1' or file_key in cached
+            for exists_key, file_key in zip(exists_keys, file_keys)
+        ]
+        uncached = [
+            i
+            for i, exists in enumerate(results)
+            if not exists
+        ]
+
+        if not uncached:
+            return results
+
+        uncached_paths_and_revisions = [
+            paths_and_revisions[i]
+            for i in uncached
+        ]
+
+        for path, revision in uncached_paths_and_revisions:
+            checking_file_exists.send(sender=self,
+                                      path=path,
+                                      revision=revision,
+                                      base_commit_id=base_commit_id,
+                                      request=request)
+
+        hosting_service = self.hosting_service
+
+        if hosting_service:
+            uncached_results = hosting_service.get_files_exist(
+                self,
+                uncached_paths_and_revisions,
+                base_commit_id=base_commit_id)
+        else:
+            uncached_results = self.get_scmtool().get_files_exist(
+                uncached_paths_and_revisions)
+
+        for i, exists in zip(uncached, uncached_results):
+            path, revision = paths_and_revisions[i]
+
+            checked_file_exists.send(sender=self,
+                                     path=path,
+                                     revision=revision,
+                                     base_commit_id=base_commit_id,
+                                     request=request,
+                                     exists=exists)
+
+            if exists:
+                cache_memoize(self._make_file_exists_cache_key(
+                                  path, revision, base_commit_id),
+                              lambda: '1')
+
+            results[i] = exists
+
+        return results
+
+    def get_files(self, paths_and_revisions, base_commit_id=None,
+                  request=None):
+        """Returns the contents of a list of files from the repository.
+
+        ``paths_and_revisions`` is a list of (path, revision) tuples. This
+        yields a (path, revision, data) tuple for each file, in the same
+        order. Files that don't exist are yielded with None for their data.
+
+        Like get_file, the contents are cached for each file. Files that
+        aren't already in the cache are fetched all at once through the
+        hosting service or SCMTool, which can be much faster than fetching
+        them one at a time. Each file is cached and yielded as soon as it's
+        been fetched.
+        """
+        file_keys = [
+            self._make_file_cache_key(path, revision, base_commit_id)
+            for path, revision in paths_and_revisions
+        ]
+        # The first part of each cached file is fetched along with its part
+        # count, which covers every file that fits in a single part.
+        cached = cache.get_many(
+            [make_cache_key(key) for key in file_keys] +
+            [make_cache_key('%s-0' % key) for key in file_keys])
+        extra_part_keys = []
+
+        for key in file_keys:
+            try:
+                num_parts = int(cached.get(make_cache_key(key), 0))
+            except (TypeError, ValueError):
+                continue
+
+            extra_part_keys += [
+                make_cache_key('%s-%d' % (key, i))
+                for i in range(1, num_parts)
+            ]
+
+        if extra_part_keys:
+            cached.update(cache.get_many(extra_part_keys))
+
+        uncached = [
+            (path, revision)
+            for (path, revision), key in zip(paths_and_revisions, file_keys)
+            if make_cache_key(key) not in cached
+        ]
+
+        # Nothing is fetched until the first uncached file is reached.
+        fetched = self._get_files_uncached(uncached, base_commit_id, request)
+
+        for (path, revision), key in zip(paths_and_revisions, file_keys):
+            if make_cache_key(key) in cached:
+                result = self._load_cached_file(key, cached)
+
+                if result is not None:
+                    data = result[0]
+                else:
+                    # Part of the entry expired after it was looked up, so
+                    # go through get_file to fetch and cache it again.
+                    try:
+                        data = self.get_file(path, revision, base_commit_id,
+                                             request)
+                    except FileNotFoundError:
+                        data = None
+            else:
+                data = next(fetched)[2]
+
+                if data is not None:
+                    cache_memoize(key, lambda: [data], large_data=True)
+
+            yield path, revision, data
+
     def get_branches(self):
         """Returns a list of branches."""
         hosting_service = self.hosting_service
@@ -313,6 +467,29 @@ class Repository(models.Model):
                                             urlquote(revision),
                                             urlquote(base_commit_id or ''))
 
+    def _load_cached_file(self, key, cached):
+        """Internal function for loading a file from cache lookup results.
+
+        get_file caches files through cache_memoize's large data support,
+        which stores the pickled, compressed data in parts, along with the
+        number of parts under the key itself. This decodes an entry from
+        the results of a cache.get_many call, returning the cached list
+        containing the file's contents, or None if any part of it is
+        missing or can't be decoded.
+        """
+        try:
+            num_parts = int(cached[make_cache_key(key)])
+            data = b''.join(
+                cached[make_cache_key('%s-%d' % (key, i))][0]
+                for i in range(num_parts)
+            )
+
+            return pickle.loads(zlib.decompress(data))
+        except Exception as e:
+            logging.warning('Failed to load cached file for key %s: %s'
+                            % (key, e))
+            return None
+
     def _get_file_uncached(self, path, revision, base_commit_id, request):
         """Internal function for fetching an uncached file.
 
@@ -355,6 +532,52 @@ class Repository(models.Model):
 
         return data
 
+    def _get_files_uncached(self, paths_and_revisions, base_commit_id,
+                            request):
+        """Internal function for fetching a list of uncached files.
+
+        This is called by get_files for the files that aren't already in
+        the cache, and yields the results as they're fetched.
+        """
+        for path, revision in paths_and_revisions:
+            fetching_file.send(sender=self,
+                               path=path,
+                               revision=revision,
+                               base_commit_id=base_commit_id,
+                               request=request)
+
+        if base_commit_id:
+            timer_msg = "Fetching %d files (base commit ID %s) from %s" \
+                        % (len(paths_and_revisions), base_commit_id, self)
+        else:
+            timer_msg = "Fetching %d files from %s" \
+                        % (len(paths_and_revisions), self)
+
+        log_timer = log_timed(timer_msg, request=request)
+
+        hosting_service = self.hosting_service
+
+        if hosting_service:
+            results = hosting_service.get_files(
+                self,
+                paths_and_revisions,
+                base_commit_id=base_commit_id)
+        else:
+            results = self.get_scmtool().get_files(paths_and_revisions)
+
+        for path, revision, data in results:
+            if data is not None:
+                fetched_file.send(sender=self,
+                                  path=path,
+                                  revision=revision,
+                                  base_commit_id=base_commit_id,
+                                  request=request,
+                                  data=data)
+
+            yield path, revision, data
+
+        log_timer.done()
+
     def _get_file_exists_uncached(self, path, revision, base_commit_id,
                                   request):
         """Internal function for checking that a file exists.
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import logging
 import os
 import random
 import re
@@ -8,6 +9,7 @@ import signal
 import socket
 import subprocess
 import tempfile
+import threading
 import time
 
 from django.utils.translation import ugettext_lazy as _
@@ -67,6 +69,16 @@ class STunnelProxy(object):
             f.close()
         shutil.rmtree(tempdir)
 
+    def is_running(self):
+        if not self.pid:
+            return False
+
+        try:
+            os.kill(self.pid, 0)
+            return True
+        except OSError:
+            return False
+
     def shutdown(self):
         if self.pid:
             os.kill(self.pid, signal.SIGTERM)
@@ -87,7 +99,81 @@ class STunnelProxy(object):
                 pass
 
 
-class PerforceClient(object):
+class PerforceConnection(object):
+    """A connection to a Perforce server.
+
+    Connections are handed out by a PerforceConnectionPool, and are only
+    used by one thread at a time.
+    """
+    def __init__(self, pool):
+        import P4
+
+        self.pool = pool
+        self.p4 = P4.P4()
+        self.reused = False
+        self.last_used = None
+
+    def connect(self, p4_port):
+        """Connects to the server, logging in if using ticket auth."""
+        pool = self.pool
+
+        self.p4.user = pool.username.encode('utf-8')
+        self.p4.password = pool.password.encode('utf-8')
+
+        if pool.encoding:
+            self.p4.charset = pool.encoding.encode('utf-8')
+
+        self.p4.exception_level = 1
+        self.p4.port = p4_port.encode('utf-8')
+
+        self.p4.connect()
+
+        if pool.use_ticket_auth:
+            self.p4.run_login()
+
+        self.last_used = time.time()
+
+    def is_connected(self):
+        """Returns whether the connection is still open.
+
+        This is false if the server has dropped the connection.
+        """
+        try:
+            return self.p4.connected()
+        except AttributeError:
+            return False
+
+    def disconnect(self):
+        """Disconnects from the server."""
+        try:
+            if self.p4.connected():
+                self.p4.disconnect()
+        except AttributeError:
+            pass
+        except P4Exception as e:
+            logging.warning('Error disconnecting from Perforce server %s: %s',
+                            self.pool.p4port, e)
+
+
+class PerforceConnectionPool(object):
+    """A pool of connections to a Perforce server, for one set of credentials.
+
+    Connecting to a Perforce server (especially through SSL or stunnel, and
+    with ticket auth) costs several round trips, so connections are kept
+    open and reused between commands. A connection is checked out for each
+    command, and returned to the pool afterward. Connections that have been
+    dropped by the server are thrown away, and connections that have been
+    idle for IDLE_TIMEOUT seconds are closed.
+
+    When using stunnel, all connections share one tunnel, which is shut down
+    once there are no more connections.
+    """
+    # The number of seconds a connection can be idle before it's closed.
+    IDLE_TIMEOUT = 5 * 60
+
+    # The maximum number of idle connections kept open.
+    MAX_IDLE_CONNECTIONS = 4
+
     def __init__(self, p4port, username, password, encoding, use_stunnel=False,
                  use_ticket_auth=False):
         self.p4port = p4port
@@ -97,61 +183,155 @@ class PerforceClient(object):
         self.use_stunnel = use_stunnel
         self.use_ticket_auth = use_ticket_auth
         self.proxy = None
+        self._idle_connections = []
+        self._num_active = 0
+        self._lock = threading.Lock()
 
-        import P4
-        self.p4 = P4.P4()
-
-        if use_stunnel and not is_exe_in_path('stunnel'):
-            raise AttributeError('stunnel proxy was requested, but stunnel '
-                                 'binary is not in the exec path.')
+    def acquire(self):
+        """Checks out a connection, connecting to the server if needed.
 
-    def _connect(self):
+        The connection must be given back with release() once it's no longer
+        being used.
         """
-        Connect to the perforce server.
+        with self._lock:
+            while self._idle_connections:
+                connection = self._idle_connections.pop()
 
-        This connects p4python to the remote server, optionally using a stunnel
-        proxy.
-        """
-        self.p4.user = self.username.encode('utf-8')
-        self.p4.password = self.password.encode('utf-8')
+                if connection.is_connected():
+                    self._num_active += 1
 
-        if self.encoding:
-            self.p4.charset = self.encoding.encode('utf-8')
+                    return connection
 
-        self.p4.exception_level = 1
+                connection.disconnect()
 
-        if self.use_stunnel:
-            # Spin up an stunnel client and then redirect through that
-            self.proxy = STunnelProxy(STUNNEL_CLIENT, self.p4port)
-            self.proxy.start_client()
-            p4_port = '127.0.0.1:%d' % self.proxy.port
-        else:
-            p4_port = self.p4port
+            self._num_active += 1
 
-        self.p4.port = p4_port.encode('utf-8')
+        try:
+            connection = PerforceConnection(self)
+            connection.connect(self._get_port())
+        except:
+            self.release(None)
+            raise
 
-        self.p4.connect()
+        return connection
 
-        if self.use_ticket_auth:
-            self.p4.run_login()
+    def release(self, connection, reusable=True):
+        """Gives back a connection checked out with acquire().
 
-    def _disconnect(self):
+        If the connection isn't reusable (for instance, because it may be in
+        a bad state after an error), it's closed.
         """
-        Disconnect from the perforce server, and also shut down the stunnel
-        proxy (if it exists).
+        with self._lock:
+            self._num_active -= 1
+
+            if (connection is not None and
+                reusable and
+                connection.is_connected() and
+                len(self._idle_connections) < self.MAX_IDLE_CONNECTIONS):
+                connection.reused = True
+                connection.last_used = time.time()
+                self._idle_connections.append(connection)
+                connection = None
+
+        if connection is not None:
+            connection.disconnect()
+
+        self._shutdown_proxy_if_unused()
+
+    def close_idle(self):
+        """Closes any connections that have been idle for too long."""
+        now = time.time()
+        expired = []
+
+        with self._lock:
+            for connection in list(self._idle_connections):
+                if now - connection.last_used >= self.IDLE_TIMEOUT:
+                    self._idle_connections.remove(connection)
+                    expired.append(connection)
+
+        for connection in expired:
+            connection.disconnect()
+
+        self._shutdown_proxy_if_unused()
+
+    def _get_port(self):
+        """Returns the port to connect to.
+
+        When using stunnel, this starts the tunnel if it's not running.
         """
+        if not self.use_stunnel:
+            return self.p4port
+
+        with self._lock:
+            if self.proxy is None or not self.proxy.is_running():
+                # Spin up an stunnel client and then redirect through that
+                proxy = STunnelProxy(STUNNEL_CLIENT, self.p4port)
+                proxy.start_client()
+                self.proxy = proxy
+
+            return '127.0.0.1:%d' % self.proxy.port
+
+    def _shutdown_proxy_if_unused(self):
+        """Shuts down the stunnel proxy if there are no connections."""
+        with self._lock:
+            if (self.proxy is None or
+                self._idle_connections or
+                self._num_active > 0):
+                return
+
+            proxy = self.proxy
+            self.proxy = None
+
         try:
-            if self.p4.connected():
-                self.p4.disconnect()
-        except AttributeError:
+            proxy.shutdown()
+        except:
             pass
 
-        if self.proxy:
-            try:
-                self.proxy.shutdown()
-            except:
-                pass
-            self.proxy = None
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(p4port, username, password, encoding,
+                        use_stunnel=False, use_ticket_auth=False):
+    """Returns the connection pool for a Perforce server and credentials.
+
+    There's one pool for each server, user and charset (and password and
+    connection options) in each worker. Any connections that have been idle
+    for too long are closed.
+    """
+    key = (p4port, username, password, encoding, use_stunnel,
+           use_ticket_auth)
+
+    with _connection_pools_lock:
+        for pool in six.itervalues(_connection_pools):
+            pool.close_idle()
+
+        try:
+            pool = _connection_pools[key]
+        except KeyError:
+            pool = PerforceConnectionPool(*key)
+            _connection_pools[key] = pool
+
+    return pool
+
+
+class PerforceClient(object):
+    # The maximum number of files to print with a single 'p4 print'.
+    MAX_PRINT_BATCH_SIZE = 100
+
+    def __init__(self, p4port, username, password, encoding, use_stunnel=False,
+                 use_ticket_auth=False):
+        self.p4port = p4port
+        self.username = username
+        self.password = password
+        self.encoding = encoding
+        self.use_stunnel = use_stunnel
+        self.use_ticket_auth = use_ticket_auth
+
+        if use_stunnel and not is_exe_in_path('stunnel'):
+            raise AttributeError('stunnel proxy was requested, but stunnel '
+                                 'binary is not in the exec path.')
 
     @staticmethod
     def _convert_p4exception_to_scmexception(e):
@@ -174,48 +354,93 @@ class PerforceClient(object):
         else:
             raise SCMError(error)
 
+    def _get_connection_pool(self):
+        return get_connection_pool(self.p4port, self.username, self.password,
+                                   self.encoding, self.use_stunnel,
+                                   self.use_ticket_auth)
+
     def _run_worker(self, worker):
-        result = None
+        """
+        Run a function with a connection to the server.
 
-        # TODO: Move to using with: when we require a minimum of Python 2.5.
-        #       We should make it auto-disconnect.
-        try:
-            self._connect()
-            result = worker()
-            self._disconnect()
-        except P4Exception as e:
-            self._disconnect()
-            self._convert_p4exception_to_scmexception(e)
-        except:
-            self._disconnect()
-            raise
+        The function is passed the P4 instance for a pooled connection. If
+        the function fails on a connection that's been reused, and the
+        connection has since been dropped by the server (or its ticket has
+        expired), the connection is thrown away and the function is retried
+        on another one.
+        """
+        pool = self._get_connection_pool()
+
+        while True:
+            connection = None
 
-        return result
+            try:
+                connection = pool.acquire()
+                result = worker(connection.p4)
+            except P4Exception as e:
+                if connection is None:
+                    self._convert_p4exception_to_scmexception(e)
+
+                retry = (connection.reused and
+                         (not connection.is_connected() or
+                          (self.use_ticket_auth and
+                           self._is_auth_error(e))))
+                pool.release(connection,
+                             reusable=not (retry or self._is_auth_error(e)))
+
+                if retry:
+                    logging.warning('Reconnecting to Perforce server %s: %s',
+                                    self.p4port, e)
+                    continue
+
+                self._convert_p4exception_to_scmexception(e)
+            except:
+                if connection is not None:
+                    pool.release(connection, reusable=False)
 
-    def _get_changeset(self, changesetid):
-        return self.p4.run_describe('-s', six.text_type(changesetid))
+                raise
+
+            pool.release(connection)
+
+            return result
+
+    @staticmethod
+    def _is_auth_error(e):
+        error = six.text_type(e)
+
+        return ('Perforce password' in error or
+                'Password must be set' in error or
+                'session has expired' in error)
+
+    def _get_changeset(self, p4, changesetid):
+        return p4.run_describe('-s', six.text_type(changesetid))
 
     def get_changeset(self, changesetid):
         """
         Get the contents of a changeset description.
         """
-        return self._run_worker(lambda: self._get_changeset(changesetid))
+        return self._run_worker(
+            lambda p4: self._get_changeset(p4, changesetid))
 
     def get_info(self):
-        return self._run_worker(self.p4.run_info)
+        return self._run_worker(lambda p4: p4.run_info())
 
-    def _get_pending_changesets(self, userid):
-        changesets = self.p4.run_changes('-s', 'pending', '-u', userid)
-        return map(self._get_changeset, [x.split()[1] for x in changesets])
+    def _get_pending_changesets(self, p4, userid):
+        changesets = p4.run_changes('-s', 'pending', '-u', userid)
+        return [
+            self._get_changeset(p4, x.split()[1])
+            for x in changesets
+        ]
 
     def get_pending_changesets(self, userid):
         """
         Get a list of changeset descriptions for all pending changesets for a
         given user.
         """
-        return self._run_worker(lambda: self._get_pending_changesets(userid))
+        return self._run_worker(
+            lambda p4: self._get_pending_changesets(p4, userid))
 
-    def _get_file(self, path, revision):
+    def _get_file(self, p4, path, revision):
         if revision == PRE_CREATION:
             return ''
         elif revision == HEAD:
@@ -223,7 +448,7 @@ class PerforceClient(object):
         else:
             depot_path = '%s#%s' % (path, revision)
 
-        res = self.p4.run_print('-q', depot_path)
+        res = p4.run_print('-q', depot_path)
         if res:
             return res[-1]
 
@@ -231,10 +456,130 @@ class PerforceClient(object):
         """
         Get the contents of a file, at a specific revision.
         """
-        return self._run_worker(lambda: self._get_file(path, revision))
+        return self._run_worker(
+            lambda p4: self._get_file(p4, path, revision))
+
+    def _get_files(self, p4, paths_and_revisions):
+        results = [None] * len(paths_and_revisions)
+        to_print = []
+
+        for i, (path, revision) in enumerate(paths_and_revisions):
+            if revision == PRE_CREATION:
+                results[i] = ''
+            else:
+                to_print.append(i)
+
+        for batch_start in range(0, len(to_print), self.MAX_PRINT_BATCH_SIZE):
+            batch = to_print[batch_start:
+                             batch_start + self.MAX_PRINT_BATCH_SIZE]
+            depot_paths = []
+
+            for i in batch:
+                path, revision = paths_and_revisions[i]
+
+                if revision == HEAD:
+                    depot_paths.append(path)
+                else:
+                    depot_paths.append('%s#%s' % (path, revision))
+
+            # Without -q, each file's contents are preceded by a dictionary
+            # describing the file. Files that don't exist only produce
+            # warnings, so the files are matched up with their descriptions,
+            # which are in the same order as the paths. The server may
+            # report paths as byte strings, and in a different case than
+            # requested, so they're compared normalized.
+            chunks = None
+            pos = 0
+
+            for item in p4.run_print(*depot_paths):
+                if isinstance(item, dict):
+                    chunks = None
+                    depot_file = self._normalize_print_value(
+                        item.get('depotFile'))
+                    rev = self._normalize_print_value(item.get('rev'))
+
+                    for j in range(pos, len(batch)):
+                        path, revision = paths_and_revisions[batch[j]]
+
+                        if (depot_file == self._normalize_print_value(path) and
+                            (revision == HEAD or
+                             rev == self._normalize_print_value(revision))):
+                            chunks = []
+                            results[batch[j]] = chunks
+                            pos = j + 1
+                            break
+                elif chunks is not None and item:
+                    # Large files may be split up into several items.
+                    chunks.append(item)
+
+            for i in batch:
+                if results[i] is not None:
+                    results[i] = b''.join(results[i])
+
+        return results
+
+    def _normalize_print_value(self, value):
+        """
+        Normalize a path or revision for matching 'p4 print' output to the
+        requested files. Values are decoded and case-folded.
+        """
+        if value is None:
+            return None
+        elif isinstance(value, bytes):
+            value = value.decode('utf-8', 'replace')
+        else:
+            value = six.text_type(value)
+
+        return value.lower()
+
+    def get_files(self, paths_and_revisions):
+        """
+        Get the contents of a list of files, at specific revisions.
+
+        Files are fetched in batches with a single 'p4 print' each. Files
+        that weren't found are returned as None.
+        """
+        return self._run_worker(
+            lambda p4: self._get_files(p4, paths_and_revisions))
+
+    def _get_files_exist(self, p4, paths_and_revisions):
+        depot_paths = []
+
+        for path, revision in paths_and_revisions:
+            if revision == HEAD:
+                depot_paths.append(path)
+            elif revision != PRE_CREATION:
+                depot_paths.append('%s#%s' % (path, revision))
+
+        # When a revision is given, fstat reports the revision of the file
+        # at that revision as its head revision.
+        head_revs = {}
+
+        if depot_paths:
+            for stat in p4.run_fstat('-T', 'depotFile,headRev,headAction',
+                                          *depot_paths):
+                if 'delete' not in stat.get('headAction', ''):
+                    head_revs.setdefault(stat['depotFile'], set()).add(
+                        stat['headRev'])
+
+        return [
+            (revision != PRE_CREATION and
+             path in head_revs and
+             (revision == HEAD or
+              six.text_type(revision) in head_revs[path]))
+            for path, revision in paths_and_revisions
+        ]
+
+    def get_files_exist(self, paths_and_revisions):
+        """
+        Get whether each of a list of files exists, at specific revisions.
+        This checks all the files with a single 'p4 fstat'.
+        """
+        return self._run_worker(
+            lambda p4: self._get_files_exist(p4, paths_and_revisions))
 
-    def _get_files_at_revision(self, revision_str):
-        return self.p4.run_files(revision_str)
+    def _get_files_at_revision(self, p4, revision_str):
+        return p4.run_files(revision_str)
 
     def get_files_at_revision(self, revision_str):
         """
@@ -242,7 +587,7 @@ class PerforceClient(object):
         to 'p4 files'
         """
         return self._run_worker(
-            lambda: self._get_files_at_revision(revision_str))
+            lambda p4: self._get_files_at_revision(p4, revision_str))
 
 
 class PerforceTool(SCMTool):
@@ -333,6 +678,27 @@ class PerforceTool(SCMTool):
     def get_file(self, path, revision=HEAD):
         return self.client.get_file(path, revision)
 
+    def get_files(self, paths_and_revisions):
+        results = self.client.get_files(paths_and_revisions)
+
+        for (path, revision), data in zip(paths_and_revisions, results):
+            if data is None:
+                # Files that couldn't be matched up with the batched output
+                # are fetched the usual way.
+                data = self.client.get_file(path, revision)
+
+            yield path, revision, data
+
+    def get_files_exist(self, paths_and_revisions):
+        results = self.client.get_files_exist(paths_and_revisions)
+
+        # Files that fstat didn't report (such as when the server's paths
+        # differ in case) are checked the usual way.
+        return [
+            exists or self.file_exists(path, revision)
+            for (path, revision), exists in zip(paths_and_revisions, results)
+        ]
+
     def parse_diff_revision(self, file_str, revision_str, *args, **kwargs):
         # Perforce has this lovely idiosyncracy that diffs show revision #1 both
         # for pre-creation and when there's an actual revision.
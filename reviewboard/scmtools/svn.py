@@ -4,21 +4,22 @@ from __future__ import unicode_literals
 import datetime
 import logging
 import os
+import posixpath
 import re
 import weakref
 from shutil import rmtree
 from tempfile import mkdtemp
 
 try:
-    from pysvn import (ClientError, Revision, opt_revision_kind,
-                       SVN_DIRENT_CREATED_REV)
+    from pysvn import (ClientError, Revision, depth, node_kind,
+                       opt_revision_kind, SVN_DIRENT_CREATED_REV)
 except ImportError:
     pass
 from django.core.cache import cache
 from django.utils.translation import ugettext as _
 from djblets.util.compat import six
 from djblets.util.compat.six.moves.urllib.parse import (urlsplit, urlunsplit,
-                                                        quote)
+                                                        quote, unquote)
 
 from reviewboard.diffviewer.parser import DiffParser
 from reviewboard.scmtools.certs import Certificate
@@ -206,6 +207,55 @@ class SVNTool(SCMTool):
 
         return self._do_on_path(get_file_keywords, path, revision)
 
+    def get_files_exist(self, paths_and_revisions):
+        """Returns whether each of a list of files exists.
+
+        Rather than fetching each file, the files in each directory are
+        listed with a single info2 call for the directory at each revision.
+        Files that aren't listed are checked the usual way.
+        """
+        def get_filenames(normpath, normrev):
+            filenames = set()
+
+            for entry_path, info in self.client.info2(normpath,
+                                                      revision=normrev,
+                                                      peg_revision=normrev,
+                                                      depth=depth.files):
+                if info['kind'] == node_kind.file:
+                    url = info['URL']
+
+                    if isinstance(url, six.text_type):
+                        url = url.encode('utf-8')
+
+                    filenames.add(
+                        unquote(url.rsplit(b'/', 1)[-1]).decode('utf-8'))
+
+            return filenames
+
+        dir_filenames = {}
+        results = []
+
+        for path, revision in paths_and_revisions:
+            exists = False
+
+            if path and revision != PRE_CREATION:
+                dirname = posixpath.dirname(path).rstrip('/') or self.repopath
+                key = (dirname, revision)
+
+                if key not in dir_filenames:
+                    try:
+                        dir_filenames[key] = self._do_on_path(
+                            get_filenames, dirname, revision)
+                    except (FileNotFoundError, SCMError):
+                        dir_filenames[key] = set()
+
+                exists = (posixpath.basename(path) in dir_filenames[key] or
+                          self.file_exists(path, revision))
+
+            results.append(exists)
+
+        return results
+
     def get_branches(self):
         """Returns a list of branches.
 
@@ -2,6 +2,8 @@
 from __future__ import unicode_literals
 
 import os
+import sys
+import types
 from errno import ECONNREFUSED
 from hashlib import md5
 from socket import error as SocketError
@@ -11,11 +13,14 @@ from django import forms
 from django.contrib.auth.models import AnonymousUser, User
 from django.core.cache import cache
 from django.test import TestCase as DjangoTestCase
+from djblets.cache.backend import CACHE_CHUNK_SIZE, make_cache_key
 from djblets.util.compat import six
 from djblets.util.compat.six.moves import zip_longest
 from djblets.util.filesystem import is_exe_in_path
+from kgb import SpyAgency
 import nose
 
+import reviewboard.scmtools.perforce as perforce
 from reviewboard.diffviewer.diffutils import patch
 from reviewboard.diffviewer.parser import DiffParserError
 from reviewboard.hostingsvcs.forms import HostingServiceForm
@@ -24,15 +29,19 @@ from reviewboard.hostingsvcs.service import (HostingService,
                                              register_hosting_service,
                                              unregister_hosting_service)
 from reviewboard.reviews.models import Group
-from reviewboard.scmtools.core import (Branch, ChangeSet, Commit, Revision,
+from reviewboard.scmtools.core import (Branch, ChangeSet, Commit, Coprocess,
+                                       CoprocessRegistry, Revision,
                                        HEAD, PRE_CREATION)
 from reviewboard.scmtools.errors import (SCMError, FileNotFoundError,
                                          RepositoryNotFoundError,
                                          AuthenticationError)
 from reviewboard.scmtools.forms import RepositoryForm
-from reviewboard.scmtools.git import ShortSHA1Error
+from reviewboard.scmtools.git import (GitCatFileProcess, ShortSHA1Error,
+                                      get_cat_file_process)
+from reviewboard.scmtools.hg import HgCommandServer, get_command_server
 from reviewboard.scmtools.models import Repository, Tool
-from reviewboard.scmtools.perforce import STunnelProxy, STUNNEL_SERVER
+from reviewboard.scmtools.perforce import (PerforceClient, STunnelProxy,
+                                           STUNNEL_SERVER)
 from reviewboard.scmtools.signals import (checked_file_exists,
                                           checking_file_exists,
                                           fetched_file, fetching_file)
@@ -166,12 +175,16 @@ class RepositoryTests(DjangoTestCase):
         self.scmtool_cls = self.repository.get_scmtool().__class__
         self.old_get_file = self.scmtool_cls.get_file
         self.old_file_exists = self.scmtool_cls.file_exists
+        self.old_get_files_exist = self.scmtool_cls.get_files_exist
+        self.old_get_files = self.scmtool_cls.get_files
 
     def tearDown(self):
         cache.clear()
 
         self.scmtool_cls.get_file = self.old_get_file
         self.scmtool_cls.file_exists = self.old_file_exists
+        self.scmtool_cls.get_files_exist = self.old_get_files_exist
+        self.scmtool_cls.get_files = self.old_get_files
 
     def test_get_file_caching(self):
         """Testing Repository.get_file caches result"""
@@ -331,6 +344,195 @@ class RepositoryTests(DjangoTestCase):
         self.assertEqual(found_signals[1],
                          ('checked_file_exists', path, revision, request))
 
+    def test_get_files(self):
+        """Testing Repository.get_files caches each file"""
+        def get_files(self, paths_and_revisions):
+            fetched.append(paths_and_revisions)
+
+            for path, revision in paths_and_revisions:
+                if revision == '12345':
+                    data = None
+                else:
+                    data = ('%s@%s' % (path, revision)).encode('utf-8')
+
+                yield path, revision, data
+
+        def on_fetched(sender, path, revision, request, data, **kwargs):
+            found_signals.append((path, revision, data))
+
+        fetched = []
+        found_signals = []
+        paths_and_revisions = [
+            ('readme', 'e965047'),
+            ('readme', '12345'),
+            ('readme', 'd6613f5'),
+        ]
+
+        self.scmtool_cls.get_files = get_files
+        fetched_file.connect(on_fetched, sender=self.repository)
+
+        files1 = list(self.repository.get_files(paths_and_revisions))
+        files2 = list(self.repository.get_files(paths_and_revisions))
+
+        expected_files = [
+            ('readme', 'e965047', b'readme@e965047'),
+            ('readme', '12345', None),
+            ('readme', 'd6613f5', b'readme@d6613f5'),
+        ]
+        self.assertEqual(files1, expected_files)
+        self.assertEqual(files2, expected_files)
+        self.assertEqual(fetched, [paths_and_revisions,
+                                   [('readme', '12345')]])
+        self.assertEqual(found_signals,
+                         [expected_files[0], expected_files[2]])
+
+        self.assertEqual(self.repository.get_file('readme', 'd6613f5'),
+                         b'readme@d6613f5')
+
+    def test_get_files_with_cached_files(self):
+        """Testing Repository.get_files loads cached files from a single
+        cache lookup
+        """
+        def get_file(self, path, revision):
+            return file_data[revision]
+
+        def get_files(self, paths_and_revisions):
+            raise AssertionError('get_files should not be called')
+
+        def repository_get_file(*args, **kwargs):
+            fetched.append(args)
+
+        fetched = []
+        file_data = {
+            'e965047': b'readme@e965047',
+            'd6613f5': os.urandom(CACHE_CHUNK_SIZE + 1),
+        }
+
+        self.scmtool_cls.get_file = get_file
+
+        for revision in file_data:
+            self.repository.get_file('readme', revision)
+
+        self.scmtool_cls.get_files = get_files
+        self.repository.get_file = repository_get_file
+
+        try:
+            files = list(self.repository.get_files([
+                ('readme', 'e965047'),
+                ('readme', 'd6613f5'),
+            ]))
+        finally:
+            del self.repository.get_file
+
+        self.assertEqual(files, [
+            ('readme', 'e965047', file_data['e965047']),
+            ('readme', 'd6613f5', file_data['d6613f5']),
+        ])
+        self.assertEqual(fetched, [])
+
+    def test_get_files_with_missing_cached_part(self):
+        """Testing Repository.get_files falls back on get_file when part of
+        a cached file is missing
+        """
+        def get_file(self, path, revision):
+            fetched.append((path, revision))
+
+            return b'file data'
+
+        fetched = []
+
+        self.scmtool_cls.get_file = get_file
+        self.repository.get_file('readme', 'e965047')
+
+        key = self.repository._make_file_cache_key('readme', 'e965047', None)
+        cache.delete(make_cache_key('%s-0' % key))
+
+        files = list(self.repository.get_files([('readme', 'e965047')]))
+
+        self.assertEqual(files, [('readme', 'e965047', b'file data')])
+        self.assertEqual(fetched, [('readme', 'e965047'),
+                                   ('readme', 'e965047')])
+
+    def test_get_files_exist_caching(self):
+        """Testing Repository.get_files_exist only checks files not known to
+        exist
+        """
+        def get_files_exist(self, paths_and_revisions):
+            checked.append(paths_and_revisions)
+
+            return [
+                revision != '12345'
+                for path, revision in paths_and_revisions
+            ]
+
+        checked = []
+        paths_and_revisions = [
+            ('readme', 'e965047'),
+            ('readme', '12345'),
+            ('readme', 'd6613f5'),
+        ]
+
+        self.scmtool_cls.get_files_exist = get_files_exist
+
+        exists1 = self.repository.get_files_exist(paths_and_revisions)
+        exists2 = self.repository.get_files_exist(paths_and_revisions)
+
+        self.assertEqual(exists1, [True, False, True])
+        self.assertEqual(exists2, [True, False, True])
+        self.assertEqual(checked, [paths_and_revisions,
+                                   [('readme', '12345')]])
+
+    def test_get_files_exist_with_fetched_file(self):
+        """Testing Repository.get_files_exist uses get_file's cached result"""
+        def get_file(self, path, revision):
+            return b'file data'
+
+        def get_files_exist(self, paths_and_revisions):
+            checked.append(paths_and_revisions)
+
+            return [True] * len(paths_and_revisions)
+
+        checked = []
+
+        self.scmtool_cls.get_file = get_file
+        self.scmtool_cls.get_files_exist = get_files_exist
+
+        self.repository.get_file('readme', 'e965047')
+
+        self.assertEqual(
+            self.repository.get_files_exist([('readme', 'e965047'),
+                                             ('readme', 'd6613f5')]),
+            [True, True])
+        self.assertEqual(checked, [[('readme', 'd6613f5')]])
+
+    def test_get_files_exist_signals(self):
+        """Testing Repository.get_files_exist emits signals"""
+        def on_checking(sender, path, revision, request, **kwargs):
+            found_signals.append(('checking_file_exists', path,
+                                  revision, request))
+
+        def on_checked(sender, path, revision, request, exists, **kwargs):
+            found_signals.append(('checked_file_exists', path,
+                                  revision, request, exists))
+
+        found_signals = []
+
+        checking_file_exists.connect(on_checking, sender=self.repository)
+        checked_file_exists.connect(on_checked, sender=self.repository)
+
+        request = {}
+
+        self.repository.get_files_exist([('readme', 'e965047'),
+                                         ('readme', 'fffffff')],
+                                        request=request)
+
+        self.assertEqual(found_signals, [
+            ('checking_file_exists', 'readme', 'e965047', request),
+            ('checking_file_exists', 'readme', 'fffffff', request),
+            ('checked_file_exists', 'readme', 'e965047', request, True),
+            ('checked_file_exists', 'readme', 'fffffff', request, False),
+        ])
+
 
 class BZRTests(SCMTestCase):
     """Unit tests for bzr."""
@@ -960,6 +1162,49 @@ class PerforceTests(SCMTestCase):
         self.assertEqual(md5(file).hexdigest(),
                          '227bdd87b052fcad9369e65c7bf23fd0')
 
+    @online_only
+    def test_client_get_files(self):
+        """Testing PerforceClient.get_files"""
+        files = self.tool.client.get_files([
+            ('//depot/foo', PRE_CREATION),
+            ('//public/perforce/api/python/P4Client/p4.py', 1),
+            ('//public/perforce/api/python/P4Client/missing.py', 1),
+            ('//public/perforce/api/python/P4Client/p4.py', 1),
+        ])
+
+        self.assertEqual(len(files), 4)
+        self.assertEqual(files[0], b'')
+        self.assertEqual(md5(files[1]).hexdigest(),
+                         '227bdd87b052fcad9369e65c7bf23fd0')
+        self.assertEqual(files[2], None)
+        self.assertEqual(files[3], files[1])
+
+    @online_only
+    def test_connection_reuse(self):
+        """Testing PerforceClient reuses connections"""
+        pool = self.tool.client._get_connection_pool()
+
+        self.tool.client.get_info()
+        self.assertEqual(len(pool._idle_connections), 1)
+        connection = pool._idle_connections[0]
+
+        self.tool.client.get_info()
+        self.assertEqual(pool._idle_connections, [connection])
+        self.assertTrue(connection.reused)
+
+        # Connections dropped by the server are replaced.
+        connection.p4.disconnect()
+        self.tool.client.get_info()
+        self.assertEqual(len(pool._idle_connections), 1)
+        self.assertNotEqual(pool._idle_connections[0], connection)
+
+        # Idle connections are closed.
+        connection = pool._idle_connections[0]
+        connection.last_used -= pool.IDLE_TIMEOUT
+        pool.close_idle()
+        self.assertEqual(pool._idle_connections, [])
+        self.assertFalse(connection.is_connected())
+
     def test_empty_diff(self):
         """Testing Perforce empty diff parsing"""
         diff = b"==== //depot/foo/proj/README#2 ==M== /src/proj/README ====\n"
@@ -1090,6 +1335,302 @@ class PerforceTests(SCMTestCase):
         self.assertEqual(files[1].delete_count, 1)
 
 
+class PerforceClientTests(DjangoTestCase):
+    """Unit tests for PerforceClient's handling of 'p4 print' output."""
+    class DummyPerforceClient(PerforceClient):
+        def __init__(self):
+            self.encoding = ''
+
+    class DummyP4(object):
+        def __init__(self, files):
+            self.files = files
+            self.printed = []
+
+        def run_print(self, *depot_paths):
+            self.printed.append(depot_paths)
+            results = []
+
+            # Like a case-insensitive server, this reports the paths in its
+            # own case, as byte strings.
+            for depot_path in depot_paths:
+                path, rev = depot_path.rsplit('#', 1)
+
+                for depot_file, file_rev, data in self.files:
+                    if (depot_file.decode('utf-8').lower() == path.lower() and
+                        file_rev == rev.encode('utf-8')):
+                        results += [
+                            {
+                                'depotFile': depot_file,
+                                'rev': file_rev,
+                            },
+                            data,
+                        ]
+
+            return results
+
+    def setUp(self):
+        super(PerforceClientTests, self).setUp()
+
+        self.client = self.DummyPerforceClient()
+        self.p4 = self.DummyP4([
+            ('//depot/caf\xe9.txt'.encode('utf-8'), b'1', b'caf\xc3\xa9'),
+            (b'//depot/Mixed/Case.txt', b'2', b'mixed'),
+            (b'//depot/plain.txt', b'3', b'plain'),
+        ])
+
+    def test_get_files_with_non_ascii_path(self):
+        """Testing PerforceClient.get_files with a non-ASCII path"""
+        self.assertEqual(
+            self.client._get_files(self.p4, [('//depot/caf\xe9.txt', '1')]),
+            [b'caf\xc3\xa9'])
+
+    def test_get_files_with_case_mismatch(self):
+        """Testing PerforceClient.get_files with a path differing in case
+        from the server's
+        """
+        self.assertEqual(
+            self.client._get_files(self.p4, [
+                ('//depot/plain.txt', PRE_CREATION),
+                ('//depot/mixed/case.txt', '2'),
+                ('//depot/missing.txt', '1'),
+                ('//depot/plain.txt', '3'),
+            ]),
+            ['', b'mixed', None, b'plain'])
+        self.assertEqual(len(self.p4.printed), 1)
+
+
+class PerforceConnectionPoolTests(SpyAgency, DjangoTestCase):
+    """Unit tests for PerforceClient's pooled connections.
+
+    These use a fake P4 module, so they run without p4python or a Perforce
+    server.
+    """
+    class FakeP4Exception(Exception):
+        pass
+
+    class FakeP4(object):
+        def __init__(self, files=[], fail_with=None):
+            self.files = files
+            self.fail_with = fail_with
+            self.is_connected = False
+
+        def connect(self):
+            self.is_connected = True
+
+        def connected(self):
+            return self.is_connected
+
+        def disconnect(self):
+            self.is_connected = False
+
+        def run_login(self):
+            pass
+
+        def run_info(self):
+            if self.fail_with:
+                error, self.fail_with = self.fail_with, None
+
+                if 'dropped' in error:
+                    self.is_connected = False
+
+                raise perforce.P4Exception(error)
+
+            return [{'serverAddress': self.port}]
+
+        def run_print(self, *depot_paths):
+            results = []
+
+            for depot_path in depot_paths:
+                path, rev = depot_path.rsplit('#', 1)
+
+                for depot_file, file_rev, data in self.files:
+                    if (depot_file.decode('utf-8').lower() == path.lower() and
+                        file_rev == rev.encode('utf-8')):
+                        results += [
+                            {
+                                'depotFile': depot_file,
+                                'rev': file_rev,
+                            },
+                            data,
+                        ]
+
+            return results
+
+        def run_fstat(self, *args):
+            return [
+                {
+                    'depotFile': depot_file.decode('utf-8'),
+                    'headRev': file_rev.decode('utf-8'),
+                    'headAction': 'edit',
+                }
+                for depot_file, file_rev, data in self.files
+            ]
+
+    def setUp(self):
+        super(PerforceConnectionPoolTests, self).setUp()
+
+        self.p4_instances = []
+        self.created_p4 = []
+
+        def create_p4():
+            p4 = self.p4_instances.pop(0)
+            self.created_p4.append(p4)
+
+            return p4
+
+        fake_module = types.ModuleType(str('P4'))
+        fake_module.P4 = create_p4
+        fake_module.P4Exception = getattr(perforce, 'P4Exception',
+                                          self.FakeP4Exception)
+
+        self.old_p4_module = sys.modules.get('P4')
+        self.set_p4exception = not hasattr(perforce, 'P4Exception')
+        sys.modules['P4'] = fake_module
+
+        if self.set_p4exception:
+            perforce.P4Exception = fake_module.P4Exception
+
+        self.client = PerforceClient('fake:1666', 'user', 'pass', '')
+
+    def tearDown(self):
+        super(PerforceConnectionPoolTests, self).tearDown()
+
+        perforce._connection_pools.clear()
+
+        if self.old_p4_module is None:
+            del sys.modules['P4']
+        else:
+            sys.modules['P4'] = self.old_p4_module
+
+        if self.set_p4exception:
+            del perforce.P4Exception
+
+    def test_reuses_connection(self):
+        """Testing PerforceClient reuses pooled connections"""
+        p4 = self.FakeP4()
+        self.p4_instances.append(p4)
+        self.spy_on(p4.connect)
+        self.spy_on(p4.disconnect)
+
+        self.assertEqual(self.client.get_info(),
+                         [{'serverAddress': b'fake:1666'}])
+        self.assertEqual(self.client.get_info(),
+                         [{'serverAddress': b'fake:1666'}])
+
+        self.assertEqual(self.created_p4, [p4])
+        self.assertEqual(len(p4.connect.spy.calls), 1)
+        self.assertEqual(len(p4.disconnect.spy.calls), 0)
+
+    def test_retries_dropped_connection(self):
+        """Testing PerforceClient retries commands on a new connection when
+        a pooled connection was dropped
+        """
+        p4_1 = self.FakeP4()
+        p4_2 = self.FakeP4()
+        self.p4_instances += [p4_1, p4_2]
+        self.spy_on(p4_1.run_info)
+        self.spy_on(p4_2.run_info)
+
+        self.client.get_info()
+        p4_1.fail_with = 'connection dropped'
+
+        self.assertEqual(self.client.get_info(),
+                         [{'serverAddress': b'fake:1666'}])
+        self.assertEqual(self.created_p4, [p4_1, p4_2])
+        self.assertEqual(len(p4_1.run_info.spy.calls), 2)
+        self.assertEqual(len(p4_2.run_info.spy.calls), 1)
+
+        pool = self.client._get_connection_pool()
+        self.assertEqual([c.p4 for c in pool._idle_connections], [p4_2])
+
+    def test_retries_expired_ticket(self):
+        """Testing PerforceClient logs in again on a new connection when a
+        pooled connection's ticket expired
+        """
+        client = PerforceClient('fake:1666', 'user', 'pass', '',
+                                use_ticket_auth=True)
+        p4_1 = self.FakeP4()
+        p4_2 = self.FakeP4()
+        self.p4_instances += [p4_1, p4_2]
+        self.spy_on(p4_1.disconnect)
+        self.spy_on(p4_2.run_login)
+
+        client.get_info()
+        p4_1.fail_with = 'Your session has expired, please login again.'
+
+        self.assertEqual(client.get_info(),
+                         [{'serverAddress': b'fake:1666'}])
+        self.assertEqual(self.created_p4, [p4_1, p4_2])
+        self.assertEqual(len(p4_1.disconnect.spy.calls), 1)
+        self.assertEqual(len(p4_2.run_login.spy.calls), 1)
+
+    def test_error_on_new_connection(self):
+        """Testing PerforceClient doesn't retry errors on a new connection"""
+        p4 = self.FakeP4(fail_with='some error')
+        self.p4_instances.append(p4)
+
+        self.assertRaises(SCMError, self.client.get_info)
+        self.assertEqual(self.created_p4, [p4])
+
+    def test_closes_idle_connections(self):
+        """Testing PerforceClient closes connections that have been idle for
+        too long
+        """
+        p4_1 = self.FakeP4()
+        p4_2 = self.FakeP4()
+        self.p4_instances += [p4_1, p4_2]
+        self.spy_on(p4_1.disconnect)
+
+        self.client.get_info()
+
+        pool = self.client._get_connection_pool()
+        pool._idle_connections[0].last_used -= pool.IDLE_TIMEOUT
+
+        self.client.get_info()
+
+        self.assertEqual(self.created_p4, [p4_1, p4_2])
+        self.assertEqual(len(p4_1.disconnect.spy.calls), 1)
+
+    def test_get_files(self):
+        """Testing PerforceClient.get_files batches 'p4 print' commands"""
+        p4 = self.FakeP4(files=[
+            ('//depot/caf\xe9.txt'.encode('utf-8'), b'1', b'caf\xc3\xa9'),
+            (b'//depot/Mixed/Case.txt', b'2', b'mixed'),
+            (b'//depot/plain.txt', b'3', b'plain'),
+        ])
+        self.p4_instances.append(p4)
+        self.spy_on(p4.run_print)
+        self.client.MAX_PRINT_BATCH_SIZE = 2
+
+        self.assertEqual(
+            self.client.get_files([
+                ('//depot/caf\xe9.txt', '1'),
+                ('//depot/mixed/case.txt', '2'),
+                ('//depot/missing.txt', '1'),
+                ('//depot/plain.txt', '3'),
+            ]),
+            [b'caf\xc3\xa9', b'mixed', None, b'plain'])
+        self.assertEqual(len(p4.run_print.spy.calls), 2)
+
+    def test_get_files_exist(self):
+        """Testing PerforceClient.get_files_exist"""
+        p4 = self.FakeP4(files=[
+            (b'//depot/plain.txt', b'3', b'plain'),
+        ])
+        self.p4_instances.append(p4)
+        self.spy_on(p4.run_fstat)
+
+        self.assertEqual(
+            self.client.get_files_exist([
+                ('//depot/plain.txt', '3'),
+                ('//depot/plain.txt', '2'),
+                ('//depot/missing.txt', '1'),
+                ('//depot/new.txt', PRE_CREATION),
+            ]),
+            [True, False, False, False])
+        self.assertEqual(len(p4.run_fstat.spy.calls), 1)
+
+
 class PerforceStunnelTests(SCMTestCase):
     """
     Unit tests for perforce running through stunnel.
@@ -1386,6 +1927,81 @@ class MercurialTests(SCMTestCase):
         self.assertRaises(FileNotFoundError,
                           lambda: self.tool.get_file('hello', PRE_CREATION))
 
+    def test_get_file_reuses_command_server(self):
+        """Testing HgTool.get_file reuses the hg command server"""
+        command_server = self._get_command_server()
+        command_server.stop()
+
+        self.assertEqual(self.tool.get_file('doc/readme', '661e5dd3c493'),
+                         b'Hello\n\ngoodbye\n')
+        pid = command_server.process.pid
+
+        self.assertRaises(FileNotFoundError,
+                          lambda: self.tool.get_file('doc/readme2'))
+        self.assertEqual(self.tool.get_file('doc/readme', '661e5dd3c493'),
+                         b'Hello\n\ngoodbye\n')
+        self.assertEqual(command_server.process.pid, pid)
+
+    def test_get_file_restarts_command_server(self):
+        """Testing HgTool.get_file restarts an hg command server that
+        exited
+        """
+        self.assertTrue(self.tool.file_exists('doc/readme'))
+
+        command_server = self._get_command_server()
+        process = command_server.process
+        process.kill()
+        process.wait()
+
+        self.assertTrue(self.tool.file_exists('doc/readme'))
+        self.assertNotEqual(command_server.process, process)
+
+        # A process left out of sync by an interrupted command is restarted
+        # as well.
+        def _read_message():
+            raise KeyboardInterrupt
+
+        process = command_server.process
+        command_server._read_message = _read_message
+
+        try:
+            self.assertRaises(
+                KeyboardInterrupt,
+                lambda: self.tool.file_exists('doc/readme'))
+        finally:
+            del command_server._read_message
+
+        self.assertFalse(self.tool.file_exists('doc/readme2'))
+        self.assertNotEqual(command_server.process, process)
+
+    def test_command_server_idle_timeout(self):
+        """Testing HgCommandServer stops idle processes"""
+        self.tool.get_file('doc/readme')
+
+        command_server = self._get_command_server()
+        self.assertFalse(command_server.is_idle())
+
+        command_server.last_used -= HgCommandServer.IDLE_TIMEOUT
+        self.assertTrue(command_server.is_idle())
+
+        self._get_command_server()
+        self.assertEqual(command_server.process, None)
+
+        self.assertEqual(self.tool.get_file('doc/readme', '661e5dd3c493'),
+                         b'Hello\n\ngoodbye\n')
+        self.assertNotEqual(command_server.process, None)
+
+    def test_command_server_run_command(self):
+        """Testing HgCommandServer.run_command"""
+        command_server = self._get_command_server()
+
+        self.assertEqual(
+            command_server.run_command(['log', '--rev', '661e5dd3c493',
+                                        '--template', '{desc}']),
+            (0, b'second'))
+        self.assertEqual(command_server.run_command(['status']), (0, b''))
+        self.assertNotEqual(command_server.run_command(['bogus'])[0], 0)
+
     def test_interface(self):
         """Testing basic HgTool API"""
         self.assertTrue(self.tool.get_diffs_use_absolute_paths())
@@ -1412,6 +2028,9 @@ class MercurialTests(SCMTestCase):
         self.assertTrue(tool.file_exists('TODO.rst', rev))
         self.assertTrue(not tool.file_exists('TODO.rstNotFound', rev))
 
+    def _get_command_server(self):
+        return get_command_server(self.tool.client.path)
+
 
 class GitTests(SCMTestCase):
     """Unit tests for Git."""
@@ -1858,6 +2477,228 @@ class GitTests(SCMTestCase):
             ShortSHA1Error,
             lambda: self.remote_tool.get_file('README', 'd7e96b3'))
 
+    def test_get_files_exist(self):
+        """Testing GitTool.get_files_exist"""
+        self.assertEqual(
+            self.tool.get_files_exist([
+                ("readme", "e965047"),
+                ("readme", PRE_CREATION),
+                ("readme", "fffffff"),
+                ("readme", "a62df6c"),
+                ("readme", "d6613f5"),
+                ("readme", HEAD),
+                ("missing", HEAD),
+                ("readme\nd6613f5", "e965047\nd6613f5"),
+            ]),
+            [True, False, False, False, True, True, False, False])
+
+    def test_get_files(self):
+        """Testing GitTool.get_files"""
+        self.assertEqual(
+            list(self.tool.get_files([
+                ("readme", "e965047"),
+                ("readme", PRE_CREATION),
+                ("readme", "fffffff"),
+                ("readme", "a62df6c"),
+                ("readme", HEAD),
+            ])),
+            [
+                ("readme", "e965047", b'Hello\n'),
+                ("readme", PRE_CREATION, ''),
+                ("readme", "fffffff", None),
+                ("readme", "a62df6c", None),
+                ("readme", HEAD, b'Hello there\n'),
+            ])
+
+    def test_get_file_reuses_cat_file_process(self):
+        """Testing GitTool.get_file reuses the git cat-file process"""
+        cat_file = self._get_cat_file_process('--batch')
+        cat_file.stop()
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), b'Hello\n')
+        pid = cat_file.process.pid
+
+        self.assertEqual(self.tool.get_file("readme", "d6613f5"),
+                         b'Hello there\n')
+        self.assertRaises(FileNotFoundError,
+                          lambda: self.tool.get_file("readme", "0000000"))
+        self.assertRaises(SCMError,
+                          lambda: self.tool.get_file("readme", "a62df6c"))
+        self.assertEqual(self.tool.get_file("readme", "e965047"), b'Hello\n')
+        self.assertEqual(cat_file.process.pid, pid)
+
+    def test_get_file_restarts_cat_file_process(self):
+        """Testing GitTool.get_file restarts a git cat-file process that
+        exited
+        """
+        self.assertTrue(self.tool.file_exists("readme", "e965047"))
+
+        cat_file = self._get_cat_file_process('--batch-check')
+        process = cat_file.process
+        process.kill()
+        process.wait()
+
+        self.assertTrue(self.tool.file_exists("readme", "d6613f5"))
+        self.assertNotEqual(cat_file.process, process)
+
+        # A process left out of sync by an interrupted lookup is restarted
+        # as well.
+        def _read_result():
+            raise KeyboardInterrupt
+
+        process = cat_file.process
+        cat_file._read_result = _read_result
+
+        try:
+            self.assertRaises(
+                KeyboardInterrupt,
+                lambda: self.tool.file_exists("readme", "e965047"))
+        finally:
+            del cat_file._read_result
+
+        self.assertFalse(self.tool.file_exists("readme", "a62df6c"))
+        self.assertNotEqual(cat_file.process, process)
+
+    def test_cat_file_process_idle_timeout(self):
+        """Testing GitCatFileProcess stops idle processes"""
+        self.tool.get_file("readme", "e965047")
+
+        cat_file = self._get_cat_file_process('--batch')
+        self.assertFalse(cat_file.is_idle())
+
+        cat_file.last_used -= GitCatFileProcess.IDLE_TIMEOUT
+        self.assertTrue(cat_file.is_idle())
+
+        self._get_cat_file_process('--batch-check')
+        self.assertEqual(cat_file.process, None)
+
+        self.assertEqual(self.tool.get_file("readme", "e965047"), b'Hello\n')
+        self.assertNotEqual(cat_file.process, None)
+
+    def test_cat_file_process_pipelining(self):
+        """Testing GitCatFileProcess.lookup with several objects"""
+        cat_file = GitCatFileProcess(self.tool.client.git_dir, '--batch')
+        cat_file.MAX_PIPELINE_BYTES = 20
+
+        try:
+            self.assertEqual(
+                cat_file.lookup(['e965047', '0000000', 'd6613f5',
+                                 'HEAD:readme', 'HEAD:missing']),
+                [
+                    ('blob', b'Hello\n'),
+                    (None, None),
+                    ('blob', b'Hello there\n'),
+                    ('blob', b'Hello there\n'),
+                    (None, None),
+                ])
+        finally:
+            cat_file.stop()
+
+    def _get_cat_file_process(self, batch_option):
+        return get_cat_file_process(self.tool.client.git_dir, batch_option)
+
+
+class CoprocessTests(DjangoTestCase):
+    """Unit tests for Coprocess and CoprocessRegistry."""
+    class DummyProcess(object):
+        def __init__(self):
+            self.stdin = six.StringIO()
+            self.stdout = six.StringIO()
+            self.returncode = None
+
+        def poll(self):
+            return self.returncode
+
+        def kill(self):
+            self.returncode = -9
+
+        def wait(self):
+            return self.returncode
+
+    class DummyCoprocess(Coprocess):
+        error_message = 'Unable to run: %s'
+
+        def __init__(self, name):
+            super(CoprocessTests.DummyCoprocess, self).__init__()
+            self.name = name
+            self.num_started = 0
+
+        def run(self, func):
+            return self._run(func)
+
+        def _start(self):
+            self.process = CoprocessTests.DummyProcess()
+            self.num_started += 1
+
+    def test_run(self):
+        """Testing Coprocess._run starts the process once"""
+        coprocess = self.DummyCoprocess('a')
+
+        self.assertEqual(coprocess.run(lambda: 1), 1)
+        self.assertEqual(coprocess.run(lambda: 2), 2)
+        self.assertEqual(coprocess.num_started, 1)
+
+    def test_run_restarts_process(self):
+        """Testing Coprocess._run restarts the process and retries once
+        on errors
+        """
+        def fail_once():
+            failures.append(1)
+
+            if len(failures) == 1:
+                raise IOError('exited')
+
+            return 'result'
+
+        failures = []
+        coprocess = self.DummyCoprocess('a')
+
+        self.assertEqual(coprocess.run(fail_once), 'result')
+        self.assertEqual(coprocess.num_started, 2)
+
+        def fail():
+            raise IOError('exited')
+
+        self.assertRaises(SCMError, lambda: coprocess.run(fail))
+        self.assertEqual(coprocess.process, None)
+
+    def test_run_not_idle(self):
+        """Testing Coprocess doesn't consider a process running a command
+        to be idle
+        """
+        def slow_command():
+            self.assertFalse(coprocess.is_idle())
+
+            # Simulate a command running longer than the idle timeout.
+            coprocess.last_used -= coprocess.IDLE_TIMEOUT
+            process = coprocess.process
+
+            coprocess.stop_if_idle()
+            self.assertEqual(coprocess.process, process)
+
+        coprocess = self.DummyCoprocess('a')
+        coprocess.run(lambda: None)
+        coprocess.last_used -= coprocess.IDLE_TIMEOUT
+
+        coprocess.run(slow_command)
+        self.assertNotEqual(coprocess.process, None)
+        self.assertFalse(coprocess.is_idle())
+
+    def test_registry_stops_idle(self):
+        """Testing CoprocessRegistry stops idle processes"""
+        registry = CoprocessRegistry(self.DummyCoprocess)
+
+        coprocess = registry.get('a')
+        self.assertEqual(registry.get('a'), coprocess)
+
+        coprocess.run(lambda: None)
+        coprocess.last_used -= coprocess.IDLE_TIMEOUT
+
+        other = registry.get('b')
+        self.assertNotEqual(other, coprocess)
+        self.assertEqual(other.name, 'b')
+        self.assertEqual(coprocess.process, None)
+
 
 class PolicyTests(DjangoTestCase):
     fixtures = ['test_scmtools']
@@ -86,6 +86,7 @@ MIDDLEWARE_CLASSES = [
     'reviewboard.admin.middleware.CheckUpdatesRequiredMiddleware',
     'reviewboard.admin.middleware.X509AuthMiddleware',
     'reviewboard.site.middleware.LocalSiteMiddleware',
+    'reviewboard.diffviewer.middleware.DiffStageTimingMiddleware',
 
     # Keep this last so that everything is initialized before middleware
     # from extensions are run.
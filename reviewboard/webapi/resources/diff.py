@@ -3,9 +3,8 @@ from __future__ import unicode_literals
 import logging
 
 from django.core.exceptions import PermissionDenied, ObjectDoesNotExist
-from django.http import HttpResponse
 from djblets.util.compat import six
-from djblets.util.http import get_http_requested_mimetype, set_last_modified
+from djblets.util.http import get_http_requested_mimetype
 from djblets.webapi.decorators import (webapi_login_required,
                                        webapi_response_errors,
                                        webapi_request_fields)
@@ -14,6 +13,7 @@ from djblets.webapi.errors import (DOES_NOT_EXIST, INVALID_FORM_DATA,
 
 from reviewboard.diffviewer.errors import DiffTooBigError, EmptyDiffError
 from reviewboard.diffviewer.models import DiffSet
+from reviewboard.diffviewer.rawdiff import get_raw_diff_response
 from reviewboard.reviews.forms import UploadDiffForm
 from reviewboard.reviews.models import ReviewRequest, ReviewRequestDraft
 from reviewboard.scmtools.errors import FileNotFoundError
@@ -159,9 +159,6 @@ class DiffResource(WebAPIResource):
             return DOES_NOT_EXIST
 
         tool = review_request.repository.get_scmtool()
-        data = tool.get_parser('').raw_diff(diffset)
-
-        resp = HttpResponse(data, mimetype='text/x-patch')
 
         if diffset.name == 'diff':
             filename = 'bug%s.patch' % \
@@ -169,10 +166,8 @@ class DiffResource(WebAPIResource):
         else:
             filename = diffset.name
 
-        resp['Content-Disposition'] = 'inline; filename=%s' % filename
-        set_last_modified(resp, diffset.timestamp)
-
-        return resp
+        return get_raw_diff_response(request, diffset, tool.get_parser(''),
+                                     filename)
 
     @webapi_login_required
     @webapi_check_local_site
@@ -1,6 +1,6 @@
 from __future__ import unicode_literals
 
-from django.http import Http404
+from django.http import Http404, HttpResponseNotModified
 from djblets.webapi.decorators import (webapi_response_errors,
                                        webapi_request_fields)
 from djblets.webapi.errors import DOES_NOT_EXIST
@@ -16,6 +16,8 @@ class DiffViewerContextView(ReviewsDiffViewerView):
     # lifting. By overriding render_to_response, we don't have to render it
     # to HTML, and can just return the data that we need from javascript.
     def render_to_response(self, context, **kwargs):
+        context['etag'] = self.etag
+
         return context
 
 
@@ -61,6 +63,8 @@ class DiffContextResource(WebAPIResource):
         The result will be an object with several fields for the files in the
         diff, pagination information, and other data which is used to render
         the diff viewer page.
+
+        This supports ETags, using the same state as the diff viewer page.
         """
         try:
             view = DiffViewerContextView.as_view()
@@ -69,8 +73,13 @@ class DiffContextResource(WebAPIResource):
         except Http404:
             return DOES_NOT_EXIST
 
+        if isinstance(context, HttpResponseNotModified):
+            return context
+
         return 200, {
             self.item_result_key: context['diff_context'],
+        }, {
+            'ETag': context['etag'],
         }
 
 
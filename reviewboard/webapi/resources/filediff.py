@@ -1,7 +1,6 @@
 from __future__ import unicode_literals
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.http import HttpResponse
 from djblets.util.compat import six
 from djblets.util.compat.six.moves.urllib.parse import quote as urllib_quote
 from djblets.util.decorators import augment_method_from
@@ -10,9 +9,11 @@ from djblets.webapi.core import WebAPIResponse
 from djblets.webapi.errors import DOES_NOT_EXIST
 
 from reviewboard.attachments.models import FileAttachment
+from reviewboard.diffviewer.chunk_generator import compute_chunk_line_regions
 from reviewboard.diffviewer.diffutils import (get_diff_files,
                                               populate_diff_chunks)
 from reviewboard.diffviewer.models import FileDiff
+from reviewboard.diffviewer.rawdiff import get_raw_filediff_response
 from reviewboard.webapi.base import CUSTOM_MIMETYPE_BASE, WebAPIResource
 from reviewboard.webapi.decorators import (webapi_check_login_required,
                                            webapi_check_local_site)
@@ -339,12 +340,9 @@ class FileDiffResource(WebAPIResource):
         except ObjectDoesNotExist:
             return DOES_NOT_EXIST
 
-        resp = HttpResponse(filediff.diff, mimetype='text/x-patch')
         filename = '%s.patch' % urllib_quote(filediff.source_file)
-        resp['Content-Disposition'] = 'inline; filename=%s' % filename
-        set_last_modified(resp, filediff.diffset.timestamp)
 
-        return resp
+        return get_raw_filediff_response(request, filediff, filename)
 
     def _get_diff_data(self, request, mimetype, *args, **kwargs):
         try:
@@ -365,10 +363,19 @@ class FileDiffResource(WebAPIResource):
         assert len(files) == 1
         f = files[0]
 
+        # Chunks loaded from the cache build their lines on demand, and
+        # regions of changes within lines are computed on demand, so the
+        # lines need to be turned into plain lists with all regions computed
+        # for serialization.
+        chunks = [
+            dict(chunk, lines=compute_chunk_line_regions(chunk['lines']))
+            for chunk in f['chunks']
+        ]
+
         payload = {
             'diff_data': {
                 'binary': f['binary'],
-                'chunks': f['chunks'],
+                'chunks': chunks,
                 'num_changes': f['num_changes'],
                 'changed_chunk_indexes': f['changed_chunk_indexes'],
                 'new_file': f['newfile'],
@@ -240,3 +240,27 @@ class ResourceItemTests(ReviewRequestChildItemMixin, BaseWebAPITestCase):
         self._testHttpCaching(
             get_diff_item_url(review_request, diffset.revision),
             check_last_modified=True)
+
+    def test_get_patch(self):
+        """Testing the GET review-requests/<id>/diffs/<revision>/ API
+        with Accept: text/x-patch
+        """
+        review_request = self.create_review_request(create_repository=True,
+                                                    publish=True)
+        diffset = self.create_diffset(review_request, name='my.patch')
+        self.create_filediff(diffset, diff=b'diff1\n')
+        self.create_filediff(diffset, diff=b'diff2\n')
+
+        url = get_diff_item_url(review_request, diffset.revision)
+        response = self.client.get(url, HTTP_ACCEPT='text/x-patch')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/x-patch')
+        self.assertEqual(response['Content-Disposition'],
+                         'inline; filename=my.patch')
+        self.assertEqual(b''.join(response.streaming_content),
+                         b'diff1\ndiff2\n')
+
+        response = self.client.get(url, HTTP_ACCEPT='text/x-patch',
+                                   HTTP_RANGE='bytes=6-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'diff2\n')